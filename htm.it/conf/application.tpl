@@ -55,11 +55,33 @@ poll_interval = 60
 # Metric error grace period seconds after which the metric will be promoted to
 # ERROR state if it continues to encounter errors
 metric_error_grace_period = 10800
+# Collect metric data on a pool of worker "threads" or of worker "processes"
+worker_mode = threads
+# Number of worker threads when worker_mode is threads
+num_worker_threads = 32
+# Maximum rate of data collection requests per second in each AWS region when
+# worker_mode is threads; 0 for no limit
+max_requests_per_sec_per_region = 50
+# Maximum number of Cloudwatch metrics of the same region and period whose data
+# is fetched together with batched GetMetricData requests; 1 to fetch each
+# metric's data with its own GetMetricStatistics requests
+max_metrics_per_batch = 100
 
 [metric_listener]
 # Port to listen on for plaintext protocol messages
 plaintext_port = 2003
 queue_name = htm.it.metric.custom.data
+# Number of epoll event loop threads that multiplex the client connections;
+# 0 to serve each TCP client on a thread of its own and to forward each UDP
+# datagram via a new message bus connection instead. UDP is always served by a
+# single event loop.
+num_event_loops = 0
+# Number of publisher threads with persistent message bus connections that
+# forward the batches of the event loops
+num_publishers = 2
+# Max time in milliseconds that a sample may wait in an event loop's batch for
+# more samples before the batch is forwarded
+max_batch_delay_ms = 20
 
 [security]
 apikey =
@@ -71,6 +93,12 @@ body_default = notification-body-default.tpl
 body_custom = notification-body-custom.tpl
 aws_access_key_id = %(NOTIFICATIONS_AWS_ACCESS_KEY_ID)s
 aws_secret_access_key = %(NOTIFICATIONS_AWS_SECRET_ACCESS_KEY)s
+# How often in seconds the notification service reloads the device
+# notification settings and this configuration
+settings_refresh_interval_sec = 60
+# How often in seconds the notification service deletes stale notification
+# devices and old notifications
+cleanup_interval_sec = 3600
 
 [registration]
 subject = Welcome to HTM-IT!
@@ -85,3 +113,19 @@ statistics_refresh_rate=24
 # Sample size to be used for the statistic calculation
 # We keep a max of one month of history (assumes 5 min metric period)
 statistics_sample_size=8640
+# Memory budget of the anomaly service's in-process windows of the models'
+# recent raw anomaly scores; least recently used windows are evicted when it's
+# exceeded. A full window takes 32 bytes per sample.
+raw_score_window_memory_budget_mb=256
+# Refresh the anomaly statistics after every row from incrementally maintained
+# statistics instead of re-estimating them from the whole sample; the refresh
+# rate then only applies when the incremental statistics need to be rebuilt
+incremental_statistics=true
+
+[anomaly_service]
+# Number of worker threads that process model result batches concurrently;
+# batches are sharded by model ID, so that the batches of a model are
+# processed in order. 0 processes all batches serially on the consumer thread.
+num_workers = 0
+# Max number of unacked model result batches in the workers' pipeline
+max_in_flight_batches = 64
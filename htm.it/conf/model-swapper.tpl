@@ -25,3 +25,41 @@ scheduler_notification_queue = htm.it.mswapper.scheduler.notification
 # batch, the actual number of requests processed before checkpointing the model
 # may be higher than this number.
 target_requests_per_checkpoint = 500
+
+
+[model_runner_host]
+# Controls whether each slot runs its models in a long-lived ModelRunnerHost
+# process instead of starting a ModelRunner process per model run: true or
+# false. The host keeps recently-run models loaded in memory, so that a model
+# that is preempted and rescheduled shortly after doesn't have to be reloaded
+# from its checkpoint.
+enabled = false
+
+# Upper bound of the estimated combined memory footprint of the models that a
+# ModelRunnerHost keeps loaded, in megabytes. Least recently run models are
+# evicted first.
+model_cache_memory_budget_mb = 1024
+
+
+[swap_controller]
+# Policy for selecting which running model to preempt when models are waiting
+# for a free slot: lru or cost_aware. lru preempts the model that received
+# input least recently. cost_aware preempts the model that is cheapest to swap
+# back in, subject to the residency, drain and wait limits below.
+preemption_policy = lru
+
+# cost_aware: minimum number of seconds that a model keeps its slot before it
+# may be preempted, so that it amortizes the cost of loading it
+min_residency_sec = 5
+
+# cost_aware: a model with this many or fewer input batches queued up is left
+# to drain its input queue instead of being preempted
+drain_threshold_batches = 1
+
+# cost_aware: once a waiting model has waited for this many seconds, running
+# models with deeper input queues may be preempted in its favor
+max_wait_sec = 30
+
+# cost_aware: estimated swap cost, in seconds, of a model that hasn't completed
+# a run yet
+default_swap_cost_sec = 1
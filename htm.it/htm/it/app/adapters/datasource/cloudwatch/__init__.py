@@ -476,6 +476,42 @@ class _CloudwatchDatasourceAdapter(DatasourceAdapterIface):
     return metricAdapter.getMetricData(start, end)
 
 
+  def getMetricDataBatch(self, requests):  # pylint: disable=R0201
+    """ Retrieve recent data of multiple metrics with batched Cloudwatch
+    requests; see AWSResourceAdapterBase.getMetricDataBatch()
+
+    :param requests: sequence of (<metricSpec>, <start>) two-tuples, where
+      <metricSpec> and <start> are as in getMetricData()
+
+    :returns: a list with one element per request, in the same order: either
+      the (<data-sequence>, <next-start-time>) two-tuple that
+      getMetricData(metricSpec, start, end=None) would return or an
+      Exception-based object if the metric's data couldn't be retrieved
+    :rtype: list
+    """
+    results = [None] * len(requests)
+
+    indexes = []
+    metricAdapters = []
+    starts = []
+    for i, (metricSpec, start) in enumerate(requests):
+      try:
+        metricAdapters.append(
+          AWSResourceAdapterBase.createMetricAdapter(metricSpec))
+      except Exception as e:  # pylint: disable=W0703
+        results[i] = e
+      else:
+        indexes.append(i)
+        starts.append(start)
+
+    for i, result in zip(indexes,
+                         AWSResourceAdapterBase.getMetricDataBatch(
+                           metricAdapters, starts)):
+      results[i] = result
+
+    return results
+
+
   def describeRegions(self):  # pylint: disable=R0201
     """ Describe AWS regions
 
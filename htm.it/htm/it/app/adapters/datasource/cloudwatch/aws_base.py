@@ -27,10 +27,14 @@ import collections
 import datetime
 import logging
 import math
+import threading
+import time
+from xml.etree import ElementTree
 
 import boto.ec2
 import boto.ec2.cloudwatch
 import boto.exception
+import boto.utils
 
 
 import htm.it.app
@@ -39,6 +43,103 @@ import htm.it.app.exceptions
 
 
 
+# Thread-local state of AWSResourceAdapterBase._connectToAWSService; see
+# enableConnectionReuse()
+_gThreadLocalState = threading.local()
+
+# Serializes reloading htm.it.app.config and reading the AWS credentials from it
+# in AWSResourceAdapterBase._getFreshAWSAuthenticationArgs: Config.loadConfig()
+# clears and re-reads its sections, so concurrent reads from other threads (e.g.,
+# Metric Collector's worker threads) could otherwise fail with NoSectionError or
+# NoOptionError
+_gConfigLock = threading.Lock()
+
+
+
+def enableConnectionReuse():
+  """ Make AWS resource adapters reuse boto connections in the calling thread
+  instead of connecting to the AWS service for every request.
+
+  boto connections aren't thread-safe, so each thread that calls this gets its
+  own cache of connections, keyed by service, region and credentials.  This is
+  intended for long-lived worker threads, such as Metric Collector's.
+  """
+  _gThreadLocalState.connections = dict()
+
+
+
+class _RegionThrottleBackoff(object):
+  """ [thread-safe] Adaptive pacing of CloudWatch requests per region: the delay
+  between consecutive requests in a region doubles each time a request is
+  throttled and halves each time a request succeeds, until it decays to zero.
+  """
+
+  # Delay after the first throttled request in seconds
+  _INITIAL_DELAY_SEC = 0.25
+
+  _MAX_DELAY_SEC = 8
+
+  # Delays that decay below this are reset to zero
+  _MIN_DELAY_SEC = 0.01
+
+
+  def __init__(self):
+    # Current delay between requests in seconds, keyed by region
+    self._delays = collections.defaultdict(float)
+
+    # Time (unix epoch) of the next request slot, keyed by region
+    self._nextSlotTimes = collections.defaultdict(float)
+
+    self._lock = threading.Lock()
+
+
+  def wait(self, region):
+    """ Sleep until the next request slot in the given region """
+    with self._lock:
+      now = time.time()
+      slotTime = max(now, self._nextSlotTimes[region])
+      self._nextSlotTimes[region] = slotTime + self._delays[region]
+
+    if slotTime > now:
+      time.sleep(slotTime - now)
+
+
+  def onThrottled(self, region):
+    with self._lock:
+      delay = min(max(self._delays[region] * 2, self._INITIAL_DELAY_SEC),
+                  self._MAX_DELAY_SEC)
+      self._delays[region] = delay
+
+      # Also delay the retry of the throttled request
+      self._nextSlotTimes[region] = max(self._nextSlotTimes[region],
+                                        time.time() + delay)
+
+
+  def onSuccess(self, region):
+    with self._lock:
+      delay = self._delays[region] / 2
+      self._delays[region] = delay if delay >= self._MIN_DELAY_SEC else 0
+
+
+  def getDelay(self, region):
+    """
+    :returns: current delay between requests in the given region in seconds
+    """
+    with self._lock:
+      return self._delays[region]
+
+
+
+# Paces GetMetricData requests of AWSResourceAdapterBase.getMetricDataBatch
+_gMetricDataThrottleBackoff = _RegionThrottleBackoff()
+
+# Namespace prefixes for CloudWatch Query API responses
+_CLOUDWATCH_XML_NAMESPACES = {
+  "cw": "http://monitoring.amazonaws.com/doc/2010-08-01/"
+}
+
+
+
 class ResourceTypeNames(object):
   """ AWS Resource types supported by the Datasource adapters. The type names
   are per AWSCloudFormation documentation, which defines a comprehensive list of
@@ -107,6 +208,15 @@ class AWSResourceAdapterBase(object):
 
   ###
 
+  # Metrics whose data ranges start within this many periods of each other are
+  # queried together by getMetricDataBatch; the samples preceding a metric's
+  # own range are discarded
+  _METRIC_DATA_BATCH_MAX_START_SPREAD_PERIODS = 12
+
+  # Number of attempts of a GetMetricData request that CloudWatch throttles
+  # before getMetricDataBatch gives up on it
+  _METRIC_DATA_MAX_THROTTLED_ATTEMPTS = 8
+
   # Registry of resource adapters populated by our registerResourceAdapter
   # decorator
   # key: resource-type
@@ -768,6 +878,253 @@ class AWSResourceAdapterBase(object):
         unit=self.UNIT)
     return data
 
+  @classmethod
+  def getMetricDataBatch(cls, metricAdapters, starts):
+    """ Retrieve recent data of multiple metrics, as getMetricData(start,
+    end=None) would for each metric, but with batched CloudWatch GetMetricData
+    requests: metrics of the same region and period whose collection ranges
+    start close to each other are queried together, and the results are
+    demultiplexed back into per-metric samples. Requests are paced adaptively
+    per region while CloudWatch throttles them.
+
+    :param metricAdapters: sequence of metric adapters derived from
+      AWSResourceAdapterBase
+    :param starts: sequence of UTC start times of the metrics' data ranges
+      corresponding to metricAdapters; see getMetricData()
+
+    :returns: a list with one element per metric adapter, in the same order:
+      either the (<data-sequence>, <next-start-time>) two-tuple per
+      getMetricData() or an Exception-based object if the metric's data
+      couldn't be retrieved
+    """
+    results = [None] * len(metricAdapters)
+
+    # Pending queries keyed by (region, period): (index, adapter, from, to)
+    pendingQueries = collections.defaultdict(list)
+
+    for i, (metricAdapter, start) in enumerate(zip(metricAdapters, starts)):
+      period = metricAdapter.METRIC_PERIOD
+      fromDate, toDate = cloudwatch_utils.normalizeMetricCollectionTimeRange(
+        startTime=start,
+        endTime=None,
+        period=period)
+
+      if toDate <= fromDate:
+        results[i] = ([], fromDate)
+      else:
+        pendingQueries[(metricAdapter._region, period)].append(
+          (i, metricAdapter, fromDate, toDate))
+
+    for (region, period), queries in pendingQueries.iteritems():
+      queries.sort(key=lambda query: query[2])
+
+      for batch in cls._splitMetricDataQueries(queries, period):
+        try:
+          batchSamples = cls._queryCloudWatchMetricDataBatch(
+            region=region,
+            period=period,
+            metricAdapters=[metricAdapter for _, metricAdapter, _, _ in batch],
+            start=batch[0][2],
+            end=max(toDate for _, _, _, toDate in batch))
+        except Exception as e:  # pylint: disable=W0703
+          logging.getLogger(__name__).exception(
+            "GetMetricData failed for numMetrics=%d in region=%s",
+            len(batch), region)
+          batchSamples = [e] * len(batch)
+
+        for (i, _, fromDate, toDate), samples in zip(batch, batchSamples):
+          if isinstance(samples, Exception):
+            results[i] = samples
+            continue
+
+          # The batch's range may exceed the metric's own range
+          samples = [sample for sample in samples
+                     if fromDate <= sample[0] < toDate]
+          if samples:
+            results[i] = (
+              samples, samples[-1][0] + datetime.timedelta(seconds=period))
+          else:
+            results[i] = ([], toDate)
+
+    return results
+
+
+  @classmethod
+  def _splitMetricDataQueries(cls, queries, period):
+    """ Split the given queries into batches for GetMetricData requests
+
+    :param queries: sequence of (index, adapter, fromDate, toDate) tuples of
+      metrics in the same region with the same period, sorted by fromDate
+    :param period: metric period in seconds
+
+    :returns: sequence of batches of queries
+    """
+    maxSpread = datetime.timedelta(
+      seconds=period * cls._METRIC_DATA_BATCH_MAX_START_SPREAD_PERIODS)
+
+    batches = []
+    for query in queries:
+      if (not batches or
+          len(batches[-1]) >=
+          cloudwatch_utils.CLOUDWATCH_MAX_METRIC_DATA_QUERIES or
+          query[2] - batches[-1][0][2] > maxSpread):
+        batches.append([])
+
+      batches[-1].append(query)
+
+    return batches
+
+
+  @classmethod
+  def _queryCloudWatchMetricDataBatch(cls, region, period, metricAdapters,
+                                      start, end):
+    """ Retrieve the datapoints of the given metrics with CloudWatch
+    GetMetricData, following pagination and retrying throttled requests with
+    adaptive backoff
+
+    :param region: AWS region name of the metrics
+    :param period: period of the metrics in seconds
+    :param metricAdapters: sequence of metric adapters; no more than
+      cloudwatch_utils.CLOUDWATCH_MAX_METRIC_DATA_QUERIES
+    :param start: UTC start time of the data range (inclusive)
+    :type start: datetime.datetime
+    :param end: UTC end time of the data range (exclusive)
+    :type end: datetime.datetime
+
+    :returns: a list with one element per metric adapter, in the same order:
+      either a sequence of (<datetime timestamp>, <value>) two-tuples sorted by
+      timestamp in ascending order or htm.it.app.exceptions.MetricDataQueryError
+
+    :raises htm.it.app.exceptions.MetricThrottleError: if CloudWatch kept
+      throttling the requests
+    """
+    params = {
+      "StartTime": start.isoformat(),
+      "EndTime": end.isoformat(),
+      "ScanBy": "TimestampAscending"
+    }
+
+    for i, metricAdapter in enumerate(metricAdapters):
+      prefix = "MetricDataQueries.member.%d." % (i + 1,)
+      params[prefix + "Id"] = "m%d" % (i,)
+
+      prefix += "MetricStat."
+      params[prefix + "Period"] = period
+      params[prefix + "Stat"] = metricAdapter.STATISTIC
+      if metricAdapter.UNIT is not None:
+        params[prefix + "Unit"] = metricAdapter.UNIT
+
+      prefix += "Metric."
+      params[prefix + "Namespace"] = metricAdapter.NAMESPACE
+      params[prefix + "MetricName"] = metricAdapter.METRIC_NAME
+      for j, (name, value) in enumerate(
+          sorted(metricAdapter._dimensions.iteritems())):
+        dimensionPrefix = prefix + "Dimensions.member.%d." % (j + 1,)
+        params[dimensionPrefix + "Name"] = name
+        params[dimensionPrefix + "Value"] = value
+
+    samples = [[] for _ in metricAdapters]
+    errors = dict()
+
+    nextToken = None
+    while True:
+      if nextToken is not None:
+        params["NextToken"] = nextToken
+
+      root = cls._requestMetricDataPage(region, params)
+
+      for member in root.iterfind(
+          "cw:GetMetricDataResult/cw:MetricDataResults/cw:member",
+          _CLOUDWATCH_XML_NAMESPACES):
+        # Query ids are "m<index>"
+        queryId = member.findtext("cw:Id",
+                                  namespaces=_CLOUDWATCH_XML_NAMESPACES)
+        i = int(queryId[1:])
+
+        statusCode = member.findtext("cw:StatusCode",
+                                     namespaces=_CLOUDWATCH_XML_NAMESPACES)
+        if statusCode not in ("Complete", "PartialData"):
+          errors[i] = htm.it.app.exceptions.MetricDataQueryError(
+            "GetMetricData statusCode=%s for metric=%s/%s dimensions=%s; "
+            "messages=%s" % (
+              statusCode, metricAdapters[i].NAMESPACE,
+              metricAdapters[i].METRIC_NAME, metricAdapters[i]._dimensions,
+              [message.findtext("cw:Value",
+                                namespaces=_CLOUDWATCH_XML_NAMESPACES)
+               for message in member.iterfind(
+                 "cw:Messages/cw:member", _CLOUDWATCH_XML_NAMESPACES)]))
+
+        samples[i].extend(zip(
+          (boto.utils.parse_ts(timestamp.text)
+           for timestamp in member.iterfind("cw:Timestamps/cw:member",
+                                            _CLOUDWATCH_XML_NAMESPACES)),
+          (float(value.text)
+           for value in member.iterfind("cw:Values/cw:member",
+                                        _CLOUDWATCH_XML_NAMESPACES))))
+
+      nextToken = root.findtext("cw:GetMetricDataResult/cw:NextToken",
+                                namespaces=_CLOUDWATCH_XML_NAMESPACES)
+      if not nextToken:
+        break
+
+    for metricSamples in samples:
+      metricSamples.sort(key=lambda sample: sample[0])
+
+    return [errors.get(i, metricSamples)
+            for i, metricSamples in enumerate(samples)]
+
+
+  @classmethod
+  def _requestMetricDataPage(cls, region, params):
+    """ Request a page of GetMetricData results, waiting out the region's
+    adaptive throttle backoff before each attempt
+
+    :param region: AWS region name
+    :param params: GetMetricData request parameters
+
+    :returns: root element of the GetMetricData response
+    :rtype: xml.etree.ElementTree.Element
+
+    :raises htm.it.app.exceptions.MetricThrottleError: if CloudWatch kept
+      throttling the request
+    """
+    # boto 2 doesn't implement GetMetricData, so make the Query API request
+    # directly; retry other transient errors as _queryCloudWatchMetricStats does
+    @cloudwatch_utils.retryOnCloudWatchTransientError(
+      retriableErrorCodes=tuple(
+        code for code in cloudwatch_utils.RETRIABLE_SERVER_ERROR_CODES
+        if code != cloudwatch_utils.CloudWatchServerErrorCodes.THROTTLING))
+    def requestPage():
+      connection = cls._connectToAWSService(boto.ec2.cloudwatch, region)
+      response = connection.make_request("GetMetricData", params, "/", "POST")
+      body = response.read()
+      if response.status != 200:
+        raise connection.ResponseError(response.status, response.reason, body)
+
+      return ElementTree.fromstring(body)
+
+    for attempt in xrange(cls._METRIC_DATA_MAX_THROTTLED_ATTEMPTS):
+      _gMetricDataThrottleBackoff.wait(region)
+      try:
+        root = requestPage()
+      except boto.exception.BotoServerError as e:
+        if (e.error_code !=
+            cloudwatch_utils.CloudWatchServerErrorCodes.THROTTLING):
+          raise
+
+        _gMetricDataThrottleBackoff.onThrottled(region)
+        logging.getLogger(__name__).warning(
+          "GetMetricData throttled in region=%s (attempt=%d); delay=%.2fs",
+          region, attempt + 1, _gMetricDataThrottleBackoff.getDelay(region))
+      else:
+        _gMetricDataThrottleBackoff.onSuccess(region)
+        return root
+
+    raise htm.it.app.exceptions.MetricThrottleError(
+      "GetMetricData throttled in region=%s after attempts=%d" % (
+        region, cls._METRIC_DATA_MAX_THROTTLED_ATTEMPTS))
+
+
   @classmethod
   def _connectToAWSService(cls, serviceModule, region):
     """ Connect to AWS service
@@ -777,16 +1134,29 @@ class AWSResourceAdapterBase(object):
     :param region: The name of AWS Region to connect to (e.g., "us-west-2")
       applicable
 
-    :returns: boto connection object
+    :returns: boto connection object; a previously-created one if
+      enableConnectionReuse() was called in the current thread
 
     :raises htm.it.app.exceptions.InvalidAWSRegionName:
     """
-    conn = serviceModule.connect_to_region(
-                region_name=region,
-                **cls._getFreshAWSAuthenticationArgs())
+    authArgs = cls._getFreshAWSAuthenticationArgs()
+
+    connections = getattr(_gThreadLocalState, "connections", None)
+    if connections is not None:
+      connectionKey = (serviceModule.__name__, region,
+                       authArgs["aws_access_key_id"],
+                       authArgs["aws_secret_access_key"])
+      conn = connections.get(connectionKey)
+      if conn is not None:
+        return conn
+
+    conn = serviceModule.connect_to_region(region_name=region, **authArgs)
     if conn is None:
       raise htm.it.app.exceptions.InvalidAWSRegionName(region)
 
+    if connections is not None:
+      connections[connectionKey] = conn
+
     return conn
 
 
@@ -800,15 +1170,16 @@ class AWSResourceAdapterBase(object):
         "aws_secret_access_key": <secret-access-key-string>
       }
     """
-    # Make sure we have the latest version of configuration
-    # TODO: probably don't need to do this here. Instead, get them on demand in
-    #   AWSResourceAdapterBase
-    htm.it.app.config.loadConfig()
-
-    return {
-      "aws_access_key_id":
-        htm.it.app.config.get("aws", "aws_access_key_id"),
-      "aws_secret_access_key":
-        htm.it.app.config.get("aws", "aws_secret_access_key")
-    }
+    with _gConfigLock:
+      # Make sure we have the latest version of configuration
+      # TODO: probably don't need to do this here. Instead, get them on demand
+      #   in AWSResourceAdapterBase
+      htm.it.app.config.loadConfig()
+
+      return {
+        "aws_access_key_id":
+          htm.it.app.config.get("aws", "aws_access_key_id"),
+        "aws_secret_access_key":
+          htm.it.app.config.get("aws", "aws_secret_access_key")
+      }
 
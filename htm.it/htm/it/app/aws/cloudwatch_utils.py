@@ -39,6 +39,10 @@ CLOUDWATCH_MAX_DATA_RECORDS = 1440
 # AWS CloudWatch only keeps 2 weeks worth of data. Limit range to 14 days
 CLOUDWATCH_DATA_MAX_STORAGE_TIMEDELTA = datetime.timedelta(days=14)
 
+# Maximum number of metric data queries in one AWS CloudWatch GetMetricData
+# request
+CLOUDWATCH_MAX_METRIC_DATA_QUERIES = 500
+
 
 
 class CloudWatchServerErrorCodes(object):
@@ -93,8 +97,10 @@ MAX_RETRY_BACKOFF_SEC = 1
 
 
 
-def retryOnCloudWatchTransientError(logger=logging.root,
-                                    timeoutSec=DEFAULT_RETRY_TIMEOUT_SEC):
+def retryOnCloudWatchTransientError(
+    logger=logging.root,
+    timeoutSec=DEFAULT_RETRY_TIMEOUT_SEC,
+    retriableErrorCodes=RETRIABLE_SERVER_ERROR_CODES):
   """ Create a decorator for retrying a function upon CloudWatch transient
   error.
 
@@ -104,6 +110,9 @@ def retryOnCloudWatchTransientError(logger=logging.root,
   :param timeoutSec: How many seconds from time of initial call to stop retrying
   :type timeoutSec: floating point
 
+  :param retriableErrorCodes: BotoServerError error codes that are subject to
+    retries; defaults to RETRIABLE_SERVER_ERROR_CODES
+
   :returns: a decorator
   """
 
@@ -111,7 +120,7 @@ def retryOnCloudWatchTransientError(logger=logging.root,
     """Return True to permit a retry, false to re-raise the exception."""
 
     if isinstance(e, BotoServerError):
-      if getattr(e, "error_code", "") in RETRIABLE_SERVER_ERROR_CODES:
+      if getattr(e, "error_code", "") in retriableErrorCodes:
         return True
       else:
         return False
@@ -68,6 +68,14 @@ class MetricThrottleError(HTMITError):
 
 
 
+class MetricDataQueryError(HTMITError):
+  """ Data source failed to return a metric's data in a batched query (e.g.,
+  error status of the metric's result in AWS CloudWatch GetMetricData)
+  """
+  pass
+
+
+
 class InvalidAWSRegionName(HTMITError):
   """ Invalid AWS Region name given """
   pass
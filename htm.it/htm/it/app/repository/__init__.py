@@ -42,6 +42,7 @@ from htm.it.app.repository.queries import (
   addMetricData,
   addMetricToAutostack,
   addNotification,
+  addNotifications,
   batchAcknowledgeNotifications,
   batchSeeNotifications,
   clearOldNotifications,
@@ -77,6 +78,7 @@ from htm.it.app.repository.queries import (
   getMetricWithUpdateLock,
   getMetricCountForServer,
   getMetricData,
+  getMetricDataChunks,
   getMetricDataCount,
   getProcessedMetricDataCount,
   getMetricDataWithRawAnomalyScoresTail,
@@ -94,6 +96,7 @@ from htm.it.app.repository.queries import (
   updateMetricColumns,
   updateMetricColumnsForRefStatus,
   updateMetricDataColumns,
+  updateMetricDataColumnsBulk,
   updateNotificationDeviceTimestamp,
   updateNotificationMessageId,
   lockOperationExclusive,
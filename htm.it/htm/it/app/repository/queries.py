@@ -56,6 +56,7 @@ from htmengine.repository.queries import (
   getMetric,
   getMetricCountForServer,
   getMetricData,
+  getMetricDataChunks,
   getMetricDataCount,
   getMetricDataWithRawAnomalyScoresTail,
   getMetricIdsSortedByDisplayValue,
@@ -72,6 +73,7 @@ from htmengine.repository.queries import (
   updateMetricColumns,
   updateMetricColumnsForRefStatus,
   updateMetricDataColumns,
+  updateMetricDataColumnsBulk,
   MetricStatus,
   OperationLock,
   saveMetricInstanceStatus,
@@ -745,6 +747,99 @@ def addNotification(conn, uid, server, metric, rowid, device, windowsize,
 
 
 
+def addNotifications(conn, server, notifications):
+  """Add a batch of notifications of the same server with a constant number of
+  statements, throttled like addNotification: a notification isn't added if
+  there is an unseen notification for the same server and device, including
+  one added earlier in the batch, within the notification's windowsize.
+
+  :param conn: SQLAlchemy Connection object for executing SQL
+  :type conn: sqlalchemy.engine.Connection
+  :param server: Metric server of the notifications
+  :param notifications: sequence of dicts of the notifications' uid, metric,
+    rowid, device, windowsize, timestamp, acknowledged and seen values (see
+    addNotification), ordered by timestamp
+  :returns: the dicts of the notifications that were added
+  :rtype: list
+  """
+  if not notifications:
+    return []
+
+  with conn.begin():
+    # Secure a write lock on notification table for the reasons described in
+    # addNotification
+    conn.execute("LOCK TABLES notification WRITE, metric READ;")
+
+    try:
+      # The latest unseen notification of each device determines whether a new
+      # notification is within the windowsize of any of the device's unseen
+      # notifications
+      query = (
+        select([schema.notification.c.device,
+                func.max(schema.notification.c.timestamp)])
+        .select_from(
+          schema.notification.outerjoin(
+            schema.metric,
+            schema.metric.c.uid == schema.notification.c.metric))
+        .where(schema.metric.c.server == server)
+        .where(schema.notification.c.device.in_(
+          set(notification["device"] for notification in notifications)))
+        .where(schema.notification.c.seen == 0)
+        .group_by(schema.notification.c.device)
+      )
+
+      latestTimestamps = dict(conn.execute(query).fetchall())
+
+      def throttle(addNotificationCb):
+        """
+        :param addNotificationCb: function that adds the given notification
+          dict and returns True if it was added
+        :returns: the dicts of the notifications that were added
+        """
+        latest = dict(latestTimestamps)
+        added = []
+        for notification in notifications:
+          timestamp = latest.get(notification["device"])
+          if (timestamp is not None and
+              (timestamp + timedelta(seconds=notification["windowsize"]) >
+               notification["timestamp"])):
+            continue
+
+          if addNotificationCb(notification):
+            latest[notification["device"]] = notification["timestamp"]
+            added.append(notification)
+
+        return added
+
+      added = throttle(lambda notification: True)
+
+      if added:
+        try:
+          conn.execute(schema.notification.insert(), # pylint: disable=E1120
+                       added)
+        except IntegrityError:
+          # E.g., the device was deleted or a notification for the same metric
+          # data row and device already exists; add the notifications one by
+          # one, skipping the offending ones
+          def addOne(notification):
+            try:
+              conn.execute(
+                schema.notification.insert() # pylint: disable=E1120
+                .values(**notification))
+            except IntegrityError:
+              return False
+
+            return True
+
+          added = throttle(addOne)
+
+    finally:
+      conn.execute("UNLOCK TABLES;") # Release table lock.
+
+  return added
+
+
+
 def addDeviceNotificationSettings(conn, # pylint: disable=C0103
                                   deviceId,
                                   windowsize,
@@ -29,6 +29,8 @@ from collections import defaultdict, OrderedDict
 from datetime import datetime
 import logging
 import multiprocessing
+from multiprocessing.pool import ThreadPool
+import Queue
 import sys
 import threading
 import time
@@ -42,6 +44,7 @@ from htmengine import utils
 
 # import from htm.it or else datasource adapters won't register properly...
 from htm.it.app.adapters.datasource import createDatasourceAdapter
+from htm.it.app.adapters.datasource.cloudwatch import aws_base
 
 from htmengine.runtime.metric_streamer_util import MetricStreamer
 from htm.it.htm_it_logging import getStandardLogPrefix
@@ -66,14 +69,50 @@ def _getLogger():
 
 
 
+class _RegionRateLimiter(object):
+  """ [thread-safe] Spaces out data collection requests within each AWS region
+  so that they don't exceed the given rate, delaying callers as needed. Each
+  region is limited independently.
+  """
+
+  def __init__(self, maxRequestsPerSec):
+    """
+    :param maxRequestsPerSec: maximum number of requests per second per region
+    """
+    self._interval = 1.0 / maxRequestsPerSec
+
+    # Time (unix epoch) of the next available request slot, keyed by region
+    self._nextSlotTimes = defaultdict(float)
+
+    self._lock = threading.Lock()
+
+
+  def acquire(self, region):
+    """ Reserve the next request slot in the given region, sleeping until that
+    slot's time
+
+    :param region: AWS region name (e.g., "us-west-2"); None for requests that
+      aren't bound to a region
+    """
+    with self._lock:
+      now = time.time()
+      slotTime = max(now, self._nextSlotTimes[region])
+      self._nextSlotTimes[region] = slotTime + self._interval
+
+    if slotTime > now:
+      time.sleep(slotTime - now)
+
+
+
 class _DataCollectionTask(object):
-  """ Data collection task parameters for data collection worker process
+  """ Data collection task parameters for data collection worker
   """
   __slots__ = ("metricID", "datasource", "metricSpec", "rangeStart",
-               "metricPeriod", "updateResourceStatus", "resultsQueue")
+               "metricPeriod", "updateResourceStatus", "resultsQueue",
+               "rateLimiter")
 
   def __init__(self, metricID, datasource, metricSpec, rangeStart, metricPeriod,
-               updateResourceStatus, resultsQueue):
+               updateResourceStatus, resultsQueue, rateLimiter=None):
     """
     :param metricID: unique id of the metric associated with the task (presently
       only for diagnostics)
@@ -83,6 +122,7 @@ class _DataCollectionTask(object):
     :param metricPeriod: metric data period in seconds
     :param updateResourceStatus: True to query the resource's status.
     :param resultsQueue: Results Queue
+    :param rateLimiter: optional _RegionRateLimiter for the task's requests
     """
     # TODO: unit-test
 
@@ -93,6 +133,7 @@ class _DataCollectionTask(object):
     self.metricPeriod = metricPeriod
     self.updateResourceStatus = updateResourceStatus
     self.resultsQueue = resultsQueue
+    self.rateLimiter = rateLimiter
 
 
   def __repr__(self):
@@ -106,7 +147,7 @@ class _DataCollectionTask(object):
 
 
 class _DataCollectionResult(object):
-  """ Metric data collection result as returned by process pool worker
+  """ Metric data collection result as returned by data collection worker
   """
   __slots__ = ("metricID", "creationTime", "exception", "resourceStatus",
                "data", "nextCallStart", "duration",)
@@ -220,9 +261,15 @@ class MetricCollector(object):
   a specified time interval
   """
 
-  # Number of concurrent worker processes used for querying metrics
+  # Number of concurrent worker processes used for querying metrics in
+  # _WORKER_MODE_PROCESSES
   _WORKER_PROCESS_POOL_SIZE = 10
 
+  # Values of the metric_collector/worker_mode config option: collect metric
+  # data on a pool of worker processes or on a pool of worker threads
+  _WORKER_MODE_PROCESSES = "processes"
+  _WORKER_MODE_THREADS = "threads"
+
   # Amount of time to sleep when there are no metrics pending data collection
   _NO_PENDING_METRICS_SLEEP_SEC = 10
 
@@ -254,6 +301,28 @@ class MetricCollector(object):
     self._metricErrorGracePeriod = htm.it.app.config.getfloat(
       "metric_collector", "metric_error_grace_period")
 
+    self._workerMode = htm.it.app.config.get("metric_collector",
+                                             "worker_mode")
+    if self._workerMode not in (self._WORKER_MODE_PROCESSES,
+                                self._WORKER_MODE_THREADS):
+      raise ValueError("Unexpected metric_collector worker_mode=%r" %
+                       (self._workerMode,))
+
+    self._numWorkerThreads = htm.it.app.config.getint(
+      "metric_collector", "num_worker_threads")
+
+    self._maxMetricsPerBatch = htm.it.app.config.getint(
+      "metric_collector", "max_metrics_per_batch")
+
+    # Per-region rate limiting of data collection requests is only possible
+    # when the requests are made by threads of this process
+    maxRequestsPerSec = htm.it.app.config.getfloat(
+      "metric_collector", "max_requests_per_sec_per_region")
+    if maxRequestsPerSec > 0 and self._workerMode == self._WORKER_MODE_THREADS:
+      self._rateLimiter = _RegionRateLimiter(maxRequestsPerSec)
+    else:
+      self._rateLimiter = None
+
     # Interval for periodic garbage collection of our caches (e.g.,
     # self._metricInfoCache and self._resourceInfoCache)
     self._cacheGarbageCollectionIntervalSec = self._metricErrorGracePeriod * 2
@@ -278,20 +347,24 @@ class MetricCollector(object):
 
 
 
-  def _collectDataForMetrics(self, metricsToUpdate, processPool, resultsQueue):
+  def _collectDataForMetrics(self, metricsToUpdate, workerPool, resultsQueue):
     """ Collect data for the given metrics
 
     :param metricsToUpdate: a dict of Metric instances which are due for
       an update
 
-    :param processPool: Process poll in which collection tasks are mapped.
-    :type processPool: multiprocessing.Pool
+    :param workerPool: Process or thread pool in which collection tasks are
+      mapped.
+    :type workerPool: multiprocessing.Pool or multiprocessing.pool.ThreadPool
 
     :param resultsQueue: Results Queue onto which collection results are
       published
-    :type resultsQueue: multiprocessing.JoinableQueue
+    :type resultsQueue: multiprocessing.JoinableQueue or Queue.Queue
+
+    Cloudwatch metrics of the same region and period are collected in batches
+    of up to max_metrics_per_batch metrics with batched requests.
 
-    :returns: Result of calling `processPool.map_async()`.  Call .wait() on the
+    :returns: Result of calling `workerPool.map_async()`.  Call .wait() on the
       return value to block until all map tasks have been completed.
       Meanwhile, you may consume resultsQueue for the results as they become
       available.
@@ -318,12 +391,27 @@ class MetricCollector(object):
         rangeStart=metricObj.last_timestamp,
         metricPeriod=metricObj.poll_interval,
         updateResourceStatus=updateResourceStatus,
-        resultsQueue=resultsQueue)
+        resultsQueue=resultsQueue,
+        rateLimiter=self._rateLimiter)
 
       tasks.append(task)
 
-    # Process the tasks concurrently, return immediately
-    return processPool.map_async(_collect, tasks)
+    # Group the tasks into batches
+    batches = []
+    openBatches = dict()
+    for task in tasks:
+      if task.datasource == "cloudwatch" and self._maxMetricsPerBatch > 1:
+        batchKey = (task.metricSpec.get("region"), task.metricPeriod)
+        batch = openBatches.get(batchKey)
+        if batch is None or len(batch) >= self._maxMetricsPerBatch:
+          batch = openBatches[batchKey] = []
+          batches.append(batch)
+        batch.append(task)
+      else:
+        batches.append([task])
+
+    # Process the batches concurrently, return immediately
+    return workerPool.map_async(_collectBatch, batches)
 
 
   def _garbageCollectInfoCache(self):
@@ -600,7 +688,7 @@ class MetricCollector(object):
 
     :param resultsQueue: Queue from which a sequence of _DataCollectionResult
       instances are processed
-    :type resultsQueue: multiprocessing.JoinableQueue
+    :type resultsQueue: multiprocessing.JoinableQueue or Queue.Queue
 
     :param modelSwapper: ModelSwapperInterface object for running models
 
@@ -646,14 +734,24 @@ class MetricCollector(object):
     # connection socket file descriptor used by multiple processes). And we
     # can't take advantage of the process Pool's maxtasksperchild feature
     # either (for the same reason)
-    self._log.info("Starting htm-it Metric Collector")
-    resultsQueue = multiprocessing.Manager().JoinableQueue()
+    self._log.info("Starting htm-it Metric Collector; workerMode=%s",
+                   self._workerMode)
 
     recvPipe, sendPipe = multiprocessing.Pipe(False)
 
-    processPool = multiprocessing.Pool(
-      processes=self._WORKER_PROCESS_POOL_SIZE,
-      maxtasksperchild=None)
+    if self._workerMode == self._WORKER_MODE_THREADS:
+      # Collection is I/O-bound, so worker threads keep up with worker
+      # processes at a fraction of the memory; they also hand results to the
+      # dispatch thread without the pickling and the manager process of
+      # multiprocessing queues, and reuse their boto connections
+      resultsQueue = Queue.Queue()
+      workerPool = ThreadPool(processes=self._numWorkerThreads,
+                              initializer=aws_base.enableConnectionReuse)
+    else:
+      resultsQueue = multiprocessing.Manager().JoinableQueue()
+      workerPool = multiprocessing.Pool(
+        processes=self._WORKER_PROCESS_POOL_SIZE,
+        maxtasksperchild=None)
 
     try:
       with ModelSwapperInterface() as modelSwapper:
@@ -678,7 +776,7 @@ class MetricCollector(object):
           collectionStartTime = time.time()
 
           poolResults = self._collectDataForMetrics(metricsToUpdate,
-                                                    processPool,
+                                                    workerPool,
                                                     resultsQueue)
 
           # Process/dispatch results in parallel in another thread as results
@@ -693,7 +791,7 @@ class MetricCollector(object):
           dispatchStartTime = time.time()
           dispatchThread.start()
 
-          # Syncronize with processPool
+          # Syncronize with workerPool
           poolResults.wait() # Wait for collection tasks to complete
 
           metricPollDuration = time.time() - collectionStartTime
@@ -717,14 +815,13 @@ class MetricCollector(object):
             metricPollDuration, dispatchDuration)
     finally:
       self._log.info("Exiting Metric Collector run-loop")
-      processPool.terminate()
-      processPool.join()
+      workerPool.terminate()
+      workerPool.join()
 
 
 
 def _collect(task):
-  """ Executed via multiprocessing Pool: Collect metric data and corresponding
-  resource status.
+  """ Collect metric data and corresponding resource status.
 
   :param task: a _DataCollectionTask instance
   """
@@ -738,6 +835,8 @@ def _collect(task):
 
   try:
     dsAdapter = createDatasourceAdapter(task.datasource)
+    if task.rateLimiter is not None:
+      task.rateLimiter.acquire(task.metricSpec.get("region"))
     result.data, result.nextCallStart = dsAdapter.getMetricData(
       metricSpec=task.metricSpec,
       start=task.rangeStart,
@@ -746,13 +845,8 @@ def _collect(task):
     log.exception("getMetricData failed in task=%s", task)
     result.data = e
 
-  try:
-    if task.updateResourceStatus:
-      result.resourceStatus = dsAdapter.getMetricResourceStatus(
-        metricSpec=task.metricSpec)
-  except Exception as e: # pylint: disable=W0703
-    log.exception("getMetricResourceStatus failed in task=%s", task)
-    result.resourceStatus = e
+  if task.updateResourceStatus:
+    result.resourceStatus = _getResourceStatus(dsAdapter, task, log)
 
   result.duration = time.time() - startTime
 
@@ -762,6 +856,76 @@ def _collect(task):
 
 
 
+def _collectBatch(tasks):
+  """ Executed via multiprocessing Pool or ThreadPool: Collect metric data and
+  corresponding resource status for a batch of metrics of the same datasource
+  and region, fetching the data of multi-metric batches with batched requests.
+
+  :param tasks: a sequence of _DataCollectionTask instances
+  """
+  if len(tasks) == 1:
+    return _collect(tasks[0])
+
+  log = htm_it_logging.getExtendedLogger(MetricCollector.__name__)
+
+  startTime = time.time()
+
+  results = [_DataCollectionResult(metricID=task.metricID) for task in tasks]
+
+  dsAdapter = None
+
+  try:
+    dsAdapter = createDatasourceAdapter(tasks[0].datasource)
+    if tasks[0].rateLimiter is not None:
+      tasks[0].rateLimiter.acquire(tasks[0].metricSpec.get("region"))
+    batchData = dsAdapter.getMetricDataBatch(
+      [(task.metricSpec, task.rangeStart) for task in tasks])
+  except Exception as e: # pylint: disable=W0703
+    log.exception("getMetricDataBatch failed in numTasks=%d; first task=%s",
+                  len(tasks), tasks[0])
+    batchData = [e] * len(tasks)
+
+  # Demultiplex the batch's data into per-metric results
+  for task, result, metricData in zip(tasks, results, batchData):
+    if isinstance(metricData, Exception):
+      log.error("getMetricDataBatch failed in task=%s: %r", task, metricData)
+      result.data = metricData
+    else:
+      result.data, result.nextCallStart = metricData
+
+    if task.updateResourceStatus:
+      result.resourceStatus = _getResourceStatus(dsAdapter, task, log)
+
+  duration = time.time() - startTime
+
+  for task, result in zip(tasks, results):
+    result.duration = duration
+    task.resultsQueue.put(result)
+
+  return True
+
+
+
+def _getResourceStatus(dsAdapter, task, log):
+  """ Query the status of the resource of the task's metric
+
+  :param dsAdapter: datasource adapter; None if it couldn't be created
+  :param task: a _DataCollectionTask instance
+  :param log: logger
+
+  :returns: resource status per the adapter's getMetricResourceStatus or
+    Exception-based object on error
+  """
+  try:
+    if task.rateLimiter is not None:
+      task.rateLimiter.acquire(task.metricSpec.get("region"))
+    return dsAdapter.getMetricResourceStatus(metricSpec=task.metricSpec)
+  except Exception as e: # pylint: disable=W0703
+    log.exception("getMetricResourceStatus failed in task=%s", task)
+    return e
+
+
+
 if __name__ == "__main__":
   logging_support.LoggingSupport.initService()
 
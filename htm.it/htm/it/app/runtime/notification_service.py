@@ -20,6 +20,7 @@
 # http://numenta.org/licenses/
 # ----------------------------------------------------------------------
 
+import bisect
 from datetime import datetime, timedelta
 import locale
 locale.setlocale(locale.LC_ALL, "en_US")
@@ -28,6 +29,8 @@ import os.path
 from pkg_resources import resource_filename
 import sys
 import StringIO
+import threading
+import time
 import traceback
 import uuid
 
@@ -52,6 +55,17 @@ _NOTIFICATION_DEVICE_STALE_DAYS = 30
 
 
 
+# Anomalous results of rows with rowids up to this are ignored due to
+# insufficient data
+_MIN_NOTIFICATION_ROWID = 1000
+
+
+
+# Anomalous results of rows with timestamps older than this are ignored
+_MAX_NOTIFICATION_AGE = timedelta(seconds=3600)
+
+
+
 def _queryAvailabilityZone():
   """ Query AWS for the machine's availability zone
 
@@ -149,6 +163,41 @@ def localizedTimestamp(timestamp,
   return zone.localize(timestamp+zone.utcoffset(timestamp))
 
 
+class NotificationSettingsIndex(object):
+  """ Device notification settings ordered by sensitivity, so that the settings
+  whose thresholds an anomaly score meets are found with a binary search
+  """
+
+  def __init__(self, settings):
+    """
+    :param settings: sequence of notification_settings rows
+    """
+    self._settings = sorted(settings, key=lambda setting: setting.sensitivity)
+    self._sensitivities = [setting.sensitivity for setting in self._settings]
+
+
+  def __len__(self):
+    return len(self._settings)
+
+
+  @property
+  def minThreshold(self):
+    """ Lowest sensitivity of the settings; None if there are no settings """
+    return self._sensitivities[0] if self._sensitivities else None
+
+
+  def match(self, anomalyScore):
+    """
+    :param anomalyScore: anomaly score of a model inference result
+    :returns: the settings whose sensitivity the anomaly score meets or
+      exceeds
+    :rtype: list
+    """
+    return self._settings[:bisect.bisect_right(self._sensitivities,
+                                               anomalyScore)]
+
+
+
 class NotificationService(object):
   """ Notification Service to monitor model inference results and trigger
       notifications where appropriate.
@@ -165,6 +214,23 @@ class NotificationService(object):
     self._modelResultsExchange = (
       htm.it.app.config.get("metric_streamer", "results_exchange_name"))
 
+    self._settingsRefreshIntervalSec = htm.it.app.config.getfloat(
+      "notifications", "settings_refresh_interval_sec")
+    self._cleanupIntervalSec = htm.it.app.config.getfloat(
+      "notifications", "cleanup_interval_sec")
+
+    # NotificationSettingsIndex of all devices' settings, reloaded by
+    # _getNotificationSettings when it expires
+    self._settingsIndex = None
+    self._settingsExpiration = 0
+
+    # Model result batch evaluation time statistics since they were last
+    # logged by the cleanup task
+    self._evalStatsLock = threading.Lock()
+    self._numEvaluatedBatches = 0
+    self._totalEvalTimeSec = 0.0
+    self._maxEvalTimeSec = 0.0
+
 
   def sendNotificationEmail(self, engine, settingObj, notificationObj):
     """ Send notification email through Amazon SES
@@ -251,6 +317,99 @@ class NotificationService(object):
       self._log.exception("Unable to send email.")
 
 
+  def _getNotificationSettings(self, engine):
+    """ Get the notification settings of all devices, reloading them along with
+    the configuration once settings_refresh_interval_sec elapses
+
+    :param engine: SQLAlchemy engine object
+    :type engine: sqlalchemy.engine.Engine
+    :returns: NotificationSettingsIndex of the settings
+    """
+    if self._settingsIndex is None or time.time() >= self._settingsExpiration:
+      htm.it.app.config.loadConfig()
+
+      with engine.connect() as conn:
+        settings = repository.retryOnTransientErrors(
+            repository.getAllNotificationSettings)(conn)
+
+      self._log.debug("settings: %r" % settings)
+
+      self._settingsIndex = NotificationSettingsIndex(settings)
+      self._settingsExpiration = time.time() + self._settingsRefreshIntervalSec
+
+    return self._settingsIndex
+
+
+  def _evaluateBatch(self, batch, settingsIndex):
+    """ Match the model inference results of a batch against the notification
+    settings' anomaly thresholds
+
+    :param batch: deserialized model inference results batch
+    :param NotificationSettingsIndex settingsIndex: notification settings
+    :returns: sequence of (settingObj, notification) pairs ordered by
+      timestamp, where notification is a dict of the notification to add (see
+      repository.addNotifications)
+    """
+    metricInfo = batch["metric"]
+    metricId = metricInfo["uid"]
+
+    # Minimum threshold to trigger any notification avoids permuting
+    # settings x metricDataRows
+    minThreshold = settingsIndex.minThreshold
+    if minThreshold is None:
+      minThreshold = 0.99999
+
+    oldestTimestamp = datetime.utcnow() - _MAX_NOTIFICATION_AGE
+
+    candidates = []
+
+    for row in batch["results"]:
+      if row["anomaly"] < minThreshold:
+        continue
+
+      rowDatetime = datetime.utcfromtimestamp(row["ts"])
+
+      if not settingsIndex:
+        # There are no device notification settings stored on this server,
+        # no notifications will be generated.  However, log that a
+        # an anomaly was detected and notification would be sent if there
+        # were any configured devices
+        self._log.info("<%r>" % (metricInfo) + (
+                                      "{TAG:APP.NOTIFICATION} Anomaly "
+                                      "detected at %s, but no devices are "
+                                      "configured.") % rowDatetime)
+        continue
+
+      if row["rowid"] <= _MIN_NOTIFICATION_ROWID:
+        continue # Not enough data
+
+      if rowDatetime < oldestTimestamp:
+        continue # Skip old
+
+      # If anomaly_score meets or exceeds any of the device notification
+      # sensitivity settings, trigger notification.
+      # repository.addNotifications() will handle throttling.
+      for settingObj in settingsIndex.match(row["anomaly"]):
+        candidates.append((settingObj,
+                           dict(uid=str(uuid.uuid4()),
+                                metric=metricId,
+                                rowid=row["rowid"],
+                                device=settingObj.uid,
+                                windowsize=settingObj.windowsize,
+                                timestamp=rowDatetime,
+                                acknowledged=0,
+                                seen=0)))
+
+    return candidates
+
+
+  def _recordEvaluationTime(self, evalTimeSec):
+    with self._evalStatsLock:
+      self._numEvaluatedBatches += 1
+      self._totalEvalTimeSec += evalTimeSec
+      self._maxEvalTimeSec = max(self._maxEvalTimeSec, evalTimeSec)
+
+
   def messageHandler(self, message):
     """ Inspect all inbound model results in a batch for anomaly thresholds and
         trigger notifications where applicable.
@@ -266,10 +425,7 @@ class NotificationService(object):
       message.ack()
       return
 
-    htm.it.app.config.loadConfig() # reload config on every batch
     engine = repository.engineFactory()
-    # Cache minimum threshold to trigger any notification to avoid permuting
-    # settings x metricDataRows
     try:
       try:
         batch = AnomalyService.deserializeModelResult(message.body)
@@ -277,102 +433,110 @@ class NotificationService(object):
         self._log.exception("Error deserializing model result")
         raise
 
-      # Load all settings for all users (once per incoming batch)
-      with engine.connect() as conn:
-        settings = repository.retryOnTransientErrors(
-            repository.getAllNotificationSettings)(conn)
+      settingsIndex = self._getNotificationSettings(engine)
 
-      self._log.debug("settings: %r" % settings)
+      evalStartTime = time.time()
+      candidates = self._evaluateBatch(batch, settingsIndex)
+      evalTimeSec = time.time() - evalStartTime
+
+      self._recordEvaluationTime(evalTimeSec)
+      self._log.debug("{TAG:APP.NOTIFICATION.EVAL} numResults=%d; "
+                      "numSettings=%d; numCandidates=%d; evalTime=%.6fs",
+                      len(batch["results"]), len(settingsIndex),
+                      len(candidates), evalTimeSec)
 
-      if settings:
-        minThreshold = min(setting.sensitivity for setting in settings)
-      else:
-        minThreshold = 0.99999
-
-      metricInfo = batch["metric"]
-      metricId = metricInfo["uid"]
-      resource = metricInfo["resource"]
-
-
-      for row in batch["results"]:
-
-        if row["anomaly"] >= minThreshold:
-          rowDatetime = datetime.utcfromtimestamp(row["ts"])
-
-          if not settings:
-            # There are no device notification settings stored on this server,
-            # no notifications will be generated.  However, log that a
-            # an anomaly was detected and notification would be sent if there
-            # were any configured devices
-            self._log.info("<%r>" % (metricInfo) + (
-                                          "{TAG:APP.NOTIFICATION} Anomaly "
-                                          "detected at %s, but no devices are "
-                                          "configured.") % rowDatetime)
-            continue
-
-          for settingObj in settings:
-            if row["rowid"] <= 1000:
-              continue # Not enough data
-
-
-            if rowDatetime < datetime.utcnow() - timedelta(seconds=3600):
-              continue # Skip old
-
-            if row["anomaly"] >= settingObj.sensitivity:
-              # First let's clear any old users out of the database.
-              with engine.connect() as conn:
-                repository.retryOnTransientErrors(
-                    repository.deleteStaleNotificationDevices)(
-                        conn, _NOTIFICATION_DEVICE_STALE_DAYS)
-
-              # If anomaly_score meets or exceeds any of the device
-              # notification sensitivity settings, trigger notification.
-              # repository.addNotification() will handle throttling.
-              notificationId = str(uuid.uuid4())
-
-              with engine.connect() as conn:
-                result = repository.retryOnTransientErrors(
-                    repository.addNotification)(conn,
-                                                uid=notificationId,
-                                                server=resource,
-                                                metric=metricId,
-                                                rowid=row["rowid"],
-                                                device=settingObj.uid,
-                                                windowsize=(
-                                                  settingObj.windowsize),
-                                                timestamp=rowDatetime,
-                                                acknowledged=0,
-                                                seen=0)
-
-              self._log.info("NOTIFICATION=%s SERVER=%s METRICID=%s DEVICE=%s "
-                             "Notification generated. " % (notificationId,
-                             resource, metricId,
-                             settingObj.uid))
-
-              if (result is not None and
-                  result.rowcount > 0 and
-                  settingObj.email_addr):
-                # Notification was generated.  Attempt to send email
-                with engine.connect() as conn:
-                  notificationObj = repository.getNotification(conn,
-                                                               notificationId)
-
-                self.sendNotificationEmail(engine,
-                                           settingObj,
-                                           notificationObj)
+      if not candidates:
+        return
+
+      metricId = batch["metric"]["uid"]
+      resource = batch["metric"]["resource"]
+
+      with engine.connect() as conn:
+        added = repository.retryOnTransientErrors(
+            repository.addNotifications)(
+                conn,
+                server=resource,
+                notifications=[notification for _, notification in candidates])
+
+      addedIds = set(notification["uid"] for notification in added)
+
+      for settingObj, notification in candidates:
+        if notification["uid"] not in addedIds:
+          continue
+
+        self._log.info("NOTIFICATION=%s SERVER=%s METRICID=%s DEVICE=%s "
+                       "Notification generated. " % (notification["uid"],
+                       resource, metricId,
+                       settingObj.uid))
+
+        if settingObj.email_addr:
+          # Notification was generated.  Attempt to send email
+          with engine.connect() as conn:
+            notificationObj = repository.getNotification(conn,
+                                                         notification["uid"])
+
+          self.sendNotificationEmail(engine,
+                                     settingObj,
+                                     notificationObj)
     finally:
       message.ack()
 
-    # Do cleanup
+
+  def cleanup(self):
+    """ Delete stale notification devices and notifications outside of the
+    30-day window, and log the model result batch evaluation time statistics
+    """
+    engine = repository.engineFactory()
+
     with engine.connect() as conn:
-      repository.clearOldNotifications(conn) # Delete all notifications outside
-                                             # of 30-day window
+      repository.retryOnTransientErrors(
+          repository.deleteStaleNotificationDevices)(
+              conn, _NOTIFICATION_DEVICE_STALE_DAYS)
+
+    with engine.connect() as conn:
+      repository.retryOnTransientErrors(
+          repository.clearOldNotifications)(conn)
+
+    # Reload the settings without the deleted devices
+    self._settingsExpiration = 0
+
+    with self._evalStatsLock:
+      numBatches = self._numEvaluatedBatches
+      totalEvalTimeSec = self._totalEvalTimeSec
+      maxEvalTimeSec = self._maxEvalTimeSec
+      self._numEvaluatedBatches = 0
+      self._totalEvalTimeSec = self._maxEvalTimeSec = 0.0
+
+    self._log.info("{TAG:APP.NOTIFICATION.EVAL.STATS} numBatches=%d; "
+                   "meanEvalTime=%.6fs; maxEvalTime=%.6fs", numBatches,
+                   totalEvalTimeSec / numBatches if numBatches else 0.0,
+                   maxEvalTimeSec)
+
+
+  def _runCleanup(self, stopEvent):
+    """ Cleanup thread target: run cleanup every cleanup_interval_sec until
+    stopEvent is set
+    """
+    while not stopEvent.wait(self._cleanupIntervalSec):
+      try:
+        self.cleanup()
+      except Exception:
+        self._log.exception("Notification cleanup failed")
 
 
   def run(self):
+    stopCleanupEvent = threading.Event()
+
     try:
       self._log.info("Starting htm-it Notification Service")
 
+      cleanupThread = threading.Thread(target=self._runCleanup,
+                                       args=(stopCleanupEvent,),
+                                       name="NotificationCleanup")
+      # Allow process to exit even if thread is still running
+      cleanupThread.setDaemon(True)
+      cleanupThread.start()
+
       def configChannel(amqpClient):
         amqpClient.requestQoS(prefetchCount=1)
 
@@ -420,6 +584,7 @@ class NotificationService(object):
     except KeyboardInterrupt:
       self._log.info("Stopping htm-it Notification Service: KeyboardInterrupt")
     finally:
+      stopCleanupEvent.set()
       self._log.info("HTM-IT Notification Service is exiting")
 
 
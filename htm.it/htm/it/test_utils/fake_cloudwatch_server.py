@@ -0,0 +1,381 @@
+# ----------------------------------------------------------------------
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2015, Numenta, Inc.  Unless you have purchased from
+# Numenta, Inc. a separate commercial license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+
+"""
+A local fake of the AWS CloudWatch endpoint for tests and benchmarks of the
+Cloudwatch datasource adapter
+"""
+
+import BaseHTTPServer
+import calendar
+import collections
+import datetime
+import SocketServer
+import threading
+import time
+import urlparse
+from xml.sax.saxutils import escape
+import zlib
+
+import boto.ec2.cloudwatch
+from boto.regioninfo import RegionInfo
+
+
+
+_XMLNS = "http://monitoring.amazonaws.com/doc/2010-08-01/"
+
+_TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+
+
+
+class FakeCloudWatchServer(object):
+  """ Local HTTP server that emulates the AWS CloudWatch Query API actions
+  GetMetricStatistics and GetMetricData. Every metric has a datapoint at each
+  multiple of its period since the unix epoch; see getDatapoints().
+
+  Example::
+
+      with FakeCloudWatchServer() as server:
+        with patch.object(boto.ec2.cloudwatch, "connect_to_region",
+                          autospec=True, side_effect=server.connectToRegion):
+          <do test logic>
+
+        self.assertEqual(server.requestCounts["GetMetricData"], 1)
+  """
+
+  def __init__(self, latencySec=0, maxRequestsPerSec=None,
+               maxDatapointsPerPage=100800):
+    """
+    :param latencySec: delay of each response in seconds
+    :param maxRequestsPerSec: requests in excess of this rate are throttled;
+      None for no limit
+    :param maxDatapointsPerPage: maximum number of datapoints per page of
+      GetMetricData results
+    """
+    self.latencySec = latencySec
+    self.maxRequestsPerSec = maxRequestsPerSec
+    self.maxDatapointsPerPage = maxDatapointsPerPage
+
+    # Number of upcoming requests to throttle regardless of request rate
+    self.numRequestsToThrottle = 0
+
+    # Names of metrics whose GetMetricData results have InternalError status
+    self.failingMetricNames = set()
+
+    # Counts of requests that weren't throttled, keyed by action
+    self.requestCounts = collections.Counter()
+
+    self.numThrottledRequests = 0
+
+    # Times of recent requests for throttling by request rate
+    self._recentRequestTimes = collections.deque()
+
+    self._lock = threading.Lock()
+
+    self._httpServer = None
+    self._serverThread = None
+
+
+  def __enter__(self):
+    self.start()
+    return self
+
+
+  def __exit__(self, *args):
+    self.stop()
+
+
+  def start(self):
+    self._httpServer = _ThreadedHTTPServer(("127.0.0.1", 0),
+                                           _FakeCloudWatchRequestHandler)
+    self._httpServer.fakeCloudWatch = self
+
+    # Poll for shutdown often to stop quickly
+    self._serverThread = threading.Thread(
+      target=self._httpServer.serve_forever, kwargs=dict(poll_interval=0.05))
+    self._serverThread.setDaemon(True)
+    self._serverThread.start()
+
+
+  def stop(self):
+    self._httpServer.shutdown()
+    self._serverThread.join()
+    self._httpServer.server_close()
+
+
+  @property
+  def port(self):
+    return self._httpServer.server_address[1]
+
+
+  def connectToRegion(self, region_name, **kwargs):
+    """ Replacement for boto.ec2.cloudwatch.connect_to_region that connects to
+    this server in any region
+    """
+    return boto.ec2.cloudwatch.CloudWatchConnection(
+      is_secure=False,
+      port=self.port,
+      region=RegionInfo(name=region_name, endpoint="127.0.0.1"),
+      **kwargs)
+
+
+  @staticmethod
+  def getDatapoints(namespace, metricName, dimensions, period, start, end):
+    """ Datapoints of the given metric in the given time range
+
+    :param dimensions: dict of dimension values keyed by dimension name
+    :param start: UTC start time of the range (inclusive)
+    :type start: datetime.datetime
+    :param end: UTC end time of the range (exclusive)
+    :type end: datetime.datetime
+
+    :returns: sequence of (<datetime timestamp>, <value>) two-tuples sorted by
+      timestamp in ascending order
+    """
+    metricHash = zlib.crc32(
+      repr((namespace, metricName, sorted(dimensions.items())))) & 0xffffffff
+
+    startEpoch = calendar.timegm(start.utctimetuple())
+    endEpoch = calendar.timegm(end.utctimetuple()) + (
+      1 if end.microsecond else 0)
+
+    return [(datetime.datetime.utcfromtimestamp(epoch),
+             float((metricHash + epoch // period) % 1000) / 10)
+            for epoch in xrange(-(-startEpoch // period) * period, endEpoch,
+                                period)]
+
+
+  def _isThrottled(self):
+    with self._lock:
+      if self.numRequestsToThrottle > 0:
+        self.numRequestsToThrottle -= 1
+        self.numThrottledRequests += 1
+        return True
+
+      if self.maxRequestsPerSec is not None:
+        now = time.time()
+        recentRequestTimes = self._recentRequestTimes
+        while recentRequestTimes and recentRequestTimes[0] <= now - 1:
+          recentRequestTimes.popleft()
+
+        if len(self._recentRequestTimes) >= self.maxRequestsPerSec:
+          self.numThrottledRequests += 1
+          return True
+
+        self._recentRequestTimes.append(now)
+
+    return False
+
+
+  def handleRequest(self, params):
+    """ Handle a Query API request
+
+    :param params: dict of request parameters
+    :returns: (<HTTP status>, <XML response body>) two-tuple
+    """
+    if self._isThrottled():
+      return 400, _errorResponse("Throttling", "Rate exceeded")
+
+    action = params.get("Action")
+    if action == "GetMetricStatistics":
+      body = self._getMetricStatistics(params)
+    elif action == "GetMetricData":
+      body = self._getMetricData(params)
+    else:
+      return 400, _errorResponse("InvalidAction",
+                                 "Unsupported action %s" % (action,))
+
+    with self._lock:
+      self.requestCounts[action] += 1
+
+    return 200, body
+
+
+  def _getMetricStatistics(self, params):
+    statistics = _getMembers(params, "Statistics.member.")
+    datapoints = self.getDatapoints(
+      namespace=params["Namespace"],
+      metricName=params["MetricName"],
+      dimensions=_getDimensions(params, ""),
+      period=int(params["Period"]),
+      start=_parseTimestamp(params["StartTime"]),
+      end=_parseTimestamp(params["EndTime"]))
+
+    members = "".join(
+      "<member><Timestamp>%s</Timestamp><Unit>%s</Unit>%s</member>" % (
+        timestamp.strftime(_TIMESTAMP_FORMAT),
+        escape(params.get("Unit", "None")),
+        "".join("<%s>%r</%s>" % (statistic, value, statistic)
+                for statistic in statistics))
+      for timestamp, value in datapoints)
+
+    return (
+      "<GetMetricStatisticsResponse xmlns=\"%s\"><GetMetricStatisticsResult>"
+      "<Datapoints>%s</Datapoints><Label>%s</Label>"
+      "</GetMetricStatisticsResult>%s</GetMetricStatisticsResponse>" % (
+        _XMLNS, members, escape(params["MetricName"]), _RESPONSE_METADATA))
+
+
+  def _getMetricData(self, params):
+    start = _parseTimestamp(params["StartTime"])
+    end = _parseTimestamp(params["EndTime"])
+
+    # (id, metricName, datapoints) of each query in request order
+    queries = []
+    for i in xrange(1, len(params)):
+      prefix = "MetricDataQueries.member.%d." % (i,)
+      if prefix + "Id" not in params:
+        break
+
+      metricPrefix = prefix + "MetricStat.Metric."
+      metricName = params[metricPrefix + "MetricName"]
+      if metricName in self.failingMetricNames:
+        datapoints = None
+      else:
+        datapoints = self.getDatapoints(
+          namespace=params[metricPrefix + "Namespace"],
+          metricName=metricName,
+          dimensions=_getDimensions(params, metricPrefix),
+          period=int(params[prefix + "MetricStat.Period"]),
+          start=start,
+          end=end)
+      queries.append((params[prefix + "Id"], metricName, datapoints))
+
+    # Page through the datapoints of all queries in query order
+    pageStart = int(params.get("NextToken", 0))
+    pageEnd = pageStart + self.maxDatapointsPerPage
+
+    members = []
+    queryStart = 0
+    for queryId, metricName, datapoints in queries:
+      if datapoints is None:
+        members.append(
+          "<member><Id>%s</Id><Label>%s</Label>"
+          "<StatusCode>InternalError</StatusCode><Timestamps/><Values/>"
+          "<Messages><member><Code>InternalError</Code>"
+          "<Value>Fake failure</Value></member></Messages></member>" % (
+            escape(queryId), escape(metricName)))
+        continue
+
+      queryEnd = queryStart + len(datapoints)
+      pageDatapoints = datapoints[max(pageStart - queryStart, 0):
+                                  max(pageEnd - queryStart, 0)]
+      members.append(
+        "<member><Id>%s</Id><Label>%s</Label><StatusCode>%s</StatusCode>"
+        "<Timestamps>%s</Timestamps><Values>%s</Values><Messages/>"
+        "</member>" % (
+          escape(queryId), escape(metricName),
+          "PartialData" if queryEnd > pageEnd else "Complete",
+          "".join("<member>%s</member>" % (
+            timestamp.strftime(_TIMESTAMP_FORMAT),)
+                  for timestamp, _ in pageDatapoints),
+          "".join("<member>%r</member>" % (value,)
+                  for _, value in pageDatapoints)))
+      queryStart = queryEnd
+
+    return (
+      "<GetMetricDataResponse xmlns=\"%s\"><GetMetricDataResult>"
+      "<MetricDataResults>%s</MetricDataResults>%s<Messages/>"
+      "</GetMetricDataResult>%s</GetMetricDataResponse>" % (
+        _XMLNS, "".join(members),
+        ("<NextToken>%d</NextToken>" % (pageEnd,)
+         if queryStart > pageEnd else ""),
+        _RESPONSE_METADATA))
+
+
+
+class _ThreadedHTTPServer(SocketServer.ThreadingMixIn,
+                          BaseHTTPServer.HTTPServer):
+  daemon_threads = True
+  request_queue_size = 128
+
+
+
+class _FakeCloudWatchRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+  # Keep connections alive, like CloudWatch does
+  protocol_version = "HTTP/1.1"
+
+
+  def do_POST(self):
+    query = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+    if "?" in self.path:
+      query += "&" + self.path.split("?", 1)[1]
+
+    fake = self.server.fakeCloudWatch
+    if fake.latencySec:
+      time.sleep(fake.latencySec)
+
+    status, body = fake.handleRequest(dict(urlparse.parse_qsl(query)))
+
+    self.send_response(status)
+    self.send_header("Content-Type", "text/xml")
+    self.send_header("Content-Length", str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+
+  do_GET = do_POST
+
+
+  def log_message(self, *args):
+    pass
+
+
+
+_RESPONSE_METADATA = (
+  "<ResponseMetadata><RequestId>fake-request</RequestId></ResponseMetadata>")
+
+
+
+def _errorResponse(code, message):
+  return (
+    "<ErrorResponse xmlns=\"%s\"><Error><Type>Sender</Type><Code>%s</Code>"
+    "<Message>%s</Message></Error><RequestId>fake-request</RequestId>"
+    "</ErrorResponse>" % (_XMLNS, escape(code), escape(message)))
+
+
+
+def _getMembers(params, prefix):
+  members = []
+  while "%s%d" % (prefix, len(members) + 1) in params:
+    members.append(params["%s%d" % (prefix, len(members) + 1)])
+  return members
+
+
+
+def _getDimensions(params, prefix):
+  dimensions = dict()
+  i = 1
+  while "%sDimensions.member.%d.Name" % (prefix, i) in params:
+    dimensions[params["%sDimensions.member.%d.Name" % (prefix, i)]] = (
+      params["%sDimensions.member.%d.Value" % (prefix, i)])
+    i += 1
+  return dimensions
+
+
+
+def _parseTimestamp(value):
+  """ Parse a request's ISO 8601 UTC timestamp, ignoring fractional seconds """
+  return datetime.datetime.strptime(value.rstrip("Z").split(".")[0],
+                                    "%Y-%m-%dT%H:%M:%S")
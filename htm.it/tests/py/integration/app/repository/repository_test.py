@@ -22,6 +22,7 @@
 
 # TODO: TAUR-412 Move into htmengine package (partial)
 
+from collections import namedtuple
 import datetime
 import unittest
 import uuid
@@ -368,6 +369,33 @@ class TestRepositoryAPI(unittest.TestCase):
     self.assertEqual(metricObj.last_rowid, 4)
 
 
+  def testIncrementMetricRowid(self):
+    metricId = str(uuid.uuid4())
+
+    with self.engine.connect() as conn:
+      self.assertRaises(exceptions.ObjectNotFoundError,
+                        queries.incrementMetricRowid, conn, metricId)
+
+    metricObj = self._addGenericMetric(uid=metricId)
+
+    with self.engine.connect() as conn:
+      self.assertEqual(queries.incrementMetricRowid(conn, metricObj.uid), 1)
+      self.assertEqual(
+        queries.incrementMetricRowid(conn, metricObj.uid, amount=1000), 1001)
+
+      # The last reservation isn't affected by other metrics' reservations
+      otherMetricObj = self._addGenericMetric(name="Other " + metricId)
+      self.assertEqual(
+        queries.incrementMetricRowid(conn, otherMetricObj.uid, amount=5), 5)
+
+      self.assertEqual(
+        repository.getMetric(conn, metricObj.uid).last_rowid, 1001)
+
+      self.assertRaises(ValueError,
+                        queries.incrementMetricRowid, conn, metricObj.uid,
+                        amount=0)
+
+
   def testaddNotification(self):
     metricObj = self._addGenericMetric()
     settingObj = self._addGenericNotificationSettings()
@@ -396,6 +424,66 @@ class TestRepositoryAPI(unittest.TestCase):
 
     self.assertFalse(result)
 
+  def testAddNotifications(self):
+    metricObj = self._addGenericMetric()
+    settingObj1 = self._addGenericNotificationSettings()
+    settingObj2 = self._addGenericNotificationSettings()
+
+    now = datetime.datetime.utcnow().replace(microsecond=0)
+
+    def notification(rowid, settingObj, timestamp):
+      return dict(uid=str(uuid.uuid4()),
+                  metric=metricObj.uid,
+                  rowid=rowid,
+                  device=settingObj.uid,
+                  windowsize=settingObj.windowsize,
+                  timestamp=timestamp,
+                  acknowledged=0,
+                  seen=0)
+
+    notifications = [
+      notification(1, settingObj1, now),
+      notification(1, settingObj2, now),
+      # Within the windowsize of the device's first notification
+      notification(2, settingObj1, now + datetime.timedelta(seconds=60)),
+      notification(3, settingObj1, now + datetime.timedelta(seconds=3600))]
+
+    with self.engine.connect() as conn:
+      added = repository.addNotifications(conn, server=metricObj.server,
+                                          notifications=notifications)
+
+    self.assertEqual(added, [notifications[0], notifications[1],
+                             notifications[3]])
+
+    for notificationDict in added:
+      with self.engine.connect() as conn:
+        notificationObj = repository.getNotification(conn,
+                                                     notificationDict["uid"])
+      self.assertEqual(notificationObj.rowid, notificationDict["rowid"])
+
+    # Throttled by the notifications added earlier
+    with self.engine.connect() as conn:
+      added = repository.addNotifications(
+        conn,
+        server=metricObj.server,
+        notifications=[
+          notification(4, settingObj2, now + datetime.timedelta(seconds=60))])
+
+    self.assertEqual(added, [])
+
+    # A duplicate notification of a metric data row is skipped without failing
+    # the rest of the batch
+    notifications = [
+      notification(1, settingObj2, now + datetime.timedelta(seconds=3600)),
+      notification(5, settingObj1, now + datetime.timedelta(seconds=7200))]
+
+    with self.engine.connect() as conn:
+      added = repository.addNotifications(conn, server=metricObj.server,
+                                          notifications=notifications)
+
+    self.assertEqual(added, [notifications[1]])
+
+
   def testClearOldNotifications(self):
     metricObj = self._addGenericMetric()
     settingObj = self._addGenericNotificationSettings()
@@ -829,6 +917,88 @@ class TestRepositoryAPI(unittest.TestCase):
     self.assertEqual(1, retrRow.metric_value)
 
 
+  def testGetMetricDataChunks(self):
+    now = datetime.datetime.now()
+    now = now.replace(second=0, microsecond=0) # truncate microseconds
+    data = [[i, now - datetime.timedelta(minutes=60 - 5 * i)]
+            for i in xrange(12)]
+
+    metricObjs = [self._addGenericMetric(uid=str(uuid.uuid4()))
+                  for _ in xrange(2)]
+
+    with self.engine.connect() as conn:
+      for metricObj in metricObjs:
+        repository.addMetricData(conn, metricObj.uid, data)
+
+    metricId = metricObjs[0].uid
+
+    def getChunks(**kwargs):
+      with self.engine.connect() as conn:
+        return list(repository.getMetricDataChunks(conn, **kwargs))
+
+    # Chunk sizes that don't divide the row count, divide it, equal it and
+    # exceed it
+    for chunkSize in (1, 5, 6, 12, 100):
+      for descending in (False, True):
+        expectedValues = range(12)[::-1] if descending else range(12)
+
+        chunks = getChunks(metricId=metricId, descending=descending,
+                           chunkSize=chunkSize)
+
+        self.assertTrue(all(0 < len(chunk) <= chunkSize for chunk in chunks))
+        rows = [row for chunk in chunks for row in chunk]
+        self.assertEqual([row.metric_value for row in rows], expectedValues)
+        self.assertEqual([row.rowid for row in rows],
+                         [value + 1 for value in expectedValues])
+        self.assertTrue(all(row.uid == metricId for row in rows))
+
+        # The limit applies across chunks
+        for limit in (1, 5, 7, 12, 20):
+          chunks = getChunks(metricId=metricId, descending=descending,
+                             limit=limit, chunkSize=chunkSize)
+
+          rows = [row for chunk in chunks for row in chunk]
+          self.assertEqual([row.metric_value for row in rows],
+                           expectedValues[:limit])
+
+    # Timestamp range filtering combined with chunking and a limit
+    chunks = getChunks(metricId=metricId,
+                       fromTimestamp=data[2][1],
+                       toTimestamp=data[9][1],
+                       descending=True,
+                       limit=5,
+                       chunkSize=2)
+    self.assertEqual([len(chunk) for chunk in chunks], [2, 2, 1])
+    self.assertEqual([row.metric_value for chunk in chunks for row in chunk],
+                     [9, 8, 7, 6, 5])
+
+    # Requested fields
+    chunks = getChunks(metricId=metricId,
+                       fields=[schema.metric_data.c.rowid,
+                               schema.metric_data.c.metric_value],
+                       chunkSize=5)
+    self.assertEqual(chunks[0][0].keys(), ["rowid", "metric_value"])
+
+    # All metrics: each chunk holds rows of a single metric, and the rows of
+    # each metric are complete and in order
+    uids = set(metricObj.uid for metricObj in metricObjs)
+    for descending in (False, True):
+      chunks = [chunk for chunk in getChunks(descending=descending,
+                                             chunkSize=5)
+                if chunk[0].uid in uids]
+
+      self.assertEqual([len(chunk) for chunk in chunks], [5, 5, 2] * 2)
+      for chunk in chunks:
+        self.assertEqual(len(set(row.uid for row in chunk)), 1)
+
+      for metricObj in metricObjs:
+        self.assertEqual(
+          [row.metric_value
+           for chunk in chunks if chunk[0].uid == metricObj.uid
+           for row in chunk],
+          range(12)[::-1] if descending else range(12))
+
+
   def testGetMetricDataCount(self):
     metricId = str(uuid.uuid4())
     now = datetime.datetime.now()
@@ -1215,6 +1385,57 @@ class TestRepositoryAPI(unittest.TestCase):
     self.assertEqual(metricDataRow.display_value, 3)
 
 
+  def testUpdateMetricDataColumnsBulk(self):
+    metricId = str(uuid.uuid4())
+    now = datetime.datetime.now().replace(second=0, microsecond=0)
+    data = [[float(i), now - datetime.timedelta(minutes=5 * (12 - i))]
+            for i in xrange(12)]
+
+    metricObj = self._addGenericMetric(uid=metricId)
+
+    with self.engine.connect() as conn:
+      repository.addMetricData(conn, metricObj.uid, data)
+
+    ScoredRow = namedtuple(
+      "ScoredRow", "rowid raw_anomaly_score anomaly_score display_value")
+
+    with self.engine.connect() as conn:
+      metricDataRows = [
+        ScoredRow(rowid=row.rowid,
+                  raw_anomaly_score=row.rowid / 100.0,
+                  anomaly_score=row.rowid / 10.0,
+                  display_value=row.rowid)
+        for row in repository.getMetricData(conn, metricObj.uid,
+                                            start=3, stop=8)]
+    self.assertEqual(len(metricDataRows), 6)
+
+    with self.engine.begin() as conn:
+      repository.updateMetricDataColumnsBulk(conn, metricObj.uid,
+                                             metricDataRows)
+
+    with self.engine.connect() as conn:
+      updatedRows = repository.getMetricData(conn, metricObj.uid).fetchall()
+
+    self.assertEqual(len(updatedRows), len(data))
+    for row in updatedRows:
+      if 3 <= row.rowid <= 8:
+        self.assertEqual(row.raw_anomaly_score, row.rowid / 100.0)
+        self.assertEqual(row.anomaly_score, row.rowid / 10.0)
+        self.assertEqual(row.display_value, row.rowid)
+      else:
+        # Rows outside of the range must not be affected
+        self.assertIsNone(row.raw_anomaly_score)
+        self.assertIsNone(row.anomaly_score)
+        self.assertIsNone(row.display_value)
+
+    # The scratch table must not leak into subsequent transactions on the
+    # connection, and the update must be repeatable
+    with self.engine.begin() as conn:
+      repository.updateMetricDataColumnsBulk(conn, metricObj.uid,
+                                             metricDataRows)
+      repository.updateMetricDataColumnsBulk(conn, metricObj.uid, [])
+
+
   def testUpdateNotificationMessageId(self):
     metricObj = self._addGenericMetric()
     settingObj = self._addGenericNotificationSettings()
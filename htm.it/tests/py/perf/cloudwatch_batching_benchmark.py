@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2015, Numenta, Inc.  Unless you have purchased from
+# Numenta, Inc. a separate commercial license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+
+"""
+Count the CloudWatch requests needed to collect the recent data of many
+metrics with one GetMetricStatistics request per metric versus batched
+GetMetricData requests (_CloudwatchDatasourceAdapter.getMetricData versus
+getMetricDataBatch), against a local fake of the CloudWatch endpoint that may
+throttle requests in excess of a given rate. Verifies that both return the
+same data when nothing is throttled.
+
+Usage:
+  APPLICATION_CONFIG_PATH=<conf dir> python cloudwatch_batching_benchmark.py \
+    --metrics=2000 --batch-size=100 [--max-rate=50]
+"""
+
+import argparse
+import datetime
+import itertools
+import logging
+from multiprocessing.pool import ThreadPool
+import random
+import time
+
+import boto.ec2.cloudwatch
+
+from htm.it import logging_support
+from htm.it.app.adapters.datasource import createDatasourceAdapter
+from htm.it.test_utils.fake_cloudwatch_server import FakeCloudWatchServer
+
+
+
+def _parseArgs():
+  parser = argparse.ArgumentParser(description=__doc__)
+  parser.add_argument("--metrics", type=int, default=2000, dest="numMetrics",
+                      help="Number of metrics to collect")
+  parser.add_argument("--regions", type=int, default=4, dest="numRegions",
+                      help="Number of AWS regions the metrics are spread over")
+  parser.add_argument("--batch-size", type=int, default=100, dest="batchSize",
+                      help="Number of metrics per getMetricDataBatch call")
+  parser.add_argument("--lag-periods", type=int, default=6, dest="lagPeriods",
+                      help="Metrics' data is up to this many periods behind")
+  parser.add_argument("--threads", type=int, default=16, dest="numThreads",
+                      help="Number of concurrent collection threads")
+  parser.add_argument("--latency-ms", type=float, default=20,
+                      dest="latencyMs",
+                      help="Response latency of the fake CloudWatch endpoint")
+  parser.add_argument("--max-rate", type=float, default=None, dest="maxRate",
+                      help="Requests/sec above which the fake CloudWatch "
+                           "endpoint throttles requests")
+  return parser.parse_args()
+
+
+
+def _generateRequests(args):
+  """
+  :returns: sequence of (metricSpec, start) two-tuples
+  """
+  rng = random.Random(42)
+  now = datetime.datetime.utcnow()
+  return [
+    (dict(region="benchmark-region-%d" % (i % args.numRegions,),
+          namespace="AWS/EC2",
+          metric="CPUUtilization",
+          dimensions=dict(InstanceId="i-%08x" % (i,))),
+     now - datetime.timedelta(minutes=5 * rng.randint(1, args.lagPeriods)))
+    for i in xrange(args.numMetrics)]
+
+
+
+def _collectPerMetric(adapter, requests, threadPool):
+  def collect(request):
+    try:
+      return adapter.getMetricData(metricSpec=request[0], start=request[1],
+                                   end=None)
+    except Exception as e:  # pylint: disable=W0703
+      return e
+
+  return threadPool.map(collect, requests, chunksize=1)
+
+
+
+def _collectBatched(adapter, requests, threadPool, batchSize):
+  # Group by region as MetricCollector does
+  order = sorted(xrange(len(requests)),
+                 key=lambda i: requests[i][0]["region"])
+  batches = [[requests[i] for i in order[j:j + batchSize]]
+             for j in xrange(0, len(order), batchSize)]
+
+  results = [None] * len(requests)
+  for i, result in zip(order,
+                       itertools.chain.from_iterable(
+                         threadPool.map(adapter.getMetricDataBatch, batches,
+                                        chunksize=1))):
+    results[i] = result
+
+  return results
+
+
+
+def main():
+  args = _parseArgs()
+
+  logging_support.LoggingSupport.initTool()
+  # Throttled requests, which boto logs as errors, are expected
+  logging.disable(logging.ERROR)
+
+  requests = _generateRequests(args)
+  adapter = createDatasourceAdapter("cloudwatch")
+  threadPool = ThreadPool(processes=args.numThreads)
+
+  results = dict()
+  for label, collect in (
+      ("per-metric", lambda: _collectPerMetric(adapter, requests,
+                                               threadPool)),
+      ("batched", lambda: _collectBatched(adapter, requests, threadPool,
+                                          args.batchSize))):
+    with FakeCloudWatchServer(latencySec=args.latencyMs / 1000.0,
+                              maxRequestsPerSec=args.maxRate) as server:
+      boto.ec2.cloudwatch.connect_to_region = server.connectToRegion
+
+      startTime = time.time()
+      results[label] = collect()
+      elapsed = time.time() - startTime
+
+      numFailed = sum(1 for result in results[label]
+                      if isinstance(result, Exception))
+      print ("%-10s metrics=%-6d %6d requests (%d throttled); "
+             "failedMetrics=%d; %.2fs") % (
+               label, args.numMetrics, sum(server.requestCounts.values()),
+               server.numThrottledRequests, numFailed, elapsed)
+
+  if args.maxRate is None and results["per-metric"] != results["batched"]:
+    raise Exception("Per-metric and batched results differ")
+
+  threadPool.terminate()
+
+
+
+if __name__ == "__main__":
+  main()
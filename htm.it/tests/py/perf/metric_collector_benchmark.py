@@ -0,0 +1,242 @@
+#!/usr/bin/env python
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2015, Numenta, Inc.  Unless you have purchased from
+# Numenta, Inc. a separate commercial license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+
+"""
+Measure the throughput (metrics/sec) and memory footprint of MetricCollector's
+data collection on a pool of worker processes versus a pool of worker threads
+(see metric_collector/worker_mode), against a local fake of the CloudWatch
+endpoint that responds with the given latency.
+
+Memory is the proportional set size (PSS) of the collector and its worker
+processes, so Linux 4.14 or later is required.
+
+Usage:
+  APPLICATION_CONFIG_PATH=<conf dir> python metric_collector_benchmark.py \
+    --metrics=2000 --latency-ms=100 --threads=32 [--batch-size=100]
+"""
+
+import argparse
+from collections import namedtuple
+import datetime
+import json
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+import os
+import Queue
+import time
+
+import boto.ec2.cloudwatch
+
+from htm.it import logging_support
+from htm.it.app.adapters.datasource.cloudwatch import aws_base
+from htm.it.app.runtime import metric_collector
+from htm.it.test_utils.fake_cloudwatch_server import FakeCloudWatchServer
+
+
+
+# Subset of repository's Metric row that is used by _collectDataForMetrics
+_Metric = namedtuple("_Metric", "uid datasource parameters server "
+                                "last_timestamp poll_interval")
+
+
+def _parseArgs():
+  parser = argparse.ArgumentParser(description=__doc__)
+  parser.add_argument("--metrics", type=int, default=2000, dest="numMetrics",
+                      help="Number of metrics collected per round")
+  parser.add_argument("--regions", type=int, default=4, dest="numRegions",
+                      help="Number of AWS regions the metrics are spread over")
+  parser.add_argument("--datapoints", type=int, default=12,
+                      dest="numDatapoints",
+                      help="Number of datapoints collected per metric")
+  parser.add_argument("--latency-ms", type=float, default=100,
+                      dest="latencyMs",
+                      help="Response latency of the fake CloudWatch endpoint")
+  parser.add_argument("--threads", type=int, default=32, dest="numThreads",
+                      help="Number of worker threads in threads mode")
+  parser.add_argument("--max-rate", type=float, default=0, dest="maxRate",
+                      help="Max requests/sec per region in threads mode; 0 "
+                           "for no limit")
+  parser.add_argument("--batch-size", type=int, default=1, dest="batchSize",
+                      help="metric_collector/max_metrics_per_batch; 1 to "
+                           "fetch each metric with its own request")
+  parser.add_argument("--rounds", type=int, default=3, dest="numRounds",
+                      help="Number of collection rounds per measurement")
+  return parser.parse_args()
+
+
+
+def _generateMetrics(numMetrics, numRegions, numDatapoints):
+  regions = ["benchmark-region-%d" % (i,) for i in xrange(numRegions)]
+
+  # Start of the metrics' data ranges such that numDatapoints datapoints of the
+  # 5-minute metrics are ready for collection
+  lastTimestamp = datetime.datetime.utcnow() - datetime.timedelta(
+    seconds=300 * numDatapoints + 360)
+
+  return dict(
+    (uid, _Metric(
+      uid=uid,
+      datasource="cloudwatch",
+      parameters=json.dumps(dict(metricSpec=dict(
+        region=regions[i % numRegions],
+        namespace="AWS/EC2",
+        metric="CPUUtilization",
+        dimensions=dict(InstanceId="i-%08x" % (i,))))),
+      server="i-%08x" % (i,),
+      last_timestamp=lastTimestamp,
+      poll_interval=300))
+    for i, uid in enumerate("metric%d" % (i,) for i in xrange(numMetrics)))
+
+
+
+def _getPss(pid):
+  """
+  :returns: proportional set size of the given process in bytes
+  """
+  with open("/proc/%d/smaps_rollup" % (pid,)) as smaps:
+    for line in smaps:
+      if line.startswith("Pss:"):
+        return int(line.split()[1]) * 1024
+
+  raise Exception("No Pss in smaps_rollup of pid=%d" % (pid,))
+
+
+
+def _getChildPids():
+  pids = []
+  for entry in os.listdir("/proc"):
+    if not entry.isdigit():
+      continue
+    try:
+      with open("/proc/%s/stat" % (entry,)) as stat:
+        # The command name in parentheses may contain spaces
+        ppid = int(stat.read().rsplit(")", 1)[1].split()[1])
+    except IOError:
+      continue
+    if ppid == os.getpid():
+      pids.append(int(entry))
+
+  return pids
+
+
+
+def _collectRound(collector, metrics, workerPool, resultsQueue):
+  """ Collect data for all metrics, consuming the results as
+  MetricCollector's dispatch thread does
+
+  :returns: number of metrics whose data was collected
+  """
+  # Don't query the resources' status; the fake only serves metric data
+  for metricObj in metrics.itervalues():
+    resourceCacheItem = collector._resourceInfoCache[metricObj.server]
+    resourceCacheItem.nextResourceStatusUpdateTime = float("inf")
+
+  poolResults = collector._collectDataForMetrics(metrics, workerPool,
+                                                 resultsQueue)
+
+  numCollected = 0
+  for _ in xrange(len(metrics)):
+    result = resultsQueue.get(True)
+    resultsQueue.task_done()
+    if isinstance(result.data, Exception):
+      raise result.data
+    numCollected += 1
+
+  poolResults.wait()
+
+  return numCollected
+
+
+
+def _measure(workerMode, metrics, args):
+  """
+  :returns: (metrics/sec, collector's total PSS, PSS per worker)
+  """
+  collector = metric_collector.MetricCollector()
+  collector._maxMetricsPerBatch = args.batchSize
+
+  pssBefore = _getPss(os.getpid())
+
+  if workerMode == metric_collector.MetricCollector._WORKER_MODE_THREADS:
+    numWorkers = args.numThreads
+    collector._rateLimiter = (
+      metric_collector._RegionRateLimiter(args.maxRate) if args.maxRate
+      else None)
+    resultsQueue = Queue.Queue()
+    workerPool = ThreadPool(processes=numWorkers,
+                            initializer=aws_base.enableConnectionReuse)
+  else:
+    numWorkers = metric_collector.MetricCollector._WORKER_PROCESS_POOL_SIZE
+    collector._rateLimiter = None
+    resultsQueue = multiprocessing.Manager().JoinableQueue()
+    workerPool = multiprocessing.Pool(processes=numWorkers)
+
+  try:
+    # Warm up
+    _collectRound(collector, metrics, workerPool, resultsQueue)
+
+    startTime = time.time()
+    numCollected = 0
+    for _ in xrange(args.numRounds):
+      numCollected += _collectRound(collector, metrics, workerPool,
+                                    resultsQueue)
+    elapsed = time.time() - startTime
+
+    # Includes the manager process of the results queue in processes mode
+    totalPss = _getPss(os.getpid()) + sum(_getPss(pid)
+                                          for pid in _getChildPids())
+  finally:
+    workerPool.terminate()
+    workerPool.join()
+
+  return (numCollected / elapsed,
+          totalPss,
+          (totalPss - pssBefore) / float(numWorkers))
+
+
+
+def main():
+  args = _parseArgs()
+
+  logging_support.LoggingSupport.initTool()
+
+  metrics = _generateMetrics(args.numMetrics, args.numRegions,
+                             args.numDatapoints)
+
+  with FakeCloudWatchServer(latencySec=args.latencyMs / 1000.0) as server:
+    # Inherited by worker processes forked afterwards
+    boto.ec2.cloudwatch.connect_to_region = server.connectToRegion
+
+    for workerMode in (metric_collector.MetricCollector._WORKER_MODE_PROCESSES,
+                       metric_collector.MetricCollector._WORKER_MODE_THREADS):
+      metricsPerSec, totalPss, pssPerWorker = _measure(workerMode, metrics,
+                                                       args)
+      print ("mode=%-9s metrics=%-6d batchSize=%-4d latency=%.0fms "
+             "%8.1f metrics/s; totalPss=%.1fMB pssPerWorker=%.2fMB") % (
+               workerMode, args.numMetrics, args.batchSize, args.latencyMs,
+               metricsPerSec, totalPss / 1e6, pssPerWorker / 1e6)
+
+
+
+if __name__ == "__main__":
+  main()
@@ -24,12 +24,27 @@
 """
 
 from datetime import datetime, timedelta
+import threading
 import unittest
 
+import boto.ec2.cloudwatch
 import mock
 from mock import Mock, patch
 
+import htm.it.app.exceptions
 from htm.it.app.adapters.datasource.cloudwatch import aws_base
+from htm.it.test_utils.fake_cloudwatch_server import FakeCloudWatchServer
+
+
+
+def _createEC2CPUUtilizationAdapters(region, numMetrics):
+  return [
+    aws_base.AWSResourceAdapterBase.createMetricAdapter(
+      dict(region=region,
+           namespace="AWS/EC2",
+           metric="CPUUtilization",
+           dimensions=dict(InstanceId="i-%08x" % (i,))))
+    for i in xrange(numMetrics)]
 
 
 
@@ -136,6 +151,224 @@ class AwsBaseTest(unittest.TestCase):
                                       stats=["Average"])
 
 
+  @patch.object(aws_base.AWSResourceAdapterBase,
+                "_getFreshAWSAuthenticationArgs",
+                return_value=dict(aws_access_key_id="keyId",
+                                  aws_secret_access_key="secretKey"))
+  def testConnectToAWSServiceReusesConnectionsPerThread(self, _authArgsMock):
+    serviceModuleMock = Mock(__name__="boto.ec2.cloudwatch")
+    serviceModuleMock.connect_to_region.side_effect = (
+      lambda **kwargs: Mock(name="connection"))
+
+    connect = aws_base.AWSResourceAdapterBase._connectToAWSService
+
+    connections = dict()
+    def threadTarget():
+      connections["beforeReuse"] = [
+        connect(serviceModuleMock, "us-west-2") for _ in xrange(2)]
+
+      aws_base.enableConnectionReuse()
+      connections["west"] = [
+        connect(serviceModuleMock, "us-west-2") for _ in xrange(2)]
+      connections["east"] = connect(serviceModuleMock, "us-east-1")
+
+    # Connection reuse is enabled per thread, so don't leak it into this one
+    thread = threading.Thread(target=threadTarget)
+    thread.setDaemon(True)
+    thread.start()
+    thread.join(5)
+    self.assertFalse(thread.isAlive())
+
+    self.assertIsNot(connections["beforeReuse"][0],
+                     connections["beforeReuse"][1])
+    self.assertIs(connections["west"][0], connections["west"][1])
+    self.assertIsNot(connections["east"], connections["west"][0])
+
+    # Connection reuse wasn't enabled in this thread
+    self.assertIsNot(connect(serviceModuleMock, "us-east-1"),
+                     connections["east"])
+
+    self.assertEqual(serviceModuleMock.connect_to_region.call_count, 5)
+    serviceModuleMock.connect_to_region.assert_called_with(
+      region_name="us-east-1", aws_access_key_id="keyId",
+      aws_secret_access_key="secretKey")
+
+
+  @patch.object(aws_base.AWSResourceAdapterBase,
+                "_getFreshAWSAuthenticationArgs", autospec=True)
+  def testConnectToAWSServiceReconnectsAfterCredentialRotation(
+      self, authArgsMock):
+    authArgsMock.return_value = dict(aws_access_key_id="keyId",
+                                     aws_secret_access_key="secretKey")
+    serviceModuleMock = Mock(__name__="boto.ec2.cloudwatch")
+    serviceModuleMock.connect_to_region.side_effect = (
+      lambda **kwargs: Mock(name="connection"))
+
+    connect = aws_base.AWSResourceAdapterBase._connectToAWSService
+
+    connections = dict()
+    def threadTarget():
+      aws_base.enableConnectionReuse()
+      connections["old"] = connect(serviceModuleMock, "us-west-2")
+
+      authArgsMock.return_value = dict(aws_access_key_id="keyId2",
+                                       aws_secret_access_key="secretKey2")
+      connections["new"] = [
+        connect(serviceModuleMock, "us-west-2") for _ in xrange(2)]
+
+    thread = threading.Thread(target=threadTarget)
+    thread.setDaemon(True)
+    thread.start()
+    thread.join(5)
+    self.assertFalse(thread.isAlive())
+
+    self.assertIsNot(connections["new"][0], connections["old"])
+    self.assertIs(connections["new"][0], connections["new"][1])
+
+    self.assertEqual(serviceModuleMock.connect_to_region.call_count, 2)
+    serviceModuleMock.connect_to_region.assert_called_with(
+      region_name="us-west-2", aws_access_key_id="keyId2",
+      aws_secret_access_key="secretKey2")
+
+
+  @patch.object(aws_base.htm.it.app, "config", autospec=True)
+  def testGetFreshAWSAuthenticationArgsHoldsConfigLock(self, configMock):
+    lockStates = []
+
+    def recordLockState(*_args):
+      lockStates.append(aws_base._gConfigLock.locked())
+      return "value"
+
+    configMock.loadConfig.side_effect = recordLockState
+    configMock.get.side_effect = recordLockState
+
+    authArgs = (
+      aws_base.AWSResourceAdapterBase._getFreshAWSAuthenticationArgs())
+
+    self.assertEqual(authArgs, dict(aws_access_key_id="value",
+                                    aws_secret_access_key="value"))
+    # The config reload and both reads happen under the lock, and it's
+    # released afterwards
+    self.assertEqual(lockStates, [True, True, True])
+    self.assertFalse(aws_base._gConfigLock.locked())
+
+
+
+@patch.object(aws_base, "_gMetricDataThrottleBackoff",
+              new_callable=aws_base._RegionThrottleBackoff)
+@patch.object(aws_base.AWSResourceAdapterBase,
+              "_getFreshAWSAuthenticationArgs",
+              return_value=dict(aws_access_key_id="keyId",
+                                aws_secret_access_key="secretKey"))
+class AwsBaseMetricDataBatchTest(unittest.TestCase):
+
+
+  def setUp(self):
+    self.server = FakeCloudWatchServer()
+    self.server.start()
+    self.addCleanup(self.server.stop)
+
+    connectPatch = patch.object(boto.ec2.cloudwatch, "connect_to_region",
+                                side_effect=self.server.connectToRegion)
+    connectPatch.start()
+    self.addCleanup(connectPatch.stop)
+
+
+  def testGetMetricDataBatchMatchesGetMetricData(self, *_mocks):
+    now = datetime.utcnow()
+    metricAdapters = (_createEC2CPUUtilizationAdapters("us-west-2", 4) +
+                      _createEC2CPUUtilizationAdapters("us-east-1", 2))
+
+    # Metrics without data yet, catching up and with data nearly up to date
+    starts = [None,
+              now - timedelta(days=1),
+              now - timedelta(hours=1),
+              now - timedelta(minutes=50),
+              now - timedelta(hours=1),
+              now - timedelta(minutes=1)]
+
+    self.server.maxDatapointsPerPage = 1000
+
+    results = aws_base.AWSResourceAdapterBase.getMetricDataBatch(
+      metricAdapters, starts)
+
+    self.assertEqual(
+      results,
+      [metricAdapter.getMetricData(start, None)
+       for metricAdapter, start in zip(metricAdapters, starts)])
+    self.assertEqual(len(results[0][0]), 1440)
+    self.assertEqual(results[5][0], [])
+
+    # Metrics starting 14 days and 1 day ago are queried separately, the first
+    # in 2 pages; the ones starting less than an hour apart together; no
+    # request is needed for the one starting a minute ago
+    self.assertEqual(self.server.requestCounts["GetMetricData"], 5)
+
+
+  def testGetMetricDataBatchWithMetricError(self, *_mocks):
+    metricAdapters = _createEC2CPUUtilizationAdapters("us-west-2", 2)
+
+    class MyFailingMetricAdapter(metricAdapters[0].__class__):
+      METRIC_NAME = "FailingMetric"
+
+    metricAdapters.append(MyFailingMetricAdapter(
+      region="us-west-2", dimensions=dict(InstanceId="i-failing")))
+
+    self.server.failingMetricNames.add("FailingMetric")
+
+    start = datetime.utcnow() - timedelta(hours=1)
+    results = aws_base.AWSResourceAdapterBase.getMetricDataBatch(
+      metricAdapters, [start] * 3)
+
+    self.assertEqual(len(results[0][0]), 10)
+    self.assertEqual(len(results[1][0]), 10)
+    self.assertIsInstance(results[2],
+                          htm.it.app.exceptions.MetricDataQueryError)
+    self.assertEqual(self.server.requestCounts["GetMetricData"], 1)
+
+
+  def testGetMetricDataBatchBacksOffWhenThrottled(self, _authArgsMock,
+                                                  throttleBackoff):
+    metricAdapters = _createEC2CPUUtilizationAdapters("us-west-2", 2)
+    start = datetime.utcnow() - timedelta(hours=1)
+
+    self.server.numRequestsToThrottle = 2
+
+    with patch.object(aws_base.time, "sleep", autospec=True) as sleepMock:
+      results = aws_base.AWSResourceAdapterBase.getMetricDataBatch(
+        metricAdapters, [start] * 2)
+
+    self.assertEqual([len(samples) for samples, _ in results], [10, 10])
+    self.assertEqual(self.server.numThrottledRequests, 2)
+    self.assertEqual(self.server.requestCounts["GetMetricData"], 1)
+
+    # The retries were delayed by 0.25 and 0.5 seconds; the delay decays after
+    # the successful request
+    self.assertEqual(len(sleepMock.call_args_list), 2)
+    self.assertAlmostEqual(sleepMock.call_args_list[0][0][0], 0.25, places=1)
+    self.assertAlmostEqual(sleepMock.call_args_list[1][0][0], 0.5, places=1)
+    self.assertEqual(throttleBackoff.getDelay("us-west-2"), 0.25)
+    self.assertEqual(throttleBackoff.getDelay("us-east-1"), 0)
+
+
+  def testGetMetricDataBatchGivesUpWhenThrottled(self, *_mocks):
+    metricAdapters = _createEC2CPUUtilizationAdapters("us-west-2", 2)
+    start = datetime.utcnow() - timedelta(hours=1)
+
+    self.server.numRequestsToThrottle = 100
+
+    with patch.object(aws_base.time, "sleep", autospec=True):
+      results = aws_base.AWSResourceAdapterBase.getMetricDataBatch(
+        metricAdapters, [start] * 2)
+
+    for result in results:
+      self.assertIsInstance(result, htm.it.app.exceptions.MetricThrottleError)
+
+    self.assertEqual(
+      self.server.numThrottledRequests,
+      aws_base.AWSResourceAdapterBase._METRIC_DATA_MAX_THROTTLED_ATTEMPTS)
+
+
 
 
 if __name__ == "__main__":
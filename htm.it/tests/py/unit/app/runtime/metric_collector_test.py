@@ -104,7 +104,8 @@ def _makeFreshMetricMockInstance(metricPollInterval, uid):
                 _RESOURCE_STATUS_UPDATE_INTERVAL_SEC=0.0)
 @ConfigAttributePatch(htm.it.app.config.CONFIG_NAME,
                       htm.it.app.config.baseConfigDir,
-                      (("metric_collector", "poll_interval", "0.000001"),))
+                      (("metric_collector", "poll_interval", "0.000001"),
+                       ("metric_collector", "worker_mode", "processes")))
 class MetricCollectorTestCase(unittest.TestCase):
   """
   Unit tests for htm.it.app.runtime.metric_collector
@@ -244,6 +245,181 @@ class MetricCollectorTestCase(unittest.TestCase):
         adapterInstanceMock.getMetricResourceStatus.return_value)
 
 
+  @patch.object(metric_collector.aws_base, "enableConnectionReuse",
+                autospec=True)
+  @patch.object(metric_collector, "createDatasourceAdapter", autospec=True)
+  @ConfigAttributePatch(
+    htm.it.app.config.CONFIG_NAME,
+    htm.it.app.config.baseConfigDir,
+    (("metric_collector", "worker_mode", "threads"),
+     ("metric_collector", "num_worker_threads", "2"),
+     ("metric_collector", "max_requests_per_sec_per_region", "1000")))
+  def testMetricCollectorRunWithWorkerThreads(self, createAdapterMock,
+                                              enableConnectionReuseMock,
+                                              repoMock, metricStreamerMock,
+                                              multiprocessingMock):
+    multiprocessingMock.Pipe.side_effect = multiprocessing.Pipe
+
+    metricPollInterval = 5
+
+    now = datetime.datetime.utcnow()
+
+    repoMock.getCloudwatchMetricsPendingDataCollection.side_effect = [
+      [_makeMetricMockInstance(metricPollInterval, now, 1)],
+      [_makeMetricMockInstance(metricPollInterval, now, 2),
+       _makeMetricMockInstance(metricPollInterval, now, 3)],
+      KeyboardInterrupt("Fake KeyboardInterrupt to interrupt run-loop")
+    ]
+    repoMock.retryOnTransientErrors.side_effect = lambda f: f
+
+    adapterInstanceMock = Mock(
+      spec_set=_CloudwatchDatasourceAdapter)
+    adapterInstanceMock.getMetricData.return_value = (
+      [[now, 1]] * 3, now + datetime.timedelta(seconds=metricPollInterval))
+    adapterInstanceMock.getMetricResourceStatus.return_value = "status"
+
+    createAdapterMock.return_value = adapterInstanceMock
+
+    # Now, run MetricCollector and check results
+    resultOfRunCollector = dict()
+    def runCollector():
+      try:
+        collector = metric_collector.MetricCollector()
+        resultOfRunCollector["returnCode"] = collector.run()
+      except:
+        resultOfRunCollector["exception"] = sys.exc_info()[1]
+
+    thread = threading.Thread(target=runCollector)
+    thread.setDaemon(True)
+    thread.start()
+
+    thread.join(60)
+    self.assertFalse(thread.isAlive())
+
+    self.assertIsInstance(resultOfRunCollector.get("exception"),
+                          KeyboardInterrupt)
+
+    # Data was collected by worker threads, not by worker processes
+    self.assertFalse(multiprocessingMock.Pool.called)
+    self.assertFalse(multiprocessingMock.Manager.called)
+    self.assertEqual(enableConnectionReuseMock.call_count, 2)
+
+    # Results of worker threads may arrive in any order
+    streamCalls = (metricStreamerMock.return_value.streamMetricData
+                   .call_args_list)
+    self.assertEqual(sorted(kwargs["metricID"] for _, kwargs in streamCalls),
+                     [1, 2, 3])
+    for args, _ in streamCalls:
+      self.assertEqual(args[0], [[now, 1]] * 3)
+
+    self.assertEqual(adapterInstanceMock.getMetricResourceStatus.call_count, 3)
+
+
+  @patch.object(metric_collector, "createDatasourceAdapter", autospec=True)
+  @ConfigAttributePatch(
+    htm.it.app.config.CONFIG_NAME,
+    htm.it.app.config.baseConfigDir,
+    (("metric_collector", "max_metrics_per_batch", "2"),))
+  def testMetricCollectorRunWithBatches(self, createAdapterMock, repoMock,
+                                        metricStreamerMock,
+                                        multiprocessingMock):
+    # Configure multiprocessing
+    def mapAsync(fn, tasks):
+      class _(object):
+        def wait(self):
+          map(fn, tasks)
+      return _()
+
+    multiprocessingMock.Pool.return_value.map_async.side_effect = mapAsync
+    multiprocessingMock.Pipe.side_effect = multiprocessing.Pipe
+    multiprocessingMock.Manager = (
+      Mock(return_value=(
+        Mock(JoinableQueue=(
+          Mock(side_effect=multiprocessing.JoinableQueue))))))
+
+    metricPollInterval = 5
+
+    now = datetime.datetime.utcnow()
+
+    metrics = [_makeMetricMockInstance(metricPollInterval, now, uid)
+               for uid in (1, 2, 3)]
+    for metricObj in metrics:
+      metricObj.datasource = "cloudwatch"
+      metricObj.parameters = json.dumps(
+        {"metricSpec": {"region": "us-west-2", "uid": metricObj.uid}})
+
+    repoMock.getCloudwatchMetricsPendingDataCollection.side_effect = [
+      metrics,
+      KeyboardInterrupt("Fake KeyboardInterrupt to interrupt run-loop")
+    ]
+    repoMock.retryOnTransientErrors.side_effect = lambda f: f
+
+    nextStart = now + datetime.timedelta(seconds=metricPollInterval)
+    adapterInstanceMock = Mock(
+      spec_set=_CloudwatchDatasourceAdapter)
+    adapterInstanceMock.getMetricDataBatch.return_value = [
+      ([[now, 1]], nextStart),
+      BotoServerError(500, "Fake BotoServerError")]
+    adapterInstanceMock.getMetricData.return_value = ([[now, 3]], nextStart)
+    adapterInstanceMock.getMetricResourceStatus.return_value = "status"
+
+    createAdapterMock.return_value = adapterInstanceMock
+
+    # Now, run MetricCollector and check results
+    resultOfRunCollector = dict()
+    def runCollector():
+      try:
+        collector = metric_collector.MetricCollector()
+        resultOfRunCollector["returnCode"] = collector.run()
+      except:
+        resultOfRunCollector["exception"] = sys.exc_info()[1]
+
+    thread = threading.Thread(target=runCollector)
+    thread.setDaemon(True)
+    thread.start()
+
+    thread.join(60)
+    self.assertFalse(thread.isAlive())
+
+    self.assertIsInstance(resultOfRunCollector.get("exception"),
+                          KeyboardInterrupt)
+
+    # The first two metrics were collected in a batch, the third alone
+    adapterInstanceMock.getMetricDataBatch.assert_called_once_with(
+      [({"region": "us-west-2", "uid": 1}, now),
+       ({"region": "us-west-2", "uid": 2}, now)])
+    adapterInstanceMock.getMetricData.assert_called_once_with(
+      metricSpec={"region": "us-west-2", "uid": 3}, start=now, end=None)
+    self.assertEqual(adapterInstanceMock.getMetricResourceStatus.call_count, 3)
+
+    # The batch's results were demultiplexed to their metrics
+    self.assertEqual(
+      [(kwargs["metricID"], args[0])
+       for args, kwargs in (metricStreamerMock.return_value.streamMetricData
+                            .call_args_list)],
+      [(1, [[now, 1]]), (3, [[now, 3]])])
+
+    self.assertEqual(repoMock.setMetricCollectorError.call_count, 1)
+    self.assertEqual(repoMock.setMetricCollectorError.call_args[0][1], 2)
+
+
+  def testRegionRateLimiter(self, *_mocks):
+    limiter = metric_collector._RegionRateLimiter(maxRequestsPerSec=10)
+
+    with patch.object(metric_collector.time, "time", autospec=True,
+                      return_value=1000), \
+        patch.object(metric_collector.time, "sleep",
+                     autospec=True) as sleepMock:
+      for region in ("us-west-2", "us-west-2", "us-east-1", "us-west-2"):
+        limiter.acquire(region)
+
+    # Requests in each region are spaced by 1/10 sec independently of other
+    # regions
+    self.assertEqual(sleepMock.call_count, 2)
+    self.assertAlmostEqual(sleepMock.call_args_list[0][0][0], 0.1)
+    self.assertAlmostEqual(sleepMock.call_args_list[1][0][0], 0.2)
+
+
   @patch.object(metric_collector, "createDatasourceAdapter", autospec=True)
   def testRecoveryFromBotoServerError(self, createAdapterMock, repoMock,
                                       metricStreamerMock, multiprocessingMock):
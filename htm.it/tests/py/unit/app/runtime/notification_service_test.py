@@ -22,6 +22,7 @@
 
 """Unit tests for notification service."""
 
+import calendar
 import datetime
 import unittest
 
@@ -190,6 +191,106 @@ class NotificationServiceTest(unittest.TestCase):
     self.assertEqual(kwargs["toAddresses"], "foo@bar.com")
 
 
+  @patch.object(notification_service.AnomalyService, "deserializeModelResult")
+  def testMessageHandlerAddsNotificationsOfBatch(self,
+                                                 deserializeModelResultMock,
+                                                 repoMock,
+                                                 _availabilityZoneMock):
+    repoMock.retryOnTransientErrors.side_effect = lambda f: f
+
+    laxSetting = Mock(uid="1", sensitivity=0.9, windowsize=3600,
+                      email_addr="foo@bar.com")
+    strictSetting = Mock(uid="2", sensitivity=0.99, windowsize=3600,
+                         email_addr=None)
+    repoMock.getAllNotificationSettings.return_value = [strictSetting,
+                                                        laxSetting]
+
+    ts = calendar.timegm(datetime.datetime.utcnow().utctimetuple())
+    deserializeModelResultMock.return_value = {
+      "metric": {"uid": "abc", "resource": "i-12345678"},
+      "results": [
+        dict(rowid=2000, ts=ts, anomaly=0.5),
+        dict(rowid=2001, ts=ts, anomaly=0.95),
+        dict(rowid=2002, ts=ts, anomaly=0.995),
+        # Not enough data
+        dict(rowid=1000, ts=ts, anomaly=0.995),
+        # Too old
+        dict(rowid=2003, ts=ts - 7200, anomaly=0.995)]}
+
+    # Throttle the notification of the strict setting's device
+    repoMock.addNotifications.side_effect = (
+      lambda conn, server, notifications: notifications[:2])
+
+    service = notification_service.NotificationService()
+
+    with patch.object(service, "sendNotificationEmail",
+                      autospec=True) as sendNotificationEmailMock:
+      for _ in xrange(2):
+        service.messageHandler(Mock(properties=Mock(headers=None)))
+
+    # Settings are loaded once and notifications are added once per batch
+    self.assertEqual(repoMock.getAllNotificationSettings.call_count, 1)
+    self.assertEqual(repoMock.addNotifications.call_count, 2)
+
+    kwargs = repoMock.addNotifications.call_args[1]
+    self.assertEqual(kwargs["server"], "i-12345678")
+    self.assertEqual(
+      [(notification["rowid"], notification["device"])
+       for notification in kwargs["notifications"]],
+      [(2001, "1"), (2002, "1"), (2002, "2")])
+
+    # Emails of the added notifications of devices with email addresses
+    self.assertEqual(sendNotificationEmailMock.call_count, 4)
+
+    # Cleanup is left to the cleanup task
+    self.assertFalse(repoMock.deleteStaleNotificationDevices.called)
+    self.assertFalse(repoMock.clearOldNotifications.called)
+
+
+  def testCleanup(self, repoMock, _availabilityZoneMock):
+    repoMock.retryOnTransientErrors.side_effect = lambda f: f
+    repoMock.getAllNotificationSettings.return_value = []
+
+    service = notification_service.NotificationService()
+    service._getNotificationSettings(repoMock.engineFactory.return_value)
+
+    service.cleanup()
+
+    self.assertEqual(repoMock.deleteStaleNotificationDevices.call_count, 1)
+    self.assertEqual(repoMock.clearOldNotifications.call_count, 1)
+
+    # Settings are reloaded without the deleted devices
+    service._getNotificationSettings(repoMock.engineFactory.return_value)
+    self.assertEqual(repoMock.getAllNotificationSettings.call_count, 2)
+
+
+
+class NotificationSettingsIndexTest(unittest.TestCase):
+  """Unit tests for NotificationSettingsIndex."""
+
+
+  def testMatch(self):
+    settings = [Mock(sensitivity=sensitivity)
+                for sensitivity in (0.99, 0.9, 0.999)]
+
+    index = notification_service.NotificationSettingsIndex(settings)
+
+    self.assertEqual(len(index), 3)
+    self.assertEqual(index.minThreshold, 0.9)
+    self.assertEqual(index.match(0.5), [])
+    self.assertEqual(index.match(0.9), [settings[1]])
+    self.assertEqual(index.match(0.995), [settings[1], settings[0]])
+    self.assertEqual(index.match(1.0), [settings[1], settings[0], settings[2]])
+
+
+  def testEmpty(self):
+    index = notification_service.NotificationSettingsIndex([])
+
+    self.assertFalse(index)
+    self.assertIsNone(index.minThreshold)
+    self.assertEqual(index.match(1.0), [])
+
+
 
 if __name__ == "__main__":
   unittest.main()
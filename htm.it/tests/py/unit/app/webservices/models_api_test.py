@@ -23,6 +23,7 @@
 # Disable "Access to a protected member" warning
 # pylint: disable=W0212
 
+import calendar
 import os
 import datetime
 import json
@@ -34,6 +35,7 @@ import unittest
 from collections import namedtuple
 from paste.fixture import TestApp
 from mock import ANY, create_autospec, MagicMock, Mock, patch
+import numpy
 
 from htm.it import logging_support
 import htm.it.app
@@ -588,13 +590,13 @@ class TestMetricDataHandler(unittest.TestCase):
     ) for row in dataRows]
     return rowTuples
 
-  @patch.object(repository, "getMetricData", autospec=True)
+  @patch.object(repository, "getMetricDataChunks", autospec=True)
   def testMetricDataHandlerGetMetricData(self,
                                          getMetricDataMock,
                                          _engineMock):
 
-    getMetricDataMock.return_value = self.decodeRowTuples(
-      self.metric_data["datalist"])
+    getMetricDataMock.return_value = [self.decodeRowTuples(
+      self.metric_data["datalist"])]
     response = self.app.get("/be9fab-f416-4845-8dab-02d292244112/data",
      headers=self.headers)
     assertions.assertSuccess(self, response)
@@ -603,7 +605,7 @@ class TestMetricDataHandler(unittest.TestCase):
      result["data"])
 
 
-  @patch.object(repository, "getMetricData", autospec=True)
+  @patch.object(repository, "getMetricDataChunks", autospec=True)
   def testMetricDataHandlerGetMultiMetricData(self,
                                               getMetricDataMock,
                                               _engineMock):
@@ -617,15 +619,16 @@ class TestMetricDataHandler(unittest.TestCase):
       fromTimestamp=ANY,
       toTimestamp=ANY,
       score=ANY,
-      sort=ANY)
+      descending=True,
+      limit=None)
 
 
-  @patch.object(repository, "getMetricData", autospec=True)
+  @patch.object(repository, "getMetricDataChunks", autospec=True)
   def testMetricDataHandlerGetMetricDataWithFromTimestamp(self,
                                                           getMetricDataMock,
                                                           _engineMock):
-    getMetricDataMock.return_value = self.decodeRowTuples(
-      self.metric_data['withfrom'])
+    getMetricDataMock.return_value = [self.decodeRowTuples(
+      self.metric_data['withfrom'])]
     response = self.app.get(
       "/be9fab-f416-4845-8dab-02d292244112/data?to=2013-08-15 21:28:00",
        headers=self.headers)
@@ -635,7 +638,7 @@ class TestMetricDataHandler(unittest.TestCase):
      result["data"])
 
 
-  @patch.object(repository, "getMetricData", autospec=True)
+  @patch.object(repository, "getMetricDataChunks", autospec=True)
   def testMetricDataHandlerGetMultiMetricDataWithFromTimestamp(self,
       getMetricDataMock, _engineMock):
     getMetricDataMock.return_value = []
@@ -649,14 +652,15 @@ class TestMetricDataHandler(unittest.TestCase):
       fromTimestamp="2013-08-15 21:30:00",
       toTimestamp=ANY,
       score=ANY,
-      sort=ANY)
+      descending=False,
+      limit=None)
 
 
-  @patch.object(repository, "getMetricData", autospec=True)
+  @patch.object(repository, "getMetricDataChunks", autospec=True)
   def testMetricDataHandlerGetMetricDataWithToTimestamp(self,
       getMetricDataMock, _engineMock):
-    getMetricDataMock.return_value = self.decodeRowTuples(
-      self.metric_data["withto"])
+    getMetricDataMock.return_value = [self.decodeRowTuples(
+      self.metric_data["withto"])]
     response = self.app.get(
       "/be9fab-f416-4845-8dab-02d292244112/data?to=2013-08-15 21:28:00",
        headers=self.headers)
@@ -666,11 +670,11 @@ class TestMetricDataHandler(unittest.TestCase):
      result["data"])
 
 
-  @patch.object(repository, "getMetricData", autospec=True)
+  @patch.object(repository, "getMetricDataChunks", autospec=True)
   def testMetricDataHandlerGetMultiMetricDataWithToTimestamp(self,
       getMetricDataMock, _engineMock):
-    getMetricDataMock.return_value = self.decodeRowTuples(
-      self.metric_data["withto"])
+    getMetricDataMock.return_value = [self.decodeRowTuples(
+      self.metric_data["withto"])]
     response = self.app.get("/data?to=2013-08-15 21:28:00",
      headers=self.headers)
     assertions.assertResponseStatusCode(self, response, 200)
@@ -681,15 +685,16 @@ class TestMetricDataHandler(unittest.TestCase):
       fromTimestamp=ANY,
       toTimestamp="2013-08-15 21:28:00",
       score=ANY,
-      sort=ANY)
+      descending=True,
+      limit=None)
 
 
-  @patch.object(repository, "getMetricData", autospec=True)
+  @patch.object(repository, "getMetricDataChunks", autospec=True)
   def testMetricDataHandlerGetMetricDataWIthAnomaly(self,
                                                     getMetricDataMock,
                                                     _engineMock):
-    getMetricDataMock.return_value = self.decodeRowTuples(
-      self.metric_data['withanomaly'])
+    getMetricDataMock.return_value = [self.decodeRowTuples(
+      self.metric_data['withanomaly'])]
     response = self.app.get(
       "/be9fab-f416-4845-8dab-02d292244112/data?anomaly=0.01",
        headers=self.headers)
@@ -699,7 +704,7 @@ class TestMetricDataHandler(unittest.TestCase):
      result["data"])
 
 
-  @patch.object(repository, "getMetricData", autospec=True)
+  @patch.object(repository, "getMetricDataChunks", autospec=True)
   def testMetricDataHandlerGetMultiMetricDataWithAnomaly(self,
       getMetricDataMock, _engineMock):
     getMetricDataMock.return_value = []
@@ -712,14 +717,15 @@ class TestMetricDataHandler(unittest.TestCase):
       fromTimestamp=ANY,
       toTimestamp=ANY,
       score=0.01,
-      sort=ANY)
+      descending=True,
+      limit=None)
 
 
-  @patch.object(repository, "getMetricData", autospec=True)
+  @patch.object(repository, "getMetricDataChunks", autospec=True)
   def testMetricDataHandlerGetMetricDataWithToFromAnomaly(self,
       getMetricDataMock, _engineMock):
-    getMetricDataMock.return_value = self.decodeRowTuples(
-      self.metric_data['withanomaly'])
+    getMetricDataMock.return_value = [self.decodeRowTuples(
+      self.metric_data['withanomaly'])]
     response = self.app.get(
       "/be9fab-f416-4845-8dab-02d292244112/data?from=2013-08-15 21:34:00&" \
       "to=2013-08-15 21:24:00&anomaly=0.025", headers=self.headers)
@@ -729,7 +735,7 @@ class TestMetricDataHandler(unittest.TestCase):
      result["data"])
 
 
-  @patch.object(repository, "getMetricData", autospec=True)
+  @patch.object(repository, "getMetricDataChunks", autospec=True)
   def testMetricDataHandlerGetMultiMetricDataWithToFromAnomaly(self,
       getMetricDataMock, _engineMock):
     getMetricDataMock.return_value = []
@@ -744,13 +750,14 @@ class TestMetricDataHandler(unittest.TestCase):
       fromTimestamp="2013-08-15 21:34:00",
       toTimestamp="2013-08-15 21:24:00",
       score=0.025,
-      sort=ANY)
+      descending=False,
+      limit=None)
 
 
-  @patch("htm.it.app.webservices.models_api.repository.getMetricData")
+  @patch("htm.it.app.webservices.models_api.repository.getMetricDataChunks")
   def testQuery(self, getMetricDataMock, _engineMock):
-    getMetricDataMock.return_value = self.decodeRowTuples(
-      self.metric_data["datalist"])
+    getMetricDataMock.return_value = [self.decodeRowTuples(
+      self.metric_data["datalist"])]
 
     response = self.app.get("/be9fab-f416-4845-8dab-02d292244112/data?\
       from=2013-08-15 21:34:00&to=2013-08-15 21:24:00&anomaly=0.025",
@@ -758,7 +765,7 @@ class TestMetricDataHandler(unittest.TestCase):
     assertions.assertSuccess(self, response)
 
 
-  @patch("htm.it.app.webservices.models_api.repository.getMetricData")
+  @patch("htm.it.app.webservices.models_api.repository.getMetricDataChunks")
   def testQueryMultiMetric(self, getMetricDataMock, _engineMock):
     response = self.app.get('/data?from=2013-08-15 21:34:00&' \
       'to=2013-08-15 21:24:00&anomaly=0.025', headers=self.headers)
@@ -767,12 +774,12 @@ class TestMetricDataHandler(unittest.TestCase):
     self.assertIn("names", result)
 
 
-  @patch("htm.it.app.webservices.models_api.repository.getMetricData")
+  @patch("htm.it.app.webservices.models_api.repository.getMetricDataChunks")
   def testQueryMultiMetricAsBinaryStream(self, getMetricDataMock, _engineMock):
     self.headers["Accept"] = "application/octet-stream"
 
-    getMetricDataMock.return_value = self.decodeRowTuples(
-      self.metric_data["datalist"])
+    getMetricDataMock.return_value = [self.decodeRowTuples(
+      self.metric_data["datalist"])]
 
     response = self.app.get("/data?from=2013-08-15 21:34:00&" \
       "to=2013-08-15 21:24:00&anomaly=0.025", headers=self.headers)
@@ -784,6 +791,92 @@ class TestMetricDataHandler(unittest.TestCase):
       "anomaly_score", "rowid"])
 
 
+  @patch.object(repository, "getMetricDataChunks", autospec=True)
+  def testQueryMultiMetricAsBinaryStreamWithLimit(self, getMetricDataMock,
+                                                  _engineMock):
+    self.headers["Accept"] = "application/octet-stream"
+
+    rows = self.decodeRowTuples(self.metric_data["datalist"])
+    getMetricDataMock.return_value = [rows[:2], rows[2:4]]
+
+    response = self.app.get("/data?limit=4", headers=self.headers)
+
+    assertions.assertResponseStatusCode(self, response, 200)
+    self.assertEqual(dict(response.headers)["Content-Type"],
+                     "application/octet-stream")
+    getMetricDataMock.assert_called_once_with(
+      _engineMock.return_value.connect.return_value.__enter__.return_value,
+      metricId=None,
+      fields=ANY,
+      fromTimestamp=None,
+      toTimestamp=None,
+      score=0.0,
+      descending=True,
+      limit=4)
+
+    records = list(msgpack.Unpacker(StringIO.StringIO(response.body)))[1:]
+    self.assertEqual(records,
+                     [[row[0],
+                       calendar.timegm(time.strptime(row[1],
+                                                     "%Y-%m-%d %H:%M:%S")),
+                       row[2], row[3], row[4]]
+                      for row in self.metric_data["datalist"][:4]])
+
+
+  @patch.object(repository, "getMetricDataChunks", autospec=True)
+  def testQueryMultiMetricAsColumnarStream(self, getMetricDataMock,
+                                           _engineMock):
+    self.headers["Accept"] = "application/x-msgpack-columnar"
+
+    rows = self.decodeRowTuples(self.metric_data["datalist"])
+    otherRows = [row._replace(uid="def") for row in rows[:2]]
+    getMetricDataMock.return_value = [rows[:3], rows[3:], otherRows]
+
+    response = self.app.get("/data", headers=self.headers)
+
+    assertions.assertResponseStatusCode(self, response, 200)
+    self.assertEqual(dict(response.headers)["Content-Type"],
+                     "application/x-msgpack-columnar")
+
+    frames = list(msgpack.Unpacker(StringIO.StringIO(response.body)))
+    self.assertEqual(frames[0], ["names", "uid", "timestamp", "value",
+                                 "anomaly_score", "rowid"])
+    self.assertEqual([frame[0] for frame in frames[1:]], ["abc", "abc", "def"])
+
+    timestamps, values, scores, rowids = [
+      numpy.concatenate([numpy.frombuffer(frame[i], dtype=dtype)
+                         for frame in frames[1:3]])
+      for i, dtype in enumerate(("<i8", "<f8", "<f8", "<i8"), 1)]
+
+    self.assertEqual(timestamps.tolist(),
+                     [calendar.timegm(row.timestamp.utctimetuple())
+                      for row in rows])
+    self.assertEqual(values.tolist(), [row.metric_value for row in rows])
+    self.assertEqual(scores.tolist(), [row.anomaly_score for row in rows])
+    self.assertEqual(rowids.tolist(), [row.rowid for row in rows])
+
+
+  @patch.object(repository, "getMetricDataChunks", autospec=True)
+  def testQueryMultiMetricGroupsRecordsByMetric(self, getMetricDataMock,
+                                                _engineMock):
+    rows = self.decodeRowTuples(self.metric_data["datalist"])
+    otherRows = [row._replace(uid="def") for row in rows[:2]]
+    getMetricDataMock.return_value = [rows[:3], rows[3:], otherRows]
+
+    response = self.app.get("/data", headers=self.headers)
+
+    assertions.assertSuccess(self, response)
+    result = json.loads(response.body)
+    self.assertEqual(result["names"],
+                     ["timestamp", "value", "anomaly_score", "rowid"])
+    self.assertEqual(
+      result["metrics"],
+      [{"uid": "abc",
+        "data": [row[1:] for row in self.metric_data["datalist"]]},
+       {"uid": "def",
+        "data": [row[1:] for row in self.metric_data["datalist"][:2]]}])
+
+
 
 @patch.object(repository, "engineFactory", autospec=True)
 class TestModelExportHandler(unittest.TestCase):
@@ -18,10 +18,16 @@
 #
 # http://numenta.org/licenses/
 # ----------------------------------------------------------------------
+from collections import namedtuple, OrderedDict
 import itertools
+import threading
+
+import numpy
 
 from nupic.algorithms import anomaly_likelihood as algorithms
 from htmengine import repository
+from htmengine.anomaly_likelihood_statistics import (
+  IncrementalLikelihoodStatistics)
 from htmengine.exceptions import MetricNotActiveError
 from htmengine.htmengine_logging import getMetricLogPrefix
 from htmengine.repository.queries import MetricStatus
@@ -34,6 +40,270 @@ NUM_SKIP_RECORDS = 288 # One day of records
                        # instead?
 
 
+# Log raw score window cache statistics once per this many window lookups
+_RAW_SCORE_WINDOW_STATS_LOG_INTERVAL = 1000
+
+
+
+# A sample served from a _RawScoreWindow; mimics the MetricData attributes
+# used in anomaly likelihood statistics
+_RawScoreSample = namedtuple("_RawScoreSample",
+                             "rowid timestamp metric_value raw_anomaly_score")
+
+
+
+class _RawScoreWindow(object):
+  """ Ring buffer of a metric's most recent samples with raw anomaly scores in
+  processed order, backed by NumPy arrays. The arrays grow geometrically up to
+  the window's capacity, after which the oldest samples are overwritten.
+  """
+
+  __slots__ = ("capacity", "nextRowID", "_rowids", "_timestamps", "_values",
+               "_scores", "_start", "_count")
+
+
+  def __init__(self, capacity):
+    """
+    :param capacity: max number of samples retained in the window
+    """
+    self.capacity = capacity
+
+    # The rowid that is expected to follow the last sample added to the window;
+    # None if nothing was added yet
+    self.nextRowID = None
+
+    self._rowids = numpy.empty(0, dtype=numpy.int64)
+    self._timestamps = numpy.empty(0, dtype="datetime64[us]")
+    self._values = numpy.empty(0, dtype=numpy.float64)
+    self._scores = numpy.empty(0, dtype=numpy.float64)
+
+    # Array index of the oldest sample
+    self._start = 0
+
+    # Number of samples in the window
+    self._count = 0
+
+
+  def __repr__(self):
+    return "%s<count=%s, capacity=%s, nextRowID=%s, nbytes=%s>" % (
+      self.__class__.__name__, self._count, self.capacity, self.nextRowID,
+      self.nbytes)
+
+
+  def __len__(self):
+    return self._count
+
+
+  @property
+  def nbytes(self):
+    """ Memory used by the window's arrays in bytes """
+    return (self._rowids.nbytes + self._timestamps.nbytes +
+            self._values.nbytes + self._scores.nbytes)
+
+
+  def _getPositions(self, offset, count):
+    """ :returns: array indexes of `count` samples starting at the given offset
+    from the oldest sample
+    """
+    return (self._start + offset + numpy.arange(count)) % len(self._rowids)
+
+
+  def _resize(self, size):
+    positions = self._getPositions(0, self._count)
+
+    for name in ("_rowids", "_timestamps", "_values", "_scores"):
+      oldArray = getattr(self, name)
+      newArray = numpy.empty(size, dtype=oldArray.dtype)
+      newArray[:self._count] = oldArray[positions]
+      setattr(self, name, newArray)
+
+    self._start = 0
+
+
+  def extend(self, samples, nextRowID):
+    """ Append samples to the window, evicting the oldest ones as needed
+
+    :param samples: a sequence of MetricData-like objects in processed order;
+      samples with a null raw_anomaly_score are skipped
+    :param nextRowID: the rowid that is expected to follow the given samples
+    """
+    samples = [sample for sample in samples
+               if sample.raw_anomaly_score is not None][-self.capacity:]
+
+    numSamples = len(samples)
+    if numSamples:
+      required = min(self.capacity, self._count + numSamples)
+      if required > len(self._rowids):
+        self._resize(min(self.capacity,
+                         max(required, 2 * len(self._rowids))))
+
+      positions = self._getPositions(self._count, numSamples)
+      self._rowids[positions] = [sample.rowid for sample in samples]
+      self._timestamps[positions] = [sample.timestamp for sample in samples]
+      self._values[positions] = [sample.metric_value for sample in samples]
+      self._scores[positions] = [sample.raw_anomaly_score
+                                 for sample in samples]
+
+      size = len(self._rowids)
+      overflow = max(0, self._count + numSamples - size)
+      self._start = (self._start + overflow) % size
+      self._count = min(size, self._count + numSamples)
+
+    self.nextRowID = nextRowID
+
+
+  def getArrays(self, start=0, stop=None):
+    """ Get a range of samples as arrays
+
+    :param start: offset of the first sample from the oldest sample
+    :param stop: offset past the last sample; defaults to the window's length
+
+    :returns: a pair of numpy arrays (rawScores, metricValues) of the samples
+      in processed order
+    """
+    stop = self._count if stop is None else min(stop, self._count)
+    if stop <= start:
+      return (numpy.empty(0, dtype=numpy.float64),
+              numpy.empty(0, dtype=numpy.float64))
+
+    positions = self._getPositions(start, stop - start)
+    return self._scores[positions], self._values[positions]
+
+
+  def tail(self, limit):
+    """
+    :param limit: max number of samples to return
+
+    :returns: a list of up to `limit` most recent _RawScoreSample objects in
+      processed order
+    """
+    numSamples = min(limit, self._count)
+    if numSamples == 0:
+      return []
+
+    positions = self._getPositions(self._count - numSamples, numSamples)
+
+    return map(_RawScoreSample._make,
+               itertools.izip(self._rowids[positions].tolist(),
+                              self._timestamps[positions].tolist(),
+                              self._values[positions].tolist(),
+                              self._scores[positions].tolist()))
+
+
+
+class _RawScoreWindowCache(object):
+  """ LRU cache of per-metric _RawScoreWindow objects bounded by a memory
+  budget.
+
+  A window is checked out for the duration of processing of a metric's
+  inference result batch and checked back in as the most recently used entry
+  afterwards. A window is only handed out if it's contiguous with the batch
+  being processed; otherwise (e.g., a result batch was redelivered or another
+  process handled some of the metric's batches) it's discarded, and the caller
+  falls back on the metric_data table.
+
+  Thread-safe, so that AnomalyService's shard workers may share it; a metric's
+  result batches are processed by one worker at a time, which has the metric's
+  window checked out meanwhile.
+  """
+
+  def __init__(self, log, memoryBudgetBytes):
+    """
+    :param log: htmengine log
+    :type log: logging.Logger
+    :param memoryBudgetBytes: upper bound of the combined size of the cached
+      windows' arrays
+    """
+    self._log = log
+
+    self._memoryBudgetBytes = memoryBudgetBytes
+
+    self._lock = threading.Lock()
+
+    # metricID -> _RawScoreWindow, in LRU order
+    self._windows = OrderedDict()
+
+    self._totalSizeBytes = 0
+
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+    self.invalidations = 0
+
+
+  def __repr__(self):
+    lookups = self.hits + self.misses
+    return ("%s<numMetrics=%s, totalSizeMB=%.1f, budgetMB=%.1f, "
+            "avgKBPerMetric=%.1f, hitRate=%.3f, hits=%s, misses=%s, "
+            "evictions=%s, invalidations=%s>") % (
+              self.__class__.__name__, len(self._windows),
+              self._totalSizeBytes / 1048576.0,
+              self._memoryBudgetBytes / 1048576.0,
+              (self._totalSizeBytes / 1024.0 / len(self._windows)
+               if self._windows else 0.0),
+              float(self.hits) / lookups if lookups else 0.0,
+              self.hits, self.misses, self.evictions, self.invalidations)
+
+
+  def __len__(self):
+    return len(self._windows)
+
+
+  def checkOut(self, metricID, firstRowID):
+    """ Remove the metric's window from the cache for processing of an
+    inference result batch
+
+    :param metricID: the metric ID
+    :param firstRowID: rowid of the first row of the inference result batch
+
+    :returns: the metric's _RawScoreWindow if it's contiguous with the batch;
+      None otherwise
+    """
+    with self._lock:
+      window = self._windows.pop(metricID, None)
+
+      if window is not None:
+        self._totalSizeBytes -= window.nbytes
+
+        if window.nextRowID != firstRowID:
+          self._log.debug("Discarding raw score window=%r of model=%s that is "
+                          "not contiguous with firstRowID=%s",
+                          window, metricID, firstRowID)
+          self.invalidations += 1
+          window = None
+
+      if window is not None:
+        self.hits += 1
+      else:
+        self.misses += 1
+
+      if (self.hits + self.misses) % _RAW_SCORE_WINDOW_STATS_LOG_INTERVAL == 0:
+        self._log.info("{TAG:ANOM.LIKELIHOOD.WINDOW.STATS} %r", self)
+
+    return window
+
+
+  def checkIn(self, metricID, window):
+    """ Return the metric's window to the cache as the most recently used entry
+    and evict least recently used windows as needed to stay within the memory
+    budget
+
+    :param metricID: the metric ID
+    :param window: the metric's _RawScoreWindow
+    """
+    with self._lock:
+      self._windows[metricID] = window
+      self._totalSizeBytes += window.nbytes
+
+      while self._windows and self._totalSizeBytes > self._memoryBudgetBytes:
+        evictedMetricID, evictedWindow = self._windows.popitem(last=False)
+        self._totalSizeBytes -= evictedWindow.nbytes
+        self.evictions += 1
+
+        self._log.debug("Evicting raw score window=%r of model=%s",
+                        evictedWindow, evictedMetricID)
+
+
 
 class AnomalyLikelihoodHelper(object):
   """ Helper class for running AnomalyLikelihood calculations in
@@ -65,6 +335,21 @@ class AnomalyLikelihoodHelper(object):
     self._statisticsSampleSize = (
       config.getint("anomaly_likelihood", "statistics_sample_size"))
 
+    # In-process windows of the models' recent raw anomaly scores; spare us
+    # from querying the metric_data tail when refreshing anomaly params
+    self._rawScoreWindows = _RawScoreWindowCache(
+      log=log,
+      memoryBudgetBytes=config.getint(
+        "anomaly_likelihood", "raw_score_window_memory_budget_mb") * 1048576)
+
+    # Whether to refresh the anomaly likelihood distribution after every sample
+    # using IncrementalLikelihoodStatistics instead of re-estimating it from
+    # the sample window at intervals; requires a window that extends past the
+    # skipped records
+    self._incrementalStatistics = (
+      config.getboolean("anomaly_likelihood", "incremental_statistics") and
+      self._statisticsSampleSize > NUM_SKIP_RECORDS)
+
 
   def _generateAnomalyParams(self, metricID, statsSampleCache,
                              defaultAnomalyParams):
@@ -241,12 +526,14 @@ class AnomalyLikelihoodHelper(object):
 
 
   def _refreshAnomalyParams(self, engine, metricID, statsSampleCache,
-                            consumedSamples, defaultAnomalyParams):
+                            consumedSamples, defaultAnomalyParams,
+                            rawScoreWindow=None):
     """ Refresh anomaly likelihood parameters from the tail of
     statsSampleCache and consumedSamples up to self._statisticsSampleSize.
 
-    Update statsSampleCache, including initializing from metric_data table, if
-    needed, and appending of consumedSamples content.
+    Update statsSampleCache, including initializing from the model's raw score
+    window or metric_data table, if needed, and appending of consumedSamples
+    content.
 
     :param engine: SQLAlchemy engine object
     :type engine: sqlalchemy.engine.Engine
@@ -264,14 +551,18 @@ class AnomalyLikelihoodHelper(object):
       appended to statsSampleCache
     :param defaultAnomalyParams: the default anomaly params value; if can't
       generate new ones, this value will be returned in the result tuple
+    :param rawScoreWindow: the model's _RawScoreWindow that is contiguous with
+      consumedSamples; None if not available. Used in place of the metric_data
+      table when initializing statsSampleCache.
 
     :returns: the tuple (anomalyParams, statsSampleCache,)
 
       If statsSampleCache was None on entry, it will be initialized as follows:
       up to the balance of self._statisticsSampleSize in excess of
-      consumedSamples metric data rows with non-null raw anomaly scores will be
-      loaded from the metric_data table and consumedSamples will be appended to
-      it. If statsSampleCache was not None on entry, then elements from
+      consumedSamples samples with non-null raw anomaly scores will be
+      taken from rawScoreWindow or, if not available, loaded from the
+      metric_data table and consumedSamples will be appended to it. If
+      statsSampleCache was not None on entry, then elements from
       consumedSamples will be appended to it. The returned statsSampleCache will
       be a list NOTE: it may be an empty list, if there was nothing to fill it
       with.
@@ -288,10 +579,13 @@ class AnomalyLikelihoodHelper(object):
       # anomaly params are being refreshed for the first time within an
       # inference result batch.
       # TODO: unit-test this
-      tail = self._tailMetricDataWithRawAnomalyScoresIter(
-        engine,
-        metricID,
-        max(0, self._statisticsSampleSize - len(consumedSamples)))
+      limit = max(0, self._statisticsSampleSize - len(consumedSamples))
+      if rawScoreWindow is not None:
+        tail = rawScoreWindow.tail(limit)
+      else:
+        tail = self._tailMetricDataWithRawAnomalyScoresIter(engine,
+                                                            metricID,
+                                                            limit)
 
       statsSampleCache = list(itertools.chain(tail, consumedSamples))
     else:
@@ -333,6 +627,196 @@ class AnomalyLikelihoodHelper(object):
     return reversed(rows)
 
 
+  def _computeIncrementalStatistics(self, rawScoreWindow, windowSize):
+    """ Compute incremental statistics from scratch
+
+    :param rawScoreWindow: the model's _RawScoreWindow
+    :param windowSize: the model's raw anomaly score averaging window size
+
+    :returns: IncrementalLikelihoodStatistics instance in sync with
+      rawScoreWindow
+    """
+    rawScores, metricValues = rawScoreWindow.getArrays()
+
+    return IncrementalLikelihoodStatistics.fromSamples(
+      rawScores=rawScores,
+      metricValues=metricValues,
+      capacity=self._statisticsSampleSize,
+      skipRecords=NUM_SKIP_RECORDS,
+      windowSize=windowSize,
+      nextRowID=rawScoreWindow.nextRowID)
+
+
+  def _initIncrementalStatistics(self, anomalyParams, rawScoreWindow):
+    """ Compute the model's incremental statistics from scratch, refresh the
+    anomaly likelihood distribution from them and save them in anomalyParams
+
+    :param anomalyParams: the model's anomaly likelihood params; updated in
+      place
+    :param rawScoreWindow: the model's _RawScoreWindow that is up to date
+    """
+    incrementalStats = self._computeIncrementalStatistics(
+      rawScoreWindow=rawScoreWindow,
+      windowSize=anomalyParams["params"]["movingAverage"]["windowSize"])
+
+    self._refreshDistribution(anomalyParams["params"], incrementalStats)
+
+    anomalyParams["last_rowid_for_stats"] = rawScoreWindow.nextRowID - 1
+    anomalyParams["incremental_statistics"] = incrementalStats.toDict()
+
+
+  def _loadIncrementalStatistics(self, metricID, anomalyParams, rawScoreWindow,
+                                 firstRowID):
+    """ Load the model's incremental statistics from anomalyParams
+
+    :param metricID: the metric ID
+    :param anomalyParams: the model's anomaly likelihood params
+    :param rawScoreWindow: the model's _RawScoreWindow that is contiguous with
+      the inference result batch
+    :param firstRowID: rowid of the first row of the inference result batch
+
+    :returns: IncrementalLikelihoodStatistics instance in sync with
+      rawScoreWindow; None if anomalyParams have no incremental statistics in
+      sync with rawScoreWindow
+    """
+    state = anomalyParams.get("incremental_statistics")
+    if state is None:
+      return None
+
+    incrementalStats = IncrementalLikelihoodStatistics.fromDict(state)
+
+    if (incrementalStats.nextRowID != firstRowID or
+        incrementalStats.numSamples != len(rawScoreWindow) or
+        incrementalStats.capacity != self._statisticsSampleSize or
+        incrementalStats.skipRecords != NUM_SKIP_RECORDS or
+        incrementalStats.windowSize !=
+        anomalyParams["params"]["movingAverage"]["windowSize"]):
+      self._log.debug(
+        "Incremental statistics=%r of model=%s are out of sync with raw score "
+        "window=%r; firstRowID=%s", incrementalStats, metricID,
+        rawScoreWindow, firstRowID)
+      return None
+
+    if incrementalStats.needsResync:
+      incrementalStats = self._computeIncrementalStatistics(
+        rawScoreWindow=rawScoreWindow,
+        windowSize=incrementalStats.windowSize)
+
+    return incrementalStats
+
+
+  @classmethod
+  def _getEvictedSamples(cls, incrementalStats, rawScoreWindow,
+                         metricDataRows):
+    """ Get the samples that leave the estimated region of the statistics'
+    window as rows of the inference result batch are appended to it
+
+    :param incrementalStats: IncrementalLikelihoodStatistics instance in sync
+      with rawScoreWindow
+    :param rawScoreWindow: the model's _RawScoreWindow that is contiguous with
+      metricDataRows
+    :param metricDataRows: the inference result batch
+
+    :returns: the tuple (firstEvictingIndex, averagedScores, metricValues)
+      firstEvictingIndex: index of the first row in metricDataRows whose
+        appending evicts a sample from the full window
+      averagedScores: numpy array of the averaged anomaly scores of the samples
+        evicted by the rows starting at firstEvictingIndex
+      metricValues: numpy array of the corresponding metric values
+    """
+    capacity = incrementalStats.capacity
+    windowSize = incrementalStats.windowSize
+    numWindowSamples = len(rawScoreWindow)
+
+    firstEvictingIndex = max(0, capacity - numWindowSamples)
+
+    # Range of the concatenation of the window's samples and metricDataRows
+    # spanning the evicted samples and the raw scores that they average
+    start = (numWindowSamples + firstEvictingIndex - capacity +
+             incrementalStats.skipRecords - (windowSize - 1))
+    stop = (numWindowSamples + len(metricDataRows) - capacity +
+            incrementalStats.skipRecords)
+
+    windowScores, windowValues = rawScoreWindow.getArrays(start, stop)
+    batchRows = metricDataRows[max(0, start - numWindowSamples):
+                               max(0, stop - numWindowSamples)]
+
+    rawScores = numpy.concatenate(
+      (windowScores, [row.raw_anomaly_score for row in batchRows]))
+    metricValues = numpy.concatenate(
+      (windowValues, [row.metric_value for row in batchRows]))
+
+    sums = numpy.concatenate(([0.0], numpy.cumsum(rawScores)))
+
+    return (firstEvictingIndex,
+            (sums[windowSize:] - sums[:-windowSize]) / windowSize,
+            metricValues[windowSize - 1:])
+
+
+  @classmethod
+  def _refreshDistribution(cls, params, incrementalStats):
+    """ Refresh the anomaly likelihood distribution and the dependent
+    historical likelihoods from incremental statistics the way that
+    algorithms.estimateAnomalyLikelihoods would have from the statistics'
+    window of samples
+
+    :param params: anomaly likelihood estimator params from
+      algorithms.estimateAnomalyLikelihoods; updated in place
+    :param incrementalStats: IncrementalLikelihoodStatistics instance
+    """
+    distribution = incrementalStats.getDistribution()
+
+    params["distribution"] = distribution
+    params["historicalLikelihoods"] = [
+      algorithms.normalProbability(averagedScore, distribution)
+      for averagedScore in incrementalStats.historicalAverages]
+
+
+  def _updateAnomalyScoresIncrementally(self, anomalyParams, incrementalStats,
+                                        metricDataRows, rawScoreWindow):
+    """ Calculate the anomaly scores of the inference result batch, refreshing
+    the anomaly likelihood distribution after every sample from incremental
+    statistics.
+
+    :param anomalyParams: the model's anomaly likelihood params; updated in
+      place, including the incremental statistics state
+    :param incrementalStats: IncrementalLikelihoodStatistics instance in sync
+      with rawScoreWindow
+    :param metricDataRows: a sequence of MetricData instances in the processed
+      order; will update their anomaly_score properties
+    :param rawScoreWindow: the model's _RawScoreWindow that is contiguous with
+      metricDataRows; not modified
+    """
+    firstEvictingIndex, evictedScores, evictedValues = (
+      self._getEvictedSamples(incrementalStats=incrementalStats,
+                              rawScoreWindow=rawScoreWindow,
+                              metricDataRows=metricDataRows))
+
+    for i, md in enumerate(metricDataRows):
+      (likelihood,), (averagedScore,), anomalyParams["params"] = (
+        algorithms.updateAnomalyLikelihoods(
+          ((md.timestamp, md.metric_value, md.raw_anomaly_score),),
+          anomalyParams["params"]))
+
+      md.anomaly_score = float(1.0 - likelihood)
+
+      if i >= firstEvictingIndex:
+        incrementalStats.append(
+          float(averagedScore),
+          md.metric_value,
+          evictedAveragedScore=float(evictedScores[i - firstEvictingIndex]),
+          evictedMetricValue=float(evictedValues[i - firstEvictingIndex]))
+      else:
+        incrementalStats.append(float(averagedScore), md.metric_value)
+
+      self._refreshDistribution(anomalyParams["params"], incrementalStats)
+
+    incrementalStats.nextRowID = metricDataRows[-1].rowid + 1
+
+    anomalyParams["last_rowid_for_stats"] = metricDataRows[-1].rowid
+    anomalyParams["incremental_statistics"] = incrementalStats.toDict()
+
+
   def updateModelAnomalyScores(self, engine, metricObj, metricDataRows):
     """
     Calculate the anomaly scores based on the anomaly likelihoods. Update
@@ -377,16 +861,45 @@ class AnomalyLikelihoodHelper(object):
                                     metricObj.status,
                                     metricObj.server,))
 
+    # The model's window of recent raw anomaly scores, if it's contiguous with
+    # metricDataRows
+    rawScoreWindow = self._rawScoreWindows.checkOut(
+      metricObj.uid,
+      firstRowID=metricDataRows[0].rowid)
+
     modelParams = jsonDecode(metricObj.model_params)
     anomalyParams = modelParams.get("anomalyLikelihoodParams", None)
     if not anomalyParams:
       # We don't have a likelihood model yet. Create one if we have sufficient
-      # records with raw anomaly scores
+      # records with raw anomaly scores. The model is built from the
+      # metric_data table, since a window may be left over from a prior
+      # incarnation of the model.
+      rawScoreWindow = None
       (anomalyParams, statsSampleCache, startRowIndex) = (
         self._initAnomalyLikelihoodModel(engine=engine,
                                          metricObj=metricObj,
                                          metricDataRows=metricDataRows))
 
+    # The model's incremental statistics, if they're in sync with
+    # rawScoreWindow
+    incrementalStats = None
+    if self._incrementalStatistics and rawScoreWindow is not None:
+      incrementalStats = self._loadIncrementalStatistics(
+        metricID=metricObj.uid,
+        anomalyParams=anomalyParams,
+        rawScoreWindow=rawScoreWindow,
+        firstRowID=metricDataRows[0].rowid)
+
+    if incrementalStats is not None:
+      self._updateAnomalyScoresIncrementally(
+        anomalyParams=anomalyParams,
+        incrementalStats=incrementalStats,
+        metricDataRows=metricDataRows,
+        rawScoreWindow=rawScoreWindow)
+
+      # Skip the batch processing below
+      startRowIndex = len(metricDataRows)
+
     # Do anomaly likelihood processing on the rest of the new samples
     # NOTE: this loop will be skipped if there are still not enough samples for
     #  creating the anomaly likelihood params
@@ -512,10 +1025,35 @@ class AnomalyLikelihoodHelper(object):
           metricID=metricObj.uid,
           statsSampleCache=statsSampleCache,
           consumedSamples=consumedSamples,
-          defaultAnomalyParams=anomalyParams)
+          defaultAnomalyParams=anomalyParams,
+          rawScoreWindow=rawScoreWindow)
 
 
       startRowIndex += len(consumedSamples)
     # <--- while
 
+    # Bring the model's raw score window up to date with the batch for use in
+    # subsequent anomaly params refreshes
+    if rawScoreWindow is None and statsSampleCache is not None:
+      # Seed the window from the metric_data tail loaded for this batch
+      rawScoreWindow = _RawScoreWindow(capacity=self._statisticsSampleSize)
+      rawScoreWindow.extend(
+        [sample for sample in statsSampleCache
+         if sample.rowid < metricDataRows[0].rowid],
+        nextRowID=metricDataRows[0].rowid)
+
+    if rawScoreWindow is not None:
+      rawScoreWindow.extend(metricDataRows,
+                            nextRowID=metricDataRows[-1].rowid + 1)
+      self._rawScoreWindows.checkIn(metricObj.uid, rawScoreWindow)
+
+    if anomalyParams and incrementalStats is None:
+      if self._incrementalStatistics and rawScoreWindow is not None:
+        # Switch to incremental refreshes from the next batch on
+        self._initIncrementalStatistics(anomalyParams=anomalyParams,
+                                        rawScoreWindow=rawScoreWindow)
+      else:
+        # Any incremental statistics are out of date now
+        anomalyParams.pop("incremental_statistics", None)
+
     return anomalyParams
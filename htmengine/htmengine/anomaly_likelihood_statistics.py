@@ -0,0 +1,348 @@
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2015, Numenta, Inc.  Unless you have purchased from
+# Numenta, Inc. a separate commercial license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+"""
+Incremental estimation of the anomaly likelihood distribution.
+
+nupic.algorithms.anomaly_likelihood.estimateAnomalyLikelihoods estimates a
+normal distribution from the moving averages of the raw anomaly scores of a
+window of samples, ignoring the window's first skipRecords samples, and falls
+back on a null distribution for windows with too few samples or a flat metric.
+IncrementalLikelihoodStatistics maintains the same estimate over a sliding
+window of samples in constant time per sample by adding the moments of the
+entering sample and removing those of the sample that leaves the estimated
+region of the window.
+"""
+
+import math
+
+import numpy
+
+
+
+# Parameters of the distribution returned by estimateAnomalyLikelihoods when
+# the samples don't permit estimation
+NULL_DISTRIBUTION = {
+  "name": "normal",
+  "mean": 0.5,
+  "variance": 1e6,
+  "stdev": 1e3,
+}
+
+# Lower bounds that estimateAnomalyLikelihoods applies to the estimated
+# distribution of averaged anomaly scores
+MIN_DISTRIBUTION_MEAN = 0.03
+MIN_DISTRIBUTION_VARIANCE = 0.0003
+
+# Metrics whose values have a smaller variance in the estimated region are
+# considered flat by estimateAnomalyLikelihoods and get the null distribution
+FLAT_METRIC_MAX_VARIANCE = 1.5e-5
+
+# The sum of squared deviations of moments that have shrunk below this fraction
+# of the largest value that it had since the moments were last computed from
+# scratch is dominated by accumulated rounding errors
+_MIN_RELIABLE_M2_FRACTION = 1e-6
+
+
+
+def computeMovingAverages(rawScores, windowSize):
+  """ Compute moving averages of raw anomaly scores the way that
+  estimateAnomalyLikelihoods does: the averaging window restarts at the first
+  sample, so the first windowSize-1 averages are over fewer samples.
+
+  :param rawScores: sequence of raw anomaly scores in processed order
+  :param windowSize: size of the averaging window
+
+  :returns: numpy array of averaged anomaly scores
+  """
+  rawScores = numpy.asarray(rawScores, dtype=numpy.float64)
+  sums = numpy.concatenate(([0.0], numpy.cumsum(rawScores)))
+  ends = numpy.arange(1, len(rawScores) + 1)
+  starts = numpy.maximum(0, ends - windowSize)
+  return (sums[ends] - sums[starts]) / (ends - starts)
+
+
+
+class _RollingMoments(object):
+  """ Count, mean and sum of squared deviations from the mean of a set of
+  samples that supports adding and removing samples (Welford's method).
+  """
+
+  __slots__ = ("count", "mean", "m2", "peakM2")
+
+
+  def __init__(self, count=0, mean=0.0, m2=0.0, peakM2=0.0):
+    self.count = count
+    self.mean = mean
+    self.m2 = m2
+
+    # The largest m2 since the moments were computed from scratch; bounds the
+    # accumulated rounding error of m2
+    self.peakM2 = peakM2
+
+
+  def __repr__(self):
+    return "%s<count=%s, mean=%s, m2=%s, peakM2=%s>" % (
+      self.__class__.__name__, self.count, self.mean, self.m2, self.peakM2)
+
+
+  @classmethod
+  def fromSamples(cls, samples):
+    """ Compute the moments of the given samples from scratch
+
+    :param samples: numpy array of samples
+    """
+    if not len(samples):
+      return cls()
+
+    mean = float(numpy.mean(samples))
+    m2 = float(numpy.sum(numpy.square(samples - mean)))
+    return cls(count=len(samples), mean=mean, m2=m2, peakM2=m2)
+
+
+  @classmethod
+  def fromDict(cls, state):
+    return cls(count=state["count"], mean=state["mean"], m2=state["m2"],
+               peakM2=state["peak_m2"])
+
+
+  def toDict(self):
+    return {"count": self.count, "mean": self.mean, "m2": self.m2,
+            "peak_m2": self.peakM2}
+
+
+  @property
+  def variance(self):
+    """ Population variance of the samples """
+    return self.m2 / self.count if self.count else 0.0
+
+
+  @property
+  def isReliable(self):
+    """ False if rounding errors accumulated by adding and removing samples
+    may be significant relative to m2
+    """
+    return self.m2 >= self.peakM2 * _MIN_RELIABLE_M2_FRACTION
+
+
+  def add(self, sample):
+    self.count += 1
+    delta = sample - self.mean
+    self.mean += delta / self.count
+    self.m2 += delta * (sample - self.mean)
+    self.peakM2 = max(self.peakM2, self.m2)
+
+
+  def remove(self, sample):
+    if self.count == 1:
+      self.count, self.mean, self.m2 = 0, 0.0, 0.0
+      return
+
+    self.count -= 1
+    delta = sample - self.mean
+    self.mean -= delta / self.count
+    self.m2 = max(0.0, self.m2 - delta * (sample - self.mean))
+
+
+
+class IncrementalLikelihoodStatistics(object):
+  """ Sliding-window estimate of the anomaly likelihood distribution that
+  matches estimateAnomalyLikelihoods over the window's samples.
+
+  The window holds up to `capacity` samples. The estimate covers the moving
+  averages of raw anomaly scores and the metric values of the samples past the
+  window's first skipRecords samples. Once the window is full, appending a
+  sample evicts the window's oldest sample, and the sample that was at
+  position skipRecords leaves the estimated region; the caller supplies its
+  averaged score and metric value, since only the moments are retained.
+
+  Since averages at positions of at least windowSize-1 span full averaging
+  windows, the averaged scores in the estimated region don't depend on where
+  the window starts as long as skipRecords >= windowSize-1.
+
+  The state is JSON-serializable via toDict()/fromDict().
+  """
+
+  def __init__(self, capacity, skipRecords, windowSize, numSamples=0,
+               scoreMoments=None, valueMoments=None, historicalAverages=None,
+               numUpdates=0, nextRowID=None):
+    """
+    :param capacity: max number of samples in the window
+    :param skipRecords: number of samples at the start of the window that are
+      excluded from the estimate
+    :param windowSize: size of the raw anomaly score averaging window
+    :param numSamples: number of samples in the window
+    :param scoreMoments: _RollingMoments of the averaged anomaly scores in the
+      estimated region
+    :param valueMoments: _RollingMoments of the metric values in the estimated
+      region
+    :param historicalAverages: the averaged anomaly scores of the window's last
+      windowSize samples
+    :param numUpdates: number of samples appended since the moments were last
+      computed from scratch
+    :param nextRowID: the rowid that is expected to follow the window's last
+      sample; maintained by the caller
+    """
+    if skipRecords < windowSize - 1:
+      raise ValueError("skipRecords=%s must be at least windowSize-1=%s" % (
+        skipRecords, windowSize - 1))
+
+    self.capacity = capacity
+    self.skipRecords = skipRecords
+    self.windowSize = windowSize
+    self.numSamples = numSamples
+    self.scoreMoments = scoreMoments or _RollingMoments()
+    self.valueMoments = valueMoments or _RollingMoments()
+    self.historicalAverages = list(historicalAverages or ())
+    self.numUpdates = numUpdates
+    self.nextRowID = nextRowID
+
+
+  def __repr__(self):
+    return ("%s<numSamples=%s, capacity=%s, skipRecords=%s, windowSize=%s, "
+            "scoreMoments=%r, valueMoments=%r, numUpdates=%s, "
+            "nextRowID=%s>") % (
+              self.__class__.__name__, self.numSamples, self.capacity,
+              self.skipRecords, self.windowSize, self.scoreMoments,
+              self.valueMoments, self.numUpdates, self.nextRowID)
+
+
+  @classmethod
+  def fromSamples(cls, rawScores, metricValues, capacity, skipRecords,
+                  windowSize, nextRowID=None):
+    """ Compute the statistics of a window of samples from scratch
+
+    :param rawScores: numpy array of the window's raw anomaly scores in
+      processed order
+    :param metricValues: numpy array of the window's metric values
+    :param capacity: max number of samples in the window; the trailing
+      `capacity` samples are used
+    :param skipRecords: see __init__
+    :param windowSize: see __init__
+    :param nextRowID: see __init__
+    """
+    rawScores = rawScores[-capacity:]
+    metricValues = metricValues[-capacity:]
+
+    averagedScores = computeMovingAverages(rawScores, windowSize)
+
+    return cls(
+      capacity=capacity,
+      skipRecords=skipRecords,
+      windowSize=windowSize,
+      numSamples=len(rawScores),
+      scoreMoments=_RollingMoments.fromSamples(averagedScores[skipRecords:]),
+      valueMoments=_RollingMoments.fromSamples(
+        numpy.asarray(metricValues[skipRecords:], dtype=numpy.float64)),
+      historicalAverages=averagedScores[-windowSize:].tolist(),
+      nextRowID=nextRowID)
+
+
+  @classmethod
+  def fromDict(cls, state):
+    return cls(capacity=state["capacity"],
+               skipRecords=state["skip_records"],
+               windowSize=state["window_size"],
+               numSamples=state["num_samples"],
+               scoreMoments=_RollingMoments.fromDict(state["score_moments"]),
+               valueMoments=_RollingMoments.fromDict(state["value_moments"]),
+               historicalAverages=state["historical_averages"],
+               numUpdates=state["num_updates"],
+               nextRowID=state["next_rowid"])
+
+
+  def toDict(self):
+    return {"capacity": self.capacity,
+            "skip_records": self.skipRecords,
+            "window_size": self.windowSize,
+            "num_samples": self.numSamples,
+            "score_moments": self.scoreMoments.toDict(),
+            "value_moments": self.valueMoments.toDict(),
+            "historical_averages": self.historicalAverages,
+            "num_updates": self.numUpdates,
+            "next_rowid": self.nextRowID}
+
+
+  @property
+  def isFull(self):
+    return self.numSamples >= self.capacity
+
+
+  @property
+  def needsResync(self):
+    """ True if the moments should be recomputed from scratch to bound the
+    accumulation of rounding errors; that's the case after a full window's
+    worth of updates or when the variance has shrunk by orders of magnitude
+    """
+    return (self.numUpdates >= self.capacity or
+            not self.scoreMoments.isReliable or
+            not self.valueMoments.isReliable)
+
+
+  def append(self, averagedScore, metricValue, evictedAveragedScore=None,
+             evictedMetricValue=None):
+    """ Append a sample to the window
+
+    :param averagedScore: the new sample's moving average of raw anomaly
+      scores
+    :param metricValue: the new sample's metric value
+    :param evictedAveragedScore: if the window is full, the averaged anomaly
+      score of the sample at position skipRecords, which leaves the estimated
+      region
+    :param evictedMetricValue: if the window is full, the metric value of the
+      sample at position skipRecords
+    """
+    if self.isFull:
+      assert evictedAveragedScore is not None, self
+      self.scoreMoments.remove(evictedAveragedScore)
+      self.valueMoments.remove(evictedMetricValue)
+    else:
+      self.numSamples += 1
+
+    if self.numSamples > self.skipRecords:
+      self.scoreMoments.add(averagedScore)
+      self.valueMoments.add(metricValue)
+
+    self.historicalAverages.append(averagedScore)
+    del self.historicalAverages[:-self.windowSize]
+
+    self.numUpdates += 1
+
+
+  def getDistribution(self):
+    """ :returns: the distribution parameters dict that
+    estimateAnomalyLikelihoods would produce for the window's samples
+    """
+    if self.numSamples <= self.skipRecords:
+      return dict(NULL_DISTRIBUTION)
+
+    if self.valueMoments.variance < FLAT_METRIC_MAX_VARIANCE:
+      return dict(NULL_DISTRIBUTION)
+
+    mean = max(self.scoreMoments.mean, MIN_DISTRIBUTION_MEAN)
+    variance = max(self.scoreMoments.variance, MIN_DISTRIBUTION_VARIANCE)
+
+    return {
+      "name": "normal",
+      "mean": mean,
+      "variance": variance,
+      "stdev": math.sqrt(variance),
+    }
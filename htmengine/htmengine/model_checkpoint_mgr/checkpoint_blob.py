@@ -0,0 +1,257 @@
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2015, Numenta, Inc.  Unless you have purchased from
+# Numenta, Inc. a separate commercial license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+"""
+Single-file checkpoint blob encoding used by ModelCheckpointMgr's "blob"
+checkpoint format.
+
+Blob layout (all integers are big-endian):
+
+  header:     8-byte magic, uint32 format version
+  attributes: uint32 length, JSON-encoded checkpoint attributes
+  model:      uint32 length, zlib-compressed model instance archive
+
+The model instance archive is a flat sequence of entries, one per file or
+directory in the tree that an OPF model's save() method produces:
+
+  entry:      1-byte entry type ("d" or "f"), uint16 path length,
+              uint32 data length, relative path (utf-8), file data
+
+The checkpoint attributes are kept uncompressed ahead of the model so that
+loadCheckpointAttributes() only needs to read the head of the blob, and so that
+updateCheckpointAttributes() can rewrite the blob reusing the already
+compressed model section verbatim.
+"""
+
+import json
+import os
+import struct
+import zlib
+
+
+
+MAGIC = "HTMCKPT\x00"
+
+FORMAT_VERSION = 1
+
+_HEADER_STRUCT = struct.Struct(">8sI")
+
+_SECTION_LENGTH_STRUCT = struct.Struct(">I")
+
+_ENTRY_HEADER_STRUCT = struct.Struct(">cHI")
+
+_ENTRY_TYPE_DIR = "d"
+
+_ENTRY_TYPE_FILE = "f"
+
+# zlib compression level for the model section; level 1 trades a little
+# compression ratio for much faster checkpointing of large models
+_COMPRESSION_LEVEL = 1
+
+
+
+class CorruptCheckpointBlob(Exception):
+  """ Raised when a checkpoint blob is truncated, has an unexpected magic
+  signature or an unsupported format version
+  """
+  pass
+
+
+
+def packModelInstance(rootPath):
+  """ Archive and compress the directory tree produced by an OPF model's save()
+  method.
+
+  :param rootPath: path of the model instance directory
+
+  :returns: zlib-compressed archive string
+  """
+  entries = []
+  for parentPath, dirNames, fileNames in os.walk(rootPath):
+    dirNames.sort()
+    relParentPath = os.path.relpath(parentPath, rootPath)
+
+    for d in dirNames:
+      relPath = os.path.normpath(os.path.join(relParentPath, d))
+      entries.append(_encodeEntry(_ENTRY_TYPE_DIR, relPath, ""))
+
+    for f in sorted(fileNames):
+      with open(os.path.join(parentPath, f), "rb") as fileObj:
+        data = fileObj.read()
+      relPath = os.path.normpath(os.path.join(relParentPath, f))
+      entries.append(_encodeEntry(_ENTRY_TYPE_FILE, relPath, data))
+
+  return zlib.compress("".join(entries), _COMPRESSION_LEVEL)
+
+
+
+def unpackModelInstance(compressedModel, rootPath):
+  """ Re-create the model instance directory tree from an archive created by
+  packModelInstance()
+
+  :param compressedModel: zlib-compressed archive string or buffer
+  :param rootPath: path of the directory to create; must not exist yet
+
+  :raises CorruptCheckpointBlob: if the archive is malformed
+  """
+  try:
+    archive = zlib.decompress(compressedModel)
+  except zlib.error as e:
+    raise CorruptCheckpointBlob("Model section decompression failed: %r" % (e,))
+
+  os.mkdir(rootPath)
+
+  offset = 0
+  while offset < len(archive):
+    if offset + _ENTRY_HEADER_STRUCT.size > len(archive):
+      raise CorruptCheckpointBlob("Truncated model archive entry header")
+
+    entryType, pathLen, dataLen = _ENTRY_HEADER_STRUCT.unpack_from(archive,
+                                                                   offset)
+    offset += _ENTRY_HEADER_STRUCT.size
+
+    if offset + pathLen + dataLen > len(archive):
+      raise CorruptCheckpointBlob("Truncated model archive entry")
+
+    relPath = archive[offset:offset + pathLen].decode("utf-8")
+    offset += pathLen
+
+    path = os.path.join(rootPath, relPath)
+    if entryType == _ENTRY_TYPE_DIR:
+      os.mkdir(path)
+    elif entryType == _ENTRY_TYPE_FILE:
+      with open(path, "wb") as fileObj:
+        fileObj.write(buffer(archive, offset, dataLen))
+    else:
+      raise CorruptCheckpointBlob("Unexpected model archive entry type=%r" %
+                                  (entryType,))
+
+    offset += dataLen
+
+
+
+def encodeBlob(attributes, compressedModel):
+  """ Assemble a checkpoint blob
+
+  :param attributes: JSONifiable checkpoint attributes
+  :param compressedModel: result of packModelInstance() or the model section
+    buffer returned by decodeBlob()
+
+  :returns: the checkpoint blob string
+  """
+  encodedAttributes = json.dumps(attributes)
+  compressedModel = str(compressedModel)
+  return "".join((
+    _HEADER_STRUCT.pack(MAGIC, FORMAT_VERSION),
+    _SECTION_LENGTH_STRUCT.pack(len(encodedAttributes)),
+    encodedAttributes,
+    _SECTION_LENGTH_STRUCT.pack(len(compressedModel)),
+    compressedModel))
+
+
+
+def decodeBlob(blob):
+  """ Split a checkpoint blob into its sections without copying the model
+  section
+
+  :param blob: the checkpoint blob string
+
+  :returns: a two-tuple (attributes, compressedModel), where compressedModel is
+    a buffer over the model section of the blob
+
+  :raises CorruptCheckpointBlob: if the blob is malformed
+  """
+  offset = _validateHeader(blob)
+
+  attributes, offset = _decodeAttributesSection(blob, offset)
+
+  modelLen, offset = _decodeSectionLength(blob, offset)
+  if offset + modelLen != len(blob):
+    raise CorruptCheckpointBlob("Model section length mismatch: expected=%s, "
+                                "found=%s" % (modelLen, len(blob) - offset))
+
+  return attributes, buffer(blob, offset, modelLen)
+
+
+
+def readAttributes(fileObj):
+  """ Read only the checkpoint attributes from the head of a checkpoint blob
+  file
+
+  :param fileObj: file object positioned at the start of the blob
+
+  :returns: the checkpoint attributes object
+
+  :raises CorruptCheckpointBlob: if the blob is malformed
+  """
+  head = fileObj.read(_HEADER_STRUCT.size + _SECTION_LENGTH_STRUCT.size)
+  offset = _validateHeader(head)
+  attributesLen, offset = _decodeSectionLength(head, offset)
+
+  encodedAttributes = fileObj.read(attributesLen)
+  if len(encodedAttributes) != attributesLen:
+    raise CorruptCheckpointBlob("Truncated attributes section")
+
+  return json.loads(encodedAttributes)
+
+
+
+def _encodeEntry(entryType, relPath, data):
+  encodedPath = relPath.encode("utf-8")
+  return "".join((
+    _ENTRY_HEADER_STRUCT.pack(entryType, len(encodedPath), len(data)),
+    encodedPath,
+    data))
+
+
+
+def _validateHeader(blob):
+  if len(blob) < _HEADER_STRUCT.size:
+    raise CorruptCheckpointBlob("Truncated checkpoint blob header")
+
+  magic, version = _HEADER_STRUCT.unpack_from(blob, 0)
+  if magic != MAGIC:
+    raise CorruptCheckpointBlob("Unexpected checkpoint blob magic=%r" %
+                                (magic,))
+  if version != FORMAT_VERSION:
+    raise CorruptCheckpointBlob("Unsupported checkpoint blob version=%s" %
+                                (version,))
+
+  return _HEADER_STRUCT.size
+
+
+
+def _decodeSectionLength(blob, offset):
+  if offset + _SECTION_LENGTH_STRUCT.size > len(blob):
+    raise CorruptCheckpointBlob("Truncated section length")
+
+  (length,) = _SECTION_LENGTH_STRUCT.unpack_from(blob, offset)
+  return length, offset + _SECTION_LENGTH_STRUCT.size
+
+
+
+def _decodeAttributesSection(blob, offset):
+  attributesLen, offset = _decodeSectionLength(blob, offset)
+  if offset + attributesLen > len(blob):
+    raise CorruptCheckpointBlob("Truncated attributes section")
+
+  attributes = json.loads(blob[offset:offset + attributesLen])
+  return attributes, offset + attributesLen
@@ -34,6 +34,7 @@ import time
 from nupic.frameworks.opf.modelfactory import ModelFactory
 
 from htmengine import htmengine_logging
+from htmengine.model_checkpoint_mgr import checkpoint_blob
 
 from nta.utils import makeDirectoryFromAbsolutePath
 from nta.utils.config import Config
@@ -104,9 +105,30 @@ class ModelCheckpointMgr(object):
           TemporalAnomaly-network.nta/
             R0-pkl
             . . .
+
+  When the "blob" checkpoint format is configured (see checkpoint_format in
+  model-checkpoint.conf), the checkpoint store directory and its link are
+  replaced by a single file containing the checkpoint attributes and the
+  compressed model instance tree (see checkpoint_blob for the encoding):
+
+  1ebd2d27dfd74cd98f96220721b9a257
+    definition.data
+    version.txt
+    checkpoint.blob
+
+  A blob checkpoint is saved with a single file fsync and an atomic rename
+  instead of the recursive fsync of the checkpoint store tree, and is loaded
+  with a single read. Either layout is loaded regardless of the configured
+  format, and the next save() converts the model entry to the configured one.
   """
 
 
+  # Checkpoint formats supported by the "checkpoint_format" option in the
+  # "storage" section of model-checkpoint.conf
+  CHECKPOINT_FORMAT_DIRECTORY = "directory"
+  CHECKPOINT_FORMAT_BLOB = "blob"
+
+
   # Current model entry version
   _MODEL_ENTRY_VERSION = "2.0"
 
@@ -141,6 +163,11 @@ class ModelCheckpointMgr(object):
   # actual model checkpoint store directory
   _CHECKPOINT_INSTANCE_DIR_NAME = "model_instance"
 
+  # Single-file checkpoint containing both the checkpoint attributes and the
+  # compressed model instance; located at top level of each model's archive
+  # when the "blob" checkpoint format is in use
+  _CHECKPOINT_BLOB_FILE_NAME = "checkpoint.blob"
+
 
   def __init__(self):
     self._logger = _getLogger()
@@ -148,7 +175,10 @@ class ModelCheckpointMgr(object):
     # Get the directory in which to save/load checkpoints
     self._storageRoot = self._getStorageRoot()
 
-    self._logger.debug("Using storage root=%s", self._storageRoot)
+    self._checkpointFormat = self._getCheckpointFormat()
+
+    self._logger.debug("Using storage root=%s; checkpointFormat=%s",
+                       self._storageRoot, self._checkpointFormat)
 
     if not os.path.exists(self._storageRoot):
       makeDirectoryFromAbsolutePath(self._storageRoot)
@@ -170,6 +200,21 @@ class ModelCheckpointMgr(object):
     return os.path.realpath(storageRoot)
 
 
+  @classmethod
+  def _getCheckpointFormat(cls):
+    config = ModelCheckpointConfig()
+    if not config.has_option("storage", "checkpoint_format"):
+      return cls.CHECKPOINT_FORMAT_DIRECTORY
+
+    checkpointFormat = config.get("storage", "checkpoint_format")
+    if checkpointFormat not in (cls.CHECKPOINT_FORMAT_DIRECTORY,
+                                cls.CHECKPOINT_FORMAT_BLOB):
+      raise ValueError("Unsupported model checkpoint format: %r" %
+                       (checkpointFormat,))
+
+    return checkpointFormat
+
+
   def _getModelDir(self, modelID, mustExist):
     """ Get the directory path of the model entry
 
@@ -210,6 +255,47 @@ class ModelCheckpointMgr(object):
     return checkpointStoreDirPath
 
 
+  def _getCurrentCheckpointBlobPath(self, modelID):
+    """ Get the path of the model's existing checkpoint blob
+
+    :returns: path of the checkpoint blob file or None if the model's entry
+      doesn't have a blob checkpoint
+
+    :raises: ModelNotFound if this model's entry doesn't exist in the
+      checkpoint archive
+    """
+    blobPath = os.path.join(self._getModelDir(modelID, mustExist=True),
+                            self._CHECKPOINT_BLOB_FILE_NAME)
+    return blobPath if os.path.exists(blobPath) else None
+
+
+  def _isBlobCheckpoint(self, modelID):
+    """ Determine the layout of the model's current checkpoint. When both
+    layouts are present (save() was interrupted while converting the model entry
+    from one format to the other), the configured format wins, since that's the
+    one that was written last.
+
+    :returns: True if the current checkpoint is a blob, False if it's a
+      checkpoint store directory
+
+    :raises: ModelNotFound if the model checkpoint hasn't been saved yet or if
+      this model's entry doesn't exist in the checkpoint archive
+    """
+    hasBlob = self._getCurrentCheckpointBlobPath(modelID) is not None
+
+    if hasBlob and self._checkpointFormat == self.CHECKPOINT_FORMAT_BLOB:
+      return True
+
+    try:
+      self._getCurrentCheckpointRealPath(modelID)
+    except ModelNotFound:
+      if hasBlob:
+        return True
+      raise
+
+    return False
+
+
   @classmethod
   def _fsyncReliably(cls, fd):
     """ perform fsync operation on the given file descriptor, retrying on EINTR
@@ -363,6 +449,16 @@ class ModelCheckpointMgr(object):
     :raises: ModelNotFound if model's entry doesn't exit in the checkpoint
       archive
     """
+    if self._checkpointFormat == self.CHECKPOINT_FORMAT_BLOB:
+      self._saveBlob(modelID, model, attributes)
+    else:
+      self._saveDirectory(modelID, model, attributes)
+
+
+  def _saveDirectory(self, modelID, model, attributes):
+    """ Checkpoint a model instance as a checkpoint store directory; see
+    save() for parameters
+    """
     startTime = time.time()
 
     modelEntryDirPath = self._getModelDir(modelID, mustExist=True)
@@ -432,9 +528,14 @@ class ModelCheckpointMgr(object):
       # old one.
       self._fsyncDirectoryOnly(modelEntryDirPath)
 
-      # Lastly, remove the old checkpoint store dir
+      # Lastly, remove the old checkpoint store dir and the blob checkpoint
+      # left over from a prior "blob" format configuration, if any
       if oldCheckpointStoreDirPath is not None:
         shutil.rmtree(oldCheckpointStoreDirPath)
+
+      oldBlobPath = self._getCurrentCheckpointBlobPath(modelID)
+      if oldBlobPath is not None:
+        os.unlink(oldBlobPath)
     finally:
       # Clean up
       shutil.rmtree(tempRoot)
@@ -444,6 +545,89 @@ class ModelCheckpointMgr(object):
       modelID, time.time() - startTime, newCheckpointStoreDirPath)
 
 
+  def _saveBlob(self, modelID, model, attributes):
+    """ Checkpoint a model instance as a single checkpoint blob file; see
+    save() for parameters
+    """
+    startTime = time.time()
+
+    modelEntryDirPath = self._getModelDir(modelID, mustExist=True)
+
+    # Let the model save itself in a temp directory and pack the resulting tree
+    # into the blob. NOTE: the temp tree is discarded after packing, so there
+    # is no need to fsync it.
+    tempRoot = tempfile.mkdtemp(prefix=modelID, dir=self._scratchDir)
+    try:
+      tempModelInstanceDirPath = os.path.join(
+        tempRoot,
+        self._CHECKPOINT_INSTANCE_DIR_NAME)
+
+      model.save(saveModelDir=tempModelInstanceDirPath)
+
+      blob = checkpoint_blob.encodeBlob(
+        attributes,
+        checkpoint_blob.packModelInstance(tempModelInstanceDirPath))
+    finally:
+      # Clean up
+      shutil.rmtree(tempRoot)
+
+    blobPath = os.path.join(modelEntryDirPath, self._CHECKPOINT_BLOB_FILE_NAME)
+
+    # Capture the old checkpoint store left over from a prior "directory"
+    # format configuration, if any, so we can delete it after the blob is in
+    # place
+    currentStoreSymlinkPath = os.path.join(modelEntryDirPath,
+                                           self._CHECKPOINT_LINK_NAME)
+    if os.path.lexists(currentStoreSymlinkPath):
+      oldCheckpointStoreDirPath = os.path.realpath(currentStoreSymlinkPath)
+    else:
+      oldCheckpointStoreDirPath = None
+
+    self._writeBlobAtomically(modelID, blobPath, blob)
+
+    if oldCheckpointStoreDirPath is not None:
+      os.unlink(currentStoreSymlinkPath)
+      if os.path.exists(oldCheckpointStoreDirPath):
+        shutil.rmtree(oldCheckpointStoreDirPath)
+
+    self._logger.info(
+      "{TAG:MCKPT.SAVE} Saved model=%s: duration=%ss; blob=%s; size=%s",
+      modelID, time.time() - startTime, blobPath, len(blob))
+
+
+  def _writeBlobAtomically(self, modelID, blobPath, blob):
+    """ Replace the model's checkpoint blob with a single fsync of the new
+    blob file, an atomic rename, and an fsync of the model entry directory to
+    persist the rename.
+
+    :param modelID: unique model ID hex string
+    :param blobPath: destination path of the blob in the model entry directory
+    :param blob: the checkpoint blob string
+    """
+    (tempFd, tempPath) = tempfile.mkstemp(
+      suffix=self._CHECKPOINT_BLOB_FILE_NAME,
+      prefix=modelID,
+      dir=self._scratchDir,
+      text=False)
+
+    try:
+      with os.fdopen(tempFd, "wb") as fileObj:
+        fileObj.write(blob)
+        # Get the temp file in consistent state
+        fileObj.flush()
+        self._fsyncReliably(tempFd)
+
+      # Atomically move the temp file into the model entry
+      os.rename(tempPath, blobPath)
+    except Exception:
+      if os.path.exists(tempPath):
+        os.unlink(tempPath)
+      raise
+
+    # Get model entry directory into consistent state
+    self._fsyncDirectoryOnly(os.path.dirname(blobPath))
+
+
   def load(self, modelID):
     """ Retrieve a model instance from checkpoint.
 
@@ -455,6 +639,9 @@ class ModelCheckpointMgr(object):
       ModelNotFound if the model checkpoint hasn't been saved yet or if this
         model's entry doesn't exist in the checkpoint archive
     """
+    if self._isBlobCheckpoint(modelID):
+      return self._loadBlob(modelID)
+
     startTime = time.time()
 
     checkpointStoreDirPath = self._getCurrentCheckpointRealPath(modelID)
@@ -471,6 +658,41 @@ class ModelCheckpointMgr(object):
     return model
 
 
+  def _loadBlob(self, modelID):
+    """ Retrieve a model instance from the model's checkpoint blob; see load()
+    """
+    startTime = time.time()
+
+    blobPath = self._getCurrentCheckpointBlobPath(modelID)
+
+    with open(blobPath, "rb") as fileObj:
+      blob = fileObj.read()
+
+    _attributes, compressedModel = checkpoint_blob.decodeBlob(blob)
+
+    # OPF can only load a model from a directory, so unpack the model instance
+    # tree into a transient scratch directory
+    tempRoot = tempfile.mkdtemp(prefix=modelID, dir=self._scratchDir)
+    try:
+      tempModelInstanceDirPath = os.path.join(
+        tempRoot,
+        self._CHECKPOINT_INSTANCE_DIR_NAME)
+
+      checkpoint_blob.unpackModelInstance(compressedModel,
+                                          tempModelInstanceDirPath)
+
+      model = ModelFactory.loadFromCheckpoint(tempModelInstanceDirPath)
+    finally:
+      # Clean up
+      shutil.rmtree(tempRoot)
+
+    self._logger.info(
+      "{TAG:MCKPT.LOAD} Loaded model=%s: duration=%ss; blob=%s; size=%s",
+      modelID, time.time() - startTime, blobPath, len(blob))
+
+    return model
+
+
   def updateCheckpointAttributes(self, modelID, attributes):
     """ Update model checkpoint attributes
 
@@ -483,6 +705,19 @@ class ModelCheckpointMgr(object):
     :raises: ModelNotFound if the model checkpoint hasn't been saved yet or if
       this model's entry doesn't exist in the checkpoint archive
     """
+    if self._isBlobCheckpoint(modelID):
+      # Rewrite the blob, reusing its already-compressed model section
+      blobPath = self._getCurrentCheckpointBlobPath(modelID)
+      with open(blobPath, "rb") as fileObj:
+        _oldAttributes, compressedModel = checkpoint_blob.decodeBlob(
+          fileObj.read())
+
+      self._writeBlobAtomically(
+        modelID,
+        blobPath,
+        checkpoint_blob.encodeBlob(attributes, compressedModel))
+      return
+
     checkpointDirPath = self._getCurrentCheckpointRealPath(modelID)
 
     attributesFilePath = os.path.join(checkpointDirPath,
@@ -522,6 +757,10 @@ class ModelCheckpointMgr(object):
     :raises: ModelNotFound if the model checkpoint hasn't been saved yet or if
       this model's entry doesn't exist in the checkpoint archive
     """
+    if self._isBlobCheckpoint(modelID):
+      with open(self._getCurrentCheckpointBlobPath(modelID), "rb") as fileObj:
+        return checkpoint_blob.readAttributes(fileObj)
+
     attributesFilePath = os.path.join(
       self._getCurrentCheckpointRealPath(modelID),
       self._CHECKPOINT_ATTRIBUTES_FILE_NAME)
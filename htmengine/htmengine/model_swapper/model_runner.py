@@ -26,15 +26,18 @@ processes are started by the Model Scheduler service.
 """
 
 import base64
+from collections import OrderedDict
 import cPickle as pickle
 from datetime import datetime
 import logging
 from optparse import OptionParser
+import os
 import select
 import sys
 import time
 import traceback
 
+import psutil
 
 from nupic.data.fieldmeta import FieldMetaInfo
 from nupic.data.record_stream import RecordStreamIface
@@ -50,6 +53,7 @@ from htmengine.model_swapper import ModelSwapperConfig
 from htmengine.model_swapper.model_swapper_interface import (
     ModelCommand, ModelCommandResult,
     ModelInferenceResult, ModelInputRow, ModelSwapperInterface)
+from htmengine.model_swapper.slot_agent import ModelRunnerHostProxy
 
 from nta.utils.logging_support_raw import LoggingSupport
 
@@ -90,17 +94,38 @@ class ModelRunner(object):
   _MAX_TRACEBACK_TAIL = 400
 
 
-  def __init__(self, modelID):
+  def __init__(self, modelID, swapperAPI=None, modelCache=None,
+               preemptionCheck=None):
     """
     :param modelID: model ID; string
+    :param swapperAPI: ModelSwapperInterface instance to share with other
+      ModelRunner instances (hosted mode); if None, ModelRunner creates its own
+      and closes it in close()
+    :param modelCache: optional _ModelCache instance (hosted mode); if not
+      None, the model is checked out of the cache on construction and checked
+      back in after a successful run, so that a model that's still resident
+      doesn't need to be reloaded from its checkpoint
+    :param preemptionCheck: optional callable that returns True when
+      SwapController wants to preempt us; defaults to detecting closing of the
+      other end of our stdin
     """
     self._logger = _getLogger()
 
     self._modelID = modelID
 
-    self._swapperAPI = ModelSwapperInterface()
+    self._ownSwapperAPI = swapperAPI is None
+    self._swapperAPI = (ModelSwapperInterface() if swapperAPI is None
+                        else swapperAPI)
+
+    self._modelCache = modelCache
+
+    self._preemptionCheck = (self._isStdinReadReady if preemptionCheck is None
+                             else preemptionCheck)
 
-    self._archiver = _ModelArchiver(self._modelID)
+    if self._modelCache is not None:
+      self._archiver = self._modelCache.checkOut(self._modelID)
+    else:
+      self._archiver = _ModelArchiver(self._modelID)
 
     # "deleteModel" command handler sets this flag to force our processing
     # loop to terminate
@@ -166,7 +191,16 @@ class ModelRunner(object):
   def close(self):
     """ Clean up """
     self._logger.debug("%r: Closing...", self)
-    self._swapperAPI.close()
+    if self._ownSwapperAPI:
+      self._swapperAPI.close()
+
+
+  @staticmethod
+  def _isStdinReadReady():
+    """ Default preemption check: SwapController closes the other end of our
+    stdin to signal the intention to preempt us
+    """
+    return bool(select.select((sys.stdin,), (), (), 0)[0])
 
 
   @logExceptions(_getLogger)
@@ -306,13 +340,15 @@ class ModelRunner(object):
             lastRequestBatch.ack(multiple=True)
 
           if not self._done:
-            # Check if SwapController wants to preempt us (it closes the other
-            # end of our stdin to signal the intention)
-            readReadyList = select.select((sys.stdin,), (), (), 0)[0]
-            if readReadyList:
+            # Check if SwapController wants to preempt us
+            if self._preemptionCheck():
               self._logger.debug("%r: SwapController wants to preempt us, "
                                 "leaving", self)
               self._done = True
+
+      if self._modelCache is not None:
+        # Keep the model resident for the next time it's scheduled
+        self._modelCache.checkIn(self._archiver)
     finally:
       if totalBatches == 0:
         self._logger.warn("%r: zero input batches were processed", self)
@@ -582,6 +618,11 @@ class _ModelArchiver(object):
     self._inputSamplesSinceLastFullCheckpointCache = None
 
 
+  @property
+  def modelID(self):
+    return self._modelID
+
+
   @property
   def model(self):
     """ An OPF Model object or None if not loaded yet """
@@ -771,6 +812,306 @@ class _ModelArchiver(object):
                                                        attributes)
 
 
+  def isCheckpointCurrent(self):
+    """ Check whether the model's current checkpoint is still the one that this
+    archiver saved last (or loaded from). A model that stays resident in
+    _ModelCache becomes stale if it's subsequently run and checkpointed in a
+    different ModelRunner, or if it's deleted.
+
+    :returns: True if the loaded model is still in sync with its checkpoint
+    """
+    if self._model is None or not self._hasCheckpoint:
+      return False
+
+    try:
+      checkpointAttributes = self._checkpointMgr.loadCheckpointAttributes(
+        self._modelID)
+    except model_checkpoint_mgr.ModelNotFound:
+      return False
+
+    if (set(checkpointAttributes[self._BATCH_IDS_CHECKPOINT_ATTR_NAME]) !=
+        self.modelCheckpointBatchIDSet):
+      return False
+
+    inputSamples = checkpointAttributes.get(
+      self._INPUT_SAMPLES_SINCE_CHECKPOINT_ATTR_NAME)
+    numInputSamples = (len(self._decodeDataSamples(inputSamples))
+                       if inputSamples else 0)
+
+    return numInputSamples == len(self._inputSamplesSinceLastFullCheckpoint)
+
+
+
+class _ModelCache(object):
+  """ LRU cache of loaded models (_ModelArchiver instances, which hold the OPF
+  model and its _InputRowEncoder) for ModelRunnerHost. Bounded by a memory
+  budget: each model's footprint is estimated from the growth of the process's
+  resident set size between checking it out and checking it in the first
+  time.
+
+  A model is checked out of the cache for the duration of its run and checked
+  back in as the most recently used entry afterwards; a cached model that's no
+  longer in sync with its checkpoint is discarded on checkout.
+  """
+
+  def __init__(self, memoryBudgetBytes):
+    """
+    :param memoryBudgetBytes: upper bound of the estimated combined footprint
+      of cached models
+    """
+    self._logger = _getLogger()
+
+    self._memoryBudgetBytes = memoryBudgetBytes
+
+    self._process = psutil.Process(os.getpid())
+
+    # modelID -> (_ModelArchiver, estimated footprint in bytes), in LRU order
+    self._entries = OrderedDict()
+
+    self._totalSizeBytes = 0
+
+    # Footprint estimates of the models that are checked out; modelID -> bytes
+    # or None if the model was not resident
+    self._checkedOutSizes = dict()
+
+    # RSS at checkout of models that weren't resident; modelID -> bytes
+    self._checkoutRSS = dict()
+
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+    self.invalidations = 0
+
+
+  def __repr__(self):
+    return ("%s<numModels=%s, totalSizeMB=%.1f, budgetMB=%.1f, hits=%s, "
+            "misses=%s, evictions=%s, invalidations=%s>") % (
+              self.__class__.__name__, len(self._entries),
+              self._totalSizeBytes / 1048576.0,
+              self._memoryBudgetBytes / 1048576.0,
+              self.hits, self.misses, self.evictions, self.invalidations)
+
+
+  def __len__(self):
+    return len(self._entries)
+
+
+  def _getRSS(self):
+    return self._process.get_memory_info().rss
+
+
+  def checkOut(self, modelID):
+    """ Remove the model from the cache for running it
+
+    :param modelID: model ID; string
+
+    :returns: the cached _ModelArchiver instance if the model is resident and
+      still in sync with its checkpoint; otherwise a new _ModelArchiver
+    """
+    entry = self._entries.pop(modelID, None)
+    if entry is not None:
+      archiver, sizeBytes = entry
+      self._totalSizeBytes -= sizeBytes
+
+      if archiver.isCheckpointCurrent():
+        self.hits += 1
+        self._checkedOutSizes[modelID] = sizeBytes
+        return archiver
+
+      self._logger.info("Discarding stale resident model=%s", modelID)
+      self.invalidations += 1
+
+    self.misses += 1
+    self._checkedOutSizes[modelID] = None
+    self._checkoutRSS[modelID] = self._getRSS()
+    return _ModelArchiver(modelID)
+
+
+  def checkIn(self, archiver):
+    """ Return the model to the cache as the most recently used entry after a
+    successful run and evict least recently used models as needed to stay
+    within the memory budget. Archivers without a loaded model (e.g., after the
+    model was deleted) are not cached.
+
+    :param archiver: the _ModelArchiver instance returned by checkOut()
+    """
+    modelID = archiver.modelID
+    sizeBytes = self._checkedOutSizes.pop(modelID, None)
+    checkoutRSS = self._checkoutRSS.pop(modelID, None)
+
+    if archiver.model is None:
+      return
+
+    if sizeBytes is None:
+      sizeBytes = self._getRSS() - checkoutRSS if checkoutRSS else 0
+      if sizeBytes <= 0 and self._entries:
+        # Memory freed by evicted models was reused; fall back on the average
+        # footprint of the resident models
+        sizeBytes = self._totalSizeBytes // len(self._entries)
+      sizeBytes = max(sizeBytes, 0)
+
+    self._entries[modelID] = (archiver, sizeBytes)
+    self._totalSizeBytes += sizeBytes
+
+    while self._entries and self._totalSizeBytes > self._memoryBudgetBytes:
+      evictedModelID, (evictedArchiver, evictedSizeBytes) = (
+        self._entries.popitem(last=False))
+      self._totalSizeBytes -= evictedSizeBytes
+      self.evictions += 1
+
+      # Nothing to save: every run ends with saving the model's checkpoint, so
+      # an evicted model has no unsaved state. Writing a checkpoint here could
+      # also clobber the checkpoint of another ModelRunner that's running the
+      # model concurrently
+      self._logger.debug("Evicting resident model=%s; sizeMB=%.1f",
+                         evictedModelID, evictedSizeBytes / 1048576.0)
+
+
+
+class ModelRunnerHost(object):
+  """ Long-lived process that runs the models assigned to a SlotAgent slot one
+  at a time, keeping recently-run models loaded in a _ModelCache so that a model
+  that's preempted and rescheduled shortly after doesn't pay the cost of
+  process startup and checkpoint deserialization again.
+
+  Controlled by ModelRunnerHostProxy via stdin; see its protocol constants.
+  Exits when its stdin is closed.
+  """
+
+  def __init__(self):
+    self._logger = _getLogger()
+
+    modelSwapperConfig = ModelSwapperConfig()
+    self._modelCache = _ModelCache(
+      memoryBudgetBytes=modelSwapperConfig.getint(
+        "model_runner_host", "model_cache_memory_budget_mb") * 1048576)
+
+    self._swapperAPI = ModelSwapperInterface()
+
+    self._stdinFD = sys.stdin.fileno()
+
+    # Buffer of partial command line read from stdin
+    self._commandBuffer = ""
+
+    # Complete command lines that have been read, but not processed yet
+    self._pendingCommands = []
+
+    # True when stdin reached EOF
+    self._eof = False
+
+    # Model ID of the model currently being run
+    self._currentModelID = None
+
+
+  def __repr__(self):
+    return "%s<currentModel=%s, cache=%r>" % (
+      self.__class__.__name__, self._currentModelID, self._modelCache)
+
+
+  def close(self):
+    self._swapperAPI.close()
+
+
+  def _readCommands(self, blocking):
+    """ Read available commands from stdin into self._pendingCommands
+
+    :param blocking: if True, wait until at least one full command line or EOF
+      is read
+    """
+    while not self._eof:
+      if not blocking and not select.select((self._stdinFD,), (), (), 0)[0]:
+        return
+
+      data = os.read(self._stdinFD, 4096)
+      if not data:
+        self._eof = True
+        return
+
+      lines = (self._commandBuffer + data).split("\n")
+      self._commandBuffer = lines.pop()
+      self._pendingCommands.extend(line for line in lines if line)
+
+      if self._pendingCommands:
+        return
+
+
+  def _isPreemptionRequested(self):
+    """ Preemption check for the ModelRunner of the current model """
+    self._readCommands(blocking=False)
+
+    if self._eof:
+      return True
+
+    for command in self._pendingCommands:
+      method, _, modelID = command.partition(" ")
+      if (method == ModelRunnerHostProxy.STOP_COMMAND and
+          modelID == self._currentModelID):
+        return True
+
+    return False
+
+
+  def _emitDone(self, modelID, exitStatus):
+    sys.stdout.write("%s %s %d\n" % (ModelRunnerHostProxy.DONE_NOTIFICATION,
+                                      modelID, exitStatus))
+    sys.stdout.flush()
+
+
+  def run(self):
+    while True:
+      if not self._pendingCommands:
+        self._readCommands(blocking=True)
+        if not self._pendingCommands:
+          # EOF
+          break
+
+      method, _, modelID = self._pendingCommands.pop(0).partition(" ")
+
+      if method == ModelRunnerHostProxy.STOP_COMMAND:
+        # Stop request for a model that already finished on its own
+        self._logger.debug("%r: Ignoring late stop request for model=%s",
+                           self, modelID)
+        continue
+
+      if method != ModelRunnerHostProxy.RUN_COMMAND:
+        raise ValueError("Unexpected ModelRunnerHost command: %r" % (method,))
+
+      self._logger.info("{TAG:SWAP.MR.HOST.RUN} model=%s", modelID)
+      self._currentModelID = modelID
+      startTime = time.time()
+      try:
+        with ModelRunner(modelID=modelID,
+                         swapperAPI=self._swapperAPI,
+                         modelCache=self._modelCache,
+                         preemptionCheck=self._isPreemptionRequested) as runner:
+          runner.run()
+      except Exception:
+        # The swapper interface or the cached model may be in an inconsistent
+        # state, so report the failure and exit the host process
+        self._logger.exception("%r: ModelRunner failed", self)
+        self._emitDone(modelID, 1)
+        raise
+      finally:
+        self._currentModelID = None
+
+      # Drop the stop request for this model, if any
+      self._pendingCommands = [
+        command for command in self._pendingCommands
+        if command != "%s %s" % (ModelRunnerHostProxy.STOP_COMMAND, modelID)]
+
+      self._logger.info(
+        "{TAG:SWAP.MR.HOST.DONE} model=%s; duration=%.4fs; numResident=%s; "
+        "hits=%s; misses=%s; evictions=%s; invalidations=%s", modelID,
+        time.time() - startTime, len(self._modelCache), self._modelCache.hits,
+        self._modelCache.misses, self._modelCache.evictions,
+        self._modelCache.invalidations)
+
+      self._emitDone(modelID, 0)
+
+      if self._eof:
+        break
+
+
 
 class _InputRowEncoder(RecordStreamIface):
   """ We make use of NuPIC's RecordStreamIface for converting a flat input
@@ -861,10 +1202,25 @@ def main(argv):
   parser.add_option("--modelID", action="store", type="str",
     help="The Model ID string that identifies the model to run.")
 
+  parser.add_option("--hosted", action="store_true", default=False,
+    help="Run as a long-lived ModelRunnerHost that runs models on request "
+         "from its stdin, keeping recently-run models loaded in memory.")
+
   (options, args) = parser.parse_args(argv[1:])
   if len(args) > 0:
     parser.error("Didn't expect any positional args (%r)." % (args,))
 
+  if options.hosted:
+    if options.modelID is not None:
+      parser.error("--modelID is not supported with --hosted")
+
+    host = ModelRunnerHost()
+    try:
+      host.run()
+    finally:
+      host.close()
+    return
+
   if options.modelID is None:
     parser.error("Missing model ID in command-line")
 
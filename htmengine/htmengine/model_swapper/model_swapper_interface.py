@@ -69,7 +69,9 @@ App layer reads results::
 
 from collections import namedtuple
 import datetime
+import itertools
 import json
+import struct
 import time
 import types
 import uuid
@@ -93,6 +95,116 @@ def _getLogger():
 
 
 
+# Columnar batch state layout produced by BatchPackager for homogeneous batches
+# of classes that implement __marshalColumns__ (all integers are little-endian):
+#
+#   header: 4-byte magic, uint8 format version, 3-byte item class
+#           __STATE_SIGNATURE__ (NUL-padded), uint32 item count
+#   body:   item class-specific contiguous columns
+#
+# The magic starts with a NUL byte, which never starts a JSON-encoded batch
+_COLUMNAR_BATCH_MAGIC = "\x00MSB"
+
+_COLUMNAR_BATCH_VERSION = 1
+
+_COLUMNAR_BATCH_HEADER_STRUCT = struct.Struct("<4sB3sI")
+
+# Column type codes of columnar batches; each is also the struct format
+# character of the column's elements except for _COLUMN_TYPE_DATETIME, whose
+# elements are int64 microseconds since the epoch
+_COLUMN_TYPE_INT = "q"
+_COLUMN_TYPE_FLOAT = "d"
+_COLUMN_TYPE_DATETIME = "t"
+
+# Smaller batches are marshalled into JSON, because the columnar encoding's fixed
+# per-batch overhead outweighs its per-item savings for them
+_MIN_COLUMNAR_BATCH_SIZE = 3
+
+_INT64_MIN = -(2 ** 63)
+_INT64_MAX = 2 ** 63 - 1
+
+_NAIVE_EPOCH = datetime.datetime.utcfromtimestamp(0)
+
+
+
+class CorruptBatchState(Exception):
+  """ Raised when a columnar batch state is truncated, or has an unsupported
+  format version or item class signature
+  """
+  pass
+
+
+
+def _getColumnType(column):
+  """ Determine the columnar batch column type of a sequence of values
+
+  :param column: non-empty sequence of values
+
+  :returns: one of the _COLUMN_TYPE_* values or None if the values don't fit
+    any single column type
+  """
+  valueTypes = set(type(value) for value in column)
+
+  if all(issubclass(t, float) for t in valueTypes):
+    return _COLUMN_TYPE_FLOAT
+
+  if valueTypes <= set((int, long)):
+    if _INT64_MIN <= min(column) and max(column) <= _INT64_MAX:
+      return _COLUMN_TYPE_INT
+    return None
+
+  if (valueTypes == set((datetime.datetime,)) and
+      all(value.tzinfo is None for value in column)):
+    return _COLUMN_TYPE_DATETIME
+
+  return None
+
+
+
+def _packColumn(columnType, column):
+  """ Pack a column of values into a contiguous string of fixed-size elements
+
+  :param columnType: one of the _COLUMN_TYPE_* values per _getColumnType()
+  :param column: sequence of values
+  """
+  if columnType == _COLUMN_TYPE_DATETIME:
+    column = [_datetimeToEpochMicroseconds(value) for value in column]
+    columnType = _COLUMN_TYPE_INT
+
+  return struct.pack("<%d%s" % (len(column), columnType), *column)
+
+
+
+def _unpackColumn(columnType, count, batchState, offset):
+  """ Inverse of _packColumn
+
+  :returns: two-tuple (values, offset following the column)
+
+  :raises CorruptBatchState: if batchState is too short
+  """
+  if columnType == _COLUMN_TYPE_DATETIME:
+    values, offset = _unpackColumn(_COLUMN_TYPE_INT, count, batchState, offset)
+    timedelta = datetime.timedelta
+    return ([_NAIVE_EPOCH + timedelta(microseconds=value) for value in values],
+            offset)
+
+  columnStruct = struct.Struct("<%d%s" % (count, columnType))
+  try:
+    values = columnStruct.unpack_from(batchState, offset)
+  except struct.error as e:
+    raise CorruptBatchState("Truncated column of type=%s at offset=%s: %r" %
+                            (columnType, offset, e))
+
+  return values, offset + columnStruct.size
+
+
+
+def _datetimeToEpochMicroseconds(dateTime):
+  delta = dateTime - _NAIVE_EPOCH
+  return (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+
+
+
 class ModelNotFound(engine_exceptions.HTMEngineError):
   """ The requested model was not found (already deleted?) """
   pass
@@ -151,6 +263,89 @@ class _ModelRequestResultBase(object):
     return obj
 
 
+  @classmethod
+  def __marshalColumnarBatch__(cls, batch):
+    """ Marshal a batch of instances of a single class into a columnar batch
+    state if the class supports it. Used by BatchPackager.marshal()
+
+    :param batch: non-empty sequence of request or result instances
+
+    :returns: columnar batch state string; None if the batch's items don't
+      support the columnar encoding
+    """
+    clientCls = batch[0].__class__
+    body = clientCls.__marshalColumns__(batch)
+    if body is None:
+      return None
+
+    return _COLUMNAR_BATCH_HEADER_STRUCT.pack(_COLUMNAR_BATCH_MAGIC,
+                                              _COLUMNAR_BATCH_VERSION,
+                                              clientCls.__STATE_SIGNATURE__,
+                                              len(batch)) + body
+
+
+  @classmethod
+  def __createBatchFromColumnarState__(cls, batchState):
+    """ Construct the client instances from a columnar batch state produced by
+    __marshalColumnarBatch__, dispatching on the item class signature in its
+    header. Used by BatchPackager.unmarshal()
+
+    :returns: sequence of client instances
+
+    :raises CorruptBatchState: if the batch state is malformed
+    """
+    try:
+      magic, version, signature, count = (
+        _COLUMNAR_BATCH_HEADER_STRUCT.unpack_from(batchState, 0))
+    except struct.error as e:
+      raise CorruptBatchState("Truncated columnar batch header: %r" % (e,))
+
+    assert magic == _COLUMNAR_BATCH_MAGIC, repr(magic)
+
+    if version != _COLUMNAR_BATCH_VERSION:
+      raise CorruptBatchState("Unsupported columnar batch version=%s" %
+                              (version,))
+
+    clientCls = cls.__factoryClassMap.get(signature.rstrip("\x00"))
+    if clientCls is None:
+      raise CorruptBatchState("Unexpected columnar batch signature=%r" %
+                              (signature,))
+
+    return clientCls.__unmarshalColumns__(batchState,
+                                          _COLUMNAR_BATCH_HEADER_STRUCT.size,
+                                          count)
+
+
+  @classmethod
+  def __marshalColumns__(cls, batch):  # pylint: disable=W0613
+    """ Encode the body of a columnar batch state; classes that support the
+    columnar encoding override this method and __unmarshalColumns__.
+
+    :param batch: non-empty sequence of instances of the batch's first item's
+      class, possibly intermixed with instances of other classes
+
+    :returns: the encoded columns string; None if the batch is not homogeneous
+      enough for the columnar encoding
+    """
+    return None
+
+
+  @classmethod
+  def __unmarshalColumns__(cls, batchState, offset, count):
+    """ Decode the body of a columnar batch state produced by
+    __marshalColumns__
+
+    :param batchState: the columnar batch state string
+    :param offset: offset of the body in batchState
+    :param count: number of encoded items
+
+    :returns: sequence of decoded instances
+
+    :raises CorruptBatchState: if the body is malformed
+    """
+    raise NotImplementedError()
+
+
   def __getstate__(self):
     """ Return state suitable for serializing; used by BatchPackager. """
     state = [self.__STATE_SIGNATURE__]
@@ -338,6 +533,72 @@ class ModelInputRow(_ModelRequestResultBase):
     self.data = data
 
 
+  @classmethod
+  def __marshalColumns__(cls, batch):
+    """ Encode input rows with integer rowIDs and the same number of fields
+    as columns: rowIDs, followed by one column per field. Each field column
+    holds only floats, only integers or only naive datetimes.
+
+    Columns: uint8 number of fields, one column type code per field, int64
+    rowIDs, then each field column.
+    """
+    numFields = len(batch[0].data)
+    if numFields > 255:
+      return None
+
+    for row in batch:
+      if row.__class__ is not cls or len(row.data) != numFields:
+        return None
+
+    rowIDs = [row.rowID for row in batch]
+    if _getColumnType(rowIDs) != _COLUMN_TYPE_INT:
+      return None
+
+    fieldColumns = zip(*(row.data for row in batch))
+    columnTypes = [_getColumnType(column) for column in fieldColumns]
+    if None in columnTypes:
+      return None
+
+    return "".join(itertools.chain(
+      (chr(numFields), "".join(columnTypes),
+       _packColumn(_COLUMN_TYPE_INT, rowIDs)),
+      (_packColumn(columnType, column)
+       for columnType, column in itertools.izip(columnTypes, fieldColumns))))
+
+
+  @classmethod
+  def __unmarshalColumns__(cls, batchState, offset, count):
+    if offset >= len(batchState):
+      raise CorruptBatchState("Truncated input row field count")
+    numFields = ord(batchState[offset])
+    offset += 1
+
+    columnTypes = batchState[offset:offset + numFields]
+    offset += numFields
+    if len(columnTypes) != numFields:
+      raise CorruptBatchState("Truncated input row column types")
+
+    rowIDs, offset = _unpackColumn(_COLUMN_TYPE_INT, count, batchState, offset)
+
+    fieldColumns = []
+    for columnType in columnTypes:
+      if columnType not in (_COLUMN_TYPE_INT, _COLUMN_TYPE_FLOAT,
+                            _COLUMN_TYPE_DATETIME):
+        raise CorruptBatchState("Unexpected input row column type=%r" %
+                                (columnType,))
+      column, offset = _unpackColumn(columnType, count, batchState, offset)
+      fieldColumns.append(column)
+
+    rows = []
+    for rowID, data in itertools.izip(rowIDs, itertools.izip(*fieldColumns)):
+      row = object.__new__(cls)
+      row.rowID = rowID
+      row.data = list(data)
+      rows.append(row)
+
+    return rows
+
+
   @classmethod
   def _encodeDateTime(cls, dateTime):
     """ Encode a datetime instance for serialization. This encoder is non-lossy.
@@ -417,6 +678,43 @@ class ModelInferenceResult(_ModelRequestResultBase):
        else ", errorMsg=%s" % (self.errorMessage,)))
 
 
+  @classmethod
+  def __marshalColumns__(cls, batch):
+    """ Encode successful inference results with integer rowIDs and float
+    anomaly scores as columns: int64 rowIDs, then float64 anomaly scores.
+    """
+    for result in batch:
+      if result.__class__ is not cls or result.status != 0:
+        return None
+
+    rowIDs = [result.rowID for result in batch]
+    anomalyScores = [result.anomalyScore for result in batch]
+    if (_getColumnType(rowIDs) != _COLUMN_TYPE_INT or
+        _getColumnType(anomalyScores) != _COLUMN_TYPE_FLOAT):
+      return None
+
+    return (_packColumn(_COLUMN_TYPE_INT, rowIDs) +
+            _packColumn(_COLUMN_TYPE_FLOAT, anomalyScores))
+
+
+  @classmethod
+  def __unmarshalColumns__(cls, batchState, offset, count):
+    rowIDs, offset = _unpackColumn(_COLUMN_TYPE_INT, count, batchState, offset)
+    anomalyScores, offset = _unpackColumn(_COLUMN_TYPE_FLOAT, count,
+                                          batchState, offset)
+
+    results = []
+    for rowID, anomalyScore in itertools.izip(rowIDs, anomalyScores):
+      result = object.__new__(cls)
+      result.rowID = rowID
+      result.status = 0
+      result.anomalyScore = anomalyScore
+      result.errorMessage = None
+      results.append(result)
+
+    return results
+
+
 
 class BatchPackager(object):
   """ Serializer for a batch of request or result items """
@@ -427,9 +725,13 @@ class BatchPackager(object):
     """ Marshal a batch of requests or results into a string, preserving their
     order.
 
-    The returned string will NOT contain newlines (this makes it convenient to
-    write newline-separated batches to stdout and readline them from stdin
-    without further escaping of the data).
+    Homogeneous batches (of at least _MIN_COLUMNAR_BATCH_SIZE items) of input
+    rows or of successful inference results with integer rowIDs are marshalled
+    into a compact binary columnar encoding (see
+    _ModelRequestResultBase.__marshalColumnarBatch__), and all other batches,
+    such as those containing commands, into JSON. Only JSON-encoded batches are
+    guaranteed to be free of newlines; RequestMessagePackager and
+    ResultMessagePackager only rely on their own header being newline-free.
 
     :param batch: a sequence of requests or results (instances of ModelCommand,
       ModelInputRow)
@@ -447,6 +749,17 @@ class BatchPackager(object):
 
     And similar for a result batch.
     """
+    if len(batch) >= _MIN_COLUMNAR_BATCH_SIZE:
+      batchState = _ModelRequestResultBase.__marshalColumnarBatch__(batch)
+      if batchState is not None:
+        return batchState
+
+    return cls._marshalJSON(batch)
+
+
+  @classmethod
+  def _marshalJSON(cls, batch):
+    """ Marshal a batch of requests or results of any type into JSON """
     return json.dumps([o.__getstate__() for o in batch])
 
 
@@ -454,8 +767,14 @@ class BatchPackager(object):
   def unmarshal(cls, batchState):
     """ Unmarshal the given batchState string into a sequence of request or
     result instances (e.g., ModelCommand, ModelInputRow), preserving the
-    original order
+    original order. The encoding of batchState is detected automatically.
+
+    :raises CorruptBatchState: if a columnar batchState is malformed
     """
+    if batchState.startswith(_COLUMNAR_BATCH_MAGIC):
+      return tuple(
+        _ModelRequestResultBase.__createBatchFromColumnarState__(batchState))
+
     return tuple(_ModelRequestResultBase.__createFromState__(itemState)
                  for itemState in json.loads(batchState))
 
@@ -774,6 +1093,20 @@ class ModelSwapperInterface(object):
       return False
 
 
+  def getModelInputQueueDepth(self, modelID):
+    """ Get the number of input request batches queued up for a model
+
+    :param modelID: a string that uniquely identifies the target model.
+
+    :returns: number of batches in the model's input queue; 0 if the model's
+      input queue doesn't exist
+    """
+    try:
+      return self._bus.getMessageCount(self._getModelInputQName(modelID))
+    except message_bus_connector.MessageQueueNotFound:
+      return 0
+
+
   def getModelsWithInputPending(self):
     """ Get model IDs of all models with pending input (non-empty input queues)
 
@@ -943,11 +1276,18 @@ class ModelSwapperInterface(object):
       raise
 
 
-  def consumeResults(self):
+  def consumeResults(self, prefetchMax=None, onDecoded=None):
     """ Create an instance of the _MessageConsumer iterable for reading model
     results, a batch at a time. The iterable yields _ConsumedResultBatch
     instances.
 
+    :param prefetchMax: the limit for how many unacked result batches the
+      message bus may deliver to the consumer; for consumers that process
+      batches concurrently and defer acks. None for the message bus default.
+    :param onDecoded: optional `NoneType onDecoded(durationSec)` to be called
+      with the time it took to decode each consumed result batch; for
+      instrumentation
+
     :returns: an instance of model_swapper_interface._MessageConsumer iterable;
       IMPORTANT: the caller is responsible for closing it before closing this
       ModelSwapperInterface instance (hint: use the returned _MessageConsumer
@@ -960,12 +1300,22 @@ class ModelSwapperInterface(object):
             processResults(modelID=batch.modelID, results=batch.objects)
             batch.ack()
     """
+    if onDecoded is None:
+      decode = _ConsumedResultBatch.decodeMessage
+    else:
+      def decode(msg):
+        startTime = time.time()
+        batch = _ConsumedResultBatch.decodeMessage(msg)
+        onDecoded(time.time() - startTime)
+        return batch
+
     consumer = _MessageConsumer(mqName=self._resultsQueueName,
                                 blocking=True,
-                                decode=_ConsumedResultBatch.decodeMessage,
+                                decode=decode,
                                 swapper=self,
                                 bus=self._bus,
-                                onQueueNotFound=self._initResultsMessageQueue)
+                                onQueueNotFound=self._initResultsMessageQueue,
+                                prefetchMax=prefetchMax)
 
     self._consumers.append(consumer)
 
@@ -1100,7 +1450,7 @@ class _MessageConsumer(object):
   """
 
   def __init__(self, mqName, blocking, decode, swapper,
-               bus, onQueueNotFound=None):
+               bus, onQueueNotFound=None, prefetchMax=None):
     """
     :param mqName: the name of the target message queue
     :param blocking: if True, the iterable will block until another batch
@@ -1116,6 +1466,8 @@ class _MessageConsumer(object):
       message_bus_connector.MessageQueueNotFound exception. onQueueNotFound is
       expected to create the queue. After calling onQueueNotFound, the consumer
       will attempt to restart the iterator.
+    :param prefetchMax: the limit for how many unacked messages the message bus
+      may deliver to a blocking consumer; None for the message bus default
     """
     self._logger = _getLogger()
     self._mqName = mqName
@@ -1124,12 +1476,17 @@ class _MessageConsumer(object):
     self._swapper = swapper
     self._bus = bus
     self._onQueueNotFound = onQueueNotFound
+    self._prefetchMax = prefetchMax
 
     self._mqConsumer = self._createMessageQueueConsumer()
 
 
   def _createMessageQueueConsumer(self):
-    return self._bus.consume(self._mqName, blocking=self._blocking)
+    if self._prefetchMax is None:
+      return self._bus.consume(self._mqName, blocking=self._blocking)
+
+    return self._bus.consume(self._mqName, blocking=self._blocking,
+                             prefetchMax=self._prefetchMax)
 
 
   def __enter__(self):
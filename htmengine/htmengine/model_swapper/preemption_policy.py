@@ -0,0 +1,327 @@
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2015, Numenta, Inc.  Unless you have purchased from
+# Numenta, Inc. a separate commercial license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+"""
+Pluggable policies that decide which running model SwapController preempts
+when models are waiting for a free slot.
+
+The policies keep the running models in a heap with lazy invalidation: a
+model's entry is re-pushed when its priority changes, and outdated entries are
+discarded when they surface at the top of the heap. This avoids sorting all
+running models on every preemption decision.
+"""
+
+import abc
+import heapq
+import itertools
+
+
+
+class PreemptionPolicyIface(object):
+  """ Baseline interface definition for preemption policies; also acts as
+  factory for derived policies.
+
+  NOTE: Derived policy classes must register themselves via our class
+    decorator PreemptionPolicyIface.registerPreemptionPolicy
+
+  All methods take the current time explicitly (as in time.time()), so that
+  policies may be driven by a simulated clock.
+  """
+
+  __metaclass__ = abc.ABCMeta
+
+
+  # Registry of preemption policies populated by our registerPreemptionPolicy
+  # decorator
+  # key: policy name (e.g., "lru")
+  # value: policy class
+  _policyRegistry = dict()
+
+
+  @classmethod
+  def registerPreemptionPolicy(cls, name):
+    """ Class decorator for registering a derived preemption policy class
+
+    :param name: policy name as referenced by the preemption_policy option in
+      the swap_controller section of model-swapper.conf
+    """
+    def registerPolicyClass(policyClass):
+      cls._policyRegistry[name] = policyClass
+      return policyClass
+
+    return registerPolicyClass
+
+
+  @classmethod
+  def createPreemptionPolicy(cls, name, getQueueDepth, config):
+    """ Factory for preemption policies
+
+    :param name: registered policy name (e.g., "lru")
+    :param getQueueDepth: function that takes a model ID and returns the number
+      of input batches queued up for the model
+    :param config: ModelSwapperConfig-like object for the policy's tunables
+
+    :returns: PreemptionPolicyIface-based policy object
+    """
+    return cls._policyRegistry[name](getQueueDepth=getQueueDepth,
+                                     config=config)
+
+
+  @classmethod
+  def listPreemptionPolicyNames(cls):
+    """ :returns: sequence of registered policy names """
+    return tuple(cls._policyRegistry.iterkeys())
+
+
+  def __init__(self, getQueueDepth, config):  # pylint: disable=W0613
+    self._getQueueDepth = getQueueDepth
+
+    # modelID -> _ModelEntry of running models
+    self._runningModels = dict()
+
+    # Heap of (priority, sequence number, modelID, _ModelEntry); an item is
+    # current only if its _ModelEntry is still in _runningModels and its
+    # priority equals the entry's priority
+    self._heap = []
+
+    # Tie-breaker for heap items with equal priority
+    self._sequence = itertools.count()
+
+    # modelID -> queue depth fetched during the current preemption decision
+    self._queueDepths = dict()
+
+
+  def __len__(self):
+    return len(self._runningModels)
+
+
+  @abc.abstractmethod
+  def _getPriority(self, entry):
+    """ Compute a running model's preemption priority; lower values are
+    preempted first
+
+    :param entry: the model's _ModelEntry
+    """
+    raise NotImplementedError()
+
+
+  def _getDecisionQueueDepth(self, modelID):
+    """ Get the number of input batches queued up for the model, fetching it at
+    most once per preemption decision, since each fetch is a round trip to the
+    message broker
+
+    :param modelID: model ID
+    """
+    try:
+      return self._queueDepths[modelID]
+    except KeyError:
+      depth = self._queueDepths[modelID] = self._getQueueDepth(modelID)
+      return depth
+
+
+  def _isPreemptible(self, entry, waitingModelID, waitingSince, now):
+    """ Decide whether the given running model may be preempted now in favor of
+    the given waiting model. The default permits preemption of any running
+    model.
+
+    :param entry: the running model's _ModelEntry
+    :param waitingModelID: ID of the model that would get the freed slot
+    :param waitingSince: time that the waiting model started waiting
+    :param now: current time
+
+    :returns: True if the model may be preempted now
+    """
+    return True
+
+
+  def _push(self, entry):
+    entry.priority = self._getPriority(entry)
+    heapq.heappush(self._heap,
+                   (entry.priority, next(self._sequence), entry.modelID, entry))
+
+    # Compact the heap if outdated items have accumulated
+    if len(self._heap) > 2 * len(self._runningModels) + 64:
+      self._heap = [item for item in self._heap if self._isCurrent(item)]
+      heapq.heapify(self._heap)
+
+
+  def _isCurrent(self, item):
+    priority, _, modelID, entry = item
+    return (self._runningModels.get(modelID) is entry and
+            entry.priority == priority)
+
+
+  def modelStarted(self, modelID, slotIndex, now):
+    """ Notification that the model was assigned to the given slot """
+    entry = _ModelEntry(modelID=modelID, slotIndex=slotIndex, startTime=now)
+    self._runningModels[modelID] = entry
+    self._push(entry)
+
+
+  def modelInputArrived(self, modelID, now):
+    """ Notification that new input was queued up for the running model """
+    entry = self._runningModels[modelID]
+    entry.activityTimestamp = now
+    self._push(entry)
+
+
+  def modelStopped(self, modelID, now):  # pylint: disable=W0613
+    """ Notification that the running model's ModelRunner completed """
+    del self._runningModels[modelID]
+
+
+  def selectSlotToPreempt(self, waitingModelID, waitingSince, excludeSlots,
+                          now):
+    """ Select a running model to preempt in favor of a waiting model
+
+    :param waitingModelID: ID of the model that would get the freed slot
+    :param waitingSince: time that the waiting model started waiting
+    :param excludeSlots: container of slot indexes that are already pending
+      preemption
+    :param now: current time
+
+    :returns: index of the slot to preempt or None if no running model should
+      be preempted at this time
+    """
+    popped = []
+    selected = None
+
+    try:
+      while self._heap:
+        item = heapq.heappop(self._heap)
+        if not self._isCurrent(item):
+          continue
+
+        # The model keeps running until it stops, so its item goes back into
+        # the heap whether it's selected or not
+        popped.append(item)
+
+        entry = item[3]
+        if entry.slotIndex in excludeSlots:
+          continue
+
+        if self._isPreemptible(entry, waitingModelID, waitingSince, now):
+          selected = entry
+          break
+    finally:
+      for item in popped:
+        heapq.heappush(self._heap, item)
+
+      # Queue depths change between decisions
+      self._queueDepths.clear()
+
+    return selected.slotIndex if selected is not None else None
+
+
+
+class _ModelEntry(object):
+  """ Running model state maintained by preemption policies """
+
+  __slots__ = ("modelID", "slotIndex", "startTime", "activityTimestamp",
+               "priority")
+
+
+  def __init__(self, modelID, slotIndex, startTime):
+    self.modelID = modelID
+    self.slotIndex = slotIndex
+    self.startTime = startTime
+    self.activityTimestamp = startTime
+    self.priority = None
+
+
+  def __repr__(self):
+    return "%s<modelID=%s, slot=%s, start=%s, activity=%s, priority=%s>" % (
+      self.__class__.__name__, self.modelID, self.slotIndex, self.startTime,
+      self.activityTimestamp, self.priority)
+
+
+
+@PreemptionPolicyIface.registerPreemptionPolicy("lru")
+class LRUPreemptionPolicy(PreemptionPolicyIface):
+  """ Preempt the running model that received input least recently """
+
+
+  def _getPriority(self, entry):
+    return entry.activityTimestamp
+
+
+
+@PreemptionPolicyIface.registerPreemptionPolicy("cost_aware")
+class CostAwarePreemptionPolicy(PreemptionPolicyIface):
+  """ Preempt the running model that is cheapest to swap back in, but only if
+  preempting it is likely to pay off:
+
+    * the model has been resident for at least the minimum residency quantum,
+      so it gets to amortize its load cost;
+    * the model isn't about to drain its input queue, in which case its slot
+      frees up on its own shortly;
+    * the model doesn't have more queued input than the waiting model, unless
+      the waiting model has been waiting longer than the maximum wait time.
+
+  A model's swap cost is estimated as the shortest run duration (start of
+  ModelRunner to its completion) observed for it, which bounds the model's
+  load plus checkpoint time; models that haven't completed a run yet are
+  assumed to cost default_swap_cost_sec. Ties are broken in favor of the least
+  recently active model.
+  """
+
+
+  def __init__(self, getQueueDepth, config):
+    super(CostAwarePreemptionPolicy, self).__init__(getQueueDepth, config)
+
+    self._minResidencySec = config.getfloat("swap_controller",
+                                            "min_residency_sec")
+    self._drainThresholdBatches = config.getint("swap_controller",
+                                                "drain_threshold_batches")
+    self._maxWaitSec = config.getfloat("swap_controller", "max_wait_sec")
+    self._defaultSwapCostSec = config.getfloat("swap_controller",
+                                               "default_swap_cost_sec")
+
+    # modelID -> estimated swap cost in seconds; retained across runs
+    self._swapCostSec = dict()
+
+
+  def _getPriority(self, entry):
+    return (self._swapCostSec.get(entry.modelID, self._defaultSwapCostSec),
+            entry.activityTimestamp)
+
+
+  def modelStopped(self, modelID, now):
+    entry = self._runningModels[modelID]
+    runDuration = now - entry.startTime
+    self._swapCostSec[modelID] = min(
+      runDuration, self._swapCostSec.get(modelID, runDuration))
+
+    super(CostAwarePreemptionPolicy, self).modelStopped(modelID, now)
+
+
+  def _isPreemptible(self, entry, waitingModelID, waitingSince, now):
+    if now - entry.startTime < self._minResidencySec:
+      return False
+
+    depth = self._getDecisionQueueDepth(entry.modelID)
+    if depth <= self._drainThresholdBatches:
+      return False
+
+    if now - waitingSince >= self._maxWaitSec:
+      return True
+
+    return depth <= self._getDecisionQueueDepth(waitingModelID)
@@ -36,6 +36,7 @@ import threading
 from nupic.support.decorators import logExceptions
 
 from htmengine import htmengine_logging
+from htmengine.model_swapper import ModelSwapperConfig
 
 from nta.utils.error_handling import abortProgramOnAnyException
 
@@ -172,6 +173,237 @@ class ModelRunnerProxy(object):
 
 
 
+class ModelRunnerHostProxy(object):
+  """ Proxy for creating, controlling, and monitoring a long-lived ModelRunner
+  host process (see model_runner.ModelRunnerHost) that runs the models assigned
+  to a slot one at a time and keeps recently-run models loaded in memory.
+
+  Protocol: the proxy writes "<RUN_COMMAND> <modelID>" and
+  "<STOP_COMMAND> <modelID>" lines to the host's stdin; the host writes a
+  "<DONE_NOTIFICATION> <modelID> <exitStatus>" line to its stdout when it
+  finishes running a model. Closing the host's stdin asks it to exit.
+  """
+
+  RUN_COMMAND = "run"
+  STOP_COMMAND = "stop"
+  DONE_NOTIFICATION = "{TAG:SWAP.MR.HOST.NOTIFY.DONE}"
+
+  _MAX_WAIT_FOR_GRACEFUL_STOP_SEC = 60*4
+  _MAX_WAIT_AFTER_SIGKILL_SEC = 10
+
+  # Exit status reported for a model whose host process died while running it
+  _HOST_DIED_EXIT_STATUS = 1
+
+
+  def __init__(self, logger):
+    self._logger = logger
+
+    self._process = subprocess.Popen(
+      args=[sys.executable,
+            "-m", "htmengine.model_swapper.model_runner",
+            "--hosted"],
+      stdin=subprocess.PIPE,
+      stdout=subprocess.PIPE,
+      close_fds=True)
+
+    self._pid = self._process.pid
+
+    # Synchronizes access to self._currentModel between the slot agent's
+    # event loop thread and our notification reader thread
+    self._lock = threading.Lock()
+
+    # The _HostedModelRunnerProxy of the model being run, if any
+    self._currentModel = None
+
+    self._logger.debug("%r: Started ModelRunnerHost", self)
+
+    # Start thread that reads notifications from the host and detects its
+    # termination
+    self._readerThread = threading.Thread(
+      target=self._runNotificationReaderThread,
+      name="%s-reader-%s" % (self.__class__.__name__, self._pid,))
+    self._readerThread.setDaemon(True)
+    self._readerThread.start()
+
+
+  def __repr__(self):
+    return "%s<pid=%s, returnCode=%s>" % (
+      self.__class__.__name__, self._pid, self._process.returncode)
+
+
+  def isAlive(self):
+    """ :returns: True if the host process is still running """
+    return self._readerThread.isAlive()
+
+
+  def startModel(self, modelID, onTermination):
+    """ Ask the host to run the given model
+
+    :param modelID: model ID (string)
+    :param onTermination: thread-safe callback that will be called when the
+      host finishes running the model
+
+    :returns: a ModelRunnerProxy-like _HostedModelRunnerProxy instance
+    """
+    modelRunner = _HostedModelRunnerProxy(modelID=modelID,
+                                          host=self,
+                                          onTermination=onTermination,
+                                          logger=self._logger)
+    with self._lock:
+      assert self._currentModel is None, repr(self._currentModel)
+      self._currentModel = modelRunner
+
+    try:
+      self._sendCommand(self.RUN_COMMAND, modelID)
+    except IOError:
+      self._logger.exception("%r: IO error starting model=%s; killing "
+                             "ModelRunnerHost", self, modelID)
+      self.kill()
+
+    return modelRunner
+
+
+  def stopModel(self, modelID):
+    """ Ask the host to stop running the given model gracefully; the model's
+    _HostedModelRunnerProxy is notified when it stops.
+    """
+    try:
+      self._sendCommand(self.STOP_COMMAND, modelID)
+    except IOError:
+      # Host died; our reader thread will report the failure
+      self._logger.exception("%r: IO error stopping model=%s", self, modelID)
+
+
+  def kill(self):
+    """ Force-kill the host process """
+    try:
+      os.kill(self._pid, signal.SIGKILL)
+    except OSError as e:
+      if e.errno == errno.ESRCH:
+        # "no such process" - our thread must have already reaped it
+        pass
+      else:
+        raise
+
+
+  def close(self):
+    """ Ask the host to exit after the current model, if any, and wait for
+    it; blocking.
+
+    :returns: return code from the host process
+    """
+    self._logger.debug("%r: Stopping ModelRunnerHost", self)
+    try:
+      self._process.stdin.close()
+    except IOError:
+      pass
+
+    self._readerThread.join(timeout=self._MAX_WAIT_FOR_GRACEFUL_STOP_SEC)
+    if self._readerThread.isAlive():
+      self._logger.error("%r: Graceful shutdown of ModelRunnerHost timed out; "
+                         "sending it SIGKILL", self)
+      self.kill()
+      self._readerThread.join(timeout=self._MAX_WAIT_AFTER_SIGKILL_SEC)
+      assert not self._readerThread.isAlive()
+
+    assert self._process.returncode is not None
+    self._logger.debug("%r: ModelRunnerHost stopped", self)
+    return self._process.returncode
+
+
+  def _sendCommand(self, method, modelID):
+    self._process.stdin.write("%s %s\n" % (method, modelID))
+    self._process.stdin.flush()
+
+
+  def _notifyModelDone(self, exitStatus):
+    with self._lock:
+      modelRunner = self._currentModel
+      self._currentModel = None
+
+    if modelRunner is not None:
+      modelRunner.onDone(exitStatus)
+
+
+  @abortProgramOnAnyException(
+    _EXIT_CODE_ON_UNHANDLED_EXCEPTION_IN_THREAD,
+    logger=_getLogger())
+  @logExceptions(_getLogger)
+  def _runNotificationReaderThread(self):
+    self._logger.debug("%s: _runNotificationReaderThread is running", self)
+
+    for line in iter(self._process.stdout.readline, ""):
+      fields = line.split()
+      if len(fields) == 3 and fields[0] == self.DONE_NOTIFICATION:
+        self._notifyModelDone(int(fields[2]))
+      else:
+        # Not a notification; pass through any other console output
+        sys.stdout.write(line)
+
+    self._process.wait()
+    self._logger.debug("%s: ModelRunnerHost subprocess terminated", self)
+
+    # Report the failure of the model that was running, if any
+    self._notifyModelDone(self._process.returncode or
+                          self._HOST_DIED_EXIT_STATUS)
+
+
+
+class _HostedModelRunnerProxy(object):
+  """ ModelRunnerProxy-like object representing a model run in a
+  ModelRunnerHost
+  """
+
+
+  def __init__(self, modelID, host, onTermination, logger):
+    self._modelID = modelID
+    self._host = host
+    self._onTermination = onTermination
+    self._logger = logger
+
+    self._exitStatus = None
+    self._doneEvent = threading.Event()
+
+
+  def __repr__(self):
+    return "%s<model=%s, host=%r, exitStatus=%s>" % (
+      self.__class__.__name__, self._modelID, self._host, self._exitStatus)
+
+
+  def onDone(self, exitStatus):
+    """ Called by ModelRunnerHostProxy when the host finishes running the
+    model
+    """
+    self._exitStatus = exitStatus
+    self._doneEvent.set()
+    self._onTermination()
+
+
+  def stopGracefully(self):
+    """ Gracefully stop running the model; blocking. The host process remains
+    running.
+
+    :returns: exit status of the model run (0 on success)
+    """
+    if not self._doneEvent.isSet():
+      self._logger.debug("%r: Stopping hosted model", self)
+      self._host.stopModel(self._modelID)
+
+      self._doneEvent.wait(
+        timeout=ModelRunnerHostProxy._MAX_WAIT_FOR_GRACEFUL_STOP_SEC)
+      if not self._doneEvent.isSet():
+        self._logger.error("%r: Graceful stop of hosted model timed out; "
+                           "killing ModelRunnerHost", self)
+        self._host.kill()
+        self._doneEvent.wait(
+          timeout=ModelRunnerHostProxy._MAX_WAIT_AFTER_SIGKILL_SEC)
+        assert self._doneEvent.isSet()
+
+    self._logger.debug("%r: Hosted model stopped", self)
+    return self._exitStatus
+
+
+
 class SlotAgent(object):
   """ Manage a single ModelRunner execution slot within a Model Scheduler
   service instance """
@@ -201,6 +433,15 @@ class SlotAgent(object):
 
     self._eventQ = Queue.Queue()
 
+    # When True, models are run in a long-lived ModelRunnerHost process that
+    # keeps recently-run models loaded, instead of a ModelRunner process per
+    # model run
+    self._useModelRunnerHost = ModelSwapperConfig().getboolean(
+      "model_runner_host", "enabled")
+
+    # ModelRunnerHostProxy instance; created on demand by the event loop thread
+    self._modelRunnerHost = None
+
     # Create our event loop thread instance
     self._thread = threading.Thread(target=self._runEventLoop,
                                     name="SlotAgentEventLoop-" + str(id(self)))
@@ -302,11 +543,19 @@ class SlotAgent(object):
         modelID = evt["modelID"]
         self._logger.debug("%r: {TAG:SWAP.SA.MODEL.STARTING} model=%s", self,
                            modelID)
-        modelRunner = ModelRunnerProxy(
-          modelID=modelID,
-          onTermination=lambda: self._eventQ.put(
-            {"method" : self._MODEL_RUNNER_EXITED}),
-          logger=self._logger)
+        onTermination = lambda: self._eventQ.put(
+          {"method" : self._MODEL_RUNNER_EXITED})
+        if self._useModelRunnerHost:
+          if (self._modelRunnerHost is None or
+              not self._modelRunnerHost.isAlive()):
+            self._modelRunnerHost = ModelRunnerHostProxy(logger=self._logger)
+          modelRunner = self._modelRunnerHost.startModel(
+            modelID=modelID, onTermination=onTermination)
+        else:
+          modelRunner = ModelRunnerProxy(
+            modelID=modelID,
+            onTermination=onTermination,
+            logger=self._logger)
         modelState = _CurrentModelState(
           modelID=evt["modelID"], modelRunner=modelRunner,
           modelFinishedCallback=evt["modelFinishedCallback"])
@@ -379,6 +628,9 @@ class SlotAgent(object):
 
         if doClose:
           # Model is stopped, we're done!
+          if self._modelRunnerHost is not None:
+            self._modelRunnerHost.close()
+            self._modelRunnerHost = None
           break
 
 
@@ -34,6 +34,7 @@ import time
 from nupic.support.decorators import logExceptions, logEntryExit
 
 from htmengine.model_swapper import ModelSwapperConfig
+from htmengine.model_swapper.preemption_policy import PreemptionPolicyIface
 from htmengine.model_swapper.model_swapper_interface import (
     ModelSwapperInterface)
 from htmengine.model_swapper.slot_agent import SlotAgent
@@ -69,14 +70,20 @@ class SwapController(object):
 
   _EXIT_CODE_ON_FAILURE_OF_NOTIFICATION_READER_THREAD = 1
 
+  # How often the event loop re-evaluates preemption while models are waiting
+  # for slots that the preemption policy declined to preempt
+  _PREEMPTION_RECHECK_INTERVAL_SEC = 1
+
   def __init__(self, concurrency):
     """
     concurrency: allowed number of model slots
     """
     self._logger = _getLogger()
 
+    config = ModelSwapperConfig()
+
     self._profiling = (
-      ModelSwapperConfig().getboolean("debugging", "profiling") or
+      config.getboolean("debugging", "profiling") or
       self._logger.isEnabledFor(logging.DEBUG))
 
     # Allowed number of model slots
@@ -113,9 +120,19 @@ class SwapController(object):
     # running; there is incoming data for them that needs to be processed
     self._waitingModelsFIFO = []
 
+    # A (non-thread-safe) map of modelIDs of waiting models to the times when
+    # they started waiting
+    self._waitingSinceMap = dict()
+
     # A (non-thread-safe) map of modelIDs to _RunningModelInfo instances
     self._runningModelsMap = dict()
 
+    # Selects running models for preemption
+    self._preemptionPolicy = PreemptionPolicyIface.createPreemptionPolicy(
+      name=config.get("swap_controller", "preemption_policy"),
+      getQueueDepth=self._mainSwapper.getModelInputQueueDepth,
+      config=config)
+
     # A (non-thread-safe) list of free slot indexes into the self._slotsAgents
     # tuple
     self._freeSlots = list(xrange(len(self._slotAgents)))
@@ -170,7 +187,18 @@ class SwapController(object):
 
 
       # Get and handle next event
-      evt = self._eventQ.get()
+      if len(self._waitingModelsFIFO) > len(self._pendingPreemptSlotsSet):
+        # The preemption policy may have deferred preemption, so wake up
+        # periodically to give it another chance
+        try:
+          evt = self._eventQ.get(
+            timeout=self._PREEMPTION_RECHECK_INTERVAL_SEC)
+        except Queue.Empty:
+          self._requestPreemptionOfRunningSlotIfNeededAndPossible()
+          continue
+      else:
+        evt = self._eventQ.get()
+
       method = evt["method"]
       handler = getattr(self, "_handle" + method + "Event")
       handler(**evt)
@@ -237,6 +265,8 @@ class SwapController(object):
     if runningModelInfo is not None:
       # This model is already running
       runningModelInfo.updateTimestamp()
+      self._preemptionPolicy.modelInputArrived(modelID,
+                                               runningModelInfo.timestamp)
 
     elif modelID not in self._waitingModelsFIFO:
       # This model was not running and is not awaiting execution
@@ -263,6 +293,7 @@ class SwapController(object):
       else:
         # This model needs to wait until resources become available
         self._waitingModelsFIFO.append(modelID)
+        self._waitingSinceMap[modelID] = time.time()
 
         if self._profiling:
           self._logger.info("{TAG:SWAP.SC.MODEL.WAIT} model=%s; "
@@ -281,7 +312,7 @@ class SwapController(object):
     exitStatus: the exit status of the ModelRunner process (per os.WEXITSTATUS)
     """
     doneModelInfo = self._runningModelsMap.pop(modelID)
-
+    self._preemptionPolicy.modelStopped(modelID, endTime)
 
     if self._profiling:
       self._logger.info(
@@ -311,6 +342,7 @@ class SwapController(object):
     if self._waitingModelsFIFO:
       # Start a waiting model, now that we know there is a free slot
       newModelID = self._waitingModelsFIFO.pop(0)
+      del self._waitingSinceMap[newModelID]
       self._assignModelToFreeSlot(newModelID)
 
       self._requestPreemptionOfRunningSlotIfNeededAndPossible()
@@ -327,7 +359,10 @@ class SwapController(object):
       modelID=modelID,
       modelFinishedCallback=partial(self._modelDoneNotifyTS, modelID))
 
-    self._runningModelsMap[modelID] = _RunningModelInfo(freeSlotIndex)
+    modelInfo = _RunningModelInfo(freeSlotIndex)
+    self._runningModelsMap[modelID] = modelInfo
+    self._preemptionPolicy.modelStarted(modelID, freeSlotIndex,
+                                        modelInfo.startTime)
 
     assert ((len(self._runningModelsMap) + len(self._freeSlots)) ==
             len(self._slotAgents)), (
@@ -350,25 +385,31 @@ class SwapController(object):
       # Not needed or no preemptable slots
       return
 
-    # Find an LRU non-pending-preempt busy slot agent, and request to
-    # preempt it
-    lru = sorted(
-      ((i.slotIndex, i.timestamp)
-        for i in self._runningModelsMap.itervalues()
-        if i.slotIndex not in self._pendingPreemptSlotsSet),
-      key=lambda element: element[1])
+    # Slots pending preemption are already spoken for by the models at the
+    # head of the FIFO, so the freed slot would go to the next waiting model
+    waitingModelID = self._waitingModelsFIFO[len(self._pendingPreemptSlotsSet)]
 
-    slotIndex, timestamp = lru.pop(0)
+    # Ask the preemption policy for a non-pending-preempt busy slot agent to
+    # preempt
+    slotIndex = self._preemptionPolicy.selectSlotToPreempt(
+      waitingModelID=waitingModelID,
+      waitingSince=self._waitingSinceMap[waitingModelID],
+      excludeSlots=self._pendingPreemptSlotsSet,
+      now=time.time())
+
+    if slotIndex is None:
+      # The policy deferred preemption; the event loop will ask again
+      return
 
-    # Request preemption of the LRU slot
+    # Request preemption of the selected slot
     self._slotAgents[slotIndex].stopModel()
     self._pendingPreemptSlotsSet.add(slotIndex)
 
     if self._profiling:
       self._logger.info(
-        "{TAG:SWAP.SC.SLOT.PREEMPT.REQ} slot=%d with timestamp=%s; "
+        "{TAG:SWAP.SC.SLOT.PREEMPT.REQ} slot=%d for model=%s; "
         "numWaitingModels=%s; numPendingPreemptSlots=%s",
-        slotIndex, timestamp, len(self._waitingModelsFIFO),
+        slotIndex, waitingModelID, len(self._waitingModelsFIFO),
         len(self._pendingPreemptSlotsSet))
 
 
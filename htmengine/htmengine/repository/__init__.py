@@ -30,8 +30,10 @@ from nta.utils import sqlalchemy_utils
 from htmengine.repository.queries import (
   addMetric,
   addMetricData,
+  addMetricDataPartitions,
   deleteMetric,
   deleteModel,
+  dropMetricDataPartitions,
   getCustomMetricByName,
   getCustomMetrics,
   getInstances,
@@ -44,13 +46,16 @@ from htmengine.repository.queries import (
   getMetricWithUpdateLock,
   getMetricCountForServer,
   getMetricData,
+  getMetricDataChunks,
   getMetricDataCount,
+  getMetricDataPartitions,
   getProcessedMetricDataCount,
   getMetricDataWithRawAnomalyScoresTail,
   getMetricIdsSortedByDisplayValue,
   getMetricStats,
   getUnprocessedModelDataCount,
   listMetricIDsForInstance,
+  partitionMetricDataByDay,
   saveMetricInstanceStatus,
   setMetricCollectorError,
   setMetricLastTimestamp,
@@ -58,6 +63,7 @@ from htmengine.repository.queries import (
   updateMetricColumns,
   updateMetricColumnsForRefStatus,
   updateMetricDataColumns,
+  updateMetricDataColumnsBulk,
   lockOperationExclusive,
   OperationLock)
 
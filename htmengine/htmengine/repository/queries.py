@@ -18,10 +18,12 @@
 #
 # http://numenta.org/licenses/
 # ----------------------------------------------------------------------
-from datetime import datetime
+from datetime import datetime, timedelta
 
-from sqlalchemy import func
-from sqlalchemy.sql import select
+from sqlalchemy import Column, func, MetaData, Table
+from sqlalchemy.dialects.mysql import DOUBLE, INTEGER
+from sqlalchemy.schema import CreateTable
+from sqlalchemy.sql import bindparam, select, text
 from sqlalchemy.engine.base import Connection
 
 from htmengine.exceptions import (MetricStatisticsNotReadyError,
@@ -89,6 +91,12 @@ def deleteMetric(conn, metricId):
     # is kept by deleting any related data when necessary
     deleteModel(conn, metricId)
 
+    # Delete the metric's data explicitly, since metric_data can't have the
+    # ON DELETE CASCADE foreign key once it's partitioned (see
+    # partitionMetricDataByDay)
+    conn.execute(schema.metric_data.delete() # pylint: disable=E1120
+                 .where(schema.metric_data.c.uid == metricId))
+
     # Delete metric
     result = (conn.execute(schema.metric.delete() # pylint: disable=E1120
                            .where(schema.metric.c.uid == metricId)))
@@ -555,7 +563,20 @@ def saveMetricInstanceStatus(conn, server, status, timestamp=None):
 
 
 def incrementMetricRowid(conn, metricId, amount=1):
-  """ Increment Metric Row ID
+  """ Increment Metric Row ID, reserving the range of rowids
+  (last_rowid + 1)..(last_rowid + amount) for the caller.
+
+  On MySQL, the range is reserved with a single
+  UPDATE ... SET last_rowid = LAST_INSERT_ID(last_rowid + amount) statement
+  whose result is returned by the server along with the UPDATE's status, as
+  opposed to a SELECT ... FOR UPDATE followed by an UPDATE. Other dialects fall
+  back to the latter.
+
+  NOTE: either way, the metric row remains locked until the caller's
+  transaction completes. This keeps the rowids of each metric contiguous and
+  in the order of the committed rows, which consumers of metric_data rely on
+  (e.g., last_rowid is used as the metric's row count and MetricStreamer
+  scrubs input samples against the timestamp of the row at last_rowid).
 
   :param conn: SQLAlchemy connection object
   :type conn: sqlalchemy.engine.Connection
@@ -575,6 +596,21 @@ def incrementMetricRowid(conn, metricId, amount=1):
     raise ValueError("Expected positive integer amount for incrementing "
                      "last_rowid, but got: %r" % (amount,))
 
+  if conn.dialect.name == "mysql":
+    update = (schema.metric.update() # pylint: disable=E1120
+              .where(schema.metric.c.uid == metricId)
+              .values(last_rowid=func.last_insert_id(
+                schema.metric.c.last_rowid + amount)))
+
+    result = conn.execute(update)
+
+    if result.rowcount == 0:
+      raise ObjectNotFoundError("Metric not found for uid=%s" % (metricId,))
+
+    # NOTE: the client library reports LAST_INSERT_ID(expr) of an UPDATE as the
+    # statement's insert id
+    return result.lastrowid
+
   with conn.begin():
     oldLastRowid = getMetricWithUpdateLock(
       conn, metricId, fields=[schema.metric.c.last_rowid])[0]
@@ -695,6 +731,99 @@ def getMetricData(conn,
 
 
 
+# Default max number of rows per chunk of getMetricDataChunks
+METRIC_DATA_CHUNK_SIZE = 10000
+
+
+
+def getMetricDataChunks(conn,
+                        metricId=None,
+                        fields=None,
+                        fromTimestamp=None,
+                        toTimestamp=None,
+                        score=None,
+                        descending=False,
+                        limit=None,
+                        chunkSize=METRIC_DATA_CHUNK_SIZE):
+  """Get Metric Data in chunks, one query per chunk, so that neither the
+  server nor the client buffers more than a chunk of a large result at a time
+  (unlike getMetricData, whose result the MySQLdb cursor fetches in full).
+
+  The rows are grouped by metric in ascending order of uid. Each chunk holds
+  rows of a single metric, which are selected by seeking past the rowid of the
+  metric's previous chunk on the primary key. So the rows of a metric are
+  ordered by rowid, which is also their timestamp order, since MetricStreamer
+  only stores samples with increasing timestamps.
+
+  :param conn: SQLAlchemy connection object; must remain open while the
+    chunks are consumed
+  :type conn: sqlalchemy.engine.base.Connection
+  :param metricId: Metric uid; None for all metrics
+  :type metricId: str
+  :param fields: Sequence of columns to be returned by underlying query; must
+    include rowid
+  :param fromTimestamp: Starting timestamp
+  :param toTimestamp: Ending timestamp
+  :param score: Return only rows with scores above this threshold
+    (all non-null scores for score=0)
+  :param descending: True to get each metric's rows from the latest one
+  :param limit: Max number of rows per metric
+  :param chunkSize: Max number of rows per chunk
+  :returns: generator of non-empty lists of rows (sqlalchemy.engine.RowProxy)
+  """
+  fields = fields or [schema.metric_data]
+
+  sel = select(fields)
+
+  if fromTimestamp:
+    sel = sel.where(schema.metric_data.c.timestamp >= fromTimestamp)
+  if toTimestamp:
+    sel = sel.where(schema.metric_data.c.timestamp <= toTimestamp)
+
+  if score > 0.0:
+    sel = sel.where(schema.metric_data.c.anomaly_score >= score)
+  elif score == 0.0:
+    sel = sel.where(schema.metric_data.c.anomaly_score != None)
+
+  if descending:
+    sel = sel.order_by(schema.metric_data.c.rowid.desc())
+  else:
+    sel = sel.order_by(schema.metric_data.c.rowid.asc())
+
+  if metricId is not None:
+    metricIds = [metricId]
+  else:
+    metricIds = [row.uid for row in conn.execute(
+      select([schema.metric.c.uid]).order_by(schema.metric.c.uid.asc()))]
+
+  for uid in metricIds:
+    metricSel = sel.where(schema.metric_data.c.uid == uid)
+    remaining = limit
+
+    while True:
+      numRows = chunkSize if not remaining else min(chunkSize, remaining)
+      rows = conn.execute(metricSel.limit(numRows)).fetchall()
+
+      if rows:
+        yield rows
+
+      if len(rows) < numRows:
+        break
+
+      if remaining:
+        remaining -= len(rows)
+        if remaining == 0:
+          break
+
+      if descending:
+        metricSel = sel.where(schema.metric_data.c.uid == uid).where(
+          schema.metric_data.c.rowid < rows[-1].rowid)
+      else:
+        metricSel = sel.where(schema.metric_data.c.uid == uid).where(
+          schema.metric_data.c.rowid > rows[-1].rowid)
+
+
+
 def getMetricDataWithRawAnomalyScoresTail(conn, metricId, limit):
   """Get MetricData ordered by timestamp, descending
 
@@ -764,6 +893,219 @@ def updateMetricDataColumns(conn, metricDataObj, fields):
 
 
 
+# Per-connection scratch table used by updateMetricDataColumnsBulk() to join
+# the new anomaly scores with metric_data in a single UPDATE statement.
+# NOTE: the TEMPORARY keyword is essential in both CREATE and DROP statements,
+#  as DROP TABLE without it implicitly commits the current transaction.
+_metricDataScoresTmp = Table(  # pylint: disable=C0103
+  "metric_data_scores_tmp",
+  MetaData(),
+  Column("rowid",
+         INTEGER(),
+         primary_key=True,
+         autoincrement=False,
+         nullable=False),
+  Column("raw_anomaly_score",
+         DOUBLE(asdecimal=False)),
+  Column("anomaly_score",
+         DOUBLE(asdecimal=False)),
+  Column("display_value",
+         INTEGER(),
+         autoincrement=False),
+  prefixes=["TEMPORARY"],
+  mysql_engine="MEMORY")
+
+# Maximum number of rows per multi-row INSERT into _metricDataScoresTmp, so that
+# statements stay well within MySQL's max_allowed_packet
+_METRIC_DATA_SCORES_INSERT_CHUNK_SIZE = 5000
+
+
+
+def updateMetricDataColumnsBulk(conn, metricId, metricDataRows):
+  """Update raw_anomaly_score, anomaly_score and display_value of a range of
+  metric_data rows of a single metric using a constant number of statements
+  (as opposed to one UPDATE per row via updateMetricDataColumns).
+
+  On MySQL, the new values are bulk-inserted into a temporary table that is
+  then joined with metric_data in a single UPDATE statement. Other dialects
+  fall back to a single executemany UPDATE.
+
+  NOTE: this is intended to be called within a transaction.
+
+  :param conn: SQLAlchemy connection object
+  :type conn: sqlalchemy.engine.base.Connection
+  :param metricId: Metric uid
+  :param metricDataRows: sequence of objects with rowid, raw_anomaly_score,
+    anomaly_score and display_value attributes (e.g., MutableMetricDataRow),
+    ordered by rowid
+  """
+  if not metricDataRows:
+    return
+
+  values = [{"rowid": row.rowid,
+             "raw_anomaly_score": row.raw_anomaly_score,
+             "anomaly_score": row.anomaly_score,
+             "display_value": row.display_value}
+            for row in metricDataRows]
+
+  if conn.dialect.name != "mysql":
+    update = (schema.metric_data.update() # pylint: disable=E1120
+              .where(schema.metric_data.c.uid == metricId)
+              .where(schema.metric_data.c.rowid == bindparam("b_rowid"))
+              .values(raw_anomaly_score=bindparam("b_raw_anomaly_score"),
+                      anomaly_score=bindparam("b_anomaly_score"),
+                      display_value=bindparam("b_display_value")))
+    conn.execute(update, [dict(("b_" + name, value)
+                               for name, value in item.iteritems())
+                          for item in values])
+    return
+
+  tmp = _metricDataScoresTmp
+  dropTmp = "DROP TEMPORARY TABLE IF EXISTS %s" % (tmp.name,)
+
+  # Drop the scratch table in case it was left over by a failed call on the
+  # same pooled connection
+  conn.execute(dropTmp)
+  conn.execute(CreateTable(tmp))
+
+  for i in xrange(0, len(values), _METRIC_DATA_SCORES_INSERT_CHUNK_SIZE):
+    conn.execute(tmp.insert(),
+                 values[i:i + _METRIC_DATA_SCORES_INSERT_CHUNK_SIZE])
+
+  update = (schema.metric_data.update() # pylint: disable=E1120
+            .where(schema.metric_data.c.uid == metricId)
+            .where(schema.metric_data.c.rowid.between(
+              metricDataRows[0].rowid, metricDataRows[-1].rowid))
+            .where(schema.metric_data.c.rowid == tmp.c.rowid)
+            .values(raw_anomaly_score=tmp.c.raw_anomaly_score,
+                    anomaly_score=tmp.c.anomaly_score,
+                    display_value=tmp.c.display_value))
+  conn.execute(update)
+
+  conn.execute(dropTmp)
+
+
+
+# Name format of the daily metric_data partitions; the partition holds the rows
+# with timestamps within that (UTC) day
+_METRIC_DATA_PARTITION_NAME_FORMAT = "p%Y%m%d"
+
+# Name of the catch-all metric_data partition for timestamps beyond the last
+# daily partition
+_METRIC_DATA_FUTURE_PARTITION_NAME = "pfuture"
+
+
+
+def _metricDataPartitionDefinitions(days):
+  """
+  :param days: ascending sequence of datetime.date
+  :returns: list of RANGE partition definitions of the given days followed by
+    the catch-all partition
+  """
+  return [
+    "PARTITION %s VALUES LESS THAN (TO_DAYS('%s'))" % (
+      day.strftime(_METRIC_DATA_PARTITION_NAME_FORMAT),
+      (day + timedelta(days=1)).isoformat())
+    for day in days
+  ] + ["PARTITION %s VALUES LESS THAN MAXVALUE" % (
+    _METRIC_DATA_FUTURE_PARTITION_NAME,)]
+
+
+
+def partitionMetricDataByDay(conn, days):
+  """Convert metric_data to RANGE partitions by day on timestamp, followed by a
+  catch-all partition for later timestamps. This lets retention drop all rows
+  of an expired day at once (see dropMetricDataPartitions) instead of deleting
+  them row by row.
+
+  MySQL requires the partitioning column in every unique key and doesn't
+  support foreign keys on partitioned tables, so this also drops
+  metric_data_to_metric_fk and extends the primary key with timestamp.
+  deleteMetric deletes the metric's rows explicitly for this reason.
+
+  NOTE: this rebuilds the table, which may take a long time on large tables.
+
+  :param conn: SQLAlchemy connection object or alembic.op
+  :param days: ascending sequence of datetime.date of the daily partitions to
+    create; the first partition also holds all earlier rows
+  """
+  conn.execute("ALTER TABLE metric_data DROP FOREIGN KEY "
+               "metric_data_to_metric_fk")
+
+  conn.execute(
+    "ALTER TABLE metric_data "
+    "DROP PRIMARY KEY, ADD PRIMARY KEY (uid, rowid, timestamp) "
+    "PARTITION BY RANGE (TO_DAYS(timestamp)) (%s)" % (
+      ", ".join(_metricDataPartitionDefinitions(days)),))
+
+
+
+def getMetricDataPartitions(conn):
+  """Get the daily partitions of metric_data created by
+  partitionMetricDataByDay and addMetricDataPartitions
+
+  :param conn: SQLAlchemy connection object
+  :type conn: sqlalchemy.engine.base.Connection
+  :returns: (day, numRows) pairs ordered by day, where day is a datetime.date
+    and numRows is the storage engine's estimate of the number of rows in the
+    partition; empty if metric_data isn't partitioned by day
+  :rtype: list
+  """
+  results = conn.execute(
+    text("SELECT PARTITION_NAME, TABLE_ROWS FROM information_schema.PARTITIONS "
+         "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :tableName "
+         "AND PARTITION_NAME IS NOT NULL"),
+    tableName=schema.metric_data.name).fetchall()
+
+  partitions = []
+  for name, numRows in results:
+    if name == _METRIC_DATA_FUTURE_PARTITION_NAME:
+      continue
+
+    day = datetime.strptime(name, _METRIC_DATA_PARTITION_NAME_FORMAT).date()
+    partitions.append((day, numRows))
+
+  partitions.sort()
+  return partitions
+
+
+
+def addMetricDataPartitions(conn, days):
+  """Add daily partitions to metric_data by splitting them from the catch-all
+  partition, which is normally empty
+
+  :param conn: SQLAlchemy connection object
+  :type conn: sqlalchemy.engine.base.Connection
+  :param days: ascending sequence of datetime.date following the last daily
+    partition
+  """
+  if not days:
+    return
+
+  conn.execute("ALTER TABLE metric_data REORGANIZE PARTITION %s INTO (%s)" % (
+    _METRIC_DATA_FUTURE_PARTITION_NAME,
+    ", ".join(_metricDataPartitionDefinitions(days))))
+
+
+
+def dropMetricDataPartitions(conn, days):
+  """Drop daily partitions of metric_data along with all of their rows. Unlike
+  DELETE, this is a quick metadata operation that is replicated as a single
+  statement.
+
+  :param conn: SQLAlchemy connection object
+  :type conn: sqlalchemy.engine.base.Connection
+  :param days: sequence of datetime.date of existing daily partitions
+  """
+  if not days:
+    return
+
+  conn.execute("ALTER TABLE metric_data DROP PARTITION %s" % (
+    ", ".join(day.strftime(_METRIC_DATA_PARTITION_NAME_FORMAT)
+              for day in days),))
+
+
+
 def getMetricStats(conn, metricId):
   """
   :param conn: SQLAlchemy connection object
@@ -24,10 +24,13 @@ import itertools
 import json
 import logging
 from collections import namedtuple
+from contextlib import contextmanager
 import math
 from optparse import OptionParser
 import os
+import Queue
 import sys
+import threading
 import time
 import zlib
 
@@ -76,6 +79,10 @@ INACTIVE_BAR_FLOOR = -10000
 LOG_1_MINUS_0_9999999999 = math.log(1.0 - 0.9999999999)
 
 
+# Log result batch processing stage timings once per this many batches
+_STAGE_TIMINGS_LOG_INTERVAL = 1000
+
+
 
 def _getLogger():
   return getExtendedLogger(_MODULE_NAME)
@@ -155,6 +162,81 @@ class RejectedInferenceResultBatch(Exception):
 
 
 
+class _StageTimingCounters(object):
+  """ Thread-safe cumulative counters of processed result batches and of the
+  time spent in each stage of result batch processing
+  """
+
+  STAGES = ("decode", "load", "score", "write", "publish")
+
+
+  def __init__(self):
+    self._lock = threading.Lock()
+    self._numBatches = 0
+    self._stageDurations = dict.fromkeys(self.STAGES, 0.0)
+
+
+  def __repr__(self):
+    counters = self.getCounters()
+    numBatches = counters["batches"]
+    return "%s<batches=%d; %s>" % (
+      self.__class__.__name__, numBatches,
+      "; ".join(
+        "%s=%.3fs (%.2fms/batch)" % (
+          stage, counters[stage + "_seconds"],
+          counters[stage + "_seconds"] * 1000.0 / numBatches
+          if numBatches else 0.0)
+        for stage in self.STAGES))
+
+
+  def addStageDuration(self, stage, durationSec):
+    """ Add to the time spent in the given stage
+
+    :param stage: one of STAGES
+    :param durationSec: duration in seconds
+    """
+    with self._lock:
+      self._stageDurations[stage] += durationSec
+
+
+  @contextmanager
+  def timeStage(self, stage):
+    """ Context manager that adds the time spent in its context to the given
+    stage
+
+    :param stage: one of STAGES
+    """
+    startTime = time.time()
+    try:
+      yield
+    finally:
+      self.addStageDuration(stage, time.time() - startTime)
+
+
+  def countBatch(self):
+    """ Count a processed result batch
+
+    :returns: the number of processed result batches
+    """
+    with self._lock:
+      self._numBatches += 1
+      return self._numBatches
+
+
+  def getCounters(self):
+    """
+    :returns: dict of counter names to cumulative values: "batches" and
+      "<stage>_seconds" for each stage
+    """
+    with self._lock:
+      counters = dict(("%s_seconds" % stage, duration)
+                      for stage, duration in self._stageDurations.iteritems())
+      counters["batches"] = self._numBatches
+
+    return counters
+
+
+
 class AnomalyService(object):
   """ Anomaly Service for processing CLA model results, calculating Anomaly
   Likelihood scores, and updating the associated metric data records
@@ -175,8 +257,24 @@ class AnomalyService(object):
   of a use-case for that exchange.  Consumers must deserialize inbound messages
   with ``AnomalyService.deserializeModelResult()``.
 
+  By default, result batches are processed serially on the consumer thread.
+  When the ``num_workers`` configuration directive from the
+  ``anomaly_service`` section of ``config`` is nonzero, result batches are
+  sharded by model ID across that many worker threads instead, so that the
+  batches of a given model are processed in order while those of different
+  models proceed in parallel; a batch is acked once its worker has committed
+  its results to the database and published them.
+
+  The time spent in the stages of result batch processing is accumulated in
+  counters that are available via ``getStageTimingCounters()`` and logged
+  periodically.
   """
 
+  # How long to wait for a shard worker to finish its current batch when
+  # stopping
+  _SHARD_WORKER_JOIN_TIMEOUT_SEC = 30
+
+
   def __init__(self):
     self._log = _getLogger()
 
@@ -190,9 +288,39 @@ class AnomalyService(object):
     self._statisticsSampleSize = (
       config.getint("anomaly_likelihood", "statistics_sample_size"))
 
+    # Number of worker threads that process result batches; 0 to process them
+    # serially on the consumer thread
+    self._numWorkers = config.getint("anomaly_service", "num_workers")
+
+    # Max number of unacked result batches in the pipeline of shard workers
+    self._maxInFlightBatches = (
+      config.getint("anomaly_service", "max_in_flight_batches"))
+
+    self._stageTimings = _StageTimingCounters()
+
+    # Properties for publishing model command results on RabbitMQ exchange
+    self._modelCommandResultProperties = MessageProperties(
+        deliveryMode=amqp.constants.AMQPDeliveryModes.PERSISTENT_MESSAGE,
+        headers=dict(dataType="model-cmd-result"))
+
+    # Properties for publishing model inference results on RabbitMQ exchange
+    self._modelInferenceResultProperties = MessageProperties(
+        deliveryMode=amqp.constants.AMQPDeliveryModes.PERSISTENT_MESSAGE)
+
+    # NOTE: thread-safe, so shard workers share it
     self.likelihoodHelper = AnomalyLikelihoodHelper(self._log, config)
 
 
+  def getStageTimingCounters(self):
+    """ [thread-safe] Snapshot of the result batch processing counters
+
+    :returns: dict of counter names to cumulative values: "batches" with the
+      number of processed result batches and "<stage>_seconds" with the time
+      spent in each stage: decode, load, score, write and publish
+    """
+    return self._stageTimings.getCounters()
+
+
   def _processModelCommandResult(self, metricID, result):
     """
     Process a single model command result
@@ -298,7 +426,7 @@ class AnomalyService(object):
 
     # Validate model ID
     try:
-      with engine.connect() as conn:
+      with self._stageTimings.timeStage("load"), engine.connect() as conn:
         metricObj = repository.getMetric(conn, metricID)
     except ObjectNotFoundError:
       # Ignore inferences for unkonwn models. Typically, this is is the result
@@ -319,7 +447,7 @@ class AnomalyService(object):
       return None
 
     # Load the MetricData instances corresponding to the results
-    with engine.connect() as conn:
+    with self._stageTimings.timeStage("load"), engine.connect() as conn:
       metricDataRows = repository.getMetricData(conn,
                                                 metricID,
                                                 start=inferenceResults[0].rowID,
@@ -351,20 +479,21 @@ class AnomalyService(object):
         metricDataRows[0].rowid, metricDataRows[-1].rowid, metricID, e)
       return None
 
-    # Update anomaly scores based on the new results
-    anomalyLikelihoodParams = (
-      self.likelihoodHelper.updateModelAnomalyScores(
-                                                engine=engine,
-                                                metricObj=metricObj,
-                                                metricDataRows=metricDataRows))
-
-    # Update metric data rows with rescaled display values
-    # NOTE: doing this outside the updateColumns loop to avoid holding row locks
-    #  any longer than necessary
-    for metricData in metricDataRows:
-      metricData.display_value = rescaleForDisplay(
-        metricData.anomaly_score,
-        active=(metricObj.status == MetricStatus.ACTIVE))
+    with self._stageTimings.timeStage("score"):
+      # Update anomaly scores based on the new results
+      anomalyLikelihoodParams = (
+        self.likelihoodHelper.updateModelAnomalyScores(
+          engine=engine,
+          metricObj=metricObj,
+          metricDataRows=metricDataRows))
+
+      # Update metric data rows with rescaled display values
+      # NOTE: doing this outside the bulk update transaction to avoid holding
+      #  row locks any longer than necessary
+      for metricData in metricDataRows:
+        metricData.display_value = rescaleForDisplay(
+          metricData.anomaly_score,
+          active=(metricObj.status == MetricStatus.ACTIVE))
 
     # Update database once via transaction!
     startTime = time.time()
@@ -372,11 +501,9 @@ class AnomalyService(object):
       @retryOnTransientErrors
       def runSQL(engine):
         with engine.begin() as conn:
-          for metricData in metricDataRows:
-            fields = {"raw_anomaly_score": metricData.raw_anomaly_score,
-                      "anomaly_score": metricData.anomaly_score,
-                      "display_value": metricData.display_value}
-            repository.updateMetricDataColumns(conn, metricData, fields)
+          repository.updateMetricDataColumnsBulk(conn,
+                                                 metricObj.uid,
+                                                 metricDataRows)
 
           self._updateAnomalyLikelihoodParams(
             conn,
@@ -384,7 +511,8 @@ class AnomalyService(object):
             metricObj.model_params,
             anomalyLikelihoodParams)
 
-      runSQL(engine)
+      with self._stageTimings.timeStage("write"):
+        runSQL(engine)
     except (ObjectNotFoundError, MetricNotActiveError):
       self._log.warning("Rejected inference result batch=[%s..%s] of model=%s",
                         inferenceResults[0].rowID, inferenceResults[-1].rowID,
@@ -628,6 +756,226 @@ class AnomalyService(object):
     return json.loads(zlib.decompress(payload))
 
 
+  def _processResultBatch(self, batch, bus):
+    """ Process a consumed batch of model results and publish the outcome on
+    the model results exchange. The caller is responsible for acking the batch
+    afterwards.
+
+    :param batch: model_swapper_interface._ConsumedResultBatch instance
+    :param bus: MessageBusConnector instance for publishing on the model
+      results exchange; owned by the calling thread
+    """
+    if self._profiling:
+      batchStartTime = time.time()
+
+    inferenceResults = []
+    for result in batch.objects:
+      try:
+        if isinstance(result, ModelCommandResult):
+          self._processModelCommandResult(batch.modelID, result)
+          # Construct model command result message for consumption by
+          # downstream processes
+          try:
+            cmdResultMessage = self._composeModelCommandResultMessage(
+              modelID=batch.modelID,
+              cmdResult=result)
+          except (ObjectNotFoundError, MetricNotMonitoredError):
+            pass
+          else:
+            with self._stageTimings.timeStage("publish"):
+              bus.publishExg(
+                exchange=self._modelResultsExchange,
+                routingKey="",
+                body=self._serializeModelResult(cmdResultMessage),
+                properties=self._modelCommandResultProperties)
+        elif isinstance(result, ModelInferenceResult):
+          inferenceResults.append(result)
+        else:
+          self._log.error("Unsupported ModelResult=%r", result)
+      except ObjectNotFoundError:
+        self._log.exception("Error processing result=%r "
+                            "from model=%s", result, batch.modelID)
+
+    if inferenceResults:
+      result = self._processModelInferenceResults(
+        inferenceResults,
+        metricID=batch.modelID)
+
+      if result is not None:
+        with self._stageTimings.timeStage("publish"):
+          # Construct model results payload for consumption by
+          # downstream processes
+          metricRow, dataRows = result
+          resultsMessage = self._composeModelInferenceResultsMessage(
+            metricRow,
+            dataRows)
+
+          payload = self._serializeModelResult(resultsMessage)
+
+          bus.publishExg(
+            exchange=self._modelResultsExchange,
+            routingKey="",
+            body=payload,
+            properties=self._modelInferenceResultProperties)
+
+    if self._stageTimings.countBatch() % _STAGE_TIMINGS_LOG_INTERVAL == 0:
+      self._log.info("{TAG:ANOM.STAGE.STATS} %r", self._stageTimings)
+
+    if self._profiling:
+      if inferenceResults:
+        if result is not None:
+          # pylint: disable=W0633
+          metricRow, rows = result
+          rowIdRange = (
+            "%s..%s" % (rows[0].rowid, rows[-1].rowid)
+            if len(rows) > 1
+            else str(rows[0].rowid))
+          self._log.info(
+            "{TAG:ANOM.BATCH.INF.DONE} model=%s; "
+            "numItems=%d; rows=[%s]; tailRowTS=%s; duration=%.4fs; "
+            "ds=%s; name=%s",
+            batch.modelID, len(batch.objects),
+            rowIdRange, rows[-1].timestamp.isoformat() + "Z",
+            time.time() - batchStartTime, metricRow.datasource,
+            metricRow.name)
+      else:
+        self._log.info(
+          "{TAG:ANOM.BATCH.CMD.DONE} model=%s; "
+          "numItems=%d; duration=%.4fs", batch.modelID,
+          len(batch.objects), time.time() - batchStartTime)
+
+
+  def _runSerially(self):
+    """ Consume result batches and process each one on this thread before
+    acking it
+    """
+    with ModelSwapperInterface() as modelSwapper, MessageBusConnector() as bus:
+      with modelSwapper.consumeResults(
+          onDecoded=self._onResultBatchDecoded) as consumer:
+        for batch in consumer:
+          self._processResultBatch(batch, bus)
+          batch.ack()
+
+
+  def _runPipelined(self):
+    """ Consume result batches and dispatch them to shard workers by model ID.
+    Batches are acked on this thread, since the consumer isn't thread-safe,
+    after their workers have completed them.
+
+    NOTE: batches that complete while this thread is waiting for the next
+    batch are acked once it arrives or the pipeline fills up; until then, they
+    would be redelivered if the service restarted, which is harmless since
+    result batch processing is idempotent.
+    """
+    # Create the shared SQLAlchemy engine before the workers race to do so
+    repository.engineFactory(config)
+
+    # Completed batches from the shard workers: (batch, excInfo) tuples, where
+    # excInfo is None if the batch was processed successfully or the
+    # sys.exc_info() of the processing error otherwise
+    completionQ = Queue.Queue()
+
+    shardQueues = tuple(Queue.Queue() for _ in xrange(self._numWorkers))
+
+    workers = []
+    for shardIndex, shardQ in enumerate(shardQueues):
+      worker = threading.Thread(
+        target=self._runShardWorker,
+        args=(shardQ, completionQ),
+        name="%s-shard-%s" % (self.__class__.__name__, shardIndex))
+      # Allow process to exit even if thread is still running
+      worker.setDaemon(True)
+      worker.start()
+      workers.append(worker)
+
+    self._log.info("Started %d shard workers; maxInFlightBatches=%d",
+                   self._numWorkers, self._maxInFlightBatches)
+
+    try:
+      with ModelSwapperInterface() as modelSwapper:
+        with modelSwapper.consumeResults(
+            prefetchMax=self._maxInFlightBatches,
+            onDecoded=self._onResultBatchDecoded) as consumer:
+          numInFlight = 0
+
+          for batch in consumer:
+            # Batches of the same model always go to the same shard, which
+            # processes them in order
+            shardQueues[hash(batch.modelID) % self._numWorkers].put(batch)
+            numInFlight += 1
+
+            # The message bus stops delivering batches once
+            # maxInFlightBatches of them are unacked, so wait for a batch to
+            # complete then
+            numInFlight -= self._ackCompletedBatches(
+              completionQ,
+              wait=(numInFlight >= self._maxInFlightBatches))
+
+          while numInFlight:
+            numInFlight -= self._ackCompletedBatches(completionQ, wait=True)
+    finally:
+      for shardQ in shardQueues:
+        shardQ.put(None)
+
+      for worker in workers:
+        worker.join(timeout=self._SHARD_WORKER_JOIN_TIMEOUT_SEC)
+
+
+  def _runShardWorker(self, shardQ, completionQ):
+    """ Shard worker thread target: process result batches from the shard's
+    queue in order until None is dequeued or processing of a batch fails
+
+    :param shardQ: Queue.Queue of the shard's _ConsumedResultBatch instances
+    :param completionQ: Queue.Queue for reporting completed batches; see
+      _runPipelined
+    """
+    with MessageBusConnector() as bus:
+      while True:
+        batch = shardQ.get()
+        if batch is None:
+          break
+
+        try:
+          self._processResultBatch(batch, bus)
+        except Exception:
+          self._log.exception("Shard worker failed to process result batch "
+                              "of model=%s", batch.modelID)
+          completionQ.put((batch, sys.exc_info()))
+          break
+
+        completionQ.put((batch, None))
+
+
+  @classmethod
+  def _ackCompletedBatches(cls, completionQ, wait):
+    """ Ack the batches that shard workers have completed
+
+    :param completionQ: Queue.Queue of completed batches; see _runPipelined
+    :param wait: if True, wait until at least one batch completes
+
+    :returns: the number of acked batches
+
+    :raises: the shard worker's exception if processing of a batch failed
+    """
+    numAcked = 0
+
+    while True:
+      try:
+        batch, excInfo = completionQ.get(block=(wait and not numAcked))
+      except Queue.Empty:
+        return numAcked
+
+      if excInfo is not None:
+        raise excInfo[0], excInfo[1], excInfo[2]
+
+      batch.ack()
+      numAcked += 1
+
+
+  def _onResultBatchDecoded(self, durationSec):
+    self._stageTimings.addStageDuration("decode", durationSec)
+
+
   def run(self):
     """
     Consumes pending results.  Once result batch arrives, it will be dispatched
@@ -635,15 +983,6 @@ class AnomalyService(object):
 
     :see: `_processModelCommandResult` and `_processModelInferenceResults`
     """
-    # Properties for publishing model command results on RabbitMQ exchange
-    modelCommandResultProperties = MessageProperties(
-        deliveryMode=amqp.constants.AMQPDeliveryModes.PERSISTENT_MESSAGE,
-        headers=dict(dataType="model-cmd-result"))
-
-    # Properties for publishing model inference results on RabbitMQ exchange
-    modelInferenceResultProperties = MessageProperties(
-        deliveryMode=amqp.constants.AMQPDeliveryModes.PERSISTENT_MESSAGE)
-
     # Declare an exchange for forwarding our results
     with amqp.synchronous_amqp_client.SynchronousAmqpClient(
         amqp.connection.getRabbitmqConnectionParameters()) as amqpClient:
@@ -651,84 +990,13 @@ class AnomalyService(object):
                                  exchangeType="fanout",
                                  durable=True)
 
-    with ModelSwapperInterface() as modelSwapper, MessageBusConnector() as bus:
-      with modelSwapper.consumeResults() as consumer:
-        for batch in consumer:
-          if self._profiling:
-            batchStartTime = time.time()
-
-          inferenceResults = []
-          for result in batch.objects:
-            try:
-              if isinstance(result, ModelCommandResult):
-                self._processModelCommandResult(batch.modelID, result)
-                # Construct model command result message for consumption by
-                # downstream processes
-                try:
-                  cmdResultMessage = self._composeModelCommandResultMessage(
-                    modelID=batch.modelID,
-                    cmdResult=result)
-                except (ObjectNotFoundError, MetricNotMonitoredError):
-                  pass
-                else:
-                  bus.publishExg(
-                    exchange=self._modelResultsExchange,
-                    routingKey="",
-                    body=self._serializeModelResult(cmdResultMessage),
-                    properties=modelCommandResultProperties)
-              elif isinstance(result, ModelInferenceResult):
-                inferenceResults.append(result)
-              else:
-                self._log.error("Unsupported ModelResult=%r", result)
-            except ObjectNotFoundError:
-              self._log.exception("Error processing result=%r "
-                                  "from model=%s", result, batch.modelID)
-
-          if inferenceResults:
-            result = self._processModelInferenceResults(
-              inferenceResults,
-              metricID=batch.modelID)
-
-            if result is not None:
-              # Construct model results payload for consumption by
-              # downstream processes
-              metricRow, dataRows = result
-              resultsMessage = self._composeModelInferenceResultsMessage(
-                metricRow,
-                dataRows)
-
-              payload = self._serializeModelResult(resultsMessage)
-
-              bus.publishExg(
-                exchange=self._modelResultsExchange,
-                routingKey="",
-                body=payload,
-                properties=modelInferenceResultProperties)
-
-          batch.ack()
-
-          if self._profiling:
-            if inferenceResults:
-              if result is not None:
-                # pylint: disable=W0633
-                metricRow, rows = result
-                rowIdRange = (
-                  "%s..%s" % (rows[0].rowid, rows[-1].rowid)
-                  if len(rows) > 1
-                  else str(rows[0].rowid))
-                self._log.info(
-                  "{TAG:ANOM.BATCH.INF.DONE} model=%s; "
-                  "numItems=%d; rows=[%s]; tailRowTS=%s; duration=%.4fs; "
-                  "ds=%s; name=%s",
-                  batch.modelID, len(batch.objects),
-                  rowIdRange, rows[-1].timestamp.isoformat() + "Z",
-                  time.time() - batchStartTime, metricRow.datasource,
-                  metricRow.name)
-            else:
-              self._log.info(
-                "{TAG:ANOM.BATCH.CMD.DONE} model=%s; "
-                "numItems=%d; duration=%.4fs", batch.modelID,
-                len(batch.objects), time.time() - batchStartTime)
+    try:
+      if self._numWorkers:
+        self._runPipelined()
+      else:
+        self._runSerially()
+    finally:
+      self._log.info("{TAG:ANOM.STAGE.STATS} %r", self._stageTimings)
 
     self._log.info("Stopped processing model results")
 
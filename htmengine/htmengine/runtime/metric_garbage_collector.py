@@ -26,6 +26,7 @@ arbitrary timestamps that are possibly in the past or future, such as HTM-IT.
 """
 
 import argparse
+from datetime import datetime, timedelta
 import logging
 import sys
 import time
@@ -49,6 +50,12 @@ _MAX_DELETE_BATCH_SIZE = 1000
 
 
 
+# Number of upcoming days for which to keep daily metric_data partitions
+# pre-created when metric_data is partitioned by day
+_NUM_FUTURE_PARTITION_DAYS = 7
+
+
+
 # How many seconds to sleep between garbage collection cycles
 _PAUSE_INTERVAL_SEC = 3600
 
@@ -98,17 +105,32 @@ def purgeOldMetricDataRows(thresholdDays):
   """ Purge rows from metric data table with timestamps that are older than
   the given number of days.
 
+  If metric_data is partitioned by day (see
+  htmengine.repository.partitionMetricDataByDay), first drops the partitions
+  whose rows are all older than that and pre-creates partitions for the
+  upcoming days; the remaining old rows, confined to the oldest partition, are
+  then deleted in batches like those of an unpartitioned metric_data.
+
   :param int thresholdDays: Metric data rows with timestamps older than this
     number of days will be purged.
 
-  :returns: number of rows that were deleted
+  :returns: number of rows that were deleted; includes the storage engine's
+    estimate of the number of rows in the dropped partitions
 
   """
+  sqlEngine = htmengine.repository.engineFactory(htmengine.APP_CONFIG)
+
+  numDropped = 0
+
+  partitions = _getMetricDataPartitions(sqlEngine)
+  if partitions:
+    numDropped = _rotateMetricDataPartitions(sqlEngine=sqlEngine,
+                                             partitions=partitions,
+                                             thresholdDays=thresholdDays)
+
   g_log.info("Estimating number of rows in table=%s older than numDays=%s",
              schema.metric_data, thresholdDays)
 
-  sqlEngine = htmengine.repository.engineFactory(htmengine.APP_CONFIG)
-
   selectionPredicate = (
     schema.metric_data.c.timestamp <
     sql.func.date_sub(sql.func.utc_timestamp(),
@@ -121,7 +143,7 @@ def purgeOldMetricDataRows(thresholdDays):
              estimate)
 
   if estimate == 0:
-    return 0
+    return numDropped
 
   # NOTE: We'll be deleting in smaller batches to avoid "Lock wait timeout
   # exceeded".
@@ -167,7 +189,97 @@ def purgeOldMetricDataRows(thresholdDays):
   g_log.info("Purged numRows=%s of estimated=%s old metric data rows from "
              "table=%s", totalDeleted, estimate, schema.metric_data)
 
-  return totalDeleted
+  return numDropped + totalDeleted
+
+
+
+def _rotateMetricDataPartitions(sqlEngine, partitions, thresholdDays):
+  """Pre-create the daily metric_data partitions of the upcoming days and drop
+  the partitions whose rows are all older than the given number of days
+
+  :param sqlalchemy.engine.Engine sqlEngine:
+  :param partitions: metric_data's (day, numRows) partition pairs ordered by
+    day, as returned by htmengine.repository.getMetricDataPartitions
+  :param int thresholdDays: Metric data rows with timestamps older than this
+    number of days will be purged.
+
+  :returns: estimated number of rows in the dropped partitions
+  """
+  now = datetime.utcnow()
+
+  # NOTE: partitions are created before dropping expired ones, so that
+  # metric_data always keeps at least one daily partition
+  lastDay = partitions[-1][0]
+  futureDays = [
+    lastDay + timedelta(days=i)
+    for i in xrange(1, (now.date() - lastDay).days +
+                    _NUM_FUTURE_PARTITION_DAYS + 1)]
+
+  if futureDays:
+    _addMetricDataPartitions(sqlEngine, futureDays)
+
+    g_log.info("Added metric data partitions for days=[%s..%s]",
+               futureDays[0], futureDays[-1])
+
+  # The partition of a given day holds the rows with timestamps within that
+  # day, so all of its rows are old only if the day precedes that of the
+  # threshold
+  thresholdDay = (now - timedelta(days=thresholdDays)).date()
+  expired = [(day, numRows) for day, numRows in partitions
+             if day < thresholdDay]
+
+  if not expired:
+    return 0
+
+  _dropMetricDataPartitions(sqlEngine, [day for day, _ in expired])
+
+  numDropped = sum(numRows for _, numRows in expired)
+
+  g_log.info("Dropped numPartitions=%s of days=[%s..%s] with estimated "
+             "numRows=%s old metric data rows from table=%s", len(expired),
+             expired[0][0], expired[-1][0], numDropped, schema.metric_data)
+
+  return numDropped
+
+
+
+@sqlalchemy_utils.retryOnTransientErrors
+def _getMetricDataPartitions(sqlEngine):
+  """
+  :param sqlalchemy.engine.Engine sqlEngine:
+
+  :returns: metric_data's (day, numRows) partition pairs ordered by day; empty
+    if metric_data isn't partitioned by day
+  """
+  with sqlEngine.connect() as conn:
+    return htmengine.repository.getMetricDataPartitions(conn)
+
+
+
+def _addMetricDataPartitions(sqlEngine, days):
+  """
+  NOTE: not retried on transient errors, since the partitions may have been
+  added by the failed attempt
+
+  :param sqlalchemy.engine.Engine sqlEngine:
+  :param days: ascending sequence of datetime.date following the last daily
+    partition
+  """
+  with sqlEngine.connect() as conn:
+    htmengine.repository.addMetricDataPartitions(conn, days)
+
+
+
+def _dropMetricDataPartitions(sqlEngine, days):
+  """
+  NOTE: not retried on transient errors, since the partitions may have been
+  dropped by the failed attempt
+
+  :param sqlalchemy.engine.Engine sqlEngine:
+  :param days: sequence of datetime.date of the partitions to drop
+  """
+  with sqlEngine.connect() as conn:
+    htmengine.repository.dropMetricDataPartitions(conn, days)
 
 
 
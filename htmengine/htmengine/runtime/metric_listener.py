@@ -22,24 +22,32 @@
 
 """Listens on a UDP or TCP port for metric data to write to a queue.
 
-TODO: Can we re-use the message bus across connections?
-TODO: (MER-1492) Use separate thread to batch upload records to queue when
-they come in as a batch but to time out quickly to avoid long delays in
-uploading.
+By default, each TCP client is served by a thread of its own and each UDP
+datagram is forwarded via a new message bus connection. When
+num_event_loops is configured in the metric_listener section of
+application.conf, clients are instead multiplexed on a few epoll event loops
+that coalesce samples into batches and hand them off to a small pool of
+publishers with persistent message bus connections (see EventDrivenServer).
 """
 
+from collections import namedtuple
 import datetime
 import errno
+import fcntl
 import itertools
 import json
 import logging
 import optparse
 import os
+import Queue
+import select
 import socket
 import SocketServer
 import threading
 import time
 
+import numpy
+
 from nta.utils.config import Config
 from nta.utils.logging_support_raw import LoggingSupport
 from nta.utils import threading_utils
@@ -55,6 +63,10 @@ from nta.utils.message_bus_connector import MessageQueueNotFound
 # Max number of data samples per batch
 _MAX_BATCH_SIZE = 200
 
+# Max number of batches waiting to be forwarded by an EventDrivenServer
+# publisher before its event loops stop reading input
+_MAX_PENDING_BATCHES_PER_PUBLISHER = 100
+
 
 LOGGER = getExtendedLogger(__name__)
 
@@ -113,6 +125,139 @@ def parsePlaintext(data):
 
 
 
+# Columnar result of parsePlaintextBatch
+#
+# metricNames: list of the distinct metric names of the accepted samples, in
+#   order of first appearance
+# metricIndices: numpy int array of the index of each accepted sample's metric
+#   name in metricNames
+# values: numpy float64 array of the accepted samples' values
+# timestamps: numpy float64 array of the accepted samples' unix timestamps
+# rejectedIndices: list of the indices of the input lines that couldn't be
+#   parsed, in ascending order
+PlaintextBatch = namedtuple(
+  "PlaintextBatch",
+  "metricNames metricIndices values timestamps rejectedIndices")
+
+
+# Range of unix timestamps representable by datetime.datetime
+_MIN_TIMESTAMP = (datetime.datetime.min -
+                  datetime.datetime(1970, 1, 1)).total_seconds()
+_MAX_TIMESTAMP = (datetime.datetime.max -
+                  datetime.datetime(1970, 1, 1)).total_seconds()
+
+
+
+def _parseFloats(strings):
+  """ Convert a sequence of strings to floats in bulk
+
+  :returns: two-tuple (numpy float64 array, list of the positions of strings
+    that couldn't be converted); the array holds NaN at those positions
+  """
+  try:
+    return (numpy.fromiter(itertools.imap(float, strings), numpy.float64,
+                           len(strings)),
+            [])
+  except ValueError:
+    pass
+
+  # Find the culprits
+  badPositions = []
+  floats = numpy.empty(len(strings), dtype=numpy.float64)
+  for i, string in enumerate(strings):
+    try:
+      floats[i] = float(string)
+    except ValueError:
+      floats[i] = numpy.nan
+      badPositions.append(i)
+
+  return floats, badPositions
+
+
+
+def parsePlaintextBatch(lines):
+  """ Parse a batch of plaintext data samples in bulk; each line is parsed
+  like parsePlaintext does
+
+  :param lines: sequence of whitespace-separated text strings containing the
+    following items in order: <metric-name> <data-value> <unix-timestamp>
+
+  :returns: PlaintextBatch of the samples
+  """
+  # The per-line work is limited to splitting the line and indexing the metric
+  # name; conversions are done in bulk
+  nameIndices = dict()
+  metricNames = []
+  metricIndices = []
+  valueStrings = []
+  timestampStrings = []
+  lineIndices = []
+  rejectedIndices = []
+
+  for i, line in enumerate(lines):
+    try:
+      name, valueString, timestampString = line.split()
+    except (AttributeError, TypeError, ValueError):
+      rejectedIndices.append(i)
+      continue
+
+    metricIndex = nameIndices.get(name)
+    if metricIndex is None:
+      metricIndex = nameIndices[name] = len(metricNames)
+      metricNames.append(name)
+
+    metricIndices.append(metricIndex)
+    valueStrings.append(valueString)
+    timestampStrings.append(timestampString)
+    lineIndices.append(i)
+
+  metricIndices = numpy.array(metricIndices, dtype=numpy.int32)
+  values, badValuePositions = _parseFloats(valueStrings)
+  timestamps, _ = _parseFloats(timestampStrings)
+
+  # NOTE: NaN timestamps fail the range check as well
+  badPositions = set(badValuePositions)
+  with numpy.errstate(invalid="ignore"):
+    badPositions.update(
+      numpy.flatnonzero(~((timestamps >= _MIN_TIMESTAMP) &
+                          (timestamps < _MAX_TIMESTAMP))).tolist())
+
+  if badPositions:
+    rejectedIndices = sorted(
+      rejectedIndices + [lineIndices[pos] for pos in badPositions])
+
+    accepted = numpy.ones(len(lineIndices), dtype=bool)
+    accepted[list(badPositions)] = False
+    metricIndices = metricIndices[accepted]
+    values = values[accepted]
+    timestamps = timestamps[accepted]
+
+    # Drop the names of metrics without accepted samples
+    usedIndices, metricIndices = numpy.unique(metricIndices,
+                                              return_inverse=True)
+    metricNames = [metricNames[j] for j in usedIndices]
+
+  return PlaintextBatch(metricNames=metricNames,
+                        metricIndices=metricIndices,
+                        values=values,
+                        timestamps=timestamps,
+                        rejectedIndices=rejectedIndices)
+
+
+
+def utcDatetimesFromTimestamps(timestamps):
+  """ Convert unix timestamps to naive UTC datetimes in bulk, like
+  datetime.datetime.utcfromtimestamp
+
+  :param timestamps: numpy float64 array of unix timestamps, e.g.
+    PlaintextBatch.timestamps
+  :returns: numpy object array of datetime.datetime
+  """
+  return (numpy.round(timestamps * 1e6).astype(numpy.int64)
+          .astype("datetime64[us]").astype(object))
+
+
+
 class Transport(object):
   __slots__ = ("UDP", "TCP")
   UDP = "udp"
@@ -147,14 +292,21 @@ def _forwardData(messageBus, data):
   if gProfiling and data:
     now = time.time()
     try:
-      for sample in data:
-        metricName, _value, timestamp = parsePlaintext(sample)
+      samples = parsePlaintextBatch(data)
+      for metricIndex, timestamp in itertools.izip(
+          samples.metricIndices,
+          utcDatetimesFromTimestamps(samples.timestamps)):
         LOGGER.info(
           "{TAG:CUSLSR.FW.DONE} metricName=%s; timestamp=%s; duration=%.4fs",
-          metricName, timestamp.isoformat() + "Z", now - startTime)
+          samples.metricNames[metricIndex], timestamp.isoformat() + "Z",
+          now - startTime)
+
+      for i in samples.rejectedIndices:
+        LOGGER.error("Profiling failed for sample=%r in data=[%r..%r]",
+                     data[i], data[0], data[-1])
     except Exception:
-      LOGGER.exception("Profiling failed for sample=%r in data=[%r..%r]",
-                       sample, data[0], data[-1])
+      LOGGER.exception("Profiling failed for data=[%r..%r]", data[0],
+                       data[-1])
 
 
 
@@ -328,6 +480,417 @@ class ThreadedTCPServer(SocketServer.ThreadingMixIn,
 
 
 
+def _runPublisher(publishQ):
+  """ EventDrivenServer publisher thread target: forward the batches from
+  publishQ over a persistent message bus connection, in order, until None is
+  dequeued.
+
+  :param publishQ: Queue.Queue of batches; each batch is a list of samples
+  """
+  with MessageBusConnector() as messageBus:
+    while True:
+      batch = publishQ.get()
+      if batch is None:
+        break
+
+      try:
+        _forwardData(messageBus, batch)
+      except Exception:  # pylint: disable=W0703
+        LOGGER.exception("Failed to forward batch; dropping batchLen=%d: "
+                         "[%r..%r]", len(batch), batch[0], batch[-1])
+
+
+
+class _EventLoop(object):
+  """ Multiplexes sockets with epoll on a thread of its own. Splits the input
+  of stream sockets into lines and takes each datagram of datagram sockets as
+  a sample, coalescing the samples into batches that are placed on a publish
+  queue once they reach the max batch size or once their first sample has
+  waited for maxBatchDelaySec.
+  """
+
+  _RECV_BUF_SIZE = 65536
+
+  # Max number of datagrams to read from a datagram socket per event, so that
+  # other sockets get their turn
+  _MAX_DATAGRAMS_PER_EVENT = 1000
+
+  # Max length of a line from a stream socket; a client connection whose
+  # unterminated line exceeds it is closed, so that a client that never sends
+  # a newline can't make its line buffer grow without bound
+  _MAX_LINE_LENGTH = 65536
+
+
+  def __init__(self, publishQ, maxBatchSize, maxBatchDelaySec):
+    """
+    :param publishQ: Queue.Queue for the batches of samples
+    :param maxBatchSize: max number of samples per batch
+    :param maxBatchDelaySec: max time that a sample may wait in a batch for
+      more samples
+    """
+    self._publishQ = publishQ
+    self._maxBatchSize = maxBatchSize
+    self._maxBatchDelaySec = maxBatchDelaySec
+
+    self._poller = select.epoll()
+
+    # fd -> (socket, callback to invoke when the socket is readable)
+    self._readers = dict()
+
+    # Line buffers of stream sockets keyed by fd
+    self._lineBuffers = dict()
+
+    # Sockets added by other threads, pending registration with our poller;
+    # (socket, callback) pairs
+    self._pendingReadersQ = Queue.Queue()
+
+    # Writing to this pipe wakes up the event loop
+    self._wakeupReadFd, self._wakeupWriteFd = os.pipe()
+    for fd in (self._wakeupReadFd, self._wakeupWriteFd):
+      fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) |
+                  os.O_NONBLOCK)
+    self._poller.register(self._wakeupReadFd, select.EPOLLIN)
+
+    self._stopRequested = False
+
+    self._batch = []
+    self._batchDeadline = None
+
+
+  def addReader(self, sock, callback):
+    """ [thread-safe] Register a non-blocking socket with the event loop
+
+    :param sock: the socket
+    :param callback: function to call with the socket on the event loop thread
+      when the socket is readable
+    """
+    self._pendingReadersQ.put((sock, callback))
+    self._wakeUp()
+
+
+  def addStreamSocket(self, sock):
+    """ [thread-safe] Register a non-blocking client connection socket; the
+    event loop closes it upon EOF or error
+    """
+    self.addReader(sock, self._readStream)
+
+
+  def addDatagramSocket(self, sock):
+    """ [thread-safe] Register a non-blocking datagram socket """
+    self.addReader(sock, self._readDatagrams)
+
+
+  def stop(self):
+    """ [thread-safe] Request the event loop to stop; the event loop places
+    the samples that it has already received on the publish queue before
+    stopping
+    """
+    self._stopRequested = True
+    self._wakeUp()
+
+
+  def close(self):
+    """ Release the event loop's resources once it has stopped running """
+    self._poller.close()
+    os.close(self._wakeupReadFd)
+    os.close(self._wakeupWriteFd)
+
+
+  def run(self):
+    """ Run the event loop until stop() is called; the client connections are
+    closed on return
+    """
+    try:
+      while not self._stopRequested:
+        if self._batchDeadline is None:
+          timeout = -1
+        else:
+          timeout = max(0, self._batchDeadline - time.time())
+
+        try:
+          events = self._poller.poll(timeout)
+        except IOError as e:
+          if e.errno == errno.EINTR:
+            continue
+
+          raise
+
+        for fd, _eventMask in events:
+          if fd == self._wakeupReadFd:
+            self._registerPendingReaders()
+          elif fd in self._readers:
+            sock, callback = self._readers[fd]
+            callback(sock)
+
+        if self._batch and time.time() >= self._batchDeadline:
+          self._flushBatch()
+    finally:
+      self._flushBatch()
+
+      for fd in self._lineBuffers.keys():
+        self._closeStream(self._readers[fd][0])
+
+
+  def _wakeUp(self):
+    try:
+      os.write(self._wakeupWriteFd, "x")
+    except OSError as e:
+      # A full pipe will wake up the event loop just the same
+      if e.errno != errno.EAGAIN:
+        raise
+
+
+  def _registerPendingReaders(self):
+    try:
+      while os.read(self._wakeupReadFd, 4096):
+        pass
+    except OSError as e:
+      if e.errno not in (errno.EAGAIN, errno.EINTR):
+        raise
+
+    while True:
+      try:
+        sock, callback = self._pendingReadersQ.get_nowait()
+      except Queue.Empty:
+        break
+
+      fd = sock.fileno()
+      self._readers[fd] = (sock, callback)
+      if callback == self._readStream:
+        self._lineBuffers[fd] = bytearray()
+      self._poller.register(fd, select.EPOLLIN)
+
+
+  def _closeStream(self, sock):
+    fd = sock.fileno()
+    self._poller.unregister(fd)
+    del self._readers[fd]
+    del self._lineBuffers[fd]
+    sock.close()
+
+
+  def _readStream(self, sock):
+    """ Read available data from a client connection and add the
+    newline-terminated lines to the batch; at EOF, add the remnant and close
+    the connection. Connections whose unterminated line exceeds
+    _MAX_LINE_LENGTH are closed.
+    """
+    lineBuf = self._lineBuffers[sock.fileno()]
+
+    try:
+      data = sock.recv(self._RECV_BUF_SIZE)
+    except socket.error as e:
+      if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+        return
+
+      LOGGER.warning("Closing client connection after recv error: %r", e)
+      data = ""
+
+    if not data:
+      # EOF reached; add the remnant (without newline)
+      if lineBuf.strip():
+        self._addSample(str(lineBuf).strip())
+
+      self._closeStream(sock)
+      return
+
+    lineBuf.extend(data)
+
+    eolPos = lineBuf.rfind("\n")
+    if eolPos != -1:
+      for line in str(lineBuf[0:eolPos]).split("\n"):
+        line = line.strip()
+        if line:
+          self._addSample(line)
+
+      del lineBuf[0:eolPos + 1]
+
+    if len(lineBuf) > self._MAX_LINE_LENGTH:
+      LOGGER.warning("Closing client connection whose line exceeds "
+                     "maxLineLength=%d", self._MAX_LINE_LENGTH)
+      self._closeStream(sock)
+
+
+  def _readDatagrams(self, sock):
+    """ Add the available datagrams to the batch; recv errors are logged and
+    don't stop the event loop
+    """
+    for _ in xrange(self._MAX_DATAGRAMS_PER_EVENT):
+      try:
+        data = sock.recv(self._RECV_BUF_SIZE)
+      except socket.error as e:
+        if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+          LOGGER.warning("Datagram recv error: %r", e)
+
+        return
+
+      data = data.strip()
+      if data:
+        self._addSample(data)
+
+
+  def _addSample(self, sample):
+    if not self._batch:
+      self._batchDeadline = time.time() + self._maxBatchDelaySec
+
+    self._batch.append(sample)
+
+    if len(self._batch) >= self._maxBatchSize:
+      self._flushBatch()
+
+
+  def _flushBatch(self):
+    if self._batch:
+      LOGGER.debug("flushing batchLen=%d", len(self._batch))
+      self._publishQ.put(self._batch)
+
+    self._batch = []
+    self._batchDeadline = None
+
+
+
+class EventDrivenServer(object):
+  """ Serves TCP or UDP clients on a few epoll event loops, each on a thread of
+  its own, and forwards their samples in batches via a small pool of
+  publishers with persistent message bus connections.
+
+  The first event loop accepts TCP connections and distributes them among the
+  event loops. UDP is served by a single event loop. Each event loop hands off
+  its batches to one publisher, so that the samples of each client are
+  forwarded in the order of arrival.
+  """
+
+  def __init__(self, listeningAddr, transport, numEventLoops, numPublishers,
+               maxBatchSize, maxBatchDelaySec):
+    """
+    :param listeningAddr: (host, port) pair
+    :param transport: Transport.TCP or Transport.UDP
+    :param numEventLoops: number of event loops; ignored for UDP
+    :param numPublishers: number of publishers; capped at the number of event
+      loops
+    :param maxBatchSize: max number of samples per batch
+    :param maxBatchDelaySec: max time that a sample may wait in a batch for
+      more samples
+    """
+    if transport == Transport.UDP:
+      numEventLoops = 1
+
+    numPublishers = max(1, min(numPublishers, numEventLoops))
+
+    self._publishQueues = tuple(
+      Queue.Queue(maxsize=_MAX_PENDING_BATCHES_PER_PUBLISHER)
+      for _ in xrange(numPublishers))
+
+    self._eventLoops = tuple(
+      _EventLoop(publishQ=self._publishQueues[i % numPublishers],
+                 maxBatchSize=maxBatchSize,
+                 maxBatchDelaySec=maxBatchDelaySec)
+      for i in xrange(numEventLoops))
+
+    if transport == Transport.UDP:
+      self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    else:
+      self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+
+    self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    self.socket.bind(listeningAddr)
+    self.server_address = self.socket.getsockname()
+    self.socket.setblocking(0)
+
+    if transport == Transport.UDP:
+      self._eventLoops[0].addDatagramSocket(self.socket)
+    else:
+      self.socket.listen(socket.SOMAXCONN)
+      self._eventLoops[0].addReader(self.socket, self._acceptConnections)
+
+    self._nextEventLoopIndex = 0
+
+
+  def serve_forever(self):
+    """ Run the event loops and publishers until shutdown() is called """
+    publishers = []
+    for i, publishQ in enumerate(self._publishQueues):
+      publisher = threading.Thread(
+        target=_runPublisher,
+        args=(publishQ,),
+        name="%s-publisher-%s" % (self.__class__.__name__, i))
+      # Allow process to exit even if thread is still running
+      publisher.setDaemon(True)
+      publisher.start()
+      publishers.append(publisher)
+
+    eventLoopThreads = []
+    for i, eventLoop in enumerate(self._eventLoops):
+      thread = threading.Thread(
+        target=eventLoop.run,
+        name="%s-loop-%s" % (self.__class__.__name__, i))
+      # Allow process to exit even if thread is still running
+      thread.setDaemon(True)
+      thread.start()
+      eventLoopThreads.append(thread)
+
+    LOGGER.info("Serving with numEventLoops=%d, numPublishers=%d",
+                len(self._eventLoops), len(self._publishQueues))
+
+    try:
+      for thread in eventLoopThreads:
+        # NOTE: join with timeout, so that KeyboardInterrupt isn't deferred
+        while thread.isAlive():
+          thread.join(timeout=1)
+    finally:
+      for eventLoop in self._eventLoops:
+        eventLoop.stop()
+
+      for thread in eventLoopThreads:
+        thread.join()
+
+      # Let the publishers forward the remaining batches
+      for publishQ in self._publishQueues:
+        publishQ.put(None)
+
+      for publisher in publishers:
+        publisher.join()
+
+      for eventLoop in self._eventLoops:
+        eventLoop.close()
+
+
+  def shutdown(self):
+    """ [thread-safe] Stop serve_forever once the samples that have been
+    received are forwarded
+    """
+    for eventLoop in self._eventLoops:
+      eventLoop.stop()
+
+
+  def server_close(self):
+    self.socket.close()
+
+
+  def _acceptConnections(self, listeningSock):
+    """ Accept the pending client connections and distribute them among the
+    event loops round-robin
+    """
+    while True:
+      try:
+        conn, clientAddr = listeningSock.accept()
+      except socket.error as e:
+        if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+          return
+
+        LOGGER.warning("Failed to accept client connection: %r", e)
+        return
+
+      LOGGER.info("Receiving samples from client=%s on eventLoop=%d",
+                  clientAddr, self._nextEventLoopIndex)
+
+      conn.setblocking(0)
+      self._eventLoops[self._nextEventLoopIndex].addStreamSocket(conn)
+      self._nextEventLoopIndex = (
+        (self._nextEventLoopIndex + 1) % len(self._eventLoops))
+
+
+
 @raiseExceptionOnMissingRequiredApplicationConfigPath
 def runServer(host="0.0.0.0", port=None, protocol=Protocol.PLAIN,
               transport=Transport.TCP):
@@ -338,14 +901,25 @@ def runServer(host="0.0.0.0", port=None, protocol=Protocol.PLAIN,
   LOGGER.info("Starting with host=%s, port=%s, protocol=%s, transport=%s",
               host, port, protocol, transport)
 
-  if transport == Transport.UDP:
+  config = Config("application.conf",
+                  os.environ["APPLICATION_CONFIG_PATH"])
+
+  numEventLoops = config.getint("metric_listener", "num_event_loops")
+
+  if numEventLoops:
+    server = EventDrivenServer(
+      (host, port),
+      transport,
+      numEventLoops=numEventLoops,
+      numPublishers=config.getint("metric_listener", "num_publishers"),
+      maxBatchSize=_MAX_BATCH_SIZE,
+      maxBatchDelaySec=(
+        config.getint("metric_listener", "max_batch_delay_ms") / 1000.0))
+  elif transport == Transport.UDP:
     server = ThreadedUDPServer((host, port), UDPHandler)
   elif transport == Transport.TCP:
     server = ThreadedTCPServer((host, port), TCPHandler)
 
-  config = Config("application.conf",
-                  os.environ["APPLICATION_CONFIG_PATH"])
-
   global gQueueName
   gQueueName = config.get("metric_listener", "queue_name")
 
@@ -0,0 +1,296 @@
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2015, Numenta, Inc.  Unless you have purchased from
+# Numenta, Inc. a separate commercial license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+"""
+Bounded LRU/TTL cache of metric metadata shared by metric_storer and
+MetricStreamer.
+"""
+
+from collections import namedtuple, OrderedDict
+import threading
+import time
+
+from htmengine import htmengine_logging
+
+
+
+# Cached metadata of a metric
+#
+# uid: metric uid
+# name: metric name; None if not known
+# status: metric status as last seen by us; None if not known
+# lastRowID: rowid of the metric's last metric_data row that we know of; None
+#   if not known
+# tailTimestamp: timestamp of the metric_data row with rowid lastRowID; None if
+#   not known
+MetricMetadata = namedtuple("MetricMetadata",
+                            "uid name status lastRowID tailTimestamp")
+
+
+
+class MetricMetadataCache(object):
+  """ [thread-safe] Bounded cache of MetricMetadata keyed by metric uid, with
+  a secondary index by metric name.
+
+  Entries expire ttlSec after they were last stored. When the cache is full,
+  storing a new entry evicts the least recently used one. Lookups, stores and
+  evictions take constant time.
+
+  The cache is only a hint: owners must invalidate a metric's entry when they
+  learn that the metric was deleted (e.g., from ObjectNotFoundError) and
+  report status changes that they observe via onMetricStatusChanged().
+  """
+
+  # Default max number of cached metrics
+  DEFAULT_MAX_ENTRIES = 15000
+
+  # Default expiration of cached entries
+  DEFAULT_TTL_SEC = 24 * 60 * 60
+
+  # Log cache statistics once per this many lookups
+  _STATS_LOG_INTERVAL = 10000
+
+
+  def __init__(self, maxEntries=DEFAULT_MAX_ENTRIES, ttlSec=DEFAULT_TTL_SEC):
+    """
+    :param maxEntries: max number of cached metrics
+    :param ttlSec: seconds after which a stored entry expires
+    """
+    self._log = htmengine_logging.getExtendedLogger(self.__class__.__name__)
+
+    self._maxEntries = maxEntries
+    self._ttlSec = ttlSec
+
+    self._lock = threading.Lock()
+
+    # uid -> (MetricMetadata, expiration time), in LRU order
+    self._entries = OrderedDict()
+
+    # name -> uid of the cached metrics with known names
+    self._uidsByName = dict()
+
+    self._hits = 0
+    self._misses = 0
+    self._expirations = 0
+    self._evictions = 0
+    self._invalidations = 0
+
+
+  def __repr__(self):
+    stats = self.getStats()
+    return "%s<%s>" % (
+      self.__class__.__name__,
+      ", ".join("%s=%s" % (name, stats[name]) for name in sorted(stats)))
+
+
+  def __len__(self):
+    return len(self._entries)
+
+
+  def getStats(self):
+    """
+    :returns: dict of cache statistics: numEntries, hits, misses, hitRatio,
+      expirations, evictions and invalidations
+    """
+    with self._lock:
+      lookups = self._hits + self._misses
+      return dict(numEntries=len(self._entries),
+                  hits=self._hits,
+                  misses=self._misses,
+                  hitRatio=(float(self._hits) / lookups if lookups else 0.0),
+                  expirations=self._expirations,
+                  evictions=self._evictions,
+                  invalidations=self._invalidations)
+
+
+  def get(self, uid):
+    """ Look up a metric by uid
+
+    :param uid: metric uid
+    :returns: MetricMetadata or None if not cached
+    """
+    with self._lock:
+      return self._lookup(uid)
+
+
+  def getByName(self, name):
+    """ Look up a metric by name
+
+    :param name: metric name
+    :returns: MetricMetadata or None if not cached
+    """
+    with self._lock:
+      uid = self._uidsByName.get(name)
+      if uid is None:
+        self._countLookup(hit=False)
+        return None
+
+      return self._lookup(uid)
+
+
+  def getTailTimestamp(self, uid, lastRowID):
+    """ Look up the timestamp of a metric's last metric_data row
+
+    :param uid: metric uid
+    :param lastRowID: the metric's current last_rowid
+    :returns: the cached timestamp of the metric_data row with rowid lastRowID;
+      None if not cached or if the cached timestamp is of another row (e.g.,
+      another process has added rows since)
+    :rtype: datetime.datetime or None
+    """
+    with self._lock:
+      metadata = self._entries.get(uid, (None,))[0]
+      if (metadata is None or metadata.lastRowID != lastRowID or
+          metadata.tailTimestamp is None):
+        # NOTE: count it as a miss, but don't discard the rest of the entry
+        self._countLookup(hit=False)
+        return None
+
+      metadata = self._lookup(uid)
+      return metadata.tailTimestamp if metadata is not None else None
+
+
+  def put(self, uid, **fields):
+    """ Store a metric's metadata as the most recently used entry, evicting
+    the least recently used entry if the cache is full
+
+    :param uid: metric uid
+    :param fields: MetricMetadata fields to set; the other fields retain their
+      cached values, if any, or None
+    :returns: the stored MetricMetadata
+    """
+    with self._lock:
+      entry = self._entries.pop(uid, None)
+
+      if entry is not None and entry[1] > time.time():
+        metadata = entry[0]._replace(**fields)
+      else:
+        metadata = MetricMetadata(uid=uid, name=None, status=None,
+                                  lastRowID=None, tailTimestamp=None)
+        metadata = metadata._replace(**fields)
+
+      if (entry is not None and entry[0].name != metadata.name and
+          self._uidsByName.get(entry[0].name) == uid):
+        # The old name may have been reassigned to another metric since
+        del self._uidsByName[entry[0].name]
+
+      self._entries[uid] = (metadata, time.time() + self._ttlSec)
+      if metadata.name is not None:
+        self._uidsByName[metadata.name] = uid
+
+      while len(self._entries) > self._maxEntries:
+        self._discardOldest()
+        self._evictions += 1
+
+      return metadata
+
+
+  def invalidate(self, uid):
+    """ Remove a metric's entry, if any
+
+    :param uid: metric uid
+    """
+    with self._lock:
+      if self._discard(uid):
+        self._invalidations += 1
+
+
+  def onMetricDeleted(self, uid):
+    """ Notify the cache that the metric was deleted
+
+    :param uid: metric uid
+    """
+    self.invalidate(uid)
+
+
+  def onMetricStatusChanged(self, uid, status):
+    """ Notify the cache of the metric's new status; the status of metrics that
+    aren't cached is ignored
+
+    :param uid: metric uid
+    :param status: new metric status
+    """
+    with self._lock:
+      entry = self._entries.get(uid)
+      if entry is not None and entry[0].status != status:
+        self._entries[uid] = (entry[0]._replace(status=status), entry[1])
+
+
+  def _lookup(self, uid):
+    """ Look up a metric by uid and make it the most recently used entry;
+    caller must hold the lock
+
+    :returns: MetricMetadata or None if not cached
+    """
+    entry = self._entries.pop(uid, None)
+
+    if entry is not None and entry[1] <= time.time():
+      self._discard(uid, entry=entry)
+      self._expirations += 1
+      entry = None
+
+    if entry is None:
+      self._countLookup(hit=False)
+      return None
+
+    self._entries[uid] = entry
+    self._countLookup(hit=True)
+    return entry[0]
+
+
+  def _countLookup(self, hit):
+    if hit:
+      self._hits += 1
+    else:
+      self._misses += 1
+
+    if (self._hits + self._misses) % self._STATS_LOG_INTERVAL == 0:
+      lookups = self._hits + self._misses
+      self._log.info(
+        "{TAG:METRIC.CACHE.STATS} numEntries=%d; hitRatio=%.3f; hits=%d; "
+        "misses=%d; expirations=%d; evictions=%d; invalidations=%d",
+        len(self._entries), float(self._hits) / lookups, self._hits,
+        self._misses, self._expirations, self._evictions, self._invalidations)
+
+
+  def _discard(self, uid, entry=None):
+    """ Remove a metric's entry and its name index; caller must hold the lock
+
+    :param entry: the metric's entry if it was already removed from
+      self._entries
+    :returns: True if the metric was cached
+    """
+    if entry is None:
+      entry = self._entries.pop(uid, None)
+      if entry is None:
+        return False
+
+    name = entry[0].name
+    if name is not None and self._uidsByName.get(name) == uid:
+      del self._uidsByName[name]
+
+    return True
+
+
+  def _discardOldest(self):
+    """ Remove the least recently used entry; caller must hold the lock """
+    uid, entry = self._entries.popitem(last=False)
+    self._discard(uid, entry=entry)
@@ -29,23 +29,27 @@ TODO: Get just the values for metrics from the database that we need instead
 of the entire rows. We might only need the `uid`.
 """
 
-from collections import defaultdict
-import datetime
 import itertools
 import json
 import logging
 import os
 import time
 
+import numpy
+
 from htmengine import (raiseExceptionOnMissingRequiredApplicationConfigPath,
                        repository)
 from htmengine.adapters.datasource import createCustomDatasourceAdapter
 import htmengine.exceptions
 from htmengine.htmengine_logging import getExtendedLogger
-from htmengine.runtime.metric_listener import parsePlaintext, Protocol
+from htmengine.runtime.metric_listener import (parsePlaintextBatch,
+                                               Protocol,
+                                               utcDatetimesFromTimestamps)
+from htmengine.runtime.metric_metadata_cache import MetricMetadataCache
 from htmengine.runtime.metric_streamer_util import MetricStreamer
 from htmengine.model_swapper.model_swapper_interface import (
     MessageBusConnector, ModelSwapperInterface)
+from htmengine.repository import schema
 
 from nta.utils.config import Config
 from nta.utils.logging_support_raw import LoggingSupport
@@ -55,12 +59,12 @@ from nta.utils.logging_support_raw import LoggingSupport
 LOGGER = getExtendedLogger(__name__)
 
 MAX_CACHED_METRICS = 15000
-CACHED_METRICS_TO_KEEP = 10000
 MAX_MESSAGES_PER_BATCH = 200
 POLL_DELAY_SEC = 1
 
-# Dict mapping metric name to [metric, lastAccessedDatetime]
-gCustomMetrics = None
+# MetricMetadataCache of custom metrics, shared with MetricStreamer; looked up
+# by metric name
+gMetricCache = None
 
 
 gProfiling = False
@@ -75,8 +79,7 @@ def _handleBatch(engine, messages, messageRxTimes, metricStreamer,
   determine how to parse the 'data' in the message. The data is added to the
   database and sent through the metric streamer.
 
-  The Metric objects are cached in gCustomMetrics to minimize database
-  lookups.
+  The metric uids are cached in gMetricCache to minimize database lookups.
 
   :param engine: SQLAlchemy engine object
   :type engine: sqlalchemy.engine.Engine
@@ -89,7 +92,9 @@ def _handleBatch(engine, messages, messageRxTimes, metricStreamer,
   :param modelSwapper: a :class:`ModelSwapperInterface` instance to use
   """
   # Use the protocol to determine the message format
-  data = []
+  rows = []
+  # Message-receive time of each row if profiling
+  rowRxTimes = []
   for m, rxTime in itertools.izip_longest(messages, messageRxTimes):
     try:
       message = json.loads(m.body)
@@ -99,84 +104,94 @@ def _handleBatch(engine, messages, messageRxTimes, metricStreamer,
       LOGGER.warn("Discarding message with unknown format: %s", m.body)
       return
     if protocol == Protocol.PLAIN:
-      for row in rawData:
-        try:
-          data.append(parsePlaintext(row))
-          if gProfiling and rxTime is not None:
-            metricName, _value, metricTimestamp = data[-1]
-            LOGGER.info(
-              "{TAG:CUSSTR.DATA.RX} metricName=%s; timestamp=%s; rxTime=%.4f",
-              metricName, metricTimestamp.isoformat() + "Z", rxTime)
-        except ValueError:
-          LOGGER.warn("Discarding plaintext message that can't be parsed: %s",
-                      row.strip())
+      rows.extend(rawData)
+      if gProfiling:
+        rowRxTimes.extend(itertools.repeat(rxTime, len(rawData)))
     else:
       LOGGER.warn("Discarding message with unknown protocol: %s", protocol)
       return
+
+  samples = parsePlaintextBatch(rows)
+
+  for i in samples.rejectedIndices:
+    LOGGER.warn("Discarding plaintext message that can't be parsed: %r",
+                rows[i])
+
   # Make sure we got some valid data
-  if not data:
+  if not samples.metricNames:
     return
-  # Create a dict mapping metric name to data list
-  dataDict = defaultdict(list)
-  for record in data:
-    dataDict[record[0]].append(record)
+
+  if gProfiling and rowRxTimes:
+    rowRxTimes = numpy.delete(numpy.array(rowRxTimes, dtype=object),
+                              samples.rejectedIndices)
+    for metricIndex, metricTimestamp, rxTime in itertools.izip(
+        samples.metricIndices,
+        utcDatetimesFromTimestamps(samples.timestamps),
+        rowRxTimes):
+      if rxTime is not None:
+        LOGGER.info(
+          "{TAG:CUSSTR.DATA.RX} metricName=%s; timestamp=%s; rxTime=%.4f",
+          samples.metricNames[metricIndex], metricTimestamp.isoformat() + "Z",
+          rxTime)
 
   LOGGER.info("Processing %i records for %i models from %i batches.",
-              len(data), len(dataDict), len(messages))
+              len(samples.values), len(samples.metricNames), len(messages))
 
   # For each metric, create the metric if it doesn't exist and add the data
-  _addMetricData(engine, dataDict, metricStreamer, modelSwapper)
+  _addMetricData(engine, samples, metricStreamer, modelSwapper)
 
 
 
-def _addMetricData(engine, dataDict, metricStreamer, modelSwapper):
+def _addMetricData(engine, samples, metricStreamer, modelSwapper):
   """Send metric data for each metric to the metric streamer.
 
-  TODO: document args
+  :param engine: SQLAlchemy engine object
+  :type engine: sqlalchemy.engine.Engine
+  :param samples: metric_listener.PlaintextBatch of the samples to add
+  :param metricStreamer: a :class:`MetricStreamer` instance to use
+  :param modelSwapper: a :class:`ModelSwapperInterface` instance to use
   """
+  # Group the samples by metric, preserving their order within each metric
+  order = numpy.argsort(samples.metricIndices, kind="mergesort")
+  ends = numpy.cumsum(numpy.bincount(samples.metricIndices,
+                                     minlength=len(samples.metricNames)))
+  datetimes = utcDatetimesFromTimestamps(samples.timestamps)
+
   # For each metric, create the metric if it doesn't exist and add the data
-  for metricName, metricData in dataDict.iteritems():
-    if metricName not in gCustomMetrics:
-      # Metric doesn't exist, create it
-      _addMetric(engine, metricName)
+  for metricName, start, end in itertools.izip(samples.metricNames,
+                                               itertools.chain((0,), ends),
+                                               ends):
+    metadata = gMetricCache.getByName(metricName)
+    if metadata is None:
+      # Metric isn't cached or doesn't exist, create it if needed
+      metricId = _addMetric(engine, metricName)
     else:
-      gCustomMetrics[metricName][1] = datetime.datetime.utcnow()
+      metricId = metadata.uid
     # Add the data
-    metricData = [(dt, value) for _, value, dt in metricData]
+    indices = order[start:end]
+    metricData = zip(datetimes[indices], samples.values[indices].tolist())
 
     try:
-      metricStreamer.streamMetricData(metricData,
-                                      gCustomMetrics[metricName][0].uid,
-                                      modelSwapper)
+      metricStreamer.streamMetricData(metricData, metricId, modelSwapper)
     except htmengine.exceptions.ObjectNotFoundError:
       # The metric may have been deleted and re-created, so attempt to update
-      # the cache.
-      _addMetric(engine, metricName)
+      # the cache. MetricStreamer already invalidated the stale entry.
+      metricId = _addMetric(engine, metricName)
       try:
-        metricStreamer.streamMetricData(metricData,
-                                        gCustomMetrics[metricName][0].uid,
-                                        modelSwapper)
+        metricStreamer.streamMetricData(metricData, metricId, modelSwapper)
       except htmengine.exceptions.ObjectNotFoundError:
         LOGGER.exception("Failed to add data for metric %s with uid %s",
-                         metricName, gCustomMetrics[metricName][0].uid)
+                         metricName, metricId)
     except Exception:  # Exception excludes KeyboardInterrupt from supervisor
       LOGGER.exception("Error adding custom metric data: %r", metricData)
 
 
 
 def _addMetric(engine, metricName):
-  """Add the new metric to the database."""
-  if metricName in gCustomMetrics:
-    try:
-      # Attempt to reload the metric
-      metricId = gCustomMetrics[metricName][0].uid
-      with engine.connect() as conn:
-        gCustomMetrics[metricName][0] = repository.getMetric(conn, metricId)
-      return
-    except htmengine.exceptions.ObjectNotFoundError:
-      # Do nothing, we will create new metric and update cache below
-      pass
+  """Add the new metric to the database, if needed, and cache it.
 
+  :returns: uid of the metric
+  """
   # Use the adapter to create the metric
   try:
     metricId = createCustomDatasourceAdapter().createMetric(metricName)
@@ -184,28 +199,17 @@ def _addMetric(engine, metricName):
     metricId = e.uid
 
   with engine.connect() as conn:
-    metric = repository.getMetric(conn, metricId)
+    metric = repository.getMetric(
+      conn,
+      metricId,
+      fields=[schema.metric.c.uid,
+              schema.metric.c.name,
+              schema.metric.c.status])
 
   # Add it to our cache
-  gCustomMetrics[metricName] = [metric, datetime.datetime.utcnow()]
-
-  _trimMetricCache()
-
-
+  gMetricCache.put(metric.uid, name=metric.name, status=metric.status)
 
-def _trimMetricCache():
-  # Make sure we don't have too many cached metrics now
-  if len(gCustomMetrics) > MAX_CACHED_METRICS:
-    # Compute the number of metrics we want to remove
-    numMetricsToRemove = len(gCustomMetrics) - CACHED_METRICS_TO_KEEP
-    # Get a list of metric names sorted by last accessed time
-    metricList = []
-    for name, (_metric, ts) in gCustomMetrics.iteritems():
-      metricList.append((ts, name))
-    metricList.sort()
-    # Remove the metrics accessed least recently
-    for _, name in metricList[:numMetricsToRemove]:
-      del gCustomMetrics[name]
+  return metric.uid
 
 
 @raiseExceptionOnMissingRequiredApplicationConfigPath
@@ -215,12 +219,16 @@ def runServer():
                      os.environ["APPLICATION_CONFIG_PATH"])
 
   engine = repository.engineFactory(appConfig)
-  global gCustomMetrics
-  now = datetime.datetime.utcnow()
+  global gMetricCache
+  gMetricCache = MetricMetadataCache(maxEntries=MAX_CACHED_METRICS)
 
   with engine.connect() as conn:
-    gCustomMetrics = dict(
-      (m.name, [m, now]) for m in repository.getCustomMetrics(conn))
+    for m in repository.getCustomMetrics(
+        conn,
+        fields=[schema.metric.c.uid,
+                schema.metric.c.name,
+                schema.metric.c.status]):
+      gMetricCache.put(m.uid, name=m.name, status=m.status)
 
   queueName = appConfig.get("metric_listener", "queue_name")
 
@@ -229,7 +237,7 @@ def runServer():
                 LOGGER.isEnabledFor(logging.DEBUG))
   del appConfig
 
-  metricStreamer = MetricStreamer()
+  metricStreamer = MetricStreamer(metricCache=gMetricCache)
   modelSwapper = ModelSwapperInterface()
 
   with MessageBusConnector() as bus:
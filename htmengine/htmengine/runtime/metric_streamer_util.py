@@ -26,7 +26,6 @@ writing data to queue
 import itertools
 import logging
 import os
-import time
 
 from nta.utils.config import Config
 from nta.utils.date_time_utils import epochFromNaiveUTCDatetime
@@ -34,11 +33,13 @@ from nta.utils.date_time_utils import epochFromNaiveUTCDatetime
 from htmengine import htmengine_logging, repository
 from htmengine.adapters.datasource import createDatasourceAdapter
 from htmengine.exceptions import (MetricStatisticsNotReadyError,
-                                  MetricStatusChangedError)
+                                  MetricStatusChangedError,
+                                  ObjectNotFoundError)
 from htmengine.model_swapper.model_swapper_interface import ModelInputRow
 from htmengine.repository import schema
 from htmengine.repository.queries import MetricStatus
 from htmengine.runtime import model_data_feeder
+from htmengine.runtime.metric_metadata_cache import MetricMetadataCache
 from htmengine.runtime.scalar_metric_utils import (
   MODEL_CREATION_RECORD_THRESHOLD)
 
@@ -49,9 +50,12 @@ config = Config("application.conf", os.environ.get("APPLICATION_CONFIG_PATH"))
 
 
 class MetricStreamer(object):
-  _TAIL_INPUT_TIMESTAMP_GC_INTERVAL_SEC = 7 * 24 * 60 * 60
 
-  def __init__(self):
+  def __init__(self, metricCache=None):
+    """
+    :param metricCache: MetricMetadataCache to share with the caller (e.g.,
+      metric_storer); if None, MetricStreamer creates its own
+    """
     super(MetricStreamer, self).__init__()
 
     # Make sure we have the latest version of configuration
@@ -66,14 +70,12 @@ class MetricStreamer(object):
     self._metricDataOutputChunkSize = config.getint(
       "metric_streamer", "chunk_size")
 
-    # Cache of latest metric_data timestamps for each metric; used for filtering
-    # out duplicate/re-delivered input metric data so it won't be saved again
-    # in the metric_data table. Each key is a metric id and the corresponding
-    # value is a datetime.datetime timestamp of the last metric_data stored by
-    # us in metric_data table.
-    self._tailInputMetricDataTimestamps = dict()
-    # Last garbage-collection time; seconds since unix epoch (time.time())
-    self._lastTailInputMetricDataTimestampsGCTime = 0
+    # Cache of metric metadata, including the timestamp of each metric's last
+    # metric_data row; the latter is used for filtering out
+    # duplicate/re-delivered input metric data so it won't be saved again in
+    # the metric_data table.
+    self._metricCache = (metricCache if metricCache is not None
+                         else MetricMetadataCache())
 
 
   def _scrubDataSamples(self, data, metricID, conn, lastDataRowID):
@@ -152,7 +154,9 @@ class MetricStreamer(object):
       rows = repository.addMetricData(conn, metricID, data)
 
       # Update tail metric data timestamp cache for metrics stored by us
-      self._tailInputMetricDataTimestamps[metricID] = rows[-1]["timestamp"]
+      self._metricCache.put(metricID,
+                            lastRowID=rows[-1]["rowid"],
+                            tailTimestamp=rows[-1]["timestamp"])
 
       # Add newly-stored records to batch for sending to CLA model
       modelInputRows = tuple(
@@ -187,26 +191,15 @@ class MetricStreamer(object):
     :param lastDataRowID: last metric data row identifier for metric with given
       metric id
 
-    :returns: timestamp of the last metric data row that *we* stored in
-        metric_data table for the given metric id, or None if none have been
-        stored
+    :returns: timestamp of the metric data row with rowid lastDataRowID, or
+        None if none have been stored
     :rtype: datetime.datetime or None
-
-    TODO: unit-test
     """
-    if (time.time() - self._lastTailInputMetricDataTimestampsGCTime >
-        self._TAIL_INPUT_TIMESTAMP_GC_INTERVAL_SEC):
-      # Garbage-collect our cache
-      # TODO: unit-test
-      self._tailInputMetricDataTimestamps.clear()
-      self._lastTailInputMetricDataTimestampsGCTime = time.time()
-      self._log.info("Garbage-collected tailInputMetricDataTimestamps cache")
-
-    timestamp = None
-    try:
-      # First try to get it from cache
-      timestamp = self._tailInputMetricDataTimestamps[metricID]
-    except KeyError:
+    # First try to get it from cache; the cached timestamp is only valid if no
+    # rows have been added since, e.g. by another process
+    timestamp = self._metricCache.getTailTimestamp(metricID, lastDataRowID)
+
+    if timestamp is None and lastDataRowID:
       # Not in cache, so try to load it from db
       rows = repository.getMetricData(conn,
                                       metricID,
@@ -214,7 +207,9 @@ class MetricStreamer(object):
 
       if rows.rowcount > 0 and rows.returns_rows:
         timestamp = next(iter(rows)).timestamp
-        self._tailInputMetricDataTimestamps[metricID] = timestamp
+        self._metricCache.put(metricID,
+                              lastRowID=lastDataRowID,
+                              tailTimestamp=timestamp)
 
     return timestamp
 
@@ -261,13 +256,21 @@ class MetricStreamer(object):
       """
       with repository.engineFactory(config).connect() as conn:
         with conn.begin():
-          # Syncrhonize with adapter's monitorMetric
-          metricObj = repository.getMetricWithUpdateLock(
-            conn,
-            metricID,
-            fields=[schema.metric.c.status,
-                    schema.metric.c.last_rowid,
-                    schema.metric.c.datasource])
+          # Syncrhonize with adapter's monitorMetric. NOTE: this also provides
+          # the authoritative status and last_rowid, so it can't be served from
+          # the metric cache.
+          try:
+            metricObj = repository.getMetricWithUpdateLock(
+              conn,
+              metricID,
+              fields=[schema.metric.c.status,
+                      schema.metric.c.last_rowid,
+                      schema.metric.c.datasource])
+          except ObjectNotFoundError:
+            self._metricCache.onMetricDeleted(metricID)
+            raise
+
+          self._metricCache.onMetricStatusChanged(metricID, metricObj.status)
 
           if (metricObj.status != MetricStatus.UNMONITORED and
               metricObj.status != MetricStatus.ACTIVE and
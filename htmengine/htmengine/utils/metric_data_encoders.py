@@ -0,0 +1,168 @@
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2015, Numenta, Inc.  Unless you have purchased from
+# Numenta, Inc. a separate commercial license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+"""
+Streaming encoders of the metric data chunks of
+htmengine.repository.getMetricDataChunks for the metric data web service
+responses. The chunks' rows must have uid, timestamp, metric_value,
+anomaly_score and rowid fields.
+"""
+
+import json
+
+import msgpack
+import numpy
+
+
+
+# Content type of the columnar msgpack encoding; see encodeMsgpackColumns
+COLUMNAR_MSGPACK_CONTENT_TYPE = "application/x-msgpack-columnar"
+
+# Names of the fields of a metric data record, following the uid
+RECORD_FIELD_NAMES = ("timestamp", "value", "anomaly_score", "rowid")
+
+# Little-endian array element types of the fields of the columnar frames
+COLUMN_DTYPES = ("<i8", "<f8", "<f8", "<i8")
+
+
+
+def _formatTimestamp(timestamp):
+  # NOTE: metric_data timestamps don't have fractional seconds, so this is
+  # equivalent to, but faster than, strftime("%Y-%m-%d %H:%M:%S")
+  return timestamp.isoformat(" ")
+
+
+
+def _encodeJSONRecords(rows):
+  """
+  :returns: JSON array elements of the rows' records, without the brackets
+  """
+  return json.dumps([(_formatTimestamp(row.timestamp),
+                      row.metric_value,
+                      row.anomaly_score,
+                      row.rowid)
+                     for row in rows])[1:-1]
+
+
+
+def encodeJSON(chunks, multiMetric):
+  """ Encode metric data as a JSON object, one piece per chunk
+
+  Single metric: {"names": [...], "data": [[timestamp, value, anomaly_score,
+  rowid], ...]}
+
+  Multiple metrics: {"names": [...], "metrics": [{"uid": uid, "data": [...]},
+  ...]}
+
+  :param chunks: iterable of lists of rows, each of a single metric, grouped
+    by metric
+  :param bool multiMetric: True to group the records by metric
+  :returns: generator of JSON text pieces
+  """
+  yield '{"names": %s, ' % (json.dumps(RECORD_FIELD_NAMES),)
+
+  if not multiMetric:
+    yield '"data": ['
+    separator = ""
+    for rows in chunks:
+      yield separator + _encodeJSONRecords(rows)
+      separator = ", "
+
+    yield "]}"
+    return
+
+  yield '"metrics": ['
+  uid = None
+  for rows in chunks:
+    if rows[0].uid == uid:
+      yield ", " + _encodeJSONRecords(rows)
+      continue
+
+    yield '%s{"uid": %s, "data": [%s' % (
+      "]}, " if uid is not None else "",
+      json.dumps(rows[0].uid),
+      _encodeJSONRecords(rows))
+    uid = rows[0].uid
+
+  yield "]}]}" if uid is not None else "]}"
+
+
+
+def encodeMsgpackRows(chunks):
+  """ Encode metric data as a stream of msgpack arrays: a header of the field
+  names ["names", "uid", "timestamp", ...], followed by one array per record
+  (uid, epoch timestamp, value, anomaly_score, rowid)
+
+  :param chunks: iterable of lists of rows
+  :returns: generator of msgpack stream pieces, one per chunk
+  """
+  packer = msgpack.Packer()
+
+  yield packer.pack(("names", "uid") + RECORD_FIELD_NAMES)
+
+  for rows in chunks:
+    timestamps = _epochTimestamps(rows).tolist()
+    yield "".join(packer.pack((row.uid,
+                               timestamp,
+                               row.metric_value,
+                               row.anomaly_score,
+                               row.rowid))
+                  for row, timestamp in zip(rows, timestamps))
+
+
+
+def encodeMsgpackColumns(chunks):
+  """ Encode metric data as a stream of msgpack arrays: a header of the field
+  names ["names", "uid", "timestamp", ...], followed by one columnar frame per
+  chunk: [uid, timestamps, values, anomaly_scores, rowids], where uid is a
+  string and the rest are raw strings holding typed arrays of the chunk's
+  records with the element types of COLUMN_DTYPES. Timestamps are epoch
+  seconds; null anomaly scores are NaN.
+
+  NOTE: the pinned msgpack-python 0.3.0 has no bin type, so the columns are
+  packed as raw strings.
+
+  :param chunks: iterable of lists of rows, each of a single metric
+  :returns: generator of msgpack stream pieces, one per chunk
+  """
+  packer = msgpack.Packer()
+
+  yield packer.pack(("names", "uid") + RECORD_FIELD_NAMES)
+
+  for rows in chunks:
+    yield packer.pack((
+      rows[0].uid,
+      _epochTimestamps(rows).tobytes(),
+      numpy.array([row.metric_value for row in rows],
+                  dtype=COLUMN_DTYPES[1]).tobytes(),
+      numpy.array([row.anomaly_score for row in rows],
+                  dtype=COLUMN_DTYPES[2]).tobytes(),
+      numpy.array([row.rowid for row in rows],
+                  dtype=COLUMN_DTYPES[3]).tobytes()))
+
+
+
+def _epochTimestamps(rows):
+  """
+  :returns: numpy array of the rows' UTC timestamps as epoch seconds
+  """
+  return numpy.array([row.timestamp for row in rows],
+                     dtype="datetime64[s]").astype(COLUMN_DTYPES[0])
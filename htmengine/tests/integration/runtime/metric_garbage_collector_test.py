@@ -22,6 +22,9 @@
 """Integration test for htmengine.runtime.metric_garbage_collector
 """
 
+# Suppress pylint warnings concerning access to protected member
+# pylint: disable=W0212
+
 from datetime import datetime, timedelta
 import unittest
 import uuid
@@ -118,3 +121,66 @@ class MetricGarbageCollectorTestCase(unittest.TestCase):
       self.assertItemsEqual(
         [(row["value"], row["timestamp"]) for row in youngRows],
         [(row.metric_value, row.timestamp) for row in remainingRows])  # pylint: disable=E1101
+
+
+  def testPurgeOldMetricDataFromPartitions(self):
+
+    gcThresholdDays = 90
+
+    now = datetime.utcnow().replace(microsecond=0)
+    today = now.date()
+
+    uid1 = uuid.uuid1().hex
+
+    # Rows in partitions that expired entirely and a row in the threshold day's
+    # partition that expired
+    oldRows = [
+      dict(value=1.0, timestamp=now - timedelta(days=gcThresholdDays + 3)),
+      dict(value=2.0, timestamp=now - timedelta(days=gcThresholdDays + 2)),
+      dict(value=3.0,
+           timestamp=datetime.combine(
+             today - timedelta(days=gcThresholdDays), datetime.min.time())),
+    ]
+
+    youngRows = [
+      dict(value=4.0, timestamp=now - timedelta(days=gcThresholdDays - 1)),
+      dict(value=5.0, timestamp=now),
+    ]
+
+    allRows = oldRows + youngRows
+
+    with repository_test_utils.HtmengineManagedTempRepository("metric_gc"):
+      engine = htmengine.repository.engineFactory(config=htmengine.APP_CONFIG)
+
+      with engine.connect() as conn:  # pylint: disable=E1101
+        htmengine.repository.partitionMetricDataByDay(
+          conn,
+          [today - timedelta(days=i)
+           for i in xrange(gcThresholdDays + 3, -1, -1)])
+
+        htmengine.repository.addMetric(conn, uid=uid1)
+        htmengine.repository.addMetricData(
+          conn,
+          metricId=uid1,
+          data=[(row["value"], row["timestamp"]) for row in allRows])
+
+      # Execute
+      metric_garbage_collector.purgeOldMetricDataRows(gcThresholdDays)
+
+      # Verify
+      with engine.connect() as conn:  # pylint: disable=E1101
+        remainingRows = htmengine.repository.getMetricData(conn).fetchall()
+        partitionDays = [
+          day for day, _ in
+          htmengine.repository.getMetricDataPartitions(conn)]
+
+      self.assertItemsEqual(
+        [(row["value"], row["timestamp"]) for row in youngRows],
+        [(row.metric_value, row.timestamp) for row in remainingRows])  # pylint: disable=E1101
+
+      self.assertEqual(partitionDays[0],
+                       today - timedelta(days=gcThresholdDays))
+      self.assertEqual(
+        partitionDays[-1],
+        today + timedelta(
+          days=metric_garbage_collector._NUM_FUTURE_PARTITION_DAYS))
@@ -0,0 +1,296 @@
+#!/usr/bin/env python
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2015, Numenta, Inc.  Unless you have purchased from
+# Numenta, Inc. a separate commercial license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+"""
+Replay recorded streams of raw anomaly scores through AnomalyLikelihoodHelper
+with incremental statistics and compare the anomaly likelihood params and
+anomaly scores with those of algorithms.estimateAnomalyLikelihoods over the
+sample window, i.e., with the batch estimator refreshing the params after
+every row. Also reports the cost of both.
+
+A recorded stream is a CSV file with the header
+"timestamp,metric_value,raw_anomaly_score" and timestamps formatted as
+"%Y-%m-%d %H:%M:%S", e.g. exported from metric_data with
+
+  SELECT timestamp, metric_value, raw_anomaly_score FROM metric_data
+    WHERE uid = '<metric uid>' AND raw_anomaly_score IS NOT NULL
+    ORDER BY rowid;
+
+Exits with status 1 if any deviation exceeds the tolerance.
+
+Usage:
+  APPLICATION_CONFIG_PATH=<conf dir> python \
+    anomaly_likelihood_equivalence_harness.py [--batch-size=1] \
+    [--check-interval=24] [--synthetic=20000] [stream.csv ...]
+"""
+
+import argparse
+import csv
+import datetime
+import json
+import logging
+import sys
+import time
+
+import numpy
+
+from nupic.algorithms import anomaly_likelihood as algorithms
+
+from htmengine.anomaly_likelihood_helper import (
+  AnomalyLikelihoodHelper,
+  NUM_SKIP_RECORDS,
+  _RawScoreWindow)
+from htmengine.repository.queries import MetricStatus
+
+
+
+class _Row(object):
+  """ Mimics the mutable metric_data rows of an inference result batch """
+
+  __slots__ = ("rowid", "timestamp", "metric_value", "raw_anomaly_score",
+               "anomaly_score")
+
+
+  def __init__(self, rowid, timestamp, metric_value, raw_anomaly_score):
+    self.rowid = rowid
+    self.timestamp = timestamp
+    self.metric_value = metric_value
+    self.raw_anomaly_score = raw_anomaly_score
+    self.anomaly_score = 0
+
+
+
+class _Metric(object):
+
+  def __init__(self, uid, anomalyParams):
+    self.uid = uid
+    self.status = MetricStatus.ACTIVE
+    self.server = None
+    self.model_params = json.dumps({"anomalyLikelihoodParams": anomalyParams})
+
+
+
+class _HarnessConfig(object):
+  """ Stands in for the application config consumed by
+  AnomalyLikelihoodHelper
+  """
+
+  def __init__(self, sampleSize):
+    self._options = {
+      "statistics_refresh_rate": 24,
+      "statistics_min_sample_size": 100,
+      "statistics_sample_size": sampleSize,
+      "raw_score_window_memory_budget_mb": 256,
+      "incremental_statistics": True
+    }
+
+
+  def loadConfig(self):
+    pass
+
+
+  def getint(self, _section, option):
+    return self._options[option]
+
+
+  def getboolean(self, _section, option):
+    return self._options[option]
+
+
+
+def _parseArgs():
+  parser = argparse.ArgumentParser(description=__doc__)
+  parser.add_argument("streams", nargs="*", metavar="stream.csv",
+                      help="Recorded streams")
+  parser.add_argument("--synthetic", type=int, default=0,
+                      help="Also replay a synthetic stream of this many rows")
+  parser.add_argument("--sample-size", type=int, default=8640,
+                      dest="sampleSize",
+                      help="statistics_sample_size")
+  parser.add_argument("--batch-size", type=int, default=1, dest="batchSize",
+                      help="Number of rows per inference result batch")
+  parser.add_argument("--check-interval", type=int, default=24,
+                      dest="checkInterval",
+                      help="Compare with the batch estimator after the batch "
+                           "that completes every this many rows")
+  parser.add_argument("--tolerance", type=float, default=1e-9,
+                      help="Max absolute deviation")
+  args = parser.parse_args()
+
+  if not args.streams and not args.synthetic:
+    parser.error("No streams given")
+  if args.sampleSize <= NUM_SKIP_RECORDS:
+    parser.error("--sample-size must exceed %d" % NUM_SKIP_RECORDS)
+
+  return args
+
+
+
+def _loadStream(path):
+  with open(path, "rb") as streamFile:
+    return [
+      _Row(rowid=i + 1,
+           timestamp=datetime.datetime.strptime(record["timestamp"],
+                                                "%Y-%m-%d %H:%M:%S"),
+           metric_value=float(record["metric_value"]),
+           raw_anomaly_score=float(record["raw_anomaly_score"]))
+      for i, record in enumerate(csv.DictReader(streamFile))]
+
+
+
+def _createSyntheticStream(numRows):
+  rng = numpy.random.RandomState(42)
+  startTime = datetime.datetime(2015, 1, 1)
+
+  rows = []
+  for i in xrange(numRows):
+    rawScore = rng.uniform(0, 0.3) ** 2
+    if rng.uniform() < 0.002:
+      rawScore = 1.0
+    # A few weeks of flat metric values in the middle
+    metricValue = 100.0 if numRows // 3 < i < numRows // 2 else rng.normal(
+      100, 10)
+    rows.append(_Row(rowid=i + 1,
+                     timestamp=startTime + datetime.timedelta(minutes=5 * i),
+                     metric_value=metricValue,
+                     raw_anomaly_score=rawScore))
+  return rows
+
+
+
+def _estimate(rows):
+  _, _, params = algorithms.estimateAnomalyLikelihoods(
+    anomalyScores=[(row.timestamp, row.metric_value, row.raw_anomaly_score)
+                   for row in rows],
+    skipRecords=NUM_SKIP_RECORDS)
+  return params
+
+
+
+def _replayStream(name, rows, args):
+  helper = AnomalyLikelihoodHelper(logging.getLogger(__name__),
+                                   _HarnessConfig(args.sampleSize))
+
+  # Bootstrap the model's anomaly likelihood params, raw score window and
+  # incremental statistics as if the anomaly service had processed a
+  # window's worth of rows; from then on, updateModelAnomalyScores doesn't
+  # touch the database
+  numBootstrapRows = args.sampleSize
+  if len(rows) <= numBootstrapRows:
+    print "%s: skipped; needs more than %d rows" % (name, numBootstrapRows)
+    return True
+
+  window = _RawScoreWindow(capacity=args.sampleSize)
+  window.extend(rows[:numBootstrapRows],
+                nextRowID=rows[numBootstrapRows].rowid)
+  anomalyParams = {"last_rowid_for_stats": rows[numBootstrapRows - 1].rowid,
+                   "params": _estimate(rows[:numBootstrapRows])}
+  helper._initIncrementalStatistics(anomalyParams, window)
+  helper._rawScoreWindows.checkOut(name, firstRowID=None)
+  helper._rawScoreWindows.checkIn(name, window)
+
+  maxDeviations = dict.fromkeys(
+    ("mean", "stdev", "historicalLikelihoods", "anomalyScore"), 0.0)
+  numChecks = 0
+  incrementalDuration = 0.0
+  batchDuration = 0.0
+
+  # (row, reference params for the row's anomaly score)
+  pendingScoreCheck = None
+
+  for start in xrange(numBootstrapRows, len(rows), args.batchSize):
+    batch = rows[start:start + args.batchSize]
+
+    startTime = time.time()
+    anomalyParams = helper.updateModelAnomalyScores(
+      engine=None,
+      metricObj=_Metric(name, anomalyParams),
+      metricDataRows=batch)
+    incrementalDuration += time.time() - startTime
+
+    if pendingScoreCheck is not None:
+      row, referenceParams = pendingScoreCheck
+      (likelihood,), _, _ = algorithms.updateAnomalyLikelihoods(
+        ((row.timestamp, row.metric_value, row.raw_anomaly_score),),
+        referenceParams)
+      maxDeviations["anomalyScore"] = max(
+        maxDeviations["anomalyScore"],
+        abs(row.anomaly_score - (1.0 - likelihood)))
+      pendingScoreCheck = None
+
+    end = start + len(batch)
+    if (end // args.checkInterval != start // args.checkInterval or
+        end == len(rows)):
+      startTime = time.time()
+      referenceParams = _estimate(rows[max(0, end - args.sampleSize):end])
+      batchDuration += time.time() - startTime
+      numChecks += 1
+
+      params = anomalyParams["params"]
+      for key in ("mean", "stdev"):
+        maxDeviations[key] = max(
+          maxDeviations[key],
+          abs(params["distribution"][key] -
+              referenceParams["distribution"][key]))
+      maxDeviations["historicalLikelihoods"] = max(
+        [maxDeviations["historicalLikelihoods"]] +
+        [abs(likelihood - referenceLikelihood)
+         for likelihood, referenceLikelihood in zip(
+           params["historicalLikelihoods"],
+           referenceParams["historicalLikelihoods"])])
+
+      if end < len(rows):
+        pendingScoreCheck = (rows[end], referenceParams)
+
+  numReplayedRows = len(rows) - numBootstrapRows
+  print ("%s: rows=%d; checks=%d; incremental=%.1fus/row; "
+         "batchEstimate=%.1fms/refresh; maxDeviation: %s") % (
+           name, numReplayedRows, numChecks,
+           incrementalDuration / numReplayedRows * 1e6,
+           batchDuration / max(numChecks, 1) * 1e3,
+           "; ".join("%s=%.3g" % item
+                     for item in sorted(maxDeviations.iteritems())))
+
+  return all(deviation <= args.tolerance
+             for deviation in maxDeviations.itervalues())
+
+
+
+def main():
+  logging.basicConfig(level=logging.WARNING)
+
+  args = _parseArgs()
+
+  streams = [(path, _loadStream(path)) for path in args.streams]
+  if args.synthetic:
+    streams.append(("synthetic", _createSyntheticStream(args.synthetic)))
+
+  equivalent = True
+  for name, rows in streams:
+    equivalent = _replayStream(name, rows, args) and equivalent
+
+  return 0 if equivalent else 1
+
+
+
+if __name__ == "__main__":
+  sys.exit(main())
@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2015, Numenta, Inc.  Unless you have purchased from
+# Numenta, Inc. a separate commercial license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+"""
+Compare marshal/unmarshal throughput and encoded size of the JSON and
+columnar encodings of model swapper request and result batches.
+
+Usage:
+  APPLICATION_CONFIG_PATH=<conf dir> python batch_codec_benchmark.py \
+    --sizes=1,10,100,1000,10000
+"""
+
+import argparse
+import datetime
+import functools
+import time
+
+from htmengine.model_swapper.model_swapper_interface import (
+  BatchPackager,
+  ModelInferenceResult,
+  ModelInputRow,
+  _ModelRequestResultBase)
+
+
+
+def _parseArgs():
+  parser = argparse.ArgumentParser(description=__doc__)
+  parser.add_argument("--sizes", default="1,10,100,1000,10000",
+                      type=lambda arg: [int(size) for size in arg.split(",")],
+                      help="Comma-separated batch sizes")
+  parser.add_argument("--items", type=int, default=200000, dest="numItems",
+                      help="Approximate number of items to process per "
+                           "measurement")
+  return parser.parse_args()
+
+
+
+def _createInputBatch(size):
+  startTime = datetime.datetime(2015, 6, 1)
+  return [
+    ModelInputRow(rowID=i,
+                  data=[startTime + datetime.timedelta(minutes=5 * i),
+                        i * 0.25])
+    for i in xrange(size)
+  ]
+
+
+
+def _createResultBatch(size):
+  return [ModelInferenceResult(rowID=i, status=0, anomalyScore=i * 1e-6)
+          for i in xrange(size)]
+
+
+
+def _measureItemsPerSec(operation, batchSize, numIterations):
+  startTime = time.time()
+  for _ in xrange(numIterations):
+    operation()
+  return batchSize * numIterations / max(time.time() - startTime, 1e-9)
+
+
+
+def _runBenchmark(label, batch, numItems):
+  numIterations = max(1, numItems // len(batch))
+
+  # NOTE: BatchPackager.marshal() only picks the columnar encoding for batches
+  # of at least _MIN_COLUMNAR_BATCH_SIZE items, so we invoke the encoders
+  # directly to compare them at all batch sizes
+  marshalColumnar = functools.partial(
+    _ModelRequestResultBase.__marshalColumnarBatch__, batch)
+  marshalJSON = functools.partial(BatchPackager._marshalJSON, batch)
+
+  results = []
+  for encoding, marshal in (("json", marshalJSON),
+                            ("columnar", marshalColumnar)):
+    batchState = marshal()
+    results.append((
+      encoding,
+      _measureItemsPerSec(marshal, len(batch), numIterations),
+      _measureItemsPerSec(
+        functools.partial(BatchPackager.unmarshal, batchState),
+        len(batch), numIterations),
+      len(batchState)))
+
+  for encoding, marshalRate, unmarshalRate, size in results:
+    print ("%-8s size=%-6d %-9s marshal=%10.0f items/s "
+           "unmarshal=%10.0f items/s bytes/item=%.1f" % (
+             label, len(batch), encoding, marshalRate, unmarshalRate,
+             float(size) / len(batch)))
+
+
+
+def main():
+  args = _parseArgs()
+
+  for size in args.sizes:
+    _runBenchmark("requests", _createInputBatch(size), args.numItems)
+    _runBenchmark("results", _createResultBatch(size), args.numItems)
+
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2015, Numenta, Inc.  Unless you have purchased from
+# Numenta, Inc. a separate commercial license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+"""
+Compare save/load latency and I/O operation counts of the "directory" and
+"blob" model checkpoint formats.
+
+Usage:
+  APPLICATION_CONFIG_PATH=<conf dir> python checkpoint_format_benchmark.py \
+    --models=20 --rounds=5
+"""
+
+import argparse
+import datetime
+import os
+import time
+import uuid
+
+from mock import patch
+
+from nupic.frameworks.opf.common_models.cluster_params import (
+  getScalarMetricWithTimeOfDayAnomalyParams)
+from nupic.frameworks.opf.modelfactory import ModelFactory
+
+from htmengine.model_checkpoint_mgr.model_checkpoint_mgr import (
+  ModelCheckpointMgr)
+from htmengine.model_checkpoint_mgr.model_checkpoint_test_utils import (
+  ModelCheckpointStoragePatch)
+
+from nta.utils.test_utils.config_test_utils import ConfigAttributePatch
+
+
+
+def _parseArgs():
+  parser = argparse.ArgumentParser(description=__doc__)
+  parser.add_argument("--models", type=int, default=20, dest="numModels",
+                      help="Number of distinct models to checkpoint")
+  parser.add_argument("--rounds", type=int, default=5, dest="numRounds",
+                      help="Number of save/load rounds per model")
+  parser.add_argument("--records", type=int, default=500, dest="numRecords",
+                      help="Number of records to feed each model before "
+                           "checkpointing, so that it accumulates state")
+  return parser.parse_args()
+
+
+
+def _readProcIOCounters():
+  """ :returns: dict of this process's I/O counters from /proc/self/io
+  (syscr, syscw, read_bytes, write_bytes, ...); empty if not available
+  """
+  try:
+    with open("/proc/self/io") as fileObj:
+      return dict((name, int(value)) for name, value in
+                  (line.split(":") for line in fileObj))
+  except IOError:
+    return dict()
+
+
+
+def _createTrainedModel(numRecords):
+  params = getScalarMetricWithTimeOfDayAnomalyParams(metricData=[0],
+                                                     minVal=0,
+                                                     maxVal=100)
+  model = ModelFactory.create(modelConfig=params["modelConfig"])
+  model.enableLearning()
+  model.enableInference(params["inferenceArgs"])
+
+  timestamp = datetime.datetime(2015, 1, 1)
+  for i in xrange(numRecords):
+    model.run({"c0": timestamp + datetime.timedelta(minutes=5 * i),
+               "c1": float(i % 100)})
+
+  return model
+
+
+
+class _Stats(object):
+
+  def __init__(self):
+    self.durations = []
+    self.fsyncs = 0
+    self.syscalls = 0
+    self.writeBytes = 0
+
+
+  def report(self, label):
+    durations = sorted(self.durations)
+    count = len(durations)
+    print ("%-10s ops=%-5d mean=%.4fs p50=%.4fs p99=%.4fs "
+           "fsyncs/op=%.1f syscalls/op=%.1f writeKB/op=%.1f" % (
+             label, count, sum(durations) / count, durations[count // 2],
+             durations[min(count - 1, int(count * 0.99))],
+             float(self.fsyncs) / count, float(self.syscalls) / count,
+             self.writeBytes / 1024.0 / count))
+
+
+
+def _timeOperation(stats, operation, fsyncCounter):
+  ioBefore = _readProcIOCounters()
+  fsyncsBefore = fsyncCounter.call_count
+  startTime = time.time()
+
+  operation()
+
+  stats.durations.append(time.time() - startTime)
+  ioAfter = _readProcIOCounters()
+  stats.fsyncs += fsyncCounter.call_count - fsyncsBefore
+  stats.syscalls += sum(ioAfter.get(name, 0) - ioBefore.get(name, 0)
+                        for name in ("syscr", "syscw"))
+  stats.writeBytes += (ioAfter.get("write_bytes", 0) -
+                       ioBefore.get("write_bytes", 0))
+
+
+
+def _runFormat(checkpointFormat, model, args):
+  saveStats = _Stats()
+  loadStats = _Stats()
+
+  with ModelCheckpointStoragePatch(), ConfigAttributePatch(
+      "model-checkpoint.conf",
+      os.environ.get("APPLICATION_CONFIG_PATH"),
+      (("storage", "checkpoint_format", checkpointFormat),)):
+
+    checkpointMgr = ModelCheckpointMgr()
+
+    modelIDs = [uuid.uuid1().hex for _ in xrange(args.numModels)]
+    for modelID in modelIDs:
+      checkpointMgr.define(modelID, definition=dict())
+
+    with patch.object(ModelCheckpointMgr, "_fsyncReliably",
+                      wraps=ModelCheckpointMgr._fsyncReliably) as fsyncCounter:
+      for _ in xrange(args.numRounds):
+        for modelID in modelIDs:
+          _timeOperation(
+            saveStats,
+            lambda: checkpointMgr.save(modelID, model,
+                                       attributes={"batchIDs": ["a", "b"]}),
+            fsyncCounter)
+
+          _timeOperation(loadStats,
+                         lambda: checkpointMgr.load(modelID),
+                         fsyncCounter)
+
+  saveStats.report("%s/save" % (checkpointFormat,))
+  loadStats.report("%s/load" % (checkpointFormat,))
+
+
+
+def main():
+  args = _parseArgs()
+
+  model = _createTrainedModel(args.numRecords)
+
+  for checkpointFormat in (ModelCheckpointMgr.CHECKPOINT_FORMAT_DIRECTORY,
+                           ModelCheckpointMgr.CHECKPOINT_FORMAT_BLOB):
+    _runFormat(checkpointFormat, model, args)
+
+
+
+if __name__ == "__main__":
+  main()
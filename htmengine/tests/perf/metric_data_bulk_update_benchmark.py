@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2015, Numenta, Inc.  Unless you have purchased from
+# Numenta, Inc. a separate commercial license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+"""
+Compare the throughput (rows/sec) of writing anomaly scores to metric_data one
+UPDATE per row via repository.updateMetricDataColumns versus
+repository.updateMetricDataColumnsBulk, as done by AnomalyService for each
+inference result batch.
+
+Runs against a temporary database on the MySQL server configured in the
+application's repository config.
+
+Usage:
+  APPLICATION_CONFIG_PATH=<conf dir> python \
+    metric_data_bulk_update_benchmark.py --sizes=10,100,1000,5000
+"""
+
+import argparse
+from collections import namedtuple
+import datetime
+import time
+
+import htmengine
+from htmengine import repository
+from htmengine.test_utils import repository_test_utils
+
+
+
+_ScoredRow = namedtuple(
+  "_ScoredRow", "uid rowid raw_anomaly_score anomaly_score display_value")
+
+
+
+def _parseArgs():
+  parser = argparse.ArgumentParser(description=__doc__)
+  parser.add_argument("--sizes", default="10,100,1000,5000",
+                      type=lambda arg: [int(size) for size in arg.split(",")],
+                      help="Comma-separated inference result batch sizes")
+  parser.add_argument("--rounds", type=int, default=3, dest="numRounds",
+                      help="Number of batches to write per measurement")
+  return parser.parse_args()
+
+
+
+def _updatePerRow(conn, metricId, scoredRows):  # pylint: disable=W0613
+  """ AnomalyService's original write path """
+  for row in scoredRows:
+    repository.updateMetricDataColumns(
+      conn,
+      row,
+      {"raw_anomaly_score": row.raw_anomaly_score,
+       "anomaly_score": row.anomaly_score,
+       "display_value": row.display_value})
+
+
+
+def _updateBulk(conn, metricId, scoredRows):
+  repository.updateMetricDataColumnsBulk(conn, metricId, scoredRows)
+
+
+
+def _measureRowsPerSec(engine, update, metricId, metricDataRows, numRounds):
+  elapsed = 0
+  for i in xrange(numRounds):
+    scoredRows = [
+      _ScoredRow(uid=metricId,
+                 rowid=row.rowid,
+                 raw_anomaly_score=(row.rowid + i) / 1e6,
+                 anomaly_score=(row.rowid + i) / 1e5,
+                 display_value=i)
+      for row in metricDataRows]
+
+    startTime = time.time()
+    with engine.begin() as conn:
+      update(conn, metricId, scoredRows)
+    elapsed += time.time() - startTime
+
+  return len(metricDataRows) * numRounds / elapsed
+
+
+
+def main():
+  args = _parseArgs()
+
+  with repository_test_utils.HtmengineManagedTempRepository("bulkupdate"):
+    engine = repository.engineFactory(config=htmengine.APP_CONFIG)
+
+    for size in args.sizes:
+      startTime = datetime.datetime(2015, 1, 1)
+      with engine.connect() as conn:
+        metricId = repository.addMetric(conn)["uid"]
+        repository.addMetricData(
+          conn,
+          metricId,
+          [(float(i), startTime + datetime.timedelta(minutes=5 * i))
+           for i in xrange(size)])
+        metricDataRows = repository.getMetricData(conn, metricId).fetchall()
+
+      for label, update in (("per-row", _updatePerRow),
+                            ("bulk", _updateBulk)):
+        rowsPerSec = _measureRowsPerSec(engine, update, metricId,
+                                        metricDataRows, args.numRounds)
+        print "batchSize=%-6d %-8s %10.0f rows/s" % (size, label, rowsPerSec)
+
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2015, Numenta, Inc.  Unless you have purchased from
+# Numenta, Inc. a separate commercial license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+
+"""
+Measure the peak RSS and time-to-first-byte of exporting a metric's data the
+way MetricDataHandler responds to GET /_models/{model-id}/data, comparing the
+original buffered pipeline (getMetricData with the whole response encoded at
+once) with the streaming pipelines of getMetricDataChunks and
+htmengine.utils.metric_data_encoders. Each pipeline runs in a fresh process.
+
+Runs against a temporary database on the MySQL server configured in the
+application's repository config.
+
+Usage:
+  APPLICATION_CONFIG_PATH=<conf dir> python metric_data_export_benchmark.py \
+    --rows=1000000
+"""
+
+import argparse
+import calendar
+import datetime
+import functools
+import multiprocessing
+import resource
+import time
+
+import msgpack
+
+import htmengine
+from htmengine import repository, utils
+from htmengine.repository import schema
+from htmengine.test_utils import repository_test_utils
+from htmengine.utils import metric_data_encoders
+
+
+
+_FIELDS = (schema.metric_data.c.uid,
+           schema.metric_data.c.timestamp,
+           schema.metric_data.c.metric_value,
+           schema.metric_data.c.anomaly_score,
+           schema.metric_data.c.rowid)
+
+# Number of metric_data rows per insert while loading the benchmark data
+_LOAD_BATCH_SIZE = 10000
+
+
+
+def _parseArgs():
+  parser = argparse.ArgumentParser(description=__doc__)
+  parser.add_argument("--rows", type=int, default=1000000, dest="numRows",
+                      help="Number of metric_data rows to export")
+  parser.add_argument("--chunk-size", type=int,
+                      default=repository.METRIC_DATA_CHUNK_SIZE,
+                      dest="chunkSize",
+                      help="Number of rows per getMetricDataChunks chunk")
+  return parser.parse_args()
+
+
+
+def _loadMetricData(engine, numRows):
+  """
+  :returns: uid of the new metric with numRows metric_data rows
+  """
+  startTime = datetime.datetime(2015, 1, 1)
+
+  with engine.connect() as conn:
+    metricId = repository.addMetric(conn)["uid"]
+
+    for start in xrange(0, numRows, _LOAD_BATCH_SIZE):
+      conn.execute(
+        schema.metric_data.insert(), # pylint: disable=E1120
+        [dict(uid=metricId,
+              rowid=rowid,
+              timestamp=startTime + datetime.timedelta(minutes=5 * rowid),
+              metric_value=float(rowid % 100),
+              anomaly_score=(rowid % 1000) / 1000.0)
+         for rowid in xrange(start + 1,
+                             min(start + _LOAD_BATCH_SIZE, numRows) + 1)])
+
+    repository.updateMetricColumns(conn, metricId, {"last_rowid": numRows})
+
+  return metricId
+
+
+
+def _exportBufferedJSON(conn, metricId, _chunkSize):
+  """ MetricDataHandler's original JSON response """
+  result = repository.getMetricData(conn,
+                                    metricId=metricId,
+                                    fields=_FIELDS,
+                                    score=0.0,
+                                    sort=schema.metric_data.c.timestamp.desc())
+  yield utils.jsonEncode(
+    {"names": metric_data_encoders.RECORD_FIELD_NAMES,
+     "data": [(row.timestamp.strftime("%Y-%m-%d %H:%M:%S"),
+               row.metric_value,
+               row.anomaly_score,
+               row.rowid) for row in result]})
+
+
+
+def _exportBufferedMsgpack(conn, metricId, _chunkSize):
+  """ MetricDataHandler's original application/octet-stream response """
+  result = repository.getMetricData(conn,
+                                    metricId=metricId,
+                                    fields=_FIELDS,
+                                    score=0.0,
+                                    sort=schema.metric_data.c.timestamp.desc())
+  packer = msgpack.Packer()
+  yield packer.pack(("names", "uid") + metric_data_encoders.RECORD_FIELD_NAMES)
+  for row in result:
+    yield packer.pack((row.uid,
+                       calendar.timegm(row.timestamp.timetuple()),
+                       row.metric_value,
+                       row.anomaly_score,
+                       row.rowid))
+
+
+
+def _exportStreaming(encode, conn, metricId, chunkSize):
+  return encode(repository.getMetricDataChunks(conn,
+                                               metricId=metricId,
+                                               fields=_FIELDS,
+                                               score=0.0,
+                                               descending=True,
+                                               chunkSize=chunkSize))
+
+
+
+_PIPELINES = (
+  ("buffered-json", _exportBufferedJSON),
+  ("buffered-msgpack", _exportBufferedMsgpack),
+  ("json", functools.partial(
+    _exportStreaming,
+    functools.partial(metric_data_encoders.encodeJSON, multiMetric=False))),
+  ("msgpack", functools.partial(_exportStreaming,
+                                metric_data_encoders.encodeMsgpackRows)),
+  ("columnar", functools.partial(_exportStreaming,
+                                 metric_data_encoders.encodeMsgpackColumns)),
+)
+
+
+
+def _runExport(export, metricId, chunkSize, resultQ):
+  """ Export process target
+
+  Reports (time-to-first-byte, total time, response size, RSS growth in KB)
+  via resultQ
+  """
+  engine = repository.engineFactory(config=htmengine.APP_CONFIG, reset=True)
+
+  with engine.connect() as conn:
+    baseRSS = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    startTime = time.time()
+    firstByteTime = None
+    size = 0
+    for piece in export(conn, metricId, chunkSize):
+      if firstByteTime is None and piece:
+        firstByteTime = time.time()
+      size += len(piece)
+
+    elapsed = time.time() - startTime
+
+  resultQ.put((firstByteTime - startTime, elapsed, size,
+               resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseRSS))
+
+
+
+def main():
+  args = _parseArgs()
+
+  with repository_test_utils.HtmengineManagedTempRepository("exportbench"):
+    engine = repository.engineFactory(config=htmengine.APP_CONFIG)
+    metricId = _loadMetricData(engine, args.numRows)
+
+    for label, export in _PIPELINES:
+      resultQ = multiprocessing.Queue()
+      exporter = multiprocessing.Process(
+        target=_runExport, args=(export, metricId, args.chunkSize, resultQ))
+      exporter.start()
+      ttfb, elapsed, size, rssGrowth = resultQ.get()
+      exporter.join()
+
+      print ("rows=%-8d %-17s ttfb=%8.1fms total=%7.2fs size=%6.1fMB "
+             "peakRSSGrowth=%7.1fMB") % (
+               args.numRows, label, ttfb * 1e3, elapsed, size / 1e6,
+               rssGrowth / 1024.0)
+
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,225 @@
+#!/usr/bin/env python
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2015, Numenta, Inc.  Unless you have purchased from
+# Numenta, Inc. a separate commercial license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+
+"""
+Measure metric_garbage_collector.purgeOldMetricDataRows on an unpartitioned
+metric_data, which deletes the old rows in batches, versus metric_data
+partitioned by day, which drops the expired partitions. Reports the purge
+duration, the binary log bytes written by the purge (i.e., the volume shipped
+to replicas) and the latency of a concurrent writer adding metric_data rows
+while the purge runs (i.e., the lock impact).
+
+Runs against a temporary database on the MySQL server configured in the
+application's repository config; the binary log is measured only if the
+server has it enabled.
+
+Usage:
+  APPLICATION_CONFIG_PATH=<conf dir> python metric_data_retention_benchmark.py \
+    --rows=100000000 --days=180 --threshold-days=90
+"""
+
+import argparse
+from datetime import datetime, timedelta
+import multiprocessing
+import time
+
+from sqlalchemy import func, select
+
+import htmengine
+from htmengine import repository
+from htmengine.repository import schema
+from htmengine.runtime import metric_garbage_collector
+from htmengine.test_utils import repository_test_utils
+
+
+
+# Number of rows per INSERT while loading metric_data
+_LOAD_CHUNK_SIZE = 10000
+
+
+
+def _parseArgs():
+  parser = argparse.ArgumentParser(description=__doc__)
+  parser.add_argument("--rows", type=int, default=100000000, dest="numRows",
+                      help="Number of metric_data rows to load")
+  parser.add_argument("--metrics", type=int, default=1000, dest="numMetrics",
+                      help="Number of metrics to spread the rows over")
+  parser.add_argument("--days", type=int, default=180, dest="numDays",
+                      help="Number of days to spread the rows' timestamps "
+                           "over, ending now")
+  parser.add_argument("--threshold-days", type=int, default=90,
+                      dest="thresholdDays",
+                      help="Retention threshold passed to "
+                           "purgeOldMetricDataRows")
+  parser.add_argument("--layout", choices=("unpartitioned", "partitioned"),
+                      action="append", dest="layouts",
+                      help="Layout(s) to measure; default both")
+  return parser.parse_args()
+
+
+
+def _loadMetricData(engine, args):
+  """ Add args.numMetrics metrics and args.numRows metric_data rows, with each
+  metric's timestamps evenly spread over args.numDays days ending now
+  """
+  rowsPerMetric = args.numRows // args.numMetrics
+  interval = timedelta(days=args.numDays) / rowsPerMetric
+  startTime = datetime.utcnow() - timedelta(days=args.numDays)
+
+  with engine.connect() as conn:
+    metricIds = [repository.addMetric(conn, last_rowid=rowsPerMetric)["uid"]
+                 for _ in xrange(args.numMetrics)]
+
+    # Load in timestamp order, as metric_data is normally appended
+    rows = []
+    for rowid in xrange(1, rowsPerMetric + 1):
+      timestamp = startTime + interval * rowid
+      for metricId in metricIds:
+        rows.append(dict(uid=metricId, rowid=rowid, timestamp=timestamp,
+                         metric_value=float(rowid)))
+
+        if len(rows) == _LOAD_CHUNK_SIZE:
+          conn.execute(schema.metric_data.insert(), # pylint: disable=E1120
+                       rows)
+          rows = []
+
+    if rows:
+      conn.execute(schema.metric_data.insert(), # pylint: disable=E1120
+                   rows)
+
+
+
+def _getBinaryLogSize(engine):
+  """
+  :returns: total size in bytes of the server's binary logs; None if binary
+    logging is disabled
+  """
+  with engine.connect() as conn:
+    if not conn.execute("SELECT @@log_bin").scalar():
+      return None
+
+    return sum(row[1] for row in conn.execute("SHOW BINARY LOGS"))
+
+
+
+def _runWriter(stopEvent, resultQ):
+  """ Writer process target: add metric_data rows to a new metric in batches
+  of 10 until stopEvent is set
+
+  Reports the writer's batch latencies via resultQ
+  """
+  engine = repository.engineFactory(config=htmengine.APP_CONFIG, reset=True)
+
+  latencies = []
+  with engine.connect() as conn:
+    metricId = repository.addMetric(conn)["uid"]
+
+    timestamp = datetime.utcnow()
+    while not stopEvent.is_set():
+      data = []
+      for _ in xrange(10):
+        timestamp += timedelta(seconds=1)
+        data.append((1.0, timestamp))
+
+      batchStartTime = time.time()
+      repository.addMetricData(conn, metricId, data)
+      latencies.append(time.time() - batchStartTime)
+
+      time.sleep(0.01)
+
+  resultQ.put(latencies)
+
+
+
+def _measure(layout, args):
+  """
+  :returns: (purge duration, number of rows deleted, binary log bytes or None,
+    sorted writer batch latencies)
+  """
+  with repository_test_utils.HtmengineManagedTempRepository("retentionbench"):
+    engine = repository.engineFactory(config=htmengine.APP_CONFIG)
+
+    if layout == "partitioned":
+      today = datetime.utcnow().date()
+      with engine.connect() as conn:
+        repository.partitionMetricDataByDay(
+          conn,
+          [today - timedelta(days=i) for i in xrange(args.numDays, -1, -1)])
+
+    _loadMetricData(engine, args)
+
+    with engine.connect() as conn:
+      numRows = conn.execute(
+        select([func.count()], from_obj=schema.metric_data)).scalar()
+    if numRows != args.numRows // args.numMetrics * args.numMetrics:
+      raise Exception("Loaded numRows=%s" % (numRows,))
+
+    stopEvent = multiprocessing.Event()
+    resultQ = multiprocessing.Queue()
+    writer = multiprocessing.Process(target=_runWriter,
+                                     args=(stopEvent, resultQ))
+    writer.start()
+
+    # Give the writer time to connect
+    time.sleep(1)
+
+    binaryLogSize = _getBinaryLogSize(engine)
+
+    startTime = time.time()
+    numDeleted = metric_garbage_collector.purgeOldMetricDataRows(
+      args.thresholdDays)
+    elapsed = time.time() - startTime
+
+    if binaryLogSize is not None:
+      binaryLogSize = _getBinaryLogSize(engine) - binaryLogSize
+
+    stopEvent.set()
+    latencies = sorted(resultQ.get())
+    writer.join()
+    if writer.exitcode != 0:
+      raise Exception("Writer failed with exitcode=%s" % (writer.exitcode,))
+
+    return elapsed, numDeleted, binaryLogSize, latencies
+
+
+
+def main():
+  args = _parseArgs()
+
+  for layout in args.layouts or ("unpartitioned", "partitioned"):
+    elapsed, numDeleted, binaryLogSize, latencies = _measure(layout, args)
+
+    print ("rows=%-10d %-13s purged=%-10d in %8.2fs; binlog=%s; "
+           "writerBatchLatency p50=%.2fms p99=%.2fms max=%.2fms") % (
+             args.numRows, layout, numDeleted, elapsed,
+             ("%dB" % (binaryLogSize,) if binaryLogSize is not None
+              else "disabled"),
+             latencies[len(latencies) // 2] * 1e3,
+             latencies[min(len(latencies) - 1, len(latencies) * 99 // 100)]
+             * 1e3,
+             latencies[-1] * 1e3)
+
+
+
+if __name__ == "__main__":
+  main()
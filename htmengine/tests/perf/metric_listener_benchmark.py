@@ -0,0 +1,219 @@
+#!/usr/bin/env python
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2015, Numenta, Inc.  Unless you have purchased from
+# Numenta, Inc. a separate commercial license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+"""
+Measure the throughput (samples/sec) and forward latency of metric_listener's
+threaded servers versus its EventDrivenServer. Load generator processes send
+plaintext samples whose timestamps are their send times; a consumer drains
+the samples from a temporary message queue and computes the forward latency
+of each sample from its timestamp.
+
+Runs against the RabbitMQ broker configured for the application.
+
+Usage:
+  APPLICATION_CONFIG_PATH=<conf dir> python metric_listener_benchmark.py \
+    [--transport=tcp] [--clients=8] [--samples=20000] [--rate=0]
+
+The load generator may also be pointed at a running metric_listener:
+  python metric_listener_benchmark.py --generate-only=<host>:<port>
+"""
+
+import argparse
+import json
+import multiprocessing
+import socket
+import threading
+import time
+import uuid
+
+from htmengine.model_swapper.model_swapper_interface import (
+  MessageBusConnector)
+from htmengine.runtime import metric_listener
+from htmengine.runtime.metric_listener import Transport
+
+
+
+def _parseArgs():
+  parser = argparse.ArgumentParser(description=__doc__)
+  parser.add_argument("--transport", choices=Transport.values(),
+                      default=Transport.TCP)
+  parser.add_argument("--clients", type=int, default=8, dest="numClients",
+                      help="Number of load generator processes")
+  parser.add_argument("--samples", type=int, default=20000,
+                      dest="samplesPerClient",
+                      help="Number of samples per load generator")
+  parser.add_argument("--rate", type=float, default=0,
+                      help="Samples/sec per load generator; 0 for max")
+  parser.add_argument("--event-loops", type=int, default=2,
+                      dest="numEventLoops")
+  parser.add_argument("--publishers", type=int, default=2,
+                      dest="numPublishers")
+  parser.add_argument("--max-batch-delay-ms", type=int, default=20,
+                      dest="maxBatchDelayMs")
+  parser.add_argument("--generate-only", default=None, dest="target",
+                      metavar="HOST:PORT",
+                      help="Only generate load against this listener")
+  return parser.parse_args()
+
+
+
+def _generateLoad(addr, transport, clientIndex, numSamples, rate):
+  """ Load generator process target: send numSamples samples of metric
+  benchmark.<clientIndex> at the given rate (samples/sec; 0 for max)
+  """
+  if transport == Transport.UDP:
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.connect(addr)
+    send = sock.send
+  else:
+    sock = socket.create_connection(addr)
+    send = sock.sendall
+
+  startTime = time.time()
+  for i in xrange(numSamples):
+    if rate:
+      delay = startTime + i / rate - time.time()
+      if delay > 0:
+        time.sleep(delay)
+
+    send("benchmark.%d %d %.6f\n" % (clientIndex, i, time.time()))
+
+  sock.close()
+
+
+
+def _runLoadGenerators(addr, args):
+  generators = [
+    multiprocessing.Process(
+      target=_generateLoad,
+      args=(addr, args.transport, i, args.samplesPerClient, args.rate))
+    for i in xrange(args.numClients)]
+
+  for generator in generators:
+    generator.start()
+
+  return generators
+
+
+
+def _consumeSamples(queueName, numSamples, timeoutSec, latencies):
+  """ Drain forwarded samples from the message queue, appending the forward
+  latency of each to latencies, until numSamples samples were received or
+  the queue remained empty for timeoutSec
+  """
+  lastRxTime = time.time()
+  with MessageBusConnector() as bus:
+    with bus.consume(queueName) as consumer:
+      while len(latencies) < numSamples:
+        message = consumer.pollOneMessage()
+        now = time.time()
+        if message is None:
+          if now - lastRxTime > timeoutSec:
+            break
+          time.sleep(0.001)
+          continue
+
+        lastRxTime = now
+        for sample in json.loads(message.body)["data"]:
+          latencies.append(now - float(sample.split()[2]))
+
+        message.ack()
+
+
+
+def _measure(label, server, args):
+  serverThread = threading.Thread(target=server.serve_forever)
+  serverThread.setDaemon(True)
+  serverThread.start()
+
+  numSamples = args.numClients * args.samplesPerClient
+  latencies = []
+
+  startTime = time.time()
+  generators = _runLoadGenerators(server.server_address, args)
+  _consumeSamples(metric_listener.gQueueName, numSamples, timeoutSec=10,
+                  latencies=latencies)
+  elapsed = time.time() - startTime
+
+  for generator in generators:
+    generator.join()
+
+  server.shutdown()
+  serverThread.join()
+  server.server_close()
+
+  if not latencies:
+    print "%-10s no samples forwarded" % (label,)
+    return
+
+  latencies.sort()
+  print ("%-10s transport=%s clients=%d samples=%d/%d %10.0f samples/s; "
+         "forwardLatency p50=%.1fms p99=%.1fms") % (
+           label, args.transport, args.numClients, len(latencies),
+           numSamples, len(latencies) / elapsed,
+           latencies[len(latencies) // 2] * 1e3,
+           latencies[len(latencies) * 99 // 100] * 1e3)
+
+
+
+def main():
+  args = _parseArgs()
+
+  if args.target:
+    host, port = args.target.rsplit(":", 1)
+    for generator in _runLoadGenerators((host, int(port)), args):
+      generator.join()
+    return
+
+  metric_listener.gQueueName = "metric_listener_benchmark.%s" % (
+    uuid.uuid1().hex,)
+
+  with MessageBusConnector() as bus:
+    bus.createMessageQueue(mqName=metric_listener.gQueueName, durable=True)
+
+  try:
+    if args.transport == Transport.UDP:
+      threadedServer = metric_listener.ThreadedUDPServer(
+        ("127.0.0.1", 0), metric_listener.UDPHandler)
+    else:
+      threadedServer = metric_listener.ThreadedTCPServer(
+        ("127.0.0.1", 0), metric_listener.TCPHandler)
+
+    _measure("threaded", threadedServer, args)
+
+    _measure("evented",
+             metric_listener.EventDrivenServer(
+               ("127.0.0.1", 0),
+               args.transport,
+               numEventLoops=args.numEventLoops,
+               numPublishers=args.numPublishers,
+               maxBatchSize=metric_listener._MAX_BATCH_SIZE,
+               maxBatchDelaySec=args.maxBatchDelayMs / 1000.0),
+             args)
+  finally:
+    with MessageBusConnector() as bus:
+      bus.deleteMessageQueue(mqName=metric_listener.gQueueName)
+
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,201 @@
+#!/usr/bin/env python
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2015, Numenta, Inc.  Unless you have purchased from
+# Numenta, Inc. a separate commercial license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+"""
+Measure the throughput (rows/sec) and batch latency of N writer processes
+concurrently adding metric_data rows to the same metric, comparing
+repository.addMetricData with its original rowid allocation, which read
+last_rowid with SELECT ... FOR UPDATE before updating it. Verifies that the
+resulting rowids are contiguous.
+
+Runs against a temporary database on the MySQL server configured in the
+application's repository config.
+
+Usage:
+  APPLICATION_CONFIG_PATH=<conf dir> python \
+    metric_rowid_concurrency_benchmark.py --writers=1,2,4,8 --batch-size=10
+"""
+
+import argparse
+import datetime
+import multiprocessing
+import time
+
+from sqlalchemy import func, select
+
+import htmengine
+from htmengine import repository
+from htmengine.repository import schema
+from htmengine.test_utils import repository_test_utils
+
+
+
+def _parseArgs():
+  parser = argparse.ArgumentParser(description=__doc__)
+  parser.add_argument("--writers", default="1,2,4,8",
+                      type=lambda arg: [int(num) for num in arg.split(",")],
+                      help="Comma-separated numbers of writer processes")
+  parser.add_argument("--batch-size", type=int, default=10, dest="batchSize",
+                      help="Number of rows per addMetricData call")
+  parser.add_argument("--batches", type=int, default=200, dest="numBatches",
+                      help="Number of batches per writer process")
+  return parser.parse_args()
+
+
+
+def _addMetricDataWithLockingRead(conn, metricId, data):
+  """ addMetricData's original implementation """
+  with conn.begin():
+    oldLastRowid = repository.getMetricWithUpdateLock(
+      conn, metricId, fields=[schema.metric.c.last_rowid])[0]
+
+    update = (schema.metric.update() # pylint: disable=E1120
+              .where(schema.metric.c.uid == metricId))
+    conn.execute(update.values(
+      last_rowid=schema.metric.c.last_rowid + len(data)))
+
+    rows = [
+      dict(uid=metricId,
+           rowid=rowid,
+           timestamp=timestamp,
+           metric_value=metricValue)
+      for rowid, (metricValue, timestamp) in enumerate(data, oldLastRowid + 1)
+    ]
+
+    conn.execute(schema.metric_data.insert(), # pylint: disable=E1120
+                 rows)
+
+  return rows
+
+
+
+def _runWriter(addMetricData, metricId, writerIndex, args, startEvent,
+               resultQ):
+  """ Writer process target
+
+  Reports the writer's batch latencies via resultQ
+  """
+  engine = repository.engineFactory(config=htmengine.APP_CONFIG, reset=True)
+
+  # Spread timestamps so that the writers never collide
+  startTime = (datetime.datetime(2015, 1, 1) +
+               datetime.timedelta(days=365 * writerIndex))
+
+  latencies = []
+  with engine.connect() as conn:
+    startEvent.wait()
+
+    for i in xrange(args.numBatches):
+      data = [
+        (float(j), startTime + datetime.timedelta(minutes=5 * j))
+        for j in xrange(i * args.batchSize, (i + 1) * args.batchSize)]
+
+      batchStartTime = time.time()
+      addMetricData(conn, metricId, data)
+      latencies.append(time.time() - batchStartTime)
+
+  resultQ.put(latencies)
+
+
+
+def _measure(engine, addMetricData, numWriters, args):
+  """
+  :returns: (rows/sec, median batch latency, 99th percentile batch latency)
+  """
+  with engine.connect() as conn:
+    metricId = repository.addMetric(conn)["uid"]
+
+  startEvent = multiprocessing.Event()
+  resultQ = multiprocessing.Queue()
+
+  writers = [
+    multiprocessing.Process(
+      target=_runWriter,
+      args=(addMetricData, metricId, i, args, startEvent, resultQ))
+    for i in xrange(numWriters)]
+
+  for writer in writers:
+    writer.start()
+
+  # Give the writers time to connect
+  time.sleep(1)
+
+  startTime = time.time()
+  startEvent.set()
+
+  latencies = []
+  for _ in writers:
+    latencies.extend(resultQ.get())
+
+  elapsed = time.time() - startTime
+
+  for writer in writers:
+    writer.join()
+    if writer.exitcode != 0:
+      raise Exception("Writer failed with exitcode=%s" % (writer.exitcode,))
+
+  with engine.connect() as conn:
+    lastRowid = repository.getMetric(
+      conn, metricId, fields=[schema.metric.c.last_rowid]).last_rowid
+
+    numRows, minRowid, maxRowid = conn.execute(
+      select([func.count(),
+              func.min(schema.metric_data.c.rowid),
+              func.max(schema.metric_data.c.rowid)])
+      .where(schema.metric_data.c.uid == metricId)).first()
+
+  expectedNumRows = numWriters * args.numBatches * args.batchSize
+  if not (numRows == lastRowid == maxRowid == expectedNumRows and
+          minRowid == 1):
+    raise Exception(
+      "Rowids aren't contiguous: numRows=%s; rowids=[%s..%s]; last_rowid=%s; "
+      "expectedNumRows=%s" % (numRows, minRowid, maxRowid, lastRowid,
+                              expectedNumRows))
+
+  latencies.sort()
+  return (expectedNumRows / elapsed,
+          latencies[len(latencies) // 2],
+          latencies[min(len(latencies) - 1, len(latencies) * 99 // 100)])
+
+
+
+def main():
+  args = _parseArgs()
+
+  with repository_test_utils.HtmengineManagedTempRepository("rowidbench"):
+    engine = repository.engineFactory(config=htmengine.APP_CONFIG)
+
+    for numWriters in args.writers:
+      for label, addMetricData in (("locking-read",
+                                    _addMetricDataWithLockingRead),
+                                   ("atomic", repository.addMetricData)):
+        rowsPerSec, p50, p99 = _measure(engine, addMetricData, numWriters,
+                                        args)
+        print ("writers=%-3d batchSize=%-5d %-12s %10.0f rows/s; "
+               "batchLatency p50=%.2fms p99=%.2fms") % (
+                 numWriters, args.batchSize, label, rowsPerSec, p50 * 1e3,
+                 p99 * 1e3)
+
+
+
+if __name__ == "__main__":
+  main()
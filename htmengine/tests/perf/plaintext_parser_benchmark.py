@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2015, Numenta, Inc.  Unless you have purchased from
+# Numenta, Inc. a separate commercial license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+"""
+Compare the throughput (lines/sec) of metric_storer's ingest of plaintext
+samples, from parsing through grouping each metric's samples into
+(datetime, value) pairs for MetricStreamer, using per-line parsePlaintext
+versus columnar parsePlaintextBatch.
+
+Usage:
+  APPLICATION_CONFIG_PATH=<conf dir> python plaintext_parser_benchmark.py \
+    --lines=100000 --metrics=1000
+"""
+
+import argparse
+from collections import defaultdict
+import itertools
+import random
+import time
+
+import numpy
+
+from htmengine.runtime.metric_listener import (parsePlaintext,
+                                               parsePlaintextBatch,
+                                               utcDatetimesFromTimestamps)
+
+
+
+def _parseArgs():
+  parser = argparse.ArgumentParser(description=__doc__)
+  parser.add_argument("--lines", type=int, default=100000, dest="numLines",
+                      help="Number of lines per batch")
+  parser.add_argument("--metrics", type=int, default=1000, dest="numMetrics",
+                      help="Number of distinct metrics per batch")
+  parser.add_argument("--rounds", type=int, default=5, dest="numRounds",
+                      help="Number of batches per measurement")
+  return parser.parse_args()
+
+
+
+def _generateLines(numLines, numMetrics):
+  rng = random.Random(42)
+  startTime = 1420070400
+  return ["custom.benchmark.metric%d %.3f %d" % (
+            rng.randrange(numMetrics), rng.uniform(0, 100), startTime + 300 * i)
+          for i in xrange(numLines)]
+
+
+
+def _ingestPerLine(lines):
+  """ metric_storer's original parsing and grouping """
+  data = []
+  for row in lines:
+    try:
+      data.append(parsePlaintext(row))
+    except ValueError:
+      pass
+
+  dataDict = defaultdict(list)
+  for record in data:
+    dataDict[record[0]].append(record)
+
+  return dict((metricName, [(dt, value) for _, value, dt in records])
+              for metricName, records in dataDict.iteritems())
+
+
+
+def _ingestColumnar(lines):
+  """ metric_storer's parsing and grouping with parsePlaintextBatch """
+  samples = parsePlaintextBatch(lines)
+
+  order = numpy.argsort(samples.metricIndices, kind="mergesort")
+  ends = numpy.cumsum(numpy.bincount(samples.metricIndices,
+                                     minlength=len(samples.metricNames)))
+  datetimes = utcDatetimesFromTimestamps(samples.timestamps)
+
+  result = dict()
+  for metricName, start, end in itertools.izip(samples.metricNames,
+                                               itertools.chain((0,), ends),
+                                               ends):
+    indices = order[start:end]
+    result[metricName] = zip(datetimes[indices],
+                             samples.values[indices].tolist())
+
+  return result
+
+
+
+def main():
+  args = _parseArgs()
+
+  lines = _generateLines(args.numLines, args.numMetrics)
+
+  if _ingestPerLine(lines) != _ingestColumnar(lines):
+    raise Exception("Per-line and columnar ingest results differ")
+
+  for label, ingest in (("per-line", _ingestPerLine),
+                        ("columnar", _ingestColumnar)):
+    startTime = time.time()
+    for _ in xrange(args.numRounds):
+      ingest(lines)
+    elapsed = time.time() - startTime
+
+    print "lines=%-7d metrics=%-6d %-9s %10.0f lines/s" % (
+      args.numLines, args.numMetrics, label,
+      args.numLines * args.numRounds / elapsed)
+
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,401 @@
+#!/usr/bin/env python
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2015, Numenta, Inc.  Unless you have purchased from
+# Numenta, Inc. a separate commercial license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+"""
+Discrete-event simulation of SwapController scheduling for comparing
+preemption policies on a model input arrival trace.
+
+The trace is a JSON-lines file of {"time": <sec>, "modelID": <id>,
+"numBatches": <n>} objects. It may be extracted from Model Runner logs with
+--from-log, which also derives each model's load and per-batch processing
+costs from the "{TAG:SWAP.MR.BATCH.DONE}" log lines. Without a trace, a
+synthetic bursty trace is generated.
+
+For each policy, reports the number of model swaps (ModelRunner starts),
+preemptions and the mean/p99 latency from batch arrival to batch completion.
+
+Usage:
+  APPLICATION_CONFIG_PATH=<conf dir> python preemption_policy_simulator.py \
+    --slots=4 --trace=trace.jsonl --policy=lru --policy=cost_aware
+
+  APPLICATION_CONFIG_PATH=<conf dir> python preemption_policy_simulator.py \
+    --from-log=model_runner.log --write-trace=trace.jsonl
+"""
+
+import argparse
+from collections import defaultdict, deque
+import datetime
+import heapq
+import itertools
+import json
+import random
+import re
+
+from htmengine.model_swapper import ModelSwapperConfig
+from htmengine.model_swapper.preemption_policy import PreemptionPolicyIface
+
+
+
+# Same as SwapController._PREEMPTION_RECHECK_INTERVAL_SEC
+_PREEMPTION_RECHECK_INTERVAL_SEC = 1
+
+_LOG_LINE_RE = re.compile(
+  r"^(?P<asctime>\d{4}-\d\d-\d\d \d\d:\d\d:\d\d,\d{3}) .*"
+  r"\{TAG:SWAP\.MR\.BATCH\.DONE\} model=(?P<modelID>[^;]+);.*"
+  r" duration=(?P<duration>[\d.]+)s; loadDuration=(?P<load>[\d.]+)s; "
+  r"procDuration=(?P<proc>[\d.]+)s;")
+
+_LOG_TIME_FORMAT = "%Y-%m-%d %H:%M:%S,%f"
+
+
+
+def _parseArgs():
+  parser = argparse.ArgumentParser(description=__doc__)
+  parser.add_argument("--slots", type=int, default=4,
+                      help="Number of model slots (SwapController concurrency)")
+  parser.add_argument("--policy", action="append", dest="policies",
+                      help="Preemption policy to simulate; may be repeated. "
+                           "Defaults to all registered policies")
+  parser.add_argument("--trace", help="JSON-lines arrival trace to replay")
+  parser.add_argument("--from-log", dest="logPath",
+                      help="Derive the arrival trace and per-model costs from "
+                           "Model Runner log lines")
+  parser.add_argument("--write-trace", dest="writeTracePath",
+                      help="Save the replayed trace to this path")
+  parser.add_argument("--load-sec", type=float, default=2.0, dest="loadSec",
+                      help="Default model load cost")
+  parser.add_argument("--proc-sec", type=float, default=0.05, dest="procSec",
+                      help="Default processing cost per batch")
+  parser.add_argument("--checkpoint-sec", type=float, default=1.0,
+                      dest="checkpointSec",
+                      help="Model checkpoint cost at the end of a run")
+  parser.add_argument("--models", type=int, default=40, dest="numModels",
+                      help="Number of models in the synthetic trace")
+  parser.add_argument("--duration", type=float, default=3600.0,
+                      help="Duration of the synthetic trace in seconds")
+  parser.add_argument("--seed", type=int, default=42,
+                      help="Random seed for the synthetic trace")
+  return parser.parse_args()
+
+
+
+def _loadTrace(path):
+  with open(path) as fileObj:
+    return [json.loads(line) for line in fileObj if line.strip()]
+
+
+
+def _saveTrace(trace, path):
+  with open(path, "w") as fileObj:
+    for arrival in trace:
+      fileObj.write(json.dumps(arrival) + "\n")
+
+
+
+def _extractFromLog(path):
+  """ Derive the arrival trace and model costs from Model Runner log lines
+
+  The arrival time of a batch is approximated by its processing start time.
+
+  :returns: two-tuple (trace, costs), where costs maps modelID to a dict with
+    "loadSec" and "procSec" keys
+  """
+  trace = []
+  loads = defaultdict(list)
+  procs = defaultdict(list)
+
+  with open(path) as fileObj:
+    for line in fileObj:
+      match = _LOG_LINE_RE.match(line)
+      if match is None:
+        continue
+
+      modelID = match.group("modelID")
+      logTime = datetime.datetime.strptime(match.group("asctime"),
+                                           _LOG_TIME_FORMAT)
+      startTime = ((logTime - datetime.datetime(1970, 1, 1)).total_seconds() -
+                   float(match.group("duration")))
+      trace.append({"time": startTime, "modelID": modelID, "numBatches": 1})
+
+      # loadDuration is non-zero only for the first batch of a run
+      load = float(match.group("load"))
+      if load > 0:
+        loads[modelID].append(load)
+      procs[modelID].append(float(match.group("proc")))
+
+  trace.sort(key=lambda arrival: arrival["time"])
+  if trace:
+    origin = trace[0]["time"]
+    for arrival in trace:
+      arrival["time"] -= origin
+
+  costs = dict()
+  for modelID in procs:
+    costs[modelID] = dict(procSec=sum(procs[modelID]) / len(procs[modelID]))
+    if loads[modelID]:
+      costs[modelID]["loadSec"] = sum(loads[modelID]) / len(loads[modelID])
+
+  return trace, costs
+
+
+
+def _generateSyntheticTrace(args):
+  """ Models receive one batch per period on average, with some models
+  occasionally catching up with a burst of backlogged batches
+  """
+  rng = random.Random(args.seed)
+  trace = []
+  for i in xrange(args.numModels):
+    modelID = "model%03d" % (i,)
+    period = rng.choice((60.0, 300.0))
+    t = rng.uniform(0, period)
+    while t < args.duration:
+      numBatches = rng.randint(20, 100) if rng.random() < 0.02 else 1
+      trace.append({"time": t, "modelID": modelID, "numBatches": numBatches})
+      t += rng.expovariate(1.0 / period)
+
+  trace.sort(key=lambda arrival: arrival["time"])
+  return trace
+
+
+
+class _SimulatedModel(object):
+
+  def __init__(self, loadSec, procSec):
+    self.loadSec = loadSec
+    self.procSec = procSec
+
+    # Arrival times of pending batches
+    self.pendingBatches = deque()
+
+    self.slotIndex = None
+    self.preemptRequested = False
+    self.numBatchesThisRun = 0
+
+
+
+class _Simulation(object):
+  """ Replays an arrival trace against SwapController's scheduling logic """
+
+  _ARRIVAL = 0
+  _MODEL_STEP = 1
+  _RECHECK = 2
+
+
+  def __init__(self, policyName, numSlots, trace, costs, args):
+    self._trace = trace
+    self._checkpointSec = args.checkpointSec
+
+    self._models = defaultdict(
+      lambda: _SimulatedModel(args.loadSec, args.procSec))
+    for modelID, modelCosts in costs.iteritems():
+      self._models[modelID] = _SimulatedModel(
+        modelCosts.get("loadSec", args.loadSec),
+        modelCosts.get("procSec", args.procSec))
+
+    self._policy = PreemptionPolicyIface.createPreemptionPolicy(
+      name=policyName,
+      getQueueDepth=lambda modelID: len(self._models[modelID].pendingBatches),
+      config=ModelSwapperConfig())
+
+    self._freeSlots = list(xrange(numSlots))
+    self._numSlots = numSlots
+    self._waitingModelsFIFO = deque()
+    self._waitingSinceMap = dict()
+    self._pendingPreemptSlotsSet = set()
+    self._recheckScheduled = False
+
+    self._events = []
+    self._sequence = itertools.count()
+
+    self.now = 0
+    self.numSwaps = 0
+    self.numPreemptions = 0
+    self.latencies = []
+
+
+  def _schedule(self, eventTime, kind, payload):
+    heapq.heappush(self._events,
+                   (eventTime, next(self._sequence), kind, payload))
+
+
+  def run(self):
+    for arrival in self._trace:
+      self._schedule(arrival["time"], self._ARRIVAL, arrival)
+
+    while self._events:
+      self.now, _, kind, payload = heapq.heappop(self._events)
+
+      if kind == self._ARRIVAL:
+        self._handleArrival(payload)
+      elif kind == self._MODEL_STEP:
+        self._handleModelStep(*payload)
+      else:
+        self._recheckScheduled = False
+        self._requestPreemptionIfNeeded()
+
+      if (len(self._waitingModelsFIFO) > len(self._pendingPreemptSlotsSet) and
+          not self._recheckScheduled):
+        self._recheckScheduled = True
+        self._schedule(self.now + _PREEMPTION_RECHECK_INTERVAL_SEC,
+                       self._RECHECK, None)
+
+
+  def _handleArrival(self, arrival):
+    modelID = arrival["modelID"]
+    model = self._models[modelID]
+    model.pendingBatches.extend([self.now] * arrival["numBatches"])
+    self._notifyNewInput(modelID)
+
+
+  def _notifyNewInput(self, modelID):
+    model = self._models[modelID]
+    if model.slotIndex is not None:
+      self._policy.modelInputArrived(modelID, self.now)
+    elif modelID not in self._waitingSinceMap:
+      if self._freeSlots:
+        self._startModel(modelID)
+      else:
+        self._waitingModelsFIFO.append(modelID)
+        self._waitingSinceMap[modelID] = self.now
+        self._requestPreemptionIfNeeded()
+
+
+  def _startModel(self, modelID):
+    model = self._models[modelID]
+    model.slotIndex = self._freeSlots.pop()
+    model.preemptRequested = False
+    model.numBatchesThisRun = 0
+    self.numSwaps += 1
+    self._policy.modelStarted(modelID, model.slotIndex, self.now)
+    self._schedule(self.now + model.loadSec, self._MODEL_STEP,
+                   (modelID, "process"))
+
+
+  def _handleModelStep(self, modelID, step):
+    model = self._models[modelID]
+
+    if step == "process":
+      # ModelRunner loads the model upon receiving its first batch and
+      # completes the batch that it's working on before stopping, so a run
+      # always processes at least one batch
+      if model.pendingBatches and (not model.preemptRequested or
+                                   not model.numBatchesThisRun):
+        self._schedule(self.now + model.procSec, self._MODEL_STEP,
+                       (modelID, "batchDone"))
+      else:
+        self._schedule(self.now + self._checkpointSec, self._MODEL_STEP,
+                       (modelID, "stopped"))
+
+    elif step == "batchDone":
+      self.latencies.append(self.now - model.pendingBatches.popleft())
+      model.numBatchesThisRun += 1
+      self._handleModelStep(modelID, "process")
+
+    else:
+      self._handleModelStopped(modelID)
+
+
+  def _handleModelStopped(self, modelID):
+    model = self._models[modelID]
+    self._policy.modelStopped(modelID, self.now)
+    self._freeSlots.append(model.slotIndex)
+    self._pendingPreemptSlotsSet.discard(model.slotIndex)
+    model.slotIndex = None
+
+    if self._waitingModelsFIFO:
+      newModelID = self._waitingModelsFIFO.popleft()
+      del self._waitingSinceMap[newModelID]
+      self._startModel(newModelID)
+      self._requestPreemptionIfNeeded()
+
+    # Like SwapController, reschedule a model with remaining input after
+    # handing its slot to the next waiting model
+    if model.pendingBatches:
+      self._notifyNewInput(modelID)
+
+
+  def _requestPreemptionIfNeeded(self):
+    if (len(self._waitingModelsFIFO) <= len(self._pendingPreemptSlotsSet) or
+        len(self._pendingPreemptSlotsSet) >= self._numSlots):
+      return
+
+    waitingModelID = self._waitingModelsFIFO[len(self._pendingPreemptSlotsSet)]
+    slotIndex = self._policy.selectSlotToPreempt(
+      waitingModelID=waitingModelID,
+      waitingSince=self._waitingSinceMap[waitingModelID],
+      excludeSlots=self._pendingPreemptSlotsSet,
+      now=self.now)
+
+    if slotIndex is None:
+      return
+
+    for model in self._models.itervalues():
+      if model.slotIndex == slotIndex:
+        model.preemptRequested = True
+        break
+
+    self._pendingPreemptSlotsSet.add(slotIndex)
+    self.numPreemptions += 1
+
+
+  def report(self, label):
+    latencies = sorted(self.latencies)
+    count = len(latencies)
+    print ("%-12s swaps=%-6d preemptions=%-6d batches=%-7d "
+           "meanLatency=%.2fs p99Latency=%.2fs makespan=%.1fs" % (
+             label, self.numSwaps, self.numPreemptions, count,
+             sum(latencies) / max(count, 1),
+             latencies[min(count - 1, int(count * 0.99))] if count else 0,
+             self.now))
+
+
+
+def main():
+  args = _parseArgs()
+
+  costs = dict()
+  if args.logPath:
+    trace, costs = _extractFromLog(args.logPath)
+  elif args.trace:
+    trace = _loadTrace(args.trace)
+  else:
+    trace = _generateSyntheticTrace(args)
+
+  if args.writeTracePath:
+    _saveTrace(trace, args.writeTracePath)
+
+  policies = (args.policies or
+              sorted(PreemptionPolicyIface.listPreemptionPolicyNames()))
+
+  print "Replaying %d arrivals for %d models on %d slots" % (
+    len(trace), len(set(arrival["modelID"] for arrival in trace)), args.slots)
+
+  for policyName in policies:
+    simulation = _Simulation(policyName, args.slots, trace, costs, args)
+    simulation.run()
+    simulation.report(policyName)
+
+
+
+if __name__ == "__main__":
+  main()
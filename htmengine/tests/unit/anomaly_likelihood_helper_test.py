@@ -0,0 +1,406 @@
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2015, Numenta, Inc.  Unless you have purchased from
+# Numenta, Inc. a separate commercial license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+"""
+Unit tests for htmengine.anomaly_likelihood_helper
+"""
+
+# Disable: Access to a protected member
+# pylint: disable=W0212
+
+from collections import namedtuple
+import datetime
+import json
+import logging
+import unittest
+
+from mock import patch, MagicMock, Mock
+import numpy
+
+from nta.utils.logging_support_raw import LoggingSupport
+
+from nupic.algorithms import anomaly_likelihood as algorithms
+
+from htmengine import anomaly_likelihood_helper
+from htmengine.anomaly_likelihood_helper import (
+  AnomalyLikelihoodHelper,
+  NUM_SKIP_RECORDS,
+  _RawScoreWindow,
+  _RawScoreWindowCache)
+from htmengine.repository.queries import MetricStatus
+
+
+
+g_log = logging.getLogger(__name__)
+
+
+MetricDataRowMock = namedtuple(
+  "MetricDataRowMock", "rowid timestamp metric_value raw_anomaly_score")
+
+
+def setUpModule():
+  LoggingSupport.initTestApp()
+
+
+
+def _createRows(firstRowID, count):
+  startTime = datetime.datetime(2015, 6, 1, 0, 0, 0, 123456)
+  return [
+    MetricDataRowMock(rowid=rowID,
+                      timestamp=startTime + datetime.timedelta(minutes=5*rowID),
+                      metric_value=rowID * 1.5,
+                      raw_anomaly_score=rowID / 100.0)
+    for rowID in xrange(firstRowID, firstRowID + count)]
+
+
+
+def _createMutableRows(firstRowID, count):
+  """ Like _createRows, but mimicking the mutable rows of an inference result
+  batch
+  """
+  return [Mock(anomaly_score=0, **row._asdict())
+          for row in _createRows(firstRowID, count)]
+
+
+
+def _createHelper(**options):
+  """ Create an AnomalyLikelihoodHelper with the given anomaly_likelihood
+  config options overriding the test defaults
+  """
+  options = dict(
+    {
+      "statistics_refresh_rate": 2,
+      "statistics_min_sample_size": 2,
+      "statistics_sample_size": 10,
+      "raw_score_window_memory_budget_mb": 1,
+      "incremental_statistics": False
+    },
+    **options)
+  config = Mock(spec_set=["loadConfig", "getint", "getboolean"])
+  config.getint.side_effect = lambda _section, option: options[option]
+  config.getboolean.side_effect = lambda _section, option: options[option]
+
+  return AnomalyLikelihoodHelper(g_log, config)
+
+
+
+def _updateModelAnomalyScores(helper, anomalyParams, metricDataRows):
+  """ Run helper.updateModelAnomalyScores() on a metric with the given anomaly
+  likelihood params, which are passed through JSON as they would be through
+  the metric's model_params
+  """
+  metricObj = Mock(
+    uid="abc",
+    status=MetricStatus.ACTIVE,
+    model_params=json.dumps({"anomalyLikelihoodParams": anomalyParams}))
+
+  return helper.updateModelAnomalyScores(engine=MagicMock(),
+                                         metricObj=metricObj,
+                                         metricDataRows=metricDataRows)
+
+
+
+class RawScoreWindowTestCase(unittest.TestCase):
+
+
+  def testTailReturnsMostRecentSamplesInProcessedOrder(self):
+    rows = _createRows(0, 5)
+
+    window = _RawScoreWindow(capacity=10)
+    window.extend(rows, nextRowID=5)
+
+    self.assertEqual(len(window), 5)
+    self.assertEqual(window.nextRowID, 5)
+    self.assertEqual(window.tail(3), rows[2:])
+    self.assertIsInstance(window.tail(1)[0].timestamp, datetime.datetime)
+    self.assertEqual(window.tail(100), rows)
+    self.assertEqual(window.tail(0), [])
+
+
+  def testExtendSkipsSamplesWithoutRawScores(self):
+    rows = _createRows(0, 3)
+    rows[1] = rows[1]._replace(raw_anomaly_score=None)
+
+    window = _RawScoreWindow(capacity=10)
+    window.extend(rows, nextRowID=3)
+
+    self.assertEqual(window.tail(10), [rows[0], rows[2]])
+
+
+  def testExtendBeyondCapacityEvictsOldestSamples(self):
+    rows = _createRows(0, 11)
+
+    window = _RawScoreWindow(capacity=4)
+    window.extend(rows[:3], nextRowID=3)
+    window.extend(rows[3:6], nextRowID=6)
+
+    self.assertEqual(window.tail(10), rows[2:6])
+
+    window.extend(rows[6:], nextRowID=11)
+
+    self.assertEqual(window.tail(10), rows[7:])
+    self.assertEqual(window.nextRowID, 11)
+
+
+  def testArraysGrowUpToCapacity(self):
+    rows = _createRows(0, 100)
+
+    window = _RawScoreWindow(capacity=50)
+    self.assertEqual(window.nbytes, 0)
+
+    window.extend(rows[:1], nextRowID=1)
+    self.assertEqual(window.nbytes, 32)
+
+    for i in xrange(1, 100):
+      window.extend(rows[i:i + 1], nextRowID=i + 1)
+
+    self.assertEqual(window.nbytes, 50 * 32)
+    self.assertEqual(window.tail(50), rows[50:])
+
+
+
+class RawScoreWindowCacheTestCase(unittest.TestCase):
+
+
+  def _createWindow(self, firstRowID, count):
+    window = _RawScoreWindow(capacity=count)
+    window.extend(_createRows(firstRowID, count),
+                  nextRowID=firstRowID + count)
+    return window
+
+
+  def testCheckOutContiguousWindowIsHit(self):
+    cache = _RawScoreWindowCache(g_log, memoryBudgetBytes=1000000)
+
+    self.assertIsNone(cache.checkOut("abc", firstRowID=10))
+    self.assertEqual(cache.misses, 1)
+
+    window = self._createWindow(0, 10)
+    cache.checkIn("abc", window)
+    self.assertEqual(len(cache), 1)
+
+    self.assertIs(cache.checkOut("abc", firstRowID=10), window)
+    self.assertEqual(cache.hits, 1)
+    self.assertEqual(len(cache), 0)
+
+
+  def testCheckOutDiscardsNonContiguousWindow(self):
+    cache = _RawScoreWindowCache(g_log, memoryBudgetBytes=1000000)
+    cache.checkIn("abc", self._createWindow(0, 10))
+
+    # E.g., redelivered result batch
+    self.assertIsNone(cache.checkOut("abc", firstRowID=5))
+    self.assertEqual(cache.invalidations, 1)
+    self.assertEqual(cache.misses, 1)
+    self.assertEqual(len(cache), 0)
+
+    self.assertIsNone(cache.checkOut("abc", firstRowID=10))
+
+
+  def testCheckInEvictsLeastRecentlyUsedWindows(self):
+    # Room for two windows of 10 samples
+    cache = _RawScoreWindowCache(g_log, memoryBudgetBytes=2 * 10 * 32)
+
+    cache.checkIn("a", self._createWindow(0, 10))
+    cache.checkIn("b", self._createWindow(0, 10))
+
+    # Make "a" the most recently used window
+    cache.checkIn("a", cache.checkOut("a", firstRowID=10))
+
+    cache.checkIn("c", self._createWindow(0, 10))
+
+    self.assertEqual(cache.evictions, 1)
+    self.assertEqual(len(cache), 2)
+    self.assertIsNone(cache.checkOut("b", firstRowID=10))
+    self.assertIsNotNone(cache.checkOut("a", firstRowID=10))
+    self.assertIsNotNone(cache.checkOut("c", firstRowID=10))
+
+
+
+@patch.object(anomaly_likelihood_helper, "algorithms", autospec=True)
+@patch.object(anomaly_likelihood_helper, "repository", autospec=True)
+class AnomalyLikelihoodHelperTestCase(unittest.TestCase):
+
+
+  def testRefreshUsesRawScoreWindowAfterColdStart(self, repoMock,
+                                                  algorithmsMock):
+    history = _createRows(0, 10)
+    repoMock.getMetricDataWithRawAnomalyScoresTail.return_value = list(
+      reversed(history))
+
+    algorithmsMock.estimateAnomalyLikelihoods.return_value = (None, None, {})
+    algorithmsMock.updateAnomalyLikelihoods.return_value = ((0.5,), None, {})
+
+    helper = _createHelper()
+
+    def updateScores(rows, lastRowIDForStats):
+      return _updateModelAnomalyScores(
+        helper,
+        {"last_rowid_for_stats": lastRowIDForStats, "params": {}},
+        rows)
+
+    # Cold start loads the tail from metric_data
+    firstBatch = _createMutableRows(10, 4)
+    anomalyParams = updateScores(firstBatch, lastRowIDForStats=9)
+
+    self.assertEqual(anomalyParams["last_rowid_for_stats"], 13)
+    self.assertEqual(
+      repoMock.getMetricDataWithRawAnomalyScoresTail.call_count, 1)
+    self.assertEqual(helper._rawScoreWindows.misses, 1)
+
+    # Subsequent refresh is served by the window
+    secondBatch = _createMutableRows(14, 2)
+    anomalyParams = updateScores(secondBatch, lastRowIDForStats=13)
+
+    self.assertEqual(anomalyParams["last_rowid_for_stats"], 15)
+    self.assertEqual(
+      repoMock.getMetricDataWithRawAnomalyScoresTail.call_count, 1)
+    self.assertEqual(helper._rawScoreWindows.hits, 1)
+
+    expectedSamples = (history + firstBatch + secondBatch)[-10:]
+    _, kwargs = algorithmsMock.estimateAnomalyLikelihoods.call_args
+    self.assertEqual(
+      kwargs["anomalyScores"],
+      tuple((row.timestamp, row.metric_value, row.raw_anomaly_score)
+            for row in expectedSamples))
+
+
+
+@patch.object(anomaly_likelihood_helper, "repository", autospec=True)
+class IncrementalStatisticsTestCase(unittest.TestCase):
+  """ Equivalence of the incremental refreshes of anomaly likelihood params
+  with algorithms.estimateAnomalyLikelihoods over the sample window after
+  every row
+  """
+
+  _SAMPLE_SIZE = NUM_SKIP_RECORDS + 112
+
+
+  def _createStream(self, numRows):
+    rng = numpy.random.RandomState(42)
+    rows = _createMutableRows(1, numRows)
+    for row in rows:
+      row.raw_anomaly_score = float(rng.uniform(0, 0.3) ** 2)
+      row.metric_value = float(rng.normal(100, 10))
+
+    # Spike
+    rows[-60].raw_anomaly_score = 1.0
+    return rows
+
+
+  def _estimate(self, rows):
+    _, _, params = algorithms.estimateAnomalyLikelihoods(
+      anomalyScores=[(row.timestamp, row.metric_value, row.raw_anomaly_score)
+                     for row in rows[-self._SAMPLE_SIZE:]],
+      skipRecords=NUM_SKIP_RECORDS)
+    return params
+
+
+  def _assertParamsEquivalent(self, params, expectedParams):
+    for key in ("mean", "variance", "stdev"):
+      self.assertAlmostEqual(params["distribution"][key],
+                             expectedParams["distribution"][key], places=9)
+
+    self.assertEqual(len(params["historicalLikelihoods"]),
+                     len(expectedParams["historicalLikelihoods"]))
+    for likelihood, expectedLikelihood in zip(
+        params["historicalLikelihoods"],
+        expectedParams["historicalLikelihoods"]):
+      self.assertAlmostEqual(likelihood, expectedLikelihood, places=9)
+
+
+  def testIncrementalParamsMatchBatchEstimation(self, repoMock):
+    stream = self._createStream(1000)
+
+    history = stream[:350]
+    repoMock.getMetricDataWithRawAnomalyScoresTail.return_value = list(
+      reversed(history))
+
+    anomalyParams = {"last_rowid_for_stats": history[-1].rowid,
+                     "params": self._estimate(history)}
+
+    helper = _createHelper(statistics_refresh_rate=24,
+                           statistics_min_sample_size=100,
+                           statistics_sample_size=self._SAMPLE_SIZE,
+                           incremental_statistics=True)
+
+    # The first batch is processed with the metric_data tail, after which the
+    # incremental statistics take over
+    batchSizes = [30, 1, 5, 150, 1, 1, 458, 3, 1]
+    self.assertEqual(sum(batchSizes), len(stream) - len(history))
+
+    with patch.object(anomaly_likelihood_helper.algorithms,
+                      "estimateAnomalyLikelihoods",
+                      autospec=True,
+                      side_effect=algorithms.estimateAnomalyLikelihoods
+                     ) as estimateMock:
+      numBatchEstimates = 0
+      start = len(history)
+      for batchSize in batchSizes:
+        batch = stream[start:start + batchSize]
+        numCalls = estimateMock.call_count
+        anomalyParams = _updateModelAnomalyScores(helper, anomalyParams, batch)
+        numBatchEstimates += estimateMock.call_count - numCalls
+        start += batchSize
+
+        self.assertIn("incremental_statistics", anomalyParams)
+        self.assertEqual(anomalyParams["last_rowid_for_stats"],
+                         batch[-1].rowid)
+        self._assertParamsEquivalent(anomalyParams["params"],
+                                     self._estimate(stream[:start]))
+
+    self.assertEqual(
+      repoMock.getMetricDataWithRawAnomalyScoresTail.call_count, 1)
+    self.assertEqual(numBatchEstimates, 1)
+
+
+  def testAnomalyScoresMatchRefreshAfterEveryRow(self, repoMock):
+    stream = self._createStream(600)
+
+    history = stream[:550]
+    repoMock.getMetricDataWithRawAnomalyScoresTail.return_value = list(
+      reversed(history[:-24]))
+
+    helper = _createHelper(statistics_refresh_rate=24,
+                           statistics_min_sample_size=100,
+                           statistics_sample_size=self._SAMPLE_SIZE,
+                           incremental_statistics=True)
+
+    # Initialize the incremental statistics with a refreshing batch
+    anomalyParams = _updateModelAnomalyScores(
+      helper,
+      {"last_rowid_for_stats": history[-25].rowid,
+       "params": self._estimate(history[:-24])},
+      history[-24:])
+
+    batch = stream[550:]
+    _updateModelAnomalyScores(helper, anomalyParams, batch)
+
+    for i, row in enumerate(batch):
+      params = self._estimate(stream[:550 + i])
+      (likelihood,), _, _ = algorithms.updateAnomalyLikelihoods(
+        ((row.timestamp, row.metric_value, row.raw_anomaly_score),), params)
+      self.assertAlmostEqual(row.anomaly_score, 1.0 - likelihood, places=9)
+
+
+
+if __name__ == "__main__":
+  unittest.main()
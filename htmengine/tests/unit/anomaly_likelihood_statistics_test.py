@@ -0,0 +1,211 @@
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2015, Numenta, Inc.  Unless you have purchased from
+# Numenta, Inc. a separate commercial license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+"""
+Unit tests for htmengine.anomaly_likelihood_statistics
+"""
+
+import json
+import math
+import unittest
+
+import numpy
+
+from htmengine.anomaly_likelihood_statistics import (
+  computeMovingAverages,
+  IncrementalLikelihoodStatistics,
+  NULL_DISTRIBUTION)
+
+
+
+def _createStream(numSamples, seed=42):
+  rng = numpy.random.RandomState(seed)
+  return (rng.uniform(0, 0.2, numSamples) ** 2,
+          rng.normal(1e6, 1e3, numSamples))
+
+
+
+class ComputeMovingAveragesTestCase(unittest.TestCase):
+
+
+  def testAveragingWindowRestartsAtFirstSample(self):
+    rawScores = numpy.arange(1, 8, dtype=numpy.float64)
+
+    averages = computeMovingAverages(rawScores, windowSize=3)
+
+    self.assertEqual(averages.tolist(),
+                     [1.0, 1.5, 2.0, 3.0, 4.0, 5.0, 6.0])
+
+
+
+class IncrementalLikelihoodStatisticsTestCase(unittest.TestCase):
+
+
+  def _appendSamples(self, stats, rawScores, metricValues, firstIndex):
+    """ Append samples the way AnomalyLikelihoodHelper does, supplying the
+    evicted samples from the given stream
+
+    :param firstIndex: index of the first sample to append; the statistics
+      must be in sync with the stream's samples preceding it
+    """
+    averagedScores = computeMovingAverages(rawScores, stats.windowSize)
+
+    for i in xrange(firstIndex, len(rawScores)):
+      if stats.isFull:
+        evictedIndex = i - stats.capacity + stats.skipRecords
+        stats.append(averagedScores[i], metricValues[i],
+                     evictedAveragedScore=averagedScores[evictedIndex],
+                     evictedMetricValue=metricValues[evictedIndex])
+      else:
+        stats.append(averagedScores[i], metricValues[i])
+
+
+  def testAppendMatchesComputationFromScratch(self):
+    rawScores, metricValues = _createStream(300)
+    averagedScores = computeMovingAverages(rawScores, 10)
+
+    stats = IncrementalLikelihoodStatistics(capacity=100, skipRecords=20,
+                                            windowSize=10)
+
+    for numSamples in xrange(1, len(rawScores) + 1):
+      self._appendSamples(stats, rawScores[:numSamples],
+                          metricValues[:numSamples], numSamples - 1)
+
+      # NOTE: once the window slides, its leading averages differ from the
+      # stream's, but only those in the skipped region
+      expected = IncrementalLikelihoodStatistics.fromSamples(
+        rawScores[:numSamples], metricValues[:numSamples], capacity=100,
+        skipRecords=20, windowSize=10)
+
+      self.assertEqual(stats.numSamples, expected.numSamples)
+      self.assertEqual(stats.scoreMoments.count, expected.scoreMoments.count)
+      self.assertAlmostEqual(stats.scoreMoments.mean,
+                             expected.scoreMoments.mean, places=12)
+      self.assertAlmostEqual(stats.scoreMoments.variance,
+                             expected.scoreMoments.variance, places=12)
+      self.assertAlmostEqual(
+        stats.valueMoments.variance / expected.valueMoments.variance
+        if expected.valueMoments.count > 1 else 1.0,
+        1.0, places=9)
+      self.assertEqual(stats.historicalAverages,
+                       averagedScores[max(0, numSamples - 10):numSamples]
+                       .tolist())
+
+
+  def testDistributionIsNullUntilSkippedRecordsAreExceeded(self):
+    rawScores, metricValues = _createStream(22)
+
+    stats = IncrementalLikelihoodStatistics.fromSamples(
+      rawScores[:20], metricValues[:20], capacity=100, skipRecords=20,
+      windowSize=10)
+    self.assertEqual(stats.getDistribution(), NULL_DISTRIBUTION)
+
+    # A single metric value past the skipped records has no variance
+    self._appendSamples(stats, rawScores[:21], metricValues[:21], 20)
+    self.assertEqual(stats.getDistribution(), NULL_DISTRIBUTION)
+
+    self._appendSamples(stats, rawScores, metricValues, 21)
+    self.assertNotEqual(stats.getDistribution(), NULL_DISTRIBUTION)
+
+
+  def testDistributionIsNullForFlatMetric(self):
+    rawScores, _ = _createStream(50)
+
+    stats = IncrementalLikelihoodStatistics.fromSamples(
+      rawScores, numpy.ones(50) * 1e9, capacity=100, skipRecords=20,
+      windowSize=10)
+
+    self.assertEqual(stats.getDistribution(), NULL_DISTRIBUTION)
+
+
+  def testDistributionLowerBounds(self):
+    _, metricValues = _createStream(50)
+
+    stats = IncrementalLikelihoodStatistics.fromSamples(
+      numpy.ones(50) * 0.001, metricValues, capacity=100, skipRecords=20,
+      windowSize=10)
+
+    distribution = stats.getDistribution()
+    self.assertEqual(distribution["mean"], 0.03)
+    self.assertEqual(distribution["variance"], 0.0003)
+    self.assertAlmostEqual(distribution["stdev"], math.sqrt(0.0003))
+
+
+  def testNeedsResyncAfterWindowOfUpdates(self):
+    rawScores, metricValues = _createStream(100)
+
+    stats = IncrementalLikelihoodStatistics.fromSamples(
+      rawScores[:50], metricValues[:50], capacity=50, skipRecords=20,
+      windowSize=10)
+    self.assertFalse(stats.needsResync)
+
+    self._appendSamples(stats, rawScores[:99], metricValues[:99], 50)
+    self.assertFalse(stats.needsResync)
+
+    self._appendSamples(stats, rawScores, metricValues, 99)
+    self.assertTrue(stats.needsResync)
+
+
+  def testNeedsResyncAfterVarianceCollapse(self):
+    rawScores, metricValues = _createStream(60)
+
+    # Metric turns flat at a very different level
+    metricValues[30:] = 1e12
+
+    stats = IncrementalLikelihoodStatistics.fromSamples(
+      rawScores[:30], metricValues[:30], capacity=30, skipRecords=10,
+      windowSize=10)
+
+    self._appendSamples(stats, rawScores[:45], metricValues[:45], 30)
+    self.assertFalse(stats.needsResync)
+
+    # The estimated region only spans flat values now
+    self._appendSamples(stats, rawScores[:50], metricValues[:50], 45)
+    self.assertLess(stats.numUpdates, stats.capacity)
+    self.assertTrue(stats.valueMoments.m2 <
+                    stats.valueMoments.peakM2 * 1e-6)
+    self.assertTrue(stats.needsResync)
+
+
+  def testStateRoundTripsThroughJSON(self):
+    rawScores, metricValues = _createStream(150)
+
+    stats = IncrementalLikelihoodStatistics.fromSamples(
+      rawScores[:120], metricValues[:120], capacity=100, skipRecords=20,
+      windowSize=10, nextRowID=121)
+    self._appendSamples(stats, rawScores, metricValues, 120)
+
+    restored = IncrementalLikelihoodStatistics.fromDict(
+      json.loads(json.dumps(stats.toDict())))
+
+    self.assertEqual(restored.toDict(), stats.toDict())
+    self.assertEqual(restored.getDistribution(), stats.getDistribution())
+
+
+  def testSkipRecordsMustCoverAveragingWindow(self):
+    with self.assertRaises(ValueError):
+      IncrementalLikelihoodStatistics(capacity=100, skipRecords=5,
+                                      windowSize=10)
+
+
+
+if __name__ == "__main__":
+  unittest.main()
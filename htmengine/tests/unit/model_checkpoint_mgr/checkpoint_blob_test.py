@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2015, Numenta, Inc.  Unless you have purchased from
+# Numenta, Inc. a separate commercial license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+import os
+import shutil
+from StringIO import StringIO
+import tempfile
+import unittest
+
+from htmengine.model_checkpoint_mgr import checkpoint_blob
+
+
+
+class CheckpointBlobTestCase(unittest.TestCase):
+
+
+  def setUp(self):
+    self.tempDir = tempfile.mkdtemp(prefix=self.__class__.__name__)
+    self.addCleanup(shutil.rmtree, self.tempDir)
+
+
+  def _createModelTree(self, rootPath):
+    os.makedirs(os.path.join(rootPath, "modelextradata", "net.nta"))
+    os.mkdir(os.path.join(rootPath, "empty"))
+
+    contents = {
+      "model.pkl": os.urandom(4096),
+      os.path.join("modelextradata", "net.nta", "R0-pkl"): "x" * 100000,
+      os.path.join("modelextradata", "net.nta", "empty.dat"): ""
+    }
+
+    for relPath, data in contents.iteritems():
+      with open(os.path.join(rootPath, relPath), "wb") as fileObj:
+        fileObj.write(data)
+
+    return contents
+
+
+  def testPackAndUnpackModelInstance(self):
+    srcRoot = os.path.join(self.tempDir, "src")
+    contents = self._createModelTree(srcRoot)
+
+    compressedModel = checkpoint_blob.packModelInstance(srcRoot)
+
+    destRoot = os.path.join(self.tempDir, "dest")
+    checkpoint_blob.unpackModelInstance(compressedModel, destRoot)
+
+    for relPath, data in contents.iteritems():
+      with open(os.path.join(destRoot, relPath), "rb") as fileObj:
+        self.assertEqual(fileObj.read(), data)
+
+    self.assertTrue(os.path.isdir(os.path.join(destRoot, "empty")))
+
+
+  def testEncodeAndDecodeBlob(self):
+    srcRoot = os.path.join(self.tempDir, "src")
+    self._createModelTree(srcRoot)
+    compressedModel = checkpoint_blob.packModelInstance(srcRoot)
+
+    attributes = {"batchIDs": ["a", "b"]}
+    blob = checkpoint_blob.encodeBlob(attributes, compressedModel)
+
+    decodedAttributes, decodedModel = checkpoint_blob.decodeBlob(blob)
+
+    self.assertEqual(decodedAttributes, attributes)
+    self.assertEqual(str(decodedModel), compressedModel)
+
+    # Only the head of the blob is needed for the attributes
+    self.assertEqual(checkpoint_blob.readAttributes(StringIO(blob)),
+                     attributes)
+
+
+  def testDecodeTruncatedBlobRaisesCorruptCheckpointBlob(self):
+    blob = checkpoint_blob.encodeBlob({"a": 1},
+                                      checkpoint_blob.packModelInstance(
+                                        self.tempDir))
+
+    with self.assertRaises(checkpoint_blob.CorruptCheckpointBlob):
+      checkpoint_blob.decodeBlob(blob[:-1])
+
+    with self.assertRaises(checkpoint_blob.CorruptCheckpointBlob):
+      checkpoint_blob.decodeBlob(blob[:4])
+
+
+  def testDecodeBlobWithBadMagicRaisesCorruptCheckpointBlob(self):
+    blob = checkpoint_blob.encodeBlob({"a": 1}, "")
+
+    with self.assertRaises(checkpoint_blob.CorruptCheckpointBlob):
+      checkpoint_blob.decodeBlob("X" + blob[1:])
+
+    with self.assertRaises(checkpoint_blob.CorruptCheckpointBlob):
+      checkpoint_blob.readAttributes(StringIO("X" + blob[1:]))
+
+
+
+if __name__ == "__main__":
+  unittest.main()
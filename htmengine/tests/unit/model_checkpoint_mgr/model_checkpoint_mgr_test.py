@@ -20,6 +20,7 @@
 # http://numenta.org/licenses/
 # ----------------------------------------------------------------------
 
+import os
 import uuid
 
 import unittest
@@ -30,6 +31,8 @@ from htmengine.model_checkpoint_mgr.model_checkpoint_test_utils import (
     ModelCheckpointStoragePatch)
 from nupic.frameworks.opf.modelfactory import ModelFactory
 
+from nta.utils.test_utils.config_test_utils import ConfigAttributePatch
+
 
 # Disable warning: Access to a protected member
 # pylint: disable=W0212
@@ -464,5 +467,72 @@ class TestModelCheckpointMgr(unittest.TestCase):
 
 
 
+@ConfigAttributePatch(
+  "model-checkpoint.conf",
+  os.environ.get("APPLICATION_CONFIG_PATH"),
+  (("storage", "checkpoint_format",
+    ModelCheckpointMgr.CHECKPOINT_FORMAT_BLOB),))
+@ModelCheckpointStoragePatch()
+class TestModelCheckpointMgrBlobFormat(TestModelCheckpointMgr):
+  """ Re-run all of TestModelCheckpointMgr with the "blob" checkpoint format
+  """
+
+
+  def testBlobCheckpointLayout(self):
+    checkpointMgr = ModelCheckpointMgr()
+
+    modelID = uuid.uuid1().hex
+    checkpointMgr.define(modelID, definition=dict(a=1, b=2))
+
+    model = ModelFactory.create(self._getModelParams("variant1"))
+    checkpointMgr.save(modelID, model, attributes="attributes1")
+
+    modelEntryDir = checkpointMgr._getModelDir(modelID, mustExist=True)
+    self.assertItemsEqual(
+      os.listdir(modelEntryDir),
+      [ModelCheckpointMgr._MODEL_ENTRY_VERSION_FILE_NAME,
+       ModelCheckpointMgr._MODEL_DEFINITION_FILE_NAME,
+       ModelCheckpointMgr._CHECKPOINT_BLOB_FILE_NAME])
+
+
+  def testConvertBetweenDirectoryAndBlobCheckpoints(self):
+    modelID = uuid.uuid1().hex
+
+    model1 = ModelFactory.create(self._getModelParams("variant1"))
+    with ConfigAttributePatch(
+        "model-checkpoint.conf",
+        os.environ.get("APPLICATION_CONFIG_PATH"),
+        (("storage", "checkpoint_format",
+          ModelCheckpointMgr.CHECKPOINT_FORMAT_DIRECTORY),)):
+      directoryCheckpointMgr = ModelCheckpointMgr()
+      directoryCheckpointMgr.define(modelID, definition=dict(a=1, b=2))
+      directoryCheckpointMgr.save(modelID, model1, attributes="attributes1")
+
+    # A directory checkpoint remains loadable in "blob" configuration
+    checkpointMgr = ModelCheckpointMgr()
+    model = checkpointMgr.load(modelID)
+    self.assertEqual(str(model.getFieldInfo()), str(model1.getFieldInfo()))
+    self.assertEqual(checkpointMgr.loadCheckpointAttributes(modelID),
+                     "attributes1")
+
+    # The next save converts the model entry to a blob checkpoint
+    model2 = ModelFactory.create(self._getModelParams("variant2"))
+    checkpointMgr.save(modelID, model2, attributes="attributes2")
+
+    modelEntryDir = checkpointMgr._getModelDir(modelID, mustExist=True)
+    self.assertNotIn(ModelCheckpointMgr._CHECKPOINT_LINK_NAME,
+                     os.listdir(modelEntryDir))
+    self.assertFalse(
+      [name for name in os.listdir(modelEntryDir)
+       if name.startswith(ModelCheckpointMgr._CHECKPOINT_STORE_DIR_NAME_BASE)])
+
+    # And the blob checkpoint remains loadable in "directory" configuration
+    model = directoryCheckpointMgr.load(modelID)
+    self.assertEqual(str(model.getFieldInfo()), str(model2.getFieldInfo()))
+    self.assertEqual(directoryCheckpointMgr.loadCheckpointAttributes(modelID),
+                     "attributes2")
+
+
+
 if __name__ == '__main__':
   unittest.main()
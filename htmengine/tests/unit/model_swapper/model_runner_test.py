@@ -1448,5 +1448,176 @@ class TestModelRunner(unittest.TestCase):
 
 
 
+@patch.object(
+  model_runner, "ModelSwapperInterface", autospec=True,
+  consumeRequests=Mock(
+    spec_set=model_runner.ModelSwapperInterface.consumeRequests))
+@patch.object(
+  model_runner, "ModelCheckpointMgr", autospec=True,
+  loadModelDefinition=Mock(
+    spec_set=model_runner.ModelCheckpointMgr.loadModelDefinition),
+  load=Mock(
+    spec_set=model_runner.ModelCheckpointMgr.load),
+  loadCheckpointAttributes=Mock(
+    spec_set=model_runner.ModelCheckpointMgr.loadCheckpointAttributes),
+  updateCheckpointAttributes=Mock(
+    spec_set=model_runner.ModelCheckpointMgr.updateCheckpointAttributes))
+class TestModelCache(unittest.TestCase):
+  """ Unit tests of the resident model cache used by ModelRunnerHost """
+
+
+  def _prepareCheckpointMgr(self, modelCheckpointMgrClassMock):
+    """ Back the checkpoint attributes of the mock checkpoint manager with a
+    dict so that updates are visible to subsequent loads
+
+    :returns: the dict of checkpoint attributes
+    """
+    checkpointAttributes = {
+      model_runner._ModelArchiver._BATCH_IDS_CHECKPOINT_ATTR_NAME: ["1"]}
+
+    checkpointMgrInstanceMock = modelCheckpointMgrClassMock.return_value
+    checkpointMgrInstanceMock.loadCheckpointAttributes.side_effect = (
+      lambda modelID: dict(checkpointAttributes))
+    checkpointMgrInstanceMock.updateCheckpointAttributes.side_effect = (
+      lambda modelID, attributes: checkpointAttributes.update(attributes))
+    checkpointMgrInstanceMock.loadModelDefinition.return_value = (
+      dict(inputSchema=[FieldMetaInfo("c1", "float", "")]))
+    checkpointMgrInstanceMock.load.return_value = Mock(
+      run=Mock(return_value=Mock(inferences=dict(anomalyScore=0.5))))
+
+    return checkpointAttributes
+
+
+  def _runModel(self, modelID, batchID, modelCache, swapperMock):
+    swapperMock.consumeRequests.return_value = _FakeConsumer([
+      _ConsumedRequestBatch(
+        batchID=batchID,
+        ack=Mock(),
+        objects=[
+          ModelInputRow(rowID=1, data=[datetime.datetime.utcnow(), 1.0])])
+    ])
+
+    with model_runner.ModelRunner(modelID=modelID,
+                                  swapperAPI=swapperMock,
+                                  modelCache=modelCache,
+                                  preemptionCheck=lambda: False) as runner:
+      runner.run()
+
+
+  def testResidentModelIsNotReloaded(self, modelCheckpointMgrClassMock,
+                                     modelSwapperInterfaceClassMock):
+    self._prepareCheckpointMgr(modelCheckpointMgrClassMock)
+    swapperMock = modelSwapperInterfaceClassMock.return_value
+    modelCache = model_runner._ModelCache(memoryBudgetBytes=1 << 40)
+
+    self._runModel("abc", "batch1", modelCache, swapperMock)
+    self._runModel("abc", "batch2", modelCache, swapperMock)
+
+    checkpointMgrInstanceMock = modelCheckpointMgrClassMock.return_value
+    self.assertEqual(checkpointMgrInstanceMock.load.call_count, 1)
+    self.assertEqual(modelCache.misses, 1)
+    self.assertEqual(modelCache.hits, 1)
+    self.assertEqual(len(modelCache), 1)
+
+    # A shared swapper interface must not be closed by the ModelRunner
+    self.assertEqual(swapperMock.close.call_count, 0)
+
+
+  def testStaleResidentModelIsReloaded(self, modelCheckpointMgrClassMock,
+                                       modelSwapperInterfaceClassMock):
+    checkpointAttributes = self._prepareCheckpointMgr(
+      modelCheckpointMgrClassMock)
+    swapperMock = modelSwapperInterfaceClassMock.return_value
+    modelCache = model_runner._ModelCache(memoryBudgetBytes=1 << 40)
+
+    self._runModel("abc", "batch1", modelCache, swapperMock)
+
+    # Simulate the model having been run and checkpointed by another
+    # ModelRunner in the meantime
+    checkpointAttributes[
+      model_runner._ModelArchiver._BATCH_IDS_CHECKPOINT_ATTR_NAME] = ["other"]
+
+    self._runModel("abc", "batch2", modelCache, swapperMock)
+
+    checkpointMgrInstanceMock = modelCheckpointMgrClassMock.return_value
+    self.assertEqual(checkpointMgrInstanceMock.load.call_count, 2)
+    self.assertEqual(modelCache.invalidations, 1)
+    self.assertEqual(modelCache.misses, 2)
+    self.assertEqual(modelCache.hits, 0)
+
+
+  def testLeastRecentlyUsedModelIsEvictedOverBudget(
+      self, modelCheckpointMgrClassMock, modelSwapperInterfaceClassMock):
+    modelCache = model_runner._ModelCache(memoryBudgetBytes=100)
+
+    archivers = dict()
+    rss = [1000]
+
+    with patch.object(model_runner._ModelCache, "_getRSS", autospec=True,
+                      side_effect=lambda _self: rss[0]):
+      for modelID in ("a", "b"):
+        modelCache.checkOut(modelID)
+        # Simulate growth of the process footprint due to loading the model
+        rss[0] += 60
+        archivers[modelID] = Mock(spec_set=model_runner._ModelArchiver,
+                                  modelID=modelID, model=Mock())
+        modelCache.checkIn(archivers[modelID])
+
+    self.assertEqual(modelCache.evictions, 1)
+    self.assertEqual(len(modelCache), 1)
+    self.assertNotIn("a", modelCache._entries)
+    self.assertIn("b", modelCache._entries)
+
+    # Evicted models are dropped without touching their checkpoints
+    self.assertEqual(archivers["a"].mock_calls, [])
+
+
+  def testEvictionDoesNotClobberConcurrentRunnersCheckpoint(
+      self, modelCheckpointMgrClassMock, modelSwapperInterfaceClassMock):
+    checkpointAttributes = self._prepareCheckpointMgr(
+      modelCheckpointMgrClassMock)
+    checkpointMgrInstanceMock = modelCheckpointMgrClassMock.return_value
+    swapperMock = modelSwapperInterfaceClassMock.return_value
+
+    modelCache = model_runner._ModelCache(memoryBudgetBytes=100)
+    rss = [1000]
+
+    def getRSS(_self):
+      # Simulate growth of the process footprint due to loading models
+      rss[0] += 60
+      return rss[0]
+
+    with patch.object(model_runner._ModelCache, "_getRSS", autospec=True,
+                      side_effect=getRSS):
+      # The model runs in this host and stays resident with an incremental
+      # checkpoint
+      self._runModel("abc", "batch1", modelCache, swapperMock)
+      self.assertEqual(len(modelCache), 1)
+
+      # Another host loads the model's checkpoint and starts a run
+      otherArchiver = model_runner._ModelArchiver("abc")
+      otherArchiver.loadModel()
+
+      # Meanwhile, this host evicts the resident model
+      modelCache.checkOut("xyz")
+      modelCache.checkIn(Mock(spec_set=model_runner._ModelArchiver,
+                              modelID="xyz", model=Mock()))
+      self.assertEqual(modelCache.evictions, 1)
+      self.assertNotIn("abc", modelCache._entries)
+
+    # The other host completes its run with an incremental checkpoint
+    otherArchiver.saveModel(
+      currentRunBatchIDSet=set(["batch2"]),
+      currentRunInputSamples=[[datetime.datetime.utcnow(), 2.0]])
+
+    # The full checkpoint was never rewritten, so the accumulated samples of
+    # both runs apply to it, and each gets replayed exactly once on next load
+    self.assertEqual(checkpointMgrInstanceMock.save.call_count, 0)
+    inputSamples = model_runner._ModelArchiver._decodeDataSamples(
+      checkpointAttributes[
+        model_runner._ModelArchiver._INPUT_SAMPLES_SINCE_CHECKPOINT_ATTR_NAME])
+    self.assertEqual([sample[1] for sample in inputSamples], [1.0, 2.0])
+
+
 if __name__ == '__main__':
   unittest.main()
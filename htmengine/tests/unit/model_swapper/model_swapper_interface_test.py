@@ -462,6 +462,96 @@ class BatchPackagerTestCase(unittest.TestCase):
     self.assertEqual(requestBatch[2].rowID, inputBatch[2].rowID)
 
 
+  def testMarshalUnmarshalColumnarInputRows(self):
+    inputBatch = [
+      ModelInputRow(rowID=i,
+                    data=[datetime.datetime(2015, 6, 1, 12, 0, i, 1000 * i),
+                          i * 1.5, -i])
+      for i in xrange(10)
+    ]
+
+    batchState = BatchPackager.marshal(batch=inputBatch)
+
+    self.assertTrue(batchState.startswith(
+      model_swapper_interface._COLUMNAR_BATCH_MAGIC))
+    self.assertLess(len(batchState),
+                    len(BatchPackager._marshalJSON(inputBatch)))
+
+    requestBatch = BatchPackager.unmarshal(batchState=batchState)
+    self.assertEqual(requestBatch, tuple(inputBatch))
+    for request in requestBatch:
+      self.assertIsInstance(request.data[0], datetime.datetime)
+      self.assertIsInstance(request.data[1], float)
+      self.assertIsInstance(request.data[2], (int, long))
+
+
+  def testMarshalUnmarshalColumnarInferenceResults(self):
+    resultBatch = [
+      ModelInferenceResult(rowID=i, status=0, anomalyScore=i / 10.0)
+      for i in xrange(10)
+    ]
+
+    batchState = BatchPackager.marshal(batch=resultBatch)
+
+    self.assertTrue(batchState.startswith(
+      model_swapper_interface._COLUMNAR_BATCH_MAGIC))
+    self.assertEqual(BatchPackager.unmarshal(batchState=batchState),
+                     tuple(resultBatch))
+
+
+  def testMarshalFallsBackToJSONForHeterogeneousBatches(self):
+    numItems = model_swapper_interface._MIN_COLUMNAR_BATCH_SIZE
+
+    batches = [
+      # Commands
+      [ModelCommand(commandID="abc", method="defineModel", args={"a": 1})] *
+      numItems,
+      # Mixed item types
+      [ModelInputRow(rowID=1, data=[1.0])] * numItems +
+      [ModelCommand(commandID="abc", method="deleteModel")],
+      # Non-integer rowIDs
+      [ModelInputRow(rowID="foo", data=[1.0])] * numItems,
+      # Mixed field types within a column
+      [ModelInputRow(rowID=1, data=[1.0])] * numItems +
+      [ModelInputRow(rowID=2, data=[2])],
+      # Ragged rows
+      [ModelInputRow(rowID=1, data=[1.0])] * numItems +
+      [ModelInputRow(rowID=2, data=[2.0, 3.0])],
+      # Failed inference results
+      [ModelInferenceResult(rowID=1, status=0, anomalyScore=0.5)] * numItems +
+      [ModelInferenceResult(rowID=2, status=1, errorMessage="error")],
+      # Integer anomaly scores
+      [ModelInferenceResult(rowID=1, status=0, anomalyScore=1)] * numItems,
+      # Batches too small to benefit from the columnar encoding
+      [ModelInferenceResult(rowID=1, status=0, anomalyScore=0.5)] *
+      (numItems - 1),
+      []
+    ]
+
+    for batch in batches:
+      batchState = BatchPackager.marshal(batch=batch)
+      self.assertEqual(batchState, BatchPackager._marshalJSON(batch))
+      self.assertEqual(BatchPackager.unmarshal(batchState=batchState),
+                       tuple(batch))
+
+
+  def testUnmarshalCorruptColumnarBatchRaisesCorruptBatchState(self):
+    batchState = BatchPackager.marshal(
+      batch=[ModelInferenceResult(rowID=i, status=0, anomalyScore=0.5)
+             for i in xrange(10)])
+
+    with self.assertRaises(model_swapper_interface.CorruptBatchState):
+      BatchPackager.unmarshal(batchState=batchState[:-1])
+
+    with self.assertRaises(model_swapper_interface.CorruptBatchState):
+      BatchPackager.unmarshal(batchState=batchState[:6])
+
+    # Unsupported version
+    with self.assertRaises(model_swapper_interface.CorruptBatchState):
+      BatchPackager.unmarshal(
+        batchState=batchState[:4] + "\xff" + batchState[5:])
+
+
 
 class RequestMessagePackagerTestCase(unittest.TestCase):
   """
@@ -1153,6 +1243,48 @@ class ModelSwapperInterfaceTestCase(unittest.TestCase):
     self.assertEqual(len(interface._consumers), 0)
 
 
+  @patch.object(
+    model_swapper_interface, "MessageBusConnector", autospec=True,
+    consume=Mock(spec_set=MessageBusConnector.consume))
+  def testConsumeResultsWithPrefetchMaxAndDecodeTiming(
+      self, messageBusConnectorClassMock):
+    expectedResults = (
+      ModelInferenceResult(rowID=1, status=0, anomalyScore=1.3),
+      ModelInferenceResult(rowID=2, status=0, anomalyScore=2.9)
+    )
+    modelID = "foobar"
+    msg = ResultMessagePackager.marshal(
+      modelID=modelID,
+      batchState=BatchPackager.marshal(batch=expectedResults))
+
+    messageBusConnectorMock = messageBusConnectorClassMock.return_value
+
+    messageBusConnectorMock.consume.return_value = Mock(
+      spec_set=message_bus_connector._QueueConsumer,
+      __iter__=lambda *args, **kwargs: iter(
+        [message_bus_connector._ConsumedMessage(
+          body=msg, ack=Mock(return_value=None))] * 2))
+
+    onDecodedMock = Mock(return_value=None)
+
+    with ModelSwapperInterface() as interface:
+      with interface.consumeResults(prefetchMax=64,
+                                    onDecoded=onDecodedMock) as consumer:
+        batches = tuple(consumer)
+
+    self.assertEqual(len(batches), 2)
+    for batch in batches:
+      self.assertEqual(batch.modelID, modelID)
+      self.assertEqual(batch.objects, expectedResults)
+
+    messageBusConnectorMock.consume.assert_called_once_with(
+      interface._resultsQueueName, blocking=True, prefetchMax=64)
+
+    self.assertEqual(onDecodedMock.call_count, 2)
+    for (durationSec,), _kwargs in onDecodedMock.call_args_list:
+      self.assertGreaterEqual(durationSec, 0)
+
+
   @patch.object(model_swapper_interface, "MessageBusConnector", autospec=True,
                 consume=Mock(spec_set=MessageBusConnector.consume))
   @patch.object(model_swapper_interface, "_ConsumedResultBatch", autospec=True)
@@ -0,0 +1,219 @@
+#!/usr/bin/env python
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2015, Numenta, Inc.  Unless you have purchased from
+# Numenta, Inc. a separate commercial license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+"""
+Unit tests for SwapController's preemption policies
+"""
+
+import os
+import unittest
+
+from nta.utils.test_utils.config_test_utils import ConfigAttributePatch
+
+from htmengine.model_swapper import ModelSwapperConfig
+from htmengine.model_swapper.preemption_policy import (
+  CostAwarePreemptionPolicy,
+  LRUPreemptionPolicy,
+  PreemptionPolicyIface)
+
+
+
+class LRUPreemptionPolicyTestCase(unittest.TestCase):
+
+
+  def _createPolicy(self):
+    return PreemptionPolicyIface.createPreemptionPolicy(
+      name="lru",
+      getQueueDepth=lambda modelID: 0,
+      config=ModelSwapperConfig())
+
+
+  def testFactoryCreatesRegisteredPolicies(self):
+    self.assertIsInstance(self._createPolicy(), LRUPreemptionPolicy)
+    self.assertItemsEqual(PreemptionPolicyIface.listPreemptionPolicyNames(),
+                          ("lru", "cost_aware"))
+
+
+  def testSelectsLeastRecentlyActiveModel(self):
+    policy = self._createPolicy()
+
+    policy.modelStarted("a", 0, now=1)
+    policy.modelStarted("b", 1, now=2)
+    policy.modelStarted("c", 2, now=3)
+
+    self.assertEqual(policy.selectSlotToPreempt("w", 0, set(), now=4), 0)
+
+    # New input for "a" makes "b" the least recently active
+    policy.modelInputArrived("a", now=5)
+    self.assertEqual(policy.selectSlotToPreempt("w", 0, set(), now=6), 1)
+
+
+  def testExcludesSlotsPendingPreemption(self):
+    policy = self._createPolicy()
+
+    policy.modelStarted("a", 0, now=1)
+    policy.modelStarted("b", 1, now=2)
+
+    self.assertEqual(policy.selectSlotToPreempt("w", 0, set([0]), now=3), 1)
+    self.assertIsNone(policy.selectSlotToPreempt("w", 0, set([0, 1]), now=3))
+
+
+  def testStoppedModelIsNotSelected(self):
+    policy = self._createPolicy()
+
+    policy.modelStarted("a", 0, now=1)
+    policy.modelStarted("b", 1, now=2)
+    policy.modelStopped("a", now=3)
+
+    self.assertEqual(len(policy), 1)
+    self.assertEqual(policy.selectSlotToPreempt("w", 0, set(), now=4), 1)
+
+    # Reusing the slot of a stopped model doesn't resurrect its old entry
+    policy.modelStarted("c", 0, now=5)
+    self.assertEqual(policy.selectSlotToPreempt("w", 0, set(), now=6), 1)
+
+
+  def testHeapIsCompacted(self):
+    policy = self._createPolicy()
+
+    policy.modelStarted("a", 0, now=0)
+    for i in xrange(1000):
+      policy.modelInputArrived("a", now=i)
+
+    self.assertLess(len(policy._heap), 100)
+    self.assertEqual(policy.selectSlotToPreempt("w", 0, set(), now=1000), 0)
+
+
+
+@ConfigAttributePatch(
+  ModelSwapperConfig.CONFIG_NAME,
+  os.environ.get("APPLICATION_CONFIG_PATH"),
+  (("swap_controller", "min_residency_sec", "10"),
+   ("swap_controller", "drain_threshold_batches", "1"),
+   ("swap_controller", "max_wait_sec", "30"),
+   ("swap_controller", "default_swap_cost_sec", "5")))
+class CostAwarePreemptionPolicyTestCase(unittest.TestCase):
+
+
+  def _createPolicy(self, queueDepths):
+    # NOTE: the config patch only applies within test methods, so the policy
+    # can't be created in setUp
+    policy = PreemptionPolicyIface.createPreemptionPolicy(
+      name="cost_aware",
+      getQueueDepth=queueDepths.__getitem__,
+      config=ModelSwapperConfig())
+    self.assertIsInstance(policy, CostAwarePreemptionPolicy)
+    return policy
+
+
+  def testPrefersCheapestModelToSwap(self):
+    queueDepths = dict(a=5, b=5, w=10)
+    policy = self._createPolicy(queueDepths)
+
+    # Record a short run of "b", which makes it cheaper than "a"
+    policy.modelStarted("b", 1, now=0)
+    policy.modelStopped("b", now=2)
+
+    policy.modelStarted("a", 0, now=0)
+    policy.modelStarted("b", 1, now=10)
+
+    self.assertEqual(
+      policy.selectSlotToPreempt("w", 100, set(), now=100), 1)
+
+
+  def testDefersModelsWithinMinimumResidency(self):
+    queueDepths = dict(a=5, w=10)
+    policy = self._createPolicy(queueDepths)
+
+    policy.modelStarted("a", 0, now=0)
+
+    self.assertIsNone(policy.selectSlotToPreempt("w", 5, set(), now=5))
+    self.assertEqual(policy.selectSlotToPreempt("w", 5, set(), now=10), 0)
+
+
+  def testDefersModelsAboutToDrain(self):
+    queueDepths = dict(a=1, w=10)
+    policy = self._createPolicy(queueDepths)
+
+    policy.modelStarted("a", 0, now=0)
+
+    self.assertIsNone(policy.selectSlotToPreempt("w", 0, set(), now=20))
+
+    queueDepths["a"] = 2
+    self.assertEqual(policy.selectSlotToPreempt("w", 0, set(), now=20), 0)
+
+
+  def testDefersBusierModelsUntilMaxWait(self):
+    queueDepths = dict(a=20, w=10)
+    policy = self._createPolicy(queueDepths)
+
+    policy.modelStarted("a", 0, now=0)
+
+    self.assertIsNone(policy.selectSlotToPreempt("w", 10, set(), now=20))
+    self.assertEqual(policy.selectSlotToPreempt("w", 10, set(), now=40),
+                     0)
+
+
+  def testDeferredModelIsReconsidered(self):
+    queueDepths = dict(a=5, b=5, w=10)
+    policy = self._createPolicy(queueDepths)
+
+    # "a" is cheaper, but still within its minimum residency
+    policy.modelStarted("a", 0, now=0)
+    policy.modelStopped("a", now=1)
+    policy.modelStarted("b", 1, now=0)
+    policy.modelStarted("a", 0, now=10)
+
+    self.assertEqual(policy.selectSlotToPreempt("w", 15, set(), now=15),
+                     1)
+    self.assertEqual(
+      policy.selectSlotToPreempt("w", 15, set([1]), now=20), 0)
+
+
+  def testFetchesQueueDepthsOncePerDecision(self):
+    queueDepths = dict(a=20, b=20, c=20, w=10)
+    fetchedModelIDs = []
+
+    def getQueueDepth(modelID):
+      fetchedModelIDs.append(modelID)
+      return queueDepths[modelID]
+
+    policy = self._createPolicy(queueDepths)
+    policy._getQueueDepth = getQueueDepth  # pylint: disable=W0212
+
+    for slotIndex, modelID in enumerate(("a", "b", "c")):
+      policy.modelStarted(modelID, slotIndex, now=0)
+
+    # All of the candidates are busier than the waiting model
+    self.assertIsNone(policy.selectSlotToPreempt("w", 10, set(), now=20))
+    self.assertItemsEqual(fetchedModelIDs, ["a", "b", "c", "w"])
+
+    # Depths are fetched anew for the next decision
+    queueDepths["w"] = 30
+    del fetchedModelIDs[:]
+    self.assertIsNotNone(policy.selectSlotToPreempt("w", 10, set(), now=21))
+    self.assertEqual(fetchedModelIDs.count("w"), 1)
+
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -34,9 +34,11 @@ import unittest
 from mock import Mock, patch
 
 
+from htmengine.model_swapper import ModelSwapperConfig
 from htmengine.model_swapper import slot_agent
 
 from nta.utils.logging_support_raw import LoggingSupport
+from nta.utils.test_utils.config_test_utils import ConfigAttributePatch
 
 
 
@@ -241,6 +243,58 @@ class SlotAgentTestCase(unittest.TestCase):
       self.assertEqual(modelRunnerProxyMock.stopGracefully.call_count, 1)
 
 
+  @ConfigAttributePatch(
+    ModelSwapperConfig.CONFIG_NAME,
+    os.environ.get("APPLICATION_CONFIG_PATH"),
+    (("model_runner_host", "enabled", "true"),))
+  @patch.object(
+    slot_agent, "ModelRunnerProxy", autospec=True,
+    side_effect=RuntimeError(
+      "ModelRunnerProxy constructor should not have been called"))
+  @patch.object(slot_agent, "ModelRunnerHostProxy", autospec=True)
+  def testSwapModelsInHostedSlotAgent(self, modelRunnerHostProxyClassMock,
+                                      _modelRunnerProxyClassMock):
+    hostMock = modelRunnerHostProxyClassMock.return_value
+    hostMock.isAlive.return_value = True
+    hostMock.startModel.side_effect = (
+      lambda modelID, onTermination: Mock(
+        spec_set=slot_agent._HostedModelRunnerProxy,
+        stopGracefully=Mock(return_value=0)))
+
+    modelFinishedQ = Queue.Queue()
+
+    def modelFinishedCallback(modelID, exitStatus):
+      modelFinishedQ.put((modelID, exitStatus))
+
+    sa = slot_agent.SlotAgent(slotID=1)
+
+    # Models are swapped in the same ModelRunnerHost process
+    modelIDs = ["abc", "def"]
+
+    for modelID in modelIDs:
+      sa.startModel(
+        modelID=modelID,
+        modelFinishedCallback=partial(modelFinishedCallback, modelID))
+      sa.stopModel()
+      self.assertEqual((modelID, 0), modelFinishedQ.get(timeout=5))
+      sa.releaseSlot()
+
+    # Close slot agent
+    t = threading.Thread(target=sa.close)
+    t.setDaemon(True)
+    t.start()
+    t.join(timeout=5)
+    self.assertFalse(t.isAlive())
+    self.assertIsNone(sa._thread)
+
+    self.assertEqual(modelRunnerHostProxyClassMock.call_count, 1)
+    self.assertEqual(
+      [kwargs["modelID"] for _args, kwargs
+       in hostMock.startModel.call_args_list],
+      modelIDs)
+    hostMock.close.assert_called_once_with()
+
+
   @patch.object(
     slot_agent, "ModelRunnerProxy", autospec=True,
     side_effect=RuntimeError("Something that should trigger "
@@ -35,6 +35,8 @@ import datetime
 import json
 import logging
 import pkg_resources
+import threading
+import time
 import unittest
 
 from mock import patch, MagicMock, Mock
@@ -696,6 +698,72 @@ class InferenceResultTestCase(unittest.TestCase):
     self.assertEqual(updateAnomalyLikelihoodParamsMock.call_count, 0)
 
 
+  @patch("htmengine.runtime.anomaly_service.AnomalyService"
+         "._updateAnomalyLikelihoodParams")
+  def testProcessModelInferenceResultsUpdatesMetricDataInBulk(
+      self, updateAnomalyLikelihoodParamsMock, repoMock, *_args):
+    """_processModelInferenceResults should write the scores of all
+    metric_data rows of the batch via a single updateMetricDataColumnsBulk call
+    """
+
+    class MetricRowSpec(object):
+      uid = None
+      status = None
+      parameters = None
+      server = None
+      model_params = None
+
+    metricRowMock = Mock(
+        spec_set=MetricRowSpec,
+        uid="abc",
+        status=MetricStatus.ACTIVE,
+        parameters=None,
+        model_params=None)
+    repoMock.getMetric.return_value = metricRowMock
+
+    metricDataRows = [
+      anomaly_service.MutableMetricDataRow(
+        anomaly_score=0.5,
+        display_value=None,
+        metric_value=float(i),
+        raw_anomaly_score=0.1,
+        rowid=i,
+        timestamp=datetime.datetime(2015, 1, 1, 0, 5 * i),
+        uid="abc")
+      for i in xrange(1, 11)
+    ]
+    repoMock.getMetricData.return_value = metricDataRows
+
+    runner = anomaly_service.AnomalyService()
+
+    runner._scrubInferenceResultsAndInitMetricData = Mock(
+      spec_set=runner._scrubInferenceResultsAndInitMetricData,
+      return_value=None)
+
+    runner.likelihoodHelper.updateModelAnomalyScores = Mock(
+      spec_set=runner.likelihoodHelper.updateModelAnomalyScores,
+      return_value=dict())
+
+    inferenceResults = [Mock(rowID=row.rowid) for row in metricDataRows]
+    metricObj, updatedRows = runner._processModelInferenceResults(
+      inferenceResults=inferenceResults,
+      metricID="abc")
+
+    self.assertIs(metricObj, metricRowMock)
+    self.assertEqual(updatedRows, metricDataRows)
+
+    self.assertEqual(repoMock.updateMetricDataColumnsBulk.call_count, 1)
+    (_conn, metricId, bulkRows), _kwargs = (
+      repoMock.updateMetricDataColumnsBulk.call_args)
+    self.assertEqual(metricId, "abc")
+    self.assertEqual(bulkRows, metricDataRows)
+    for row in bulkRows:
+      self.assertIsNotNone(row.display_value)
+
+    self.assertFalse(repoMock.updateMetricDataColumns.called)
+    self.assertEqual(updateAnomalyLikelihoodParamsMock.call_count, 1)
+
+
   def testTruncatedInferenceResultsInScrubInferernceResults(
       self, *_args):
     """Calling _scrubInferenceResultsAndInitMetricData with fewer
@@ -899,6 +967,173 @@ class InferenceResultTestCase(unittest.TestCase):
 
 
 
+@patch("htmengine.runtime.anomaly_service.amqp", autospec=True)
+@patch.object(anomaly_service, "MessageBusConnector", autospec=True)
+@patch.object(anomaly_service, "ModelSwapperInterface", autospec=True)
+@patch.object(anomaly_service, "repository", autospec=True)
+class PipelinedRunTestCase(unittest.TestCase):
+  """ Unit tests for AnomalyService.run() with shard workers """
+
+  def _createService(self, ModelSwapperInterfaceMock, batches):
+    consumeResultsReturnValueMock = MagicMock(
+      __enter__=Mock(return_value=batches)
+    )
+
+    (ModelSwapperInterfaceMock.return_value.__enter__.return_value
+     .consumeResults.return_value) = consumeResultsReturnValueMock
+
+    service = anomaly_service.AnomalyService()
+    service._numWorkers = 4
+    service._maxInFlightBatches = 5
+
+    return service
+
+
+  def testBatchesOfEachModelAreProcessedInOrderAndAckedAfterProcessing(
+      self, _repositoryMock, ModelSwapperInterfaceMock, *_args):
+    processed = []
+    acked = []
+    lock = threading.Lock()
+
+    def createBatch(modelID, seq):
+      def ack(multiple=False):  # pylint: disable=W0613
+        with lock:
+          # Acks are deferred until the shard worker is done with the batch
+          self.assertIn((modelID, seq), processed)
+          acked.append((modelID, seq))
+
+      return model_swapper_interface._ConsumedResultBatch(
+        modelID=modelID, objects=[seq], ack=Mock(side_effect=ack))
+
+    modelIDs = ("slow", "a", "b", "c", "d", "e")
+    batches = [createBatch(modelID, seq)
+               for seq in xrange(20)
+               for modelID in modelIDs]
+
+    def processResultBatch(batch, _bus):
+      if batch.modelID == "slow":
+        time.sleep(0.002)
+      with lock:
+        processed.append((batch.modelID, batch.objects[0]))
+
+    service = self._createService(ModelSwapperInterfaceMock, batches)
+
+    with patch.object(service, "_processResultBatch", autospec=True,
+                      side_effect=processResultBatch):
+      service.run()
+
+    (ModelSwapperInterfaceMock.return_value.__enter__.return_value
+     .consumeResults.assert_called_once_with(
+       prefetchMax=5, onDecoded=service._onResultBatchDecoded))
+
+    self.assertEqual(len(processed), len(batches))
+    self.assertItemsEqual(acked, processed)
+
+    for modelID in modelIDs:
+      self.assertEqual([seq for mid, seq in processed if mid == modelID],
+                       range(20))
+
+
+  def testShardWorkerErrorIsRaisedAndFailedBatchIsNotAcked(
+      self, _repositoryMock, ModelSwapperInterfaceMock, *_args):
+    batches = [
+      model_swapper_interface._ConsumedResultBatch(
+        modelID=modelID, objects=[seq],
+        ack=Mock(spec_set=(lambda multiple: None)))
+      for seq in xrange(10)
+      for modelID in ("a", "b")]
+
+    class ProcessingError(Exception):
+      pass
+
+    def processResultBatch(batch, _bus):
+      if batch.modelID == "b" and batch.objects[0] == 3:
+        raise ProcessingError("from mock test")
+
+    service = self._createService(ModelSwapperInterfaceMock, batches)
+
+    with patch.object(service, "_processResultBatch", autospec=True,
+                      side_effect=processResultBatch):
+      with self.assertRaises(ProcessingError):
+        service.run()
+
+      processedBatches = [
+        args[0] for args, _kwargs in
+        service._processResultBatch.call_args_list]  # pylint: disable=E1101
+
+    # Processing of model "b" stops at the failed batch
+    self.assertEqual(
+      [batch.objects[0] for batch in processedBatches
+       if batch.modelID == "b"],
+      range(4))
+
+    for batch in batches:
+      if batch.modelID == "b" and batch.objects[0] >= 3:
+        self.assertFalse(batch.ack.called)
+
+
+
+class StageTimingCountersTestCase(unittest.TestCase):
+  """ Unit tests for result batch processing stage timing counters """
+
+  def testCounters(self):
+    counters = anomaly_service._StageTimingCounters()
+
+    counters.addStageDuration("write", 0.25)
+    counters.addStageDuration("write", 0.5)
+
+    with counters.timeStage("load"):
+      time.sleep(0.001)
+
+    self.assertEqual(counters.countBatch(), 1)
+    self.assertEqual(counters.countBatch(), 2)
+
+    self.assertEqual(
+      counters.getCounters(),
+      {
+        "batches": 2,
+        "decode_seconds": 0.0,
+        "load_seconds": counters.getCounters()["load_seconds"],
+        "score_seconds": 0.0,
+        "write_seconds": 0.75,
+        "publish_seconds": 0.0
+      })
+    self.assertGreater(counters.getCounters()["load_seconds"], 0)
+
+
+  @patch("htmengine.runtime.anomaly_service.amqp", autospec=True)
+  @patch.object(anomaly_service, "MessageBusConnector", autospec=True)
+  @patch.object(anomaly_service, "ModelSwapperInterface", autospec=True)
+  def testServiceCountsDecodedAndProcessedBatches(
+      self, ModelSwapperInterfaceMock, *_args):
+    batch = model_swapper_interface._ConsumedResultBatch(
+      modelID="abcdef",
+      objects=[ModelInferenceResult(rowID=1, status=0, anomalyScore=0)],
+      ack=Mock(spec_set=(lambda multiple: None))
+    )
+
+    (ModelSwapperInterfaceMock.return_value.__enter__.return_value
+     .consumeResults.return_value) = MagicMock(
+       __enter__=Mock(return_value=[batch]))
+
+    service = anomaly_service.AnomalyService()
+
+    with patch.object(service, "_processModelInferenceResults", autospec=True,
+                      return_value=None):
+      service.run()
+
+    self.assertTrue(batch.ack.called)
+
+    _args, kwargs = (ModelSwapperInterfaceMock.return_value.__enter__
+                     .return_value.consumeResults.call_args)
+    kwargs["onDecoded"](0.125)
+
+    counters = service.getStageTimingCounters()
+    self.assertEqual(counters["batches"], 1)
+    self.assertEqual(counters["decode_seconds"], 0.125)
+
+
+
 class UpdateAnomalyLikelihoodParamsTestCase(unittest.TestCase):
 
   def testUpdateAnomalyLikelihoodParams(
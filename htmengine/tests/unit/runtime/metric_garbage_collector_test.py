@@ -27,6 +27,7 @@ htmengine.runtime.metric_garbage_collector.purgeOldMetricDataRows
 # pylint: disable=W0212
 
 
+from datetime import datetime, timedelta
 import itertools
 import unittest
 
@@ -51,6 +52,8 @@ def setUpModule():
        "._queryCandidateRows", autospec=True)
 @patch("htmengine.runtime.metric_garbage_collector"
        "._estimateNumRowsToDelete", autospec=True)
+@patch("htmengine.runtime.metric_garbage_collector"
+       "._getMetricDataPartitions", new=mock.Mock(return_value=[]))
 @patch("htmengine.runtime.metric_garbage_collector"
        ".htmengine.repository",
        new=mock.Mock(spec_set=htmengine.repository))
@@ -180,3 +183,80 @@ class PurgeOldMetricDataRowsUnitTestCase(unittest.TestCase):
 
     # Make sure it didn't try to retrieve candidates beyond estimated number
     self.assertEqual(len(tuple(candidatesIter)), 1)
+
+
+
+@patch("htmengine.runtime.metric_garbage_collector"
+       "._estimateNumRowsToDelete", autospec=True)
+@patch("htmengine.runtime.metric_garbage_collector"
+       "._dropMetricDataPartitions", autospec=True)
+@patch("htmengine.runtime.metric_garbage_collector"
+       "._addMetricDataPartitions", autospec=True)
+@patch("htmengine.runtime.metric_garbage_collector"
+       "._getMetricDataPartitions", autospec=True)
+@patch("htmengine.runtime.metric_garbage_collector"
+       ".htmengine.repository",
+       new=mock.Mock(spec_set=htmengine.repository))
+class PurgeOldMetricDataPartitionsUnitTestCase(unittest.TestCase):
+
+
+  def testPurgeOldMetricDataRowsDropsExpiredPartitions(
+      self,
+      getMetricDataPartitionsMock,
+      addMetricDataPartitionsMock,
+      dropMetricDataPartitionsMock,
+      estimateNumRowsToDeleteMock):
+
+    today = datetime.utcnow().date()
+
+    getMetricDataPartitionsMock.return_value = [
+      (today - timedelta(days=i), 100) for i in xrange(92, -3, -1)]
+
+    # The rows of the threshold day's partition are left for the row-delete
+    # path
+    estimateNumRowsToDeleteMock.return_value = 0
+
+    # Execute
+    numDeleted = metric_garbage_collector.purgeOldMetricDataRows(
+      thresholdDays=90)
+
+    self.assertEqual(numDeleted, 200)
+
+    self.assertEqual(addMetricDataPartitionsMock.call_count, 1)
+    self.assertEqual(
+      addMetricDataPartitionsMock.call_args[0][1],
+      [today + timedelta(days=i)
+       for i in xrange(
+         3, metric_garbage_collector._NUM_FUTURE_PARTITION_DAYS + 1)])
+
+    self.assertEqual(dropMetricDataPartitionsMock.call_count, 1)
+    self.assertEqual(dropMetricDataPartitionsMock.call_args[0][1],
+                     [today - timedelta(days=92), today - timedelta(days=91)])
+
+    self.assertEqual(estimateNumRowsToDeleteMock.call_count, 1)
+
+
+  def testPurgeOldMetricDataRowsWithoutExpiredPartitions(
+      self,
+      getMetricDataPartitionsMock,
+      addMetricDataPartitionsMock,
+      dropMetricDataPartitionsMock,
+      estimateNumRowsToDeleteMock):
+
+    today = datetime.utcnow().date()
+
+    getMetricDataPartitionsMock.return_value = [
+      (today + timedelta(days=i), 100)
+      for i in xrange(
+        -5, metric_garbage_collector._NUM_FUTURE_PARTITION_DAYS + 1)]
+
+    estimateNumRowsToDeleteMock.return_value = 0
+
+    # Execute
+    numDeleted = metric_garbage_collector.purgeOldMetricDataRows(
+      thresholdDays=90)
+
+    self.assertEqual(numDeleted, 0)
+
+    self.assertEqual(addMetricDataPartitionsMock.call_count, 0)
+    self.assertEqual(dropMetricDataPartitionsMock.call_count, 0)
@@ -22,7 +22,11 @@
 
 """Tests the metric listener."""
 
+import errno
+import Queue
 import socket
+import threading
+import time
 import unittest
 
 import mock
@@ -51,6 +55,44 @@ class MetricListenerTest(unittest.TestCase):
     self.assertEqual(dt.second, 55)
 
 
+  def testParsePlaintextBatch(self):
+    lines = [
+      "test.metric 4.0 1386792175",
+      u"other.metric -1e3 1386792175.5\n",
+      "test.metric 5 1386792475",
+      "test.metric 5",
+      "test.metric x 1386792775",
+      None,
+      "test.metric 6 12:30PM",
+      "test.metric nan inf",
+      "third.metric 7 1386793075 extra",
+    ]
+
+    result = metric_listener.parsePlaintextBatch(lines)
+
+    self.assertEqual(result.metricNames, ["test.metric", "other.metric"])
+    self.assertEqual(result.metricIndices.tolist(), [0, 1, 0])
+    self.assertEqual(result.values.tolist(), [4.0, -1000.0, 5.0])
+    self.assertEqual(result.timestamps.tolist(),
+                     [1386792175, 1386792175.5, 1386792475])
+    self.assertEqual(result.rejectedIndices, [3, 4, 5, 6, 7, 8])
+
+    # Same as parsePlaintext
+    for i, datetime in enumerate(
+        metric_listener.utcDatetimesFromTimestamps(result.timestamps)):
+      self.assertEqual(
+        datetime,
+        metric_listener.parsePlaintext(lines[[0, 1, 2][i]])[2])
+
+
+  def testParsePlaintextBatchEmpty(self):
+    result = metric_listener.parsePlaintextBatch([])
+
+    self.assertEqual(result.metricNames, [])
+    self.assertEqual(len(result.values), 0)
+    self.assertEqual(result.rejectedIndices, [])
+
+
   @patch.object(metric_listener, "MessageBusConnector", autospec=True)
   @patch.object(metric_listener, "_forwardData", autospec=True)
   def testPlaintextTCP(self, forwardDataMock,
@@ -122,5 +164,246 @@ class MetricListenerTest(unittest.TestCase):
 
 
 
+class EventLoopTest(unittest.TestCase):
+
+
+  def _runEventLoop(self, eventLoop):
+    thread = threading.Thread(target=eventLoop.run)
+    thread.setDaemon(True)
+    thread.start()
+    self.addCleanup(eventLoop.close)
+    self.addCleanup(thread.join, 5)
+    self.addCleanup(eventLoop.stop)
+    return thread
+
+
+  def _getBatches(self, publishQ, numSamples):
+    batches = []
+    while sum(len(batch) for batch in batches) < numSamples:
+      batches.append(publishQ.get(timeout=5))
+    return batches
+
+
+  def testStreamSamplesSplitIntoLinesAndBatchedBySize(self):
+    publishQ = Queue.Queue()
+    eventLoop = metric_listener._EventLoop(publishQ=publishQ,
+                                           maxBatchSize=2,
+                                           maxBatchDelaySec=60)
+
+    serverSock, clientSock = socket.socketpair()
+    serverSock.setblocking(0)
+    eventLoop.addStreamSocket(serverSock)
+    self._runEventLoop(eventLoop)
+
+    clientSock.sendall("test.metric 4 1386120789\ntest.metric 5 13861")
+    clientSock.sendall("20799\n\ntest.metric 6 1386120999\n")
+    clientSock.sendall("test.metric 7 1386121099")
+    clientSock.close()
+
+    self.assertEqual(
+      self._getBatches(publishQ, numSamples=2),
+      [["test.metric 4 1386120789", "test.metric 5 1386120799"]])
+
+    # Including the remnant at EOF
+    self.assertEqual(
+      self._getBatches(publishQ, numSamples=2),
+      [["test.metric 6 1386120999", "test.metric 7 1386121099"]])
+
+
+  def testPendingBatchForwardedOnStop(self):
+    publishQ = Queue.Queue()
+    eventLoop = metric_listener._EventLoop(publishQ=publishQ,
+                                           maxBatchSize=100,
+                                           maxBatchDelaySec=60)
+
+    serverSock, clientSock = socket.socketpair()
+    self.addCleanup(clientSock.close)
+    serverSock.setblocking(0)
+    eventLoop.addStreamSocket(serverSock)
+    thread = self._runEventLoop(eventLoop)
+
+    clientSock.sendall("test.metric 4 1386120789\n")
+
+    deadline = time.time() + 5
+    while not eventLoop._batch and time.time() < deadline:
+      time.sleep(0.001)
+
+    self.assertTrue(publishQ.empty())
+
+    eventLoop.stop()
+    thread.join(5)
+    self.assertFalse(thread.isAlive())
+    self.assertEqual(self._getBatches(publishQ, numSamples=1),
+                     [["test.metric 4 1386120789"]])
+
+
+  def testSamplesBatchedByTimeWindow(self):
+    publishQ = Queue.Queue()
+    eventLoop = metric_listener._EventLoop(publishQ=publishQ,
+                                           maxBatchSize=100,
+                                           maxBatchDelaySec=0.01)
+
+    serverSock, clientSock = socket.socketpair()
+    serverSock.setblocking(0)
+    eventLoop.addStreamSocket(serverSock)
+    self._runEventLoop(eventLoop)
+
+    clientSock.sendall("test.metric 4 1386120789\n")
+    self.assertEqual(self._getBatches(publishQ, numSamples=1),
+                     [["test.metric 4 1386120789"]])
+
+    clientSock.sendall("test.metric 5 1386120799\n")
+    self.assertEqual(self._getBatches(publishQ, numSamples=1),
+                     [["test.metric 5 1386120799"]])
+
+    clientSock.close()
+
+
+  def testDatagramSamples(self):
+    publishQ = Queue.Queue()
+    eventLoop = metric_listener._EventLoop(publishQ=publishQ,
+                                           maxBatchSize=3,
+                                           maxBatchDelaySec=60)
+
+    serverSock, clientSock = socket.socketpair(socket.AF_UNIX,
+                                               socket.SOCK_DGRAM)
+    self.addCleanup(serverSock.close)
+    self.addCleanup(clientSock.close)
+    serverSock.setblocking(0)
+    eventLoop.addDatagramSocket(serverSock)
+    self._runEventLoop(eventLoop)
+
+    for i in xrange(3):
+      clientSock.send("test.metric %d 1386120789\n" % (i,))
+
+    self.assertEqual(
+      self._getBatches(publishQ, numSamples=3),
+      [["test.metric 0 1386120789", "test.metric 1 1386120789",
+        "test.metric 2 1386120789"]])
+
+
+
+  @patch.object(metric_listener._EventLoop, "_MAX_LINE_LENGTH", 100)
+  def testStreamWithOverlongLineClosed(self):
+    publishQ = Queue.Queue()
+    eventLoop = metric_listener._EventLoop(publishQ=publishQ,
+                                           maxBatchSize=1,
+                                           maxBatchDelaySec=60)
+
+    serverSock, clientSock = socket.socketpair()
+    self.addCleanup(clientSock.close)
+    serverSock.setblocking(0)
+    eventLoop.addStreamSocket(serverSock)
+    self._runEventLoop(eventLoop)
+
+    clientSock.sendall("test.metric 4 1386120789\n" + "x" * 101)
+
+    self.assertEqual(self._getBatches(publishQ, numSamples=1),
+                     [["test.metric 4 1386120789"]])
+
+    # The event loop closed the connection without adding the overlong line
+    clientSock.settimeout(5)
+    self.assertEqual(clientSock.recv(1), "")
+    self.assertEqual(eventLoop._lineBuffers, dict())
+    self.assertTrue(publishQ.empty())
+
+
+  def testDatagramRecvErrorLoggedAndIgnored(self):
+    publishQ = Queue.Queue()
+    eventLoop = metric_listener._EventLoop(publishQ=publishQ,
+                                           maxBatchSize=1,
+                                           maxBatchDelaySec=60)
+    self.addCleanup(eventLoop.close)
+
+    sockMock = Mock(spec_set=socket.socket)
+    sockMock.recv.side_effect = [
+      "test.metric 4 1386120789",
+      socket.error(errno.ECONNREFUSED, "Connection refused")]
+
+    with patch.object(metric_listener, "LOGGER", autospec=True) as loggerMock:
+      eventLoop._readDatagrams(sockMock)
+
+    self.assertEqual(sockMock.recv.call_count, 2)
+    self.assertEqual(loggerMock.warning.call_count, 1)
+    self.assertEqual(self._getBatches(publishQ, numSamples=1),
+                     [["test.metric 4 1386120789"]])
+
+
+
+class EventDrivenServerTest(unittest.TestCase):
+
+
+  @patch.object(metric_listener, "MessageBusConnector", autospec=True)
+  @patch.object(metric_listener, "_forwardData", autospec=True)
+  def testTCPClientsMultiplexed(self, forwardDataMock,
+                                _MessageBusConnectorMock):
+    server = metric_listener.EventDrivenServer(
+      ("127.0.0.1", 0),
+      metric_listener.Transport.TCP,
+      numEventLoops=2,
+      numPublishers=2,
+      maxBatchSize=100,
+      maxBatchDelaySec=0.001)
+    self.addCleanup(server.server_close)
+
+    serverThread = threading.Thread(target=server.serve_forever)
+    serverThread.setDaemon(True)
+    serverThread.start()
+
+    clients = [socket.create_connection(server.server_address)
+               for _ in xrange(3)]
+    for i, client in enumerate(clients):
+      for j in xrange(10):
+        client.sendall("test.metric.%d %d 1386120789\n" % (i, j))
+      client.close()
+
+    def getForwardedSamples():
+      return [sample
+              for call in forwardDataMock.call_args_list
+              for sample in call[0][1]]
+
+    deadline = time.time() + 5
+    while len(getForwardedSamples()) < 30 and time.time() < deadline:
+      time.sleep(0.01)
+
+    server.shutdown()
+    serverThread.join(5)
+    self.assertFalse(serverThread.isAlive())
+
+    # The samples of each client are forwarded in order
+    samples = getForwardedSamples()
+    self.assertEqual(len(samples), 30)
+    for i in xrange(3):
+      self.assertEqual(
+        [sample for sample in samples
+         if sample.startswith("test.metric.%d " % (i,))],
+        ["test.metric.%d %d 1386120789" % (i, j) for j in xrange(10)])
+
+
+
+class PublisherTest(unittest.TestCase):
+
+
+  @patch.object(metric_listener, "MessageBusConnector", autospec=True)
+  @patch.object(metric_listener, "_forwardData", autospec=True)
+  def testBatchesForwardedInOrderOverPersistentConnection(
+      self, forwardDataMock, messageBusConnectorClassMock):
+    forwardDataMock.side_effect = [None, Exception("publish failed"), None]
+
+    publishQ = Queue.Queue()
+    for batch in (["a"], ["b"], ["c"], None):
+      publishQ.put(batch)
+
+    metric_listener._runPublisher(publishQ)
+
+    self.assertEqual(messageBusConnectorClassMock.call_count, 1)
+    messageBus = messageBusConnectorClassMock.return_value.__enter__()
+    self.assertEqual(forwardDataMock.call_args_list,
+                     [mock.call(messageBus, ["a"]),
+                      mock.call(messageBus, ["b"]),
+                      mock.call(messageBus, ["c"])])
+
+
+
 if __name__ == "__main__":
   unittest.main()
@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2015, Numenta, Inc.  Unless you have purchased from
+# Numenta, Inc. a separate commercial license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+"""Tests the metric metadata cache."""
+
+import datetime
+import unittest
+
+from mock import patch
+
+from htmengine.repository.queries import MetricStatus
+from htmengine.runtime import metric_metadata_cache
+from htmengine.runtime.metric_metadata_cache import MetricMetadataCache
+
+
+
+class MetricMetadataCacheTestCase(unittest.TestCase):
+
+
+  def testPutAndGet(self):
+    cache = MetricMetadataCache()
+
+    self.assertIsNone(cache.get("abcdef"))
+    self.assertIsNone(cache.getByName("test.metric"))
+
+    cache.put("abcdef", name="test.metric", status=MetricStatus.ACTIVE)
+    cache.put("abcdef", lastRowID=10)
+
+    metadata = cache.getByName("test.metric")
+    self.assertEqual(metadata.uid, "abcdef")
+    self.assertEqual(metadata.status, MetricStatus.ACTIVE)
+    self.assertEqual(metadata.lastRowID, 10)
+    self.assertIsNone(metadata.tailTimestamp)
+    self.assertEqual(cache.get("abcdef"), metadata)
+
+    stats = cache.getStats()
+    self.assertEqual(stats["numEntries"], 1)
+    self.assertEqual(stats["hits"], 2)
+    self.assertEqual(stats["misses"], 2)
+    self.assertEqual(stats["hitRatio"], 0.5)
+
+
+  def testGetTailTimestamp(self):
+    cache = MetricMetadataCache()
+    now = datetime.datetime.utcnow()
+
+    self.assertIsNone(cache.getTailTimestamp("abcdef", 10))
+
+    cache.put("abcdef", lastRowID=10, tailTimestamp=now)
+    self.assertEqual(cache.getTailTimestamp("abcdef", 10), now)
+
+    # Rows were added since, e.g. by another process
+    self.assertIsNone(cache.getTailTimestamp("abcdef", 11))
+    self.assertIsNotNone(cache.get("abcdef"))
+
+
+  def testLeastRecentlyUsedEviction(self):
+    cache = MetricMetadataCache(maxEntries=3)
+
+    for uid in ("m1", "m2", "m3"):
+      cache.put(uid, name=uid + ".name")
+
+    # Make m1 the most recently used
+    cache.get("m1")
+    cache.put("m4", name="m4.name")
+
+    self.assertEqual(len(cache), 3)
+    self.assertIsNone(cache.get("m2"))
+    self.assertIsNone(cache.getByName("m2.name"))
+    for uid in ("m1", "m3", "m4"):
+      self.assertEqual(cache.getByName(uid + ".name").uid, uid)
+
+    self.assertEqual(cache.getStats()["evictions"], 1)
+
+
+  def testExpiration(self):
+    cache = MetricMetadataCache(ttlSec=60)
+
+    with patch.object(metric_metadata_cache.time, "time", autospec=True,
+                      return_value=1000):
+      cache.put("abcdef", name="test.metric", lastRowID=1,
+                tailTimestamp=datetime.datetime.utcnow())
+
+    with patch.object(metric_metadata_cache.time, "time", autospec=True,
+                      return_value=1059):
+      self.assertIsNotNone(cache.getByName("test.metric"))
+
+    with patch.object(metric_metadata_cache.time, "time", autospec=True,
+                      return_value=1060):
+      self.assertIsNone(cache.getTailTimestamp("abcdef", 1))
+      self.assertIsNone(cache.getByName("test.metric"))
+
+      # Stale fields aren't merged into the new entry
+      self.assertIsNone(cache.put("abcdef", status="x").name)
+
+    self.assertEqual(cache.getStats()["expirations"], 1)
+
+
+  def testMetricDeleted(self):
+    cache = MetricMetadataCache()
+    cache.put("abcdef", name="test.metric")
+
+    cache.onMetricDeleted("abcdef")
+    cache.onMetricDeleted("abcdef")
+
+    self.assertIsNone(cache.get("abcdef"))
+    self.assertIsNone(cache.getByName("test.metric"))
+    self.assertEqual(cache.getStats()["invalidations"], 1)
+
+
+  def testMetricRecreatedWithSameName(self):
+    cache = MetricMetadataCache()
+    cache.put("abcdef", name="test.metric")
+    cache.put("123456", name="test.metric")
+
+    self.assertEqual(cache.getByName("test.metric").uid, "123456")
+
+    # Invalidating the old metric doesn't affect the new one
+    cache.invalidate("abcdef")
+    self.assertEqual(cache.getByName("test.metric").uid, "123456")
+
+
+  def testRenameAfterNameReassigned(self):
+    cache = MetricMetadataCache()
+    cache.put("abcdef", name="test.metric")
+    cache.put("123456", name="test.metric")
+
+    # Renaming the old metric doesn't evict the new one's name mapping
+    cache.put("abcdef", name="other.metric")
+    self.assertEqual(cache.getByName("test.metric").uid, "123456")
+    self.assertEqual(cache.getByName("other.metric").uid, "abcdef")
+
+    # Renaming the metric that holds the mapping removes its old name
+    cache.put("123456", name="new.metric")
+    self.assertIsNone(cache.getByName("test.metric"))
+    self.assertEqual(cache.getByName("new.metric").uid, "123456")
+
+
+  def testMetricStatusChanged(self):
+    cache = MetricMetadataCache()
+    cache.put("abcdef", status=MetricStatus.PENDING_DATA)
+
+    cache.onMetricStatusChanged("abcdef", MetricStatus.CREATE_PENDING)
+    self.assertEqual(cache.get("abcdef").status, MetricStatus.CREATE_PENDING)
+
+    # Status of metrics that aren't cached is ignored
+    cache.onMetricStatusChanged("123456", MetricStatus.ACTIVE)
+    self.assertIsNone(cache.get("123456"))
+
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -26,14 +26,18 @@
 # pylint: disable=W0212
 
 import datetime
+import json
 import unittest
 
 import mock
 from mock import MagicMock, Mock, patch
 
+import htmengine.exceptions
 from htmengine.model_swapper import model_swapper_interface
 from htmengine.runtime import metric_storer
 from htmengine.runtime import metric_streamer_util
+from htmengine.runtime.metric_listener import parsePlaintextBatch
+from htmengine.runtime.metric_metadata_cache import MetricMetadataCache
 
 class MetricStorerTest(unittest.TestCase):
 
@@ -41,13 +45,11 @@ class MetricStorerTest(unittest.TestCase):
   @patch("sqlalchemy.engine")
   def testHandleBatchSingle(self, mockEngine, addMetricMock):
     # Create mocks
-    metric_storer.gCustomMetrics = {}
-
-    metricMock = MagicMock()
+    metric_storer.gMetricCache = MetricMetadataCache()
 
     def addMetricSideEffect(*_args, **_kwargs):
-      metric_storer.gCustomMetrics["test.metric"] = [
-          metricMock, datetime.datetime.utcnow()]
+      metric_storer.gMetricCache.put("abcdef", name="test.metric")
+      return "abcdef"
 
     addMetricMock.side_effect = addMetricSideEffect
 
@@ -72,7 +74,8 @@ class MetricStorerTest(unittest.TestCase):
     # Check the results
     addMetricMock.assert_called_once_with(mockEngine, "test.metric")
     self.assertEqual(metricStreamerMock.streamMetricData.call_count, 1)
-    data, _uid, modelSwapper = metricStreamerMock.streamMetricData.call_args[0]
+    data, uid, modelSwapper = metricStreamerMock.streamMetricData.call_args[0]
+    self.assertEqual(uid, "abcdef")
     self.assertIs(modelSwapper, modelSwapperMock)
     self.assertEqual(len(data), 1)
     self.assertEqual(len(data[0]), 2)
@@ -109,65 +112,97 @@ class MetricStorerTest(unittest.TestCase):
     self.assertTrue(loggingMock.warn.called)
 
 
-  def testTrimMetricCacheNoMetrics(self):
-    metric_storer.MAX_CACHED_METRICS = 5
-    metric_storer.CACHED_METRICS_TO_KEEP = 3
-    metric_storer.gCustomMetrics = {}
-
-    metric_storer._trimMetricCache()
+  @patch("htmengine.runtime.metric_storer._addMetric", autospec=True)
+  @patch("sqlalchemy.engine")
+  def testAddMetricDataUsesCachedMetric(self, mockEngine, addMetricMock):
+    metric_storer.gMetricCache = MetricMetadataCache()
+    metric_storer.gMetricCache.put("abcdef", name="test.metric")
 
-    self.assertDictEqual(metric_storer.gCustomMetrics, {})
+    metricStreamerMock = Mock(spec_set=metric_streamer_util.MetricStreamer)
+    modelSwapperMock = Mock(
+      spec_set=model_swapper_interface.ModelSwapperInterface)
 
+    timestamp = datetime.datetime(2013, 12, 11, 20, 2, 55)
+    metric_storer._addMetricData(
+      mockEngine,
+      parsePlaintextBatch(["test.metric 4.0 1386792175"]),
+      metricStreamerMock,
+      modelSwapperMock)
 
-  def testTrimMetricCacheOneMetric(self):
-    metric_storer.MAX_CACHED_METRICS = 5
-    metric_storer.CACHED_METRICS_TO_KEEP = 3
-    m1 = (MagicMock(), datetime.datetime.utcnow())
-    metric_storer.gCustomMetrics = {"m1": m1}
+    self.assertFalse(addMetricMock.called)
+    metricStreamerMock.streamMetricData.assert_called_once_with(
+      [(timestamp, 4.0)], "abcdef", modelSwapperMock)
+    self.assertEqual(metric_storer.gMetricCache.getStats()["hits"], 1)
 
-    metric_storer._trimMetricCache()
 
-    self.assertDictEqual(metric_storer.gCustomMetrics, {"m1": m1})
+  @patch("htmengine.runtime.metric_storer._addMetric", autospec=True)
+  @patch("sqlalchemy.engine")
+  def testAddMetricDataRecreatedMetric(self, mockEngine, addMetricMock):
+    metric_storer.gMetricCache = MetricMetadataCache()
+    metric_storer.gMetricCache.put("abcdef", name="test.metric")
 
+    addMetricMock.return_value = "123456"
 
-  def testTrimMetricCacheMaxMetric(self):
-    metric_storer.MAX_CACHED_METRICS = 5
-    metric_storer.CACHED_METRICS_TO_KEEP = 3
-    startDT = datetime.datetime.utcnow()
-    m1 = (MagicMock(), startDT)
-    m2 = (MagicMock(), startDT)
-    m3 = (MagicMock(), startDT)
-    m4 = (MagicMock(), startDT)
-    m5 = (MagicMock(), startDT)
-    metric_storer.gCustomMetrics = {
-        "m1": m1, "m2": m2, "m3": m3, "m4": m4, "m5": m5}
+    metricStreamerMock = Mock(spec_set=metric_streamer_util.MetricStreamer)
+    metricStreamerMock.streamMetricData.side_effect = [
+      htmengine.exceptions.ObjectNotFoundError("abcdef"),
+      None]
+    modelSwapperMock = Mock(
+      spec_set=model_swapper_interface.ModelSwapperInterface)
 
-    metric_storer._trimMetricCache()
+    timestamp = datetime.datetime(2013, 12, 11, 20, 2, 55)
+    metric_storer._addMetricData(
+      mockEngine,
+      parsePlaintextBatch(["test.metric 4.0 1386792175"]),
+      metricStreamerMock,
+      modelSwapperMock)
 
-    self.assertDictEqual(metric_storer.gCustomMetrics,
-                         {"m1": m1, "m2": m2, "m3": m3, "m4": m4, "m5": m5})
+    addMetricMock.assert_called_once_with(mockEngine, "test.metric")
+    self.assertEqual(
+      metricStreamerMock.streamMetricData.call_args_list,
+      [mock.call([(timestamp, 4.0)], "abcdef", modelSwapperMock),
+       mock.call([(timestamp, 4.0)], "123456", modelSwapperMock)])
 
 
-  def testTrimMetricCacheOverLimit(self):
-    metric_storer.MAX_CACHED_METRICS = 5
-    metric_storer.CACHED_METRICS_TO_KEEP = 3
-    startDT = datetime.datetime.utcnow()
-    td = datetime.timedelta(minutes=1)
-    m1 = (MagicMock(), startDT - (td * 5))
-    m2 = (MagicMock(), startDT - (td * 4))
-    m3 = (MagicMock(), startDT - (td * 3))
-    m4 = (MagicMock(), startDT - (td * 2))
-    m5 = (MagicMock(), startDT - td)
-    m6 = (MagicMock(), startDT)
-    metric_storer.gCustomMetrics = {
-        "m1": m1, "m2": m2, "m3": m3, "m4": m4, "m5": m5, "m6": m6}
+  @patch("htmengine.runtime.metric_storer._addMetric", autospec=True)
+  @patch.object(metric_storer, "LOGGER")
+  @patch("sqlalchemy.engine")
+  def testHandleBatchGroupsSamplesByMetric(self, mockEngine, loggingMock,
+                                           addMetricMock):
+    metric_storer.gMetricCache = MetricMetadataCache()
+    addMetricMock.side_effect = lambda engine, name: "uid-" + name
 
-    metric_storer._trimMetricCache()
+    metricStreamerMock = Mock(spec_set=metric_streamer_util.MetricStreamer)
+    modelSwapperMock = Mock(
+      spec_set=model_swapper_interface.ModelSwapperInterface)
 
-    self.assertDictEqual(
-        metric_storer.gCustomMetrics,
-        {"m4": m4, "m5": m5, "m6": m6})
+    messages = [
+      Mock(body=json.dumps(
+        {"protocol": "plain",
+         "data": ["m1 1.0 1386792175", "m2 2.0 1386792175", "bad sample",
+                  "m1 3.0 1386792475"]})),
+      Mock(body=json.dumps(
+        {"protocol": "plain",
+         "data": ["m2 4.0 1386792475", "m3 x 1386792475",
+                  "m1 5.0 1386792775"]}))]
+
+    metric_storer._handleBatch(mockEngine, messages, [], metricStreamerMock,
+                               modelSwapperMock)
 
+    startTime = datetime.datetime(2013, 12, 11, 20, 2, 55)
+    interval = datetime.timedelta(minutes=5)
+    self.assertEqual(
+      metricStreamerMock.streamMetricData.call_args_list,
+      [mock.call([(startTime, 1.0),
+                  (startTime + interval, 3.0),
+                  (startTime + interval * 2, 5.0)],
+                 "uid-m1", modelSwapperMock),
+       mock.call([(startTime, 2.0),
+                  (startTime + interval, 4.0)],
+                 "uid-m2", modelSwapperMock)])
+
+    # The rejects are reported
+    self.assertEqual(loggingMock.warn.call_count, 2)
 
 
 if __name__ == "__main__":
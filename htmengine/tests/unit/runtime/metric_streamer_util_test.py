@@ -31,9 +31,10 @@ Unit tests for htmengine.runtime.metric_streamer_util
 from datetime import datetime, timedelta
 import unittest
 
-from mock import Mock, patch
+from mock import MagicMock, Mock, patch
 
 from htmengine.runtime import metric_streamer_util
+from htmengine.runtime.metric_metadata_cache import MetricMetadataCache
 from htmengine.model_swapper import model_swapper_interface
 
 
@@ -263,6 +264,52 @@ class MetricStreamerTestCase(unittest.TestCase):
       inputRows[:1])
 
 
+  @patch.object(metric_streamer_util, "repository", autospec=True)
+  def testGetTailMetricRowTimestampFromSharedCache(self, repositoryMock):
+    metricCache = MetricMetadataCache()
+    streamer = metric_streamer_util.MetricStreamer(metricCache=metricCache)
+
+    now = datetime.utcnow()
+    metricCache.put("abcdef", lastRowID=10, tailTimestamp=now)
+
+    timestamp = streamer._getTailMetricRowTimestamp(
+      conn=Mock(name="SqlalchemyConnection"),
+      metricID="abcdef",
+      lastDataRowID=10)
+
+    self.assertEqual(timestamp, now)
+    self.assertFalse(repositoryMock.getMetricData.called)
+    self.assertEqual(metricCache.getStats()["hits"], 1)
+
+
+  @patch.object(metric_streamer_util, "repository", autospec=True)
+  def testGetTailMetricRowTimestampReloadsWhenRowsAddedElsewhere(
+      self, repositoryMock):
+    metricCache = MetricMetadataCache()
+    streamer = metric_streamer_util.MetricStreamer(metricCache=metricCache)
+
+    now = datetime.utcnow()
+    metricCache.put("abcdef", lastRowID=10,
+                    tailTimestamp=now - timedelta(seconds=300))
+
+    rows = MagicMock(rowcount=1, returns_rows=True)
+    rows.__iter__.return_value = iter([Mock(timestamp=now)])
+    repositoryMock.getMetricData.return_value = rows
+
+    conn = Mock(name="SqlalchemyConnection")
+
+    timestamp = streamer._getTailMetricRowTimestamp(
+      conn=conn,
+      metricID="abcdef",
+      lastDataRowID=12)
+
+    self.assertEqual(timestamp, now)
+    repositoryMock.getMetricData.assert_called_once_with(conn, "abcdef",
+                                                         rowid=12)
+    self.assertEqual(metricCache.get("abcdef").lastRowID, 12)
+    self.assertEqual(metricCache.get("abcdef").tailTimestamp, now)
+
+
 
 if __name__ == '__main__':
   unittest.main()
@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2015, Numenta, Inc.  Unless you have purchased from
+# Numenta, Inc. a separate commercial license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+
+"""Unit tests for the metric data encoders."""
+
+from collections import namedtuple
+import datetime
+import json
+import StringIO
+import unittest
+
+import msgpack
+import numpy
+
+from htmengine.utils import metric_data_encoders
+
+
+
+Row = namedtuple("Row", "uid timestamp metric_value anomaly_score rowid")
+
+
+
+def _makeRows(uid, numRows, firstRowid=1):
+  startTime = datetime.datetime(2015, 1, 1)
+  return [Row(uid=uid,
+              timestamp=startTime + datetime.timedelta(minutes=5 * i),
+              metric_value=float(i),
+              anomaly_score=(None if i == 0 else i / 100.0),
+              rowid=firstRowid + i)
+          for i in xrange(numRows)]
+
+
+
+class MetricDataEncodersTestCase(unittest.TestCase):
+
+
+  def testEncodeJSONSingleMetric(self):
+    rows = _makeRows("abc", 3)
+
+    result = json.loads("".join(
+      metric_data_encoders.encodeJSON([rows[:2], rows[2:]],
+                                      multiMetric=False)))
+
+    self.assertEqual(result["names"],
+                     ["timestamp", "value", "anomaly_score", "rowid"])
+    self.assertEqual(result["data"],
+                     [["2015-01-01 00:00:00", 0.0, None, 1],
+                      ["2015-01-01 00:05:00", 1.0, 0.01, 2],
+                      ["2015-01-01 00:10:00", 2.0, 0.02, 3]])
+
+
+  def testEncodeJSONMultiMetric(self):
+    rows = _makeRows("abc", 3)
+    otherRows = _makeRows("def", 1)
+
+    result = json.loads("".join(
+      metric_data_encoders.encodeJSON([rows[:2], rows[2:], otherRows],
+                                      multiMetric=True)))
+
+    self.assertEqual([(metric["uid"], [record[3] for record in metric["data"]])
+                      for metric in result["metrics"]],
+                     [("abc", [1, 2, 3]), ("def", [1])])
+
+
+  def testEncodeJSONWithoutData(self):
+    for multiMetric, key in ((False, "data"), (True, "metrics")):
+      result = json.loads("".join(
+        metric_data_encoders.encodeJSON([], multiMetric=multiMetric)))
+      self.assertEqual(result[key], [])
+
+
+  def testEncodeMsgpackRows(self):
+    rows = _makeRows("abc", 2) + _makeRows("def", 1)
+
+    records = list(msgpack.Unpacker(StringIO.StringIO("".join(
+      metric_data_encoders.encodeMsgpackRows([rows[:2], rows[2:]])))))
+
+    self.assertEqual(records,
+                     [["names", "uid", "timestamp", "value", "anomaly_score",
+                       "rowid"],
+                      ["abc", 1420070400, 0.0, None, 1],
+                      ["abc", 1420070700, 1.0, 0.01, 2],
+                      ["def", 1420070400, 0.0, None, 1]])
+
+
+  def testEncodeMsgpackColumns(self):
+    rows = _makeRows("abc", 3)
+
+    frames = list(msgpack.Unpacker(StringIO.StringIO("".join(
+      metric_data_encoders.encodeMsgpackColumns([rows])))))
+
+    self.assertEqual(len(frames), 2)
+    self.assertEqual(frames[1][0], "abc")
+
+    timestamps, values, scores, rowids = [
+      numpy.frombuffer(column, dtype=dtype)
+      for column, dtype in zip(frames[1][1:],
+                               metric_data_encoders.COLUMN_DTYPES)]
+
+    self.assertEqual(timestamps.tolist(),
+                     [1420070400, 1420070700, 1420071000])
+    self.assertEqual(values.tolist(), [0.0, 1.0, 2.0])
+    self.assertTrue(numpy.isnan(scores[0]))
+    self.assertEqual(scores[1:].tolist(), [0.01, 0.02])
+    self.assertEqual(rowids.tolist(), [1, 2, 3])
+
+
+
+if __name__ == "__main__":
+  unittest.main()
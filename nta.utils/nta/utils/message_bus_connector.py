@@ -218,20 +218,32 @@ class MessageBusConnector(object):
         raise
 
 
-  @_RETRY_ON_AMQP_ERROR
   def isEmpty(self, mqName):
     """
     raises: MessageQueueNotFound
     """
+    # NOTE: we implement this on top of getMessageCount(), which already uses
+    # _RETRY_ON_AMQP_ERROR, so we don't need retries on this method.
+    return self.getMessageCount(mqName) == 0
+
+
+  @_RETRY_ON_AMQP_ERROR
+  def getMessageCount(self, mqName):
+    """ Get the number of messages that are ready for delivery in the given
+    message queue
+
+    retval: number of ready messages in the queue
+    raises: MessageQueueNotFound
+    """
     try:
       r = self._channelMgr.client.declareQueue(mqName,
                                                passive=True)
-      return r.messageCount == 0
+      return r.messageCount
     except amqp.exceptions.AmqpChannelError as e:
       if e.code == amqp.constants.AMQPErrorCodes.NOT_FOUND:
         self._channelMgr.reset()
         raise MessageQueueNotFound(
-          "isEmpty: mq=%s not found (%r)" % (mqName, e,))
+          "getMessageCount: mq=%s not found (%r)" % (mqName, e,))
       else:
         raise
 
@@ -366,7 +378,7 @@ class MessageBusConnector(object):
     return True
 
 
-  def consume(self, mqName, blocking=True):
+  def consume(self, mqName, blocking=True, prefetchMax=None):
     """ Create an instance of _QueueConsumer iterable for consuming messages.
     The iterable yields an instance of _ConsumedMessage.
 
@@ -374,6 +386,9 @@ class MessageBusConnector(object):
     blocking: if True, the iterable will block until another message becomes
       available; if False, the iterable will terminate iteration when no more
       messages are available in the queue. [Defaults to blocking=True]
+    prefetchMax: the limit for how many unacked messages the broker may deliver
+      to a blocking consumer; consumers that process messages concurrently and
+      defer acks need a larger limit. [Defaults to _PREFETCH_MAX]
 
     The iterable raises: MessageQueueNotFound
 
@@ -395,7 +410,8 @@ class MessageBusConnector(object):
     consumer = _QueueConsumer(
       mqName=mqName,
       blocking=blocking,
-      prefetchMax=self._PREFETCH_MAX,
+      prefetchMax=(prefetchMax if prefetchMax is not None
+                   else self._PREFETCH_MAX),
       bus=self)
 
     self._consumers.append(consumer)
@@ -303,6 +303,38 @@ Index("stored_at_idx", twitterTweetSamples.c.stored_at)
 
 
 
+# Tweet volumes per metric and aggregation timestamp; maintained by
+# twitter_direct_agent as it saves twitter_tweet_samples rows, so that tweet
+# volume metrics over a range of aggregations may be forwarded without counting
+# twitter_tweet_samples rows
+twitterTweetVolumes = Table(
+  "twitter_tweet_volumes",
+  metadata,
+
+  # Aggregation timestamp
+  Column("agg_ts",
+         DATETIME(),
+         nullable=False),
+
+  # Metric name
+  Column("metric",
+         mysql.VARCHAR(length=METRIC_NAME_MAX_LEN),
+         nullable=False),
+
+  PrimaryKeyConstraint("agg_ts", "metric",
+                       name="twitter_tweet_volumes_pk"),
+
+  # Number of twitter_tweet_samples rows of the metric with this agg_ts
+  Column("volume",
+         mysql.INTEGER(unsigned=True),
+         nullable=False),
+
+  mysql_COLLATE=MYSQL_COLLATE,
+  mysql_CHARSET=MYSQL_CHARSET,
+)
+
+
+
 # Tweet IDs to be deleted from Status deletion notices; see
 # https://dev.twitter.com/streaming/overview/messages-types
 # NOTE: per twitter doc, deletion notices may arrive prior to the
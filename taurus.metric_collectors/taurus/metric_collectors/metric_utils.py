@@ -24,12 +24,14 @@ from datetime import datetime, timedelta
 import json
 import logging
 import os
+import Queue
+import threading
 import time
 
 import requests
 import sqlalchemy as sql
 
-from nta.utils.error_handling import retry
+from nta.utils.error_handling import logExceptions, retry
 from nta.utils import date_time_utils
 from nta.utils import message_bus_connector
 
@@ -92,6 +94,12 @@ class RetriesExceededError(Exception):
 
 
 
+class MetricDataPublishError(Exception):
+  """ Some metric data samples failed to publish to the message bus """
+  pass
+
+
+
 g_log = logging.getLogger("metric_collectors.metric_utils")
 
 
@@ -714,9 +722,196 @@ def aggTimestampFromSampleTimestamp(sampleDatetime, aggRefDatetime, aggSec):
   return datetime.utcfromtimestamp(aggEpoch)
 
 
-# Number of data samples per batch; used by metricDataBatchWrite
+# Name of Taurus Engine's custom metric data message queue
+_METRIC_DATA_MQ_NAME = "taurus.metric.custom.data"
+
+# Number of data samples per batch; used by MetricDataPublisher
 _METRIC_DATA_BATCH_WRITE_SIZE = 200
 
+# Maximum time that MetricDataPublisher holds a sample before publishing its
+# batch
+_METRIC_DATA_PUBLISH_DELAY_SEC = 0.5
+
+# Maximum number of samples buffered by MetricDataPublisher; putting samples
+# blocks while the buffer is full
+_METRIC_DATA_PUBLISH_BUFFER_SIZE = 10000
+
+
+
+class _PublishSession(object):
+  """ Samples put by one metricDataBatchWrite context; tracks whether any of
+  them failed to publish
+  """
+  def __init__(self):
+    # Set by MetricDataPublisher once the session's samples are flushed
+    self.flushed = threading.Event()
+
+    # Number of the session's samples that failed to publish
+    self.numFailedSamples = 0
+
+
+
+class MetricDataPublisher(object):
+  """ Publishes metric data samples to Taurus Engine's custom metric data
+  message queue from a background thread over a long-lived message bus
+  connection.
+
+  Samples are buffered in a bounded queue and published in batches of up to
+  `batchSize` samples, at most `maxDelaySec` after the first sample of a batch
+  was put. MessageBusConnector.publish waits for the broker to confirm each
+  batch. Putting samples blocks while the buffer is full, which holds back
+  producers when the broker is slow.
+
+  Use `getMetricDataPublisher()` to get the process-wide instance.
+  """
+
+  def __init__(self,
+               batchSize=_METRIC_DATA_BATCH_WRITE_SIZE,
+               maxDelaySec=_METRIC_DATA_PUBLISH_DELAY_SEC,
+               maxBufferedSamples=_METRIC_DATA_PUBLISH_BUFFER_SIZE):
+    """
+    :param int batchSize: maximum number of samples per published message
+    :param float maxDelaySec: maximum time that a sample waits for its batch
+      to fill up
+    :param int maxBufferedSamples: capacity of the sample buffer
+    """
+    self._batchSize = batchSize
+    self._maxDelaySec = maxDelaySec
+
+    # Two-tuples (<_PublishSession>, <sample>); sample of None requests a flush
+    # of the session
+    self._sampleQ = Queue.Queue(maxsize=maxBufferedSamples)
+
+    self._thread = threading.Thread(target=self._run,
+                                    name=self.__class__.__name__)
+    self._thread.setDaemon(True)
+    self._thread.start()
+
+
+  def put(self, session, sample):
+    """ Buffer a sample for publishing; blocks while the buffer is full
+
+    :param _PublishSession session: session of the sample
+    :param str sample: plaintext sample "<metricName> <value> <epochTimestamp>"
+    """
+    self._sampleQ.put((session, sample))
+
+
+  def flush(self, session):
+    """ Publish buffered samples and wait until the given session's samples are
+    confirmed by the broker
+
+    :param _PublishSession session: session to flush
+
+    :raises MetricDataPublishError: if any of the session's samples failed to
+      publish
+    """
+    self._sampleQ.put((session, None))
+
+    while not session.flushed.wait(1):
+      if not self._thread.isAlive():
+        raise MetricDataPublishError("MetricDataPublisher thread has stopped")
+
+    if session.numFailedSamples:
+      raise MetricDataPublishError(
+        "Failed to publish numSamples=%d" % (session.numFailedSamples,))
+
+
+  @logExceptions(g_log)
+  def _run(self):
+    """ Publisher thread function """
+    bus = None
+
+    while True:
+      batch = []
+      # Number of samples in the batch per session
+      batchSessions = dict()
+      flushedSessions = []
+
+      # Accumulate a batch of samples
+      # NOTE: once a flush is requested, we only add samples that are already
+      # buffered, so that concurrent sessions share batches
+      deadline = None
+      while len(batch) < self._batchSize:
+        try:
+          if flushedSessions:
+            session, sample = self._sampleQ.get_nowait()
+          else:
+            timeout = None if deadline is None else deadline - time.time()
+            if timeout is not None and timeout <= 0:
+              break
+            session, sample = self._sampleQ.get(timeout=timeout)
+        except Queue.Empty:
+          break
+
+        if sample is None:
+          flushedSessions.append(session)
+        else:
+          batch.append(sample)
+          batchSessions[session] = batchSessions.get(session, 0) + 1
+          if deadline is None:
+            deadline = time.time() + self._maxDelaySec
+
+      # Publish the batch
+      if batch:
+        try:
+          if bus is None:
+            bus = message_bus_connector.MessageBusConnector()
+
+          bus.publish(mqName=_METRIC_DATA_MQ_NAME,
+                      body=json.dumps(dict(protocol="plain", data=batch)),
+                      persistent=True)
+        except Exception:  # pylint: disable=W0703
+          g_log.exception("Failed to publish numSamples=%d: first=%r; last=%r",
+                          len(batch), batch[0], batch[-1])
+
+          for session, numSamples in batchSessions.iteritems():
+            session.numFailedSamples += numSamples
+
+          # Reconnect on next publish
+          if bus is not None:
+            try:
+              bus.close()
+            except Exception:  # pylint: disable=W0703
+              g_log.exception("Failed to close message bus connector")
+            bus = None
+        else:
+          g_log.debug("Published numSamples=%d: first=%r; last=%r",
+                      len(batch), batch[0], batch[-1])
+
+      for session in flushedSessions:
+        session.flushed.set()
+
+
+
+class _MetricDataPublisherSingleton(object):
+
+  _mutex = threading.Lock()
+  _pid = None
+  _publisher = None
+
+
+  @classmethod
+  def getPublisher(cls):
+    with cls._mutex:
+      # NOTE: the publisher thread doesn't survive fork, so a forked child
+      # process gets a publisher of its own
+      if cls._publisher is None or cls._pid != os.getpid():
+        cls._publisher = MetricDataPublisher()
+        cls._pid = os.getpid()
+
+      return cls._publisher
+
+
+
+def getMetricDataPublisher():
+  """
+  :returns: the process-wide MetricDataPublisher
+  :rtype: MetricDataPublisher
+  """
+  return _MetricDataPublisherSingleton.getPublisher()
+
+
 
 @contextlib.contextmanager
 def metricDataBatchWrite(log):
@@ -730,9 +925,10 @@ def metricDataBatchWrite(log):
     putSample(metricName, value, epochTimestamp)
 
   The user calls putSample for each metricDataSample that it wants to send;
-  putSample accumulates incoming samples into a batch and sends each batch to
-  Taurus server when optimal batch size is reached. At normal exit, the context
-  manager sends remaining samples, if any
+  putSample hands incoming samples to the process-wide MetricDataPublisher,
+  which sends them to Taurus server in batches. At normal exit, the context
+  manager flushes the samples and waits until they are published; it raises
+  MetricDataPublishError if any of them failed to publish.
 
   Usage example:
 
@@ -746,34 +942,31 @@ def metricDataBatchWrite(log):
 
   # __enter__ part begins here:
 
-  batch = []
-
-  bus = message_bus_connector.MessageBusConnector()
-
-  def sendBatch():
-    try:
-      msg = json.dumps(dict(protocol="plain", data=batch))
-      bus.publish(mqName="taurus.metric.custom.data", body=msg, persistent=True)
-      log.info("Published numSamples=%d: first=%r; last=%r",
-               len(batch), str(batch[0]), str(batch[-1]))
-    finally:
-      del batch[:]
+  publisher = getMetricDataPublisher()
+  session = _PublishSession()
 
+  # First and last samples put, and number of samples put
+  putStats = dict(first=None, last=None, numSamples=0)
 
   def putSample(metricName, value, epochTimestamp):
     # NOTE: we use %r for value to avoid loss of accuracy in floats;
     # NOTE: we cast value to float to deal with values like the long 72001L that
     #   would fail the parsing back to float in the receiver.
-    batch.append("%s %r %d" % (metricName, float(value), epochTimestamp))
-    if len(batch) >= _METRIC_DATA_BATCH_WRITE_SIZE:
-      sendBatch()
+    sample = "%s %r %d" % (metricName, float(value), epochTimestamp)
+    publisher.put(session, sample)
+
+    if putStats["first"] is None:
+      putStats["first"] = sample
+    putStats["last"] = sample
+    putStats["numSamples"] += 1
 
 
-  with bus:
-    yield putSample
+  yield putSample
 
-    # __exit__ part begins here:
+  # __exit__ part begins here:
 
-    # Send remnants, if any
-    if batch:
-      sendBatch()
+  # Wait for remnants, if any
+  if putStats["numSamples"]:
+    publisher.flush(session)
+    log.info("Published numSamples=%d: first=%r; last=%r",
+             putStats["numSamples"], putStats["first"], putStats["last"])
@@ -21,7 +21,8 @@
 # ----------------------------------------------------------------------
 
 """
-Purges old records from taurus_collectors.twitter_tweets table.
+Purges old records from taurus_collectors.twitter_tweets and
+taurus_collectors.twitter_tweet_volumes tables.
 
 NOTE: this script may be configured as "console" app by the package
 installer.
@@ -77,7 +78,7 @@ def _parseArgs():
 
 def purgeOldTweets(thresholdDays):
   """ Purge tweets from twitter_tweets table that are older than the given
-  number of days.
+  number of days, along with tweet volumes from twitter_tweet_volumes table.
 
   :param int thresholdDays: tweets older than this many days will be deleted
 
@@ -91,6 +92,11 @@ def purgeOldTweets(thresholdDays):
 
   sqlEngine = collectorsdb.engineFactory()
 
+  numVolumesDeleted = _deleteOldTweetVolumes(sqlEngine=sqlEngine,
+                                             thresholdDays=thresholdDays)
+
+  g_log.info("Purged numRows=%s old tweet volumes", numVolumesDeleted)
+
   selectionPredicate = (
     twitterTweetsSchema.c.created_at <
     sql.func.date_sub(sql.func.utc_timestamp(),
@@ -154,6 +160,29 @@ def purgeOldTweets(thresholdDays):
 
 
 
+@collectorsdb.retryOnTransientErrors
+def _deleteOldTweetVolumes(sqlEngine, thresholdDays):
+  """Delete twitter_tweet_volumes rows of aggregations older than the given
+  number of days
+
+  :param sqlalchemy.engine.Engine sqlEngine:
+  :param int thresholdDays: tweet volumes older than this many days will be
+    deleted
+
+  :returns: number of rows deleted
+  """
+  twitterTweetVolumesSchema = collectorsdb.schema.twitterTweetVolumes
+
+  return sqlEngine.execute(
+    twitterTweetVolumesSchema.delete()  # pylint: disable=E1120
+    .where(twitterTweetVolumesSchema.c.agg_ts <
+           sql.func.date_sub(
+             sql.func.utc_timestamp(),
+             sql.text("INTERVAL {:d} DAY".format(thresholdDays))))
+  ).rowcount
+
+
+
 @collectorsdb.retryOnTransientErrors
 def _estimateNumTweetsToDelete(sqlEngine, selectionPredicate):
   """
@@ -31,6 +31,7 @@ from optparse import OptionParser
 import os
 import pprint
 import Queue
+import re
 import sys
 import threading
 import time
@@ -109,113 +110,141 @@ def loadMetricSpecs():
 
 
 
-def buildTaggingMapAndStreamFilterParams(metricSpecs, authHandler):
-  """ Build tweet tag processing map and the corresponding twitter stream filter
-  params
+class TweetTagIndex(object):
+  """ Compiled tweet tagging index: maps cashtags, source user ids and
+  mentioned user ids to bitmasks of metric indices, so that a tweet is tagged
+  with a few dict lookups and bitwise ORs, and tweets that can't match any
+  metric are recognized from their raw JSON without decoding it.
+  """
 
-  :param metricSpecs: sequence of TwitterMetricSpec objects
+  # Matches the string values of "id_str" and "text" keys in the raw JSON of a
+  # status; the source user id, mentioned user ids and cashtags of a tweet are
+  # among them
+  _CANDIDATE_VALUES_RE = re.compile(r'"(?:id_str|text)"\s*:\s*"([^"\\]*)"')
 
-  :returns: a two-tuple (<taggingMap>, <streamFilterParams>)
-    <taggingMap>: a dict of callables to corresponding mapping dictionaries;
-      each mapping dictionary key is a target value of interest (e.g., stock
-      ticker) and the corresponding value is the name(s) of the metric(s)
-      corresonding to that value; the callable is passed each message and
-      the mapping dictionary corresponding to the callable, and is responsible
-      for adding metric names to the metricTagSet of the message for any hits
-      that it finds. This example demonstrates the structure of the
-      <taggingMap>:
-        {
-          tagOnSymbols: {
-            "ACN": "TWITTER.TWEET.HANDLE.ACN.VOLUME",
-            "IRBT": "TWITTER.TWEET.HANDLE.IRBT.VOLUME",
-            . . .
-          },
-          tagOnSourceUsers: {
-            "10194682": set(["TWITTER.TWEET.HANDLE.ACN.VOLUME"]),  # @Accenture
-            "20536157": set(["TWITTER.TWEET.HANDLE.GOOGL.VOLUME",
-                             "TWITTER.TWEET.HANDLE.GOOG.VOLUME"]), # @google
-            "111682122": set(["TWITTER.TWEET.HANDLE.IRBT.VOLUME"]) # @RoombaLove
-            . . .
-          },
-          tagOnMentions: {
-            "10194682": set(["TWITTER.TWEET.HANDLE.ACN.VOLUME"]),  # @Accenture
-            "20536157": set(["TWITTER.TWEET.HANDLE.GOOGL.VOLUME",
-                             "TWITTER.TWEET.HANDLE.GOOG.VOLUME"]), # @google
-            "111682122": set(["TWITTER.TWEET.HANDLE.IRBT.VOLUME"]) # @RoombaLove
-            . . .
-          }
-        }
-    <streamFilterParams>: a dictionary of parameters to pass to
-      tweepy.Stream.filter(); for examle:
-        {
-          "track": ["@Accenture", "@iRobot", "@RoombaLove", "$ACN", "$IRBT",],
-          "follow": ["10194682", "62515374", "111682122",]
-        }
-  """
-  g_log.info("Building Metric Tagging Map and Stream Filter Params")
 
-  def tagOnSymbols(msg, mappings):
-    """ Adds metric names to msg["metricTagSet"] for each cashtag in msg with a
-    matching key in mappings
+  def __init__(self, symbolToMetricMap, userIdToMetricsMap):
     """
-    entities = msg.get("entities")
-    if not entities:
-      return
-    symbols = entities.get("symbols")
-    if not symbols:
-      return
+    :param symbolToMetricMap: lower-case stock symbol-to-metric name map
+    :param userIdToMetricsMap: twitter userId-to-metric names map
+    """
+    metricNames = set(symbolToMetricMap.itervalues())
+    for names in userIdToMetricsMap.itervalues():
+      metricNames.update(names)
 
-    for sym in symbols:
-      ticker = sym.get("text")
-      if not ticker:
-        continue
-      metricName = mappings.get(ticker.lower())
-      if metricName:
-        msg["metricTagSet"].add(metricName)
+    # Metric names in metric index order
+    self.metricNames = tuple(intern(str(name)) for name in sorted(metricNames))
+
+    metricBits = dict((name, 1 << i) for i, name in enumerate(self.metricNames))
+
+    self._symbolMasks = dict(
+      (intern(str(symbol.lower())), metricBits[metricName])
+      for symbol, metricName in symbolToMetricMap.iteritems())
+
+    self._userIdMasks = dict()
+    for userId, names in userIdToMetricsMap.iteritems():
+      mask = 0
+      for metricName in names:
+        mask |= metricBits[metricName]
+      self._userIdMasks[intern(str(userId))] = mask
+
+    # Keys of both tables for pre-filtering raw tweets
+    self._keys = frozenset(self._symbolMasks).union(self._userIdMasks)
 
-  def tagOnSourceUsers(msg, mappings):
-    """ Adds metric name(s) to msg["metricTagSet"] corresponding to the matching
-    source twitter user id in mappings, if any
+    # Metric name sets by metric mask; there are only a handful of distinct
+    # masks in practice
+    self._metricNameSets = {0: frozenset()}
 
-    :param mappings: userId-to-metricNames map
+
+  def __len__(self):
+    return len(self.metricNames)
+
+
+  def mayMatchRawTweet(self, rawTweet):
+    """ Cheap pre-filter that scans the raw JSON of a tweet for candidate user
+    ids and cashtags without decoding it
+
+    :param rawTweet: JSON string representing a twitter status
+
+    :returns: False if the tweet can't match any metric; True if it might, in
+      which case it needs to be decoded and tagged via `tag()`
     """
-    userObj = msg.get("user")
-    if not userObj:
-      return
-    idStr = userObj.get("id_str")
-    metricNames = mappings.get(idStr)
-    if metricNames:
-      msg["metricTagSet"].update(metricNames)
+    keys = self._keys
+    for value in self._CANDIDATE_VALUES_RE.findall(rawTweet):
+      if value.lower() in keys:
+        return True
+
+    return False
+
+
+  def tag(self, msg):
+    """ Compute the metric mask of a tweet
 
-  def tagOnMentions(msg, mappings):
-    """ Adds metric names to msg["metricTagSet"] corresponding to the matching
-    twitter mention user ids in mappings, if any
+    :param dict msg: Twitter status object
 
-    :param mappings: userId-to-metricNames map
+    :returns: bitmask of the indices in `metricNames` of the metrics matching
+      the tweet on its cashtags, source user or user mentions; 0 if none
+    :rtype: int
     """
+    mask = 0
+
+    userObj = msg.get("user")
+    if userObj:
+      mask |= self._userIdMasks.get(userObj.get("id_str"), 0)
+
     entities = msg.get("entities")
-    if not entities:
-      return
-    userMentions = entities.get("user_mentions")
-    if not userMentions:
-      return
+    if entities:
+      for sym in entities.get("symbols") or ():
+        ticker = sym.get("text")
+        if ticker:
+          mask |= self._symbolMasks.get(ticker.lower(), 0)
+
+      for mention in entities.get("user_mentions") or ():
+        mask |= self._userIdMasks.get(mention.get("id_str"), 0)
+
+    return mask
+
+
+  def getMetricNames(self, mask):
+    """
+    :param int mask: metric mask as returned by `tag()`
+
+    :returns: the names of the metrics in the given mask
+    :rtype: frozenset
+    """
+    metricNames = self._metricNameSets.get(mask)
+    if metricNames is None:
+      metricNames = frozenset(name
+                              for i, name in enumerate(self.metricNames)
+                              if mask >> i & 1)
+      self._metricNameSets[mask] = metricNames
+
+    return metricNames
+
 
-    for mention in userMentions:
-      idStr = mention.get("id_str")
-      metricNames = mappings.get(idStr)
-      if metricNames:
-        msg["metricTagSet"].update(metricNames)
 
+def buildTagIndexAndStreamFilterParams(metricSpecs, authHandler):
+  """ Build tweet tag index and the corresponding twitter stream filter params
+
+  :param metricSpecs: sequence of TwitterMetricSpec objects
+
+  :returns: a two-tuple (<tagIndex>, <streamFilterParams>)
+    <tagIndex>: TweetTagIndex compiled from the stock symbols of the metrics
+      and the twitter ids of their screen names; a tweet matches a metric if
+      one of its cashtags is the metric's symbol, or if its source user or one
+      of its user mentions is one of the metric's screen names
+    <streamFilterParams>: a dictionary of parameters to pass to
+      tweepy.Stream.filter(); for examle:
+        {
+          "track": ["@Accenture", "@iRobot", "@RoombaLove", "$ACN", "$IRBT",],
+          "follow": ["10194682", "62515374", "111682122",]
+        }
+  """
+  g_log.info("Building Metric Tag Index and Stream Filter Params")
 
   symbolToMetricMap = dict()
   userIdToMetricsMap = dict()
 
-  taggingMap = {
-    tagOnSymbols: symbolToMetricMap,
-    tagOnSourceUsers: userIdToMetricsMap,
-    tagOnMentions: userIdToMetricsMap
-  }
-
   screenNameToMetricsMap = dict()
 
   tweepyApi = tweepy.API(authHandler)
@@ -263,8 +292,12 @@ def buildTaggingMapAndStreamFilterParams(metricSpecs, authHandler):
     stall_warnings=True
   )
 
+  tagIndex = TweetTagIndex(symbolToMetricMap=symbolToMetricMap,
+                           userIdToMetricsMap=userIdToMetricsMap)
+
+  g_log.info("Compiled tag index: numMetrics=%d", len(tagIndex))
 
-  return taggingMap, streamFilterParams
+  return tagIndex, streamFilterParams
 
 
 
@@ -381,16 +414,16 @@ class TwitterStreamListener(tweepy.StreamListener):
     g_log.info("%s is running: opMode=%s", self.__class__.__name__,
                self._opMode)
 
-    taggingMap, self._streamFilterParams = (
-      buildTaggingMapAndStreamFilterParams(self._metricSpecs,
-                                           self._authHandler))
+    tagIndex, self._streamFilterParams = (
+      buildTagIndexAndStreamFilterParams(self._metricSpecs,
+                                         self._authHandler))
 
     # Start tweet storage thread
     storageThreadKwargs=dict(
       aggSec=self._aggregationPeriod,
       msgQ=self._messageHoldingQ,
       echoData=self._echoData,
-      taggingMap=taggingMap)
+      tagIndex=tagIndex)
 
     self._storageThread = threading.Thread(
       target=TweetStorer.runInThread,
@@ -415,10 +448,47 @@ class TwitterStreamListener(tweepy.StreamListener):
 class TweetStorer(object):
   """ This class is responsible to dequeueing messages from
   TwitterStreamListener and saving them in the database
+
+  Messages are processed in two pipeline stages: the reaper stage decodes and
+  tags messages and generates tweet and reference rows, and the writer stage
+  coalesces those rows into large batches and saves them in bulk.
   """
 
   _MAX_SAVED_TEXT_LEN = 2000
 
+  # Maximum number of row batches from the reaper stage pending save by the
+  # writer stage; the reaper stage blocks when the writer stage falls behind
+  _MAX_PENDING_ROW_BATCHES = 100
+
+  # Bounds of the number of tweets saved per transaction by the writer stage;
+  # the batch size adapts to database latency within these bounds
+  _MIN_WRITE_BATCH_SIZE = 100
+  _MAX_WRITE_BATCH_SIZE = 5000
+
+  # Write latency that the writer stage's batch size adapts to
+  _TARGET_WRITE_LATENCY_SEC = 0.5
+
+  # Maximum time that the writer stage waits for rows to coalesce
+  _MAX_WRITE_DELAY_SEC = 0.5
+
+  # Maximum number of rows per INSERT statement
+  # NOTE: MySQLdb's executemany() sends the rows of an INSERT as a single
+  # multi-row INSERT statement, which must fit within mysql's
+  # max_allowed_packet
+  _MAX_ROWS_PER_INSERT = 1000
+
+  # Matches the raw JSON of a (re)tweet, as opposed to other status types
+  _RAW_TWEET_RE = re.compile(r'"in_reply_to_status_id"\s*:')
+
+  # Increments tweet volumes by the given counts
+  # NOTE: sqlalchemy doesn't support "ON DUPLICATE KEY UPDATE" in its syntactic
+  # sugar; see https://bitbucket.org/zzzeek/sqlalchemy/issue/960
+  _INCREMENT_TWEET_VOLUMES_SQL = sql.text(
+    "INSERT INTO `%s` (`agg_ts`, `metric`, `volume`) "
+    "VALUES (:agg_ts, :metric, :volume) "
+    "ON DUPLICATE KEY UPDATE `volume` = `volume` + VALUES(`volume`)"
+    % (schema.twitterTweetVolumes.name,))
+
 
   class _StreamingStatsBase(object):
     def __init__(self):
@@ -500,16 +570,47 @@ class TweetStorer(object):
         self.streamNumber,)
 
 
-  def __init__(self, taggingMap, aggSec, msgQ, echoData):
+  class _PipelineStageStats(object):
+    """ Throughput and input queue depth of a pipeline stage """
+    def __init__(self, name, inputQ):
+      self.name = name
+      self._inputQ = inputQ
+
+      # Count of items processed by the stage
+      self.numItems = 0
+
+      # Count of batches processed by the stage
+      self.numBatches = 0
+
+      self.startingEpoch = time.time()
+
+    def add(self, numItems):
+      self.numItems += numItems
+      self.numBatches += 1
+
+    def __str__(self):
+      return (
+        "%(name)s: queueDepth=%(queueDepth)d; items=%(items)d; "
+        "batches=%(batches)d; rate=%(rate).1f items/s"
+        % dict(
+          name=self.name,
+          queueDepth=self._inputQ.qsize(),
+          items=self.numItems,
+          batches=self.numBatches,
+          rate=self.numItems / max(time.time() - self.startingEpoch, 1e-6))
+        )
+
+
+  def __init__(self, tagIndex, aggSec, msgQ, echoData):
     """
-    :param taggingMap: tweet tagging map as returned by
-      `buildTaggingMapAndStreamFilterParams()`
+    :param TweetTagIndex tagIndex: tweet tag index as returned by
+      `buildTagIndexAndStreamFilterParams()`
     :param int aggSec: metric aggregation period in seconds
     :param Queue.Queue msgQ: input messages queue receiving messages from our
       TwitterStreamListener
     :param bool echoData: wheter we should log incoming messages
     """
-    self._taggingMap = taggingMap
+    self._tagIndex = tagIndex
     self._aggSec = aggSec
     self._msgQ = msgQ
     self._echoData = echoData
@@ -522,21 +623,32 @@ class TweetStorer(object):
     # Overall runtime streaming stats
     self._runtimeStreamingStats = self._RuntimeStreamingStats()
 
+    # Two-tuples (<tweetRows>, <referenceRows>) generated by the reaper stage
+    # pending save by the writer stage
+    self._rowQ = Queue.Queue(maxsize=self._MAX_PENDING_ROW_BATCHES)
+
+    # Current number of tweets per transaction of the writer stage
+    self._writeBatchSize = self._MIN_WRITE_BATCH_SIZE
+
+    # Pipeline stage stats
+    self._reaperStats = self._PipelineStageStats("reaper", msgQ)
+    self._writerStats = self._PipelineStageStats("writer", self._rowQ)
+
 
   @classmethod
   @logExceptions(g_log)
-  def runInThread(cls, taggingMap, aggSec, msgQ, echoData):
+  def runInThread(cls, tagIndex, aggSec, msgQ, echoData):
     """ The thread target function; instantiates and runs TweetStorer
 
-    :param taggingMap: tweet tagging map as returned by
-      `buildTaggingMapAndStreamFilterParams()`
+    :param TweetTagIndex tagIndex: tweet tag index as returned by
+      `buildTagIndexAndStreamFilterParams()`
     :param int aggSec: metric aggregation period in seconds
     :param Queue.Queue msgQ: input messages queue receiving messages from our
       TwitterStreamListener
     :param bool echoData: wheter we should log incoming messages
     """
     g_log.info("%s thread is running", cls.__name__)
-    tweetStorer = cls(taggingMap=taggingMap,
+    tweetStorer = cls(tagIndex=tagIndex,
                       aggSec=aggSec,
                       msgQ=msgQ,
                       echoData=echoData)
@@ -546,17 +658,26 @@ class TweetStorer(object):
   def _run(self):
     """ Thread function; preprocess and store incoming tweets deposited by
     twitter streamer into self._msgQ
+
+    Runs the reaper stage and starts the writer stage in its own thread.
     """
     # Get time reference for calculating aggregation timestamps
     aggRefDatetime = metric_utils.establishLastEmittedSampleDatetime(
       key=_EMITTED_TWEET_VOLUME_SAMPLE_TRACKER_KEY,
       aggSec=self._aggSec)
 
+    writerThread = threading.Thread(target=self._runWriter)
+    writerThread.setDaemon(True)
+    writerThread.start()
+
     statsIntervalSec = 600
     nextStatsUpdateEpoch = time.time()
 
     maxBatchSize = 100
     while True:
+      if not writerThread.isAlive():
+        raise RuntimeError("Tweet writer thread has stopped")
+
       # Accumulate batch of incoming messages for SQL insert performance
       messages = []
       while len(messages) < maxBatchSize:
@@ -577,12 +698,19 @@ class TweetStorer(object):
       except Exception:  # pylint: disable=W0703
         g_log.exception("_reapMessages failed")
 
-      # Save (re)tweets
+      self._reaperStats.add(len(messages))
+
+      # Hand off (re)tweets to the writer stage
       if tweets:
-        try:
-          self._saveTweets(messages=tweets, aggRefDatetime=aggRefDatetime)
-        except Exception:  # pylint: disable=W0703
-          g_log.exception("Failed to save numTweets=%d", len(tweets))
+        rows = self._createRows(messages=tweets, aggRefDatetime=aggRefDatetime)
+        while True:
+          try:
+            self._rowQ.put(rows, timeout=10)
+          except Queue.Full:
+            if not writerThread.isAlive():
+              raise RuntimeError("Tweet writer thread has stopped")
+          else:
+            break
 
       # Save deletion requests
       if deletes:
@@ -605,6 +733,61 @@ class TweetStorer(object):
       if now >= nextStatsUpdateEpoch:
         nextStatsUpdateEpoch = now + statsIntervalSec
         self._logStreamStats()
+        self._logPipelineStats()
+
+
+  @logExceptions(g_log)
+  def _runWriter(self):
+    """ Writer stage thread function; coalesce tweet and reference rows from
+    the reaper stage into batches of up to self._writeBatchSize tweets, save
+    each batch in one transaction, and adapt the batch size to the latency of
+    the saves.
+    """
+    while True:
+      tweetRows, referenceRows = self._rowQ.get()
+      tweetRows = list(tweetRows)
+      referenceRows = list(referenceRows)
+
+      deadline = time.time() + self._MAX_WRITE_DELAY_SEC
+      while len(tweetRows) < self._writeBatchSize:
+        timeout = deadline - time.time()
+        if timeout <= 0:
+          break
+        try:
+          moreTweetRows, moreReferenceRows = self._rowQ.get(timeout=timeout)
+        except Queue.Empty:
+          break
+        else:
+          tweetRows.extend(moreTweetRows)
+          referenceRows.extend(moreReferenceRows)
+
+      startTime = time.time()
+      try:
+        self._saveTweetRows(tweetRows, referenceRows)
+      except Exception:  # pylint: disable=W0703
+        g_log.exception("Failed to save numTweets=%d", len(tweetRows))
+        continue
+
+      self._writerStats.add(len(tweetRows))
+      self._adaptWriteBatchSize(numTweets=len(tweetRows),
+                                latencySec=time.time() - startTime)
+
+
+  def _adaptWriteBatchSize(self, numTweets, latencySec):
+    """ Halve the writer stage's batch size when a save exceeds the target
+    latency; double it when a full batch was saved in less than half the target
+    latency
+
+    :param int numTweets: number of tweets in the saved batch
+    :param float latencySec: duration of the save
+    """
+    if latencySec > self._TARGET_WRITE_LATENCY_SEC:
+      self._writeBatchSize = max(self._writeBatchSize // 2,
+                                 self._MIN_WRITE_BATCH_SIZE)
+    elif (numTweets >= self._writeBatchSize and
+          latencySec < self._TARGET_WRITE_LATENCY_SEC / 2):
+      self._writeBatchSize = min(self._writeBatchSize * 2,
+                                 self._MAX_WRITE_BATCH_SIZE)
 
 
   def _logStreamStats(self):
@@ -613,6 +796,11 @@ class TweetStorer(object):
     g_log.info("Runtime streaming stats: %s", self._runtimeStreamingStats)
 
 
+  def _logPipelineStats(self):
+    g_log.info("Pipeline stats: %s; %s; writeBatchSize=%d", self._reaperStats,
+               self._writerStats, self._writeBatchSize)
+
+
   def _reapMessages(self, messages):
     """ Process the messages from TwitterStreamListener and update stats; they
     could be (re)tweets or notifications, such as "limit", "delete", "warning",
@@ -622,7 +810,9 @@ class TweetStorer(object):
     See https://dev.twitter.com/streaming/overview/messages-types
 
     Tweets that match one or more metrics and delete notifications are returned
-    to caller. Other notifications of interest are logged.
+    to caller. Other notifications of interest are logged. Tweets that the tag
+    index's pre-filter rules out are counted as untagged without being
+    decoded.
 
     :param messages: messages received from our TwitterStreamListener
     :type messages: sequence of JSON strings representing twitter statuses
@@ -646,6 +836,15 @@ class TweetStorer(object):
     for msg in messages:
       if isinstance(msg, basestring):
         # Got Twitter Status
+        if (self._RAW_TWEET_RE.search(msg) and
+            not self._tagIndex.mayMatchRawTweet(msg)):
+          # Got a tweet that can't match any metrics; skip decoding it
+          streamStats.numTweets += 1
+          runtimeStats.numTweets += 1
+          streamStats.numUntaggedTweets += 1
+          runtimeStats.numUntaggedTweets += 1
+          continue
+
         try:
           msg = json.loads(msg)
         except ValueError:
@@ -730,18 +929,18 @@ class TweetStorer(object):
 
   def _tagMessage(self, msg):
     """ Tag message: add "metricTagSet" attribute to the message; the value
-    of "metricTagSet" is a possibly-empty set containing metric name(s) that
-    match the containing message.
+    of "metricTagSet" is a possibly-empty frozenset containing metric name(s)
+    that match the containing message.
 
     :param dict msg: Twitter status object
     """
-    msg["metricTagSet"] = set()
-    for tagger, mappings in self._taggingMap.iteritems():
-      try:
-        tagger(msg, mappings)
-      except Exception:
-        g_log.exception("Tagging failed on msg=%s", pprint.pformat(msg))
-        raise
+    try:
+      mask = self._tagIndex.tag(msg)
+    except Exception:
+      g_log.exception("Tagging failed on msg=%s", pprint.pformat(msg))
+      raise
+
+    msg["metricTagSet"] = self._tagIndex.getMetricNames(mask)
 
 
   @classmethod
@@ -858,8 +1057,76 @@ class TweetStorer(object):
     return (tweetRow, referenceRows)
 
 
+  @classmethod
+  def _selectNewReferenceRows(cls, conn, referenceRows):
+    """ Select the reference rows that aren't in schema.twitterTweetSamples
+    yet, locking their (metric, msg_uid) keys until the end of the caller's
+    transaction
+
+    NOTE: this is a locking read, so that concurrent writers saving the same
+    references can't both see them as new and both increment their tweet
+    volumes. With InnoDB's default REPEATABLE READ isolation, it places
+    next-key locks on the metric_and_msg_uid_idx ranges of absent keys, which
+    block other writers' inserts of those keys until the transaction ends;
+    when two writers contend, one of them is rolled back with a deadlock
+    error and retried by retryOnTransientErrors, and then sees the other's
+    references.
+
+    :param conn: SQLAlchemy connection object in a transaction
+    :param referenceRows: sequence of tweet reference row dicts as returned by
+      `_createTweetAndReferenceRows()`
+
+    :returns: reference rows whose (metric, msg_uid) aren't in the database,
+      without duplicates
+    :rtype: list
+    """
+    samplesSchema = schema.twitterTweetSamples
+
+    # Look up the keys via the metric_and_msg_uid_idx unique index
+    keys = list(set((row["metric"], row["msg_uid"]) for row in referenceRows))
+
+    existing = set()
+    for i in xrange(0, len(keys), cls._MAX_ROWS_PER_INSERT):
+      existing.update(
+        (row[0], row[1]) for row in conn.execute(
+          sql.select([samplesSchema.c.metric, samplesSchema.c.msg_uid])
+          .where(sql.or_(*[
+            sql.and_(samplesSchema.c.metric == metric,
+                     samplesSchema.c.msg_uid == msgUid)
+            for metric, msgUid in keys[i:i + cls._MAX_ROWS_PER_INSERT]]))
+          .with_for_update()))
+
+    newReferenceRows = []
+    for row in referenceRows:
+      key = (row["metric"], row["msg_uid"])
+      if key not in existing:
+        existing.add(key)
+        newReferenceRows.append(row)
+
+    return newReferenceRows
+
+
+  @staticmethod
+  def _countTweetVolumes(referenceRows):
+    """ Count tweet references per metric and aggregation timestamp
+
+    :param referenceRows: sequence of tweet reference row dicts as returned by
+      `_createTweetAndReferenceRows()`
+
+    :returns: sequence of dicts with agg_ts, metric and volume keys for
+      incrementing schema.twitterTweetVolumes
+    """
+    volumes = defaultdict(int)
+    for row in referenceRows:
+      volumes[(row["agg_ts"], row["metric"])] += 1
+
+    return [dict(agg_ts=aggDatetime, metric=metric, volume=volume)
+            for (aggDatetime, metric), volume in volumes.iteritems()]
+
+
   def _saveTweets(self, messages, aggRefDatetime):
-    """ Save tweets and references in database
+    """ Save tweets and references in database, and increment the
+    corresponding tweet volumes by the references that weren't saved already
 
     See https://dev.twitter.com/overview/api/tweets
 
@@ -869,6 +1136,23 @@ class TweetStorer(object):
     :param datetime aggRefDatetime: aggregation reference time for determining
       aggregation timestamp of the given messages
     """
+    tweetRows, referenceRows = self._createRows(messages, aggRefDatetime)
+
+    self._saveTweetRows(tweetRows, referenceRows)
+
+
+  def _createRows(self, messages, aggRefDatetime):
+    """ Generate tweet and reference rows from tagged tweets; tweets that fail
+    are logged and skipped
+
+    :param messages: sequence of tweet dict received from twitter with an
+      additional "metricTagSet" attribute
+    :param datetime aggRefDatetime: aggregation reference time for determining
+      aggregation timestamp of the given messages
+
+    :returns: two-tuple (<tweetRows>, <referenceRows>); see
+      `_createTweetAndReferenceRows()`
+    """
     tweetRows = []
     referenceRows = []
     for msg in messages:
@@ -881,25 +1165,54 @@ class TweetStorer(object):
         tweetRows.append(tweet)
         referenceRows.extend(references)
 
+    return tweetRows, referenceRows
+
+
+  def _saveTweetRows(self, tweetRows, referenceRows):
+    """ Save tweet and reference rows in database in one transaction, and
+    increment the corresponding tweet volumes by the references that weren't
+    saved already
+
+    :param tweetRows: sequence of dicts representing tweet rows for inserting
+      into schema.twitterTweets
+    :param referenceRows: sequence of dicts representing tweet reference rows
+      for inserting into schema.twitterTweetSamples
+    """
     g_log.debug("tweetRows=%s, referenceRows=%s", tweetRows, referenceRows)
 
+    if not tweetRows:
+      return
+
+    maxRows = self._MAX_ROWS_PER_INSERT
+
     @collectorsdb.retryOnTransientErrors
     def saveWithRetries():
       # NOTE: we use "IGNORE" to avoid errors due to occasional duplicate tweets
       # from twitter stream
       with self._sqlEngine.begin() as conn:
         # Save twitter message
-        conn.execute(
-          schema.twitterTweets.insert(  # pylint: disable=E1120
-            ).prefix_with("IGNORE", dialect="mysql"),
-          tweetRows)
+        for i in xrange(0, len(tweetRows), maxRows):
+          conn.execute(
+            schema.twitterTweets.insert(  # pylint: disable=E1120
+              ).prefix_with("IGNORE", dialect="mysql"),
+            tweetRows[i:i + maxRows])
+
+        # NOTE: duplicate tweets must not add to tweet volumes, including
+        # references that concurrent writers are saving
+        newReferenceRows = self._selectNewReferenceRows(conn, referenceRows)
 
         # Save corresponding references
         # NOTE: some tweets may match multiple metrics
-        conn.execute(
-          schema.twitterTweetSamples.insert(  # pylint: disable=E1120
-            ).prefix_with("IGNORE", dialect="mysql"),
-          referenceRows)
+        for i in xrange(0, len(referenceRows), maxRows):
+          conn.execute(
+            schema.twitterTweetSamples.insert(  # pylint: disable=E1120
+              ).prefix_with("IGNORE", dialect="mysql"),
+            referenceRows[i:i + maxRows])
+
+        # Increment tweet volumes of the new references
+        volumeRows = self._countTweetVolumes(newReferenceRows)
+        if volumeRows:
+          conn.execute(self._INCREMENT_TWEET_VOLUMES_SQL, volumeRows)
 
     saveWithRetries()
 
@@ -1161,6 +1474,10 @@ class TweetForwarder(object):
 class MetricDataForwarder(object):
   """ This class is responsible for aggregating and forwarding metric data """
 
+  # Maximum time span of aggregations forwarded in one pass when catching up
+  _MAX_FORWARD_RANGE_SEC = 24 * 60 * 60
+
+
   def __init__(self, metricSpecs, aggSec):
     self._metricSpecs = metricSpecs
     self._aggSec = aggSec
@@ -1232,16 +1549,17 @@ class MetricDataForwarder(object):
     :param metrics: optional sequence of metric names; if specified (non-None),
       the operation will be limited to the given metric names
     """
+    # Query Tweet Volume metrics for all aggregation intervals in the range
+    aggToVolumeMap = dict(
+      ((aggDatetime, metric), volume)
+      for aggDatetime, metric, volume in self._queryTweetVolumes(
+        aggStartDatetime, stopDatetime, metrics))
+
     def getSamples(aggStartDatetime):
       """Retrieve and yield metric data samples of interest"""
       periodTimedelta = timedelta(seconds=self._aggSec)
 
       while aggStartDatetime < stopDatetime:
-        # Query Tweet Volume metrics for one aggregation interval
-        metricToVolumeMap = defaultdict(
-          int,
-          self._queryTweetVolumes(aggStartDatetime, metrics))
-
         # Generate metric samples
         epochTimestamp = date_time_utils.epochFromNaiveUTCDatetime(
           aggStartDatetime)
@@ -1249,7 +1567,7 @@ class MetricDataForwarder(object):
         samples = tuple(
           dict(
             metricName=spec.metric,
-            value=metricToVolumeMap[spec.metric],
+            value=aggToVolumeMap.get((aggStartDatetime, spec.metric), 0),
             epochTimestamp=epochTimestamp)
           for spec in self._metricSpecs
           if metrics is None or spec.metric in metrics
@@ -1281,7 +1599,8 @@ class MetricDataForwarder(object):
 
   def _forwardTweetVolumeMetrics(self, lastEmittedAggTime, stopDatetime):
     """ Query tweet volume metrics since the given last emitted aggregation time
-    through stopDatetime and forward them to Taurus. Update
+    through stopDatetime and forward them to Taurus, up to
+    _MAX_FORWARD_RANGE_SEC worth of aggregations at a time. Update
     the datetime of the last successfully-emitted tweet volume metric batch in
     the database.
 
@@ -1301,50 +1620,61 @@ class MetricDataForwarder(object):
     :rtype: datetime.datetime
     """
     periodTimedelta = timedelta(seconds=self._aggSec)
+    maxRangeTimedelta = periodTimedelta * max(
+      self._MAX_FORWARD_RANGE_SEC // self._aggSec, 1)
     aggStartDatetime = lastEmittedAggTime + periodTimedelta
 
     while aggStartDatetime < stopDatetime:
-      # Aggregate and forward Tweet Volume metrics for one aggregation interval
+      # Aggregate and forward Tweet Volume metrics for a range of aggregation
+      # intervals
+      rangeStopDatetime = min(aggStartDatetime + maxRangeTimedelta,
+                              stopDatetime)
       try:
         self.aggregateAndForward(
           aggStartDatetime=aggStartDatetime,
-          stopDatetime=aggStartDatetime + periodTimedelta)
+          stopDatetime=rangeStopDatetime)
       except Exception:  # pylint: disable=W0703
         return lastEmittedAggTime
 
+      # Set up for next iteration
+      while aggStartDatetime < rangeStopDatetime:
+        lastEmittedAggTime = aggStartDatetime
+        aggStartDatetime += periodTimedelta
+
       # Update db with last successfully-emitted datetime
       metric_utils.updateLastEmittedSampleDatetime(
         key=_EMITTED_TWEET_VOLUME_SAMPLE_TRACKER_KEY,
-        sampleDatetime=aggStartDatetime)
-
-      # Set up for next iteration
-      lastEmittedAggTime = aggStartDatetime
-      aggStartDatetime += periodTimedelta
+        sampleDatetime=lastEmittedAggTime)
 
 
     return lastEmittedAggTime
 
 
   @collectorsdb.retryOnTransientErrors
-  def _queryTweetVolumes(self, aggDatetime, metrics):
-    """ Query the database for the counts of tweet metric volumes for the
-    specified aggregation.
+  def _queryTweetVolumes(self, aggStartDatetime, stopDatetime, metrics):
+    """ Query the database for the tweet metric volumes of the aggregations in
+    the specified datetime range.
 
-    :param datetime aggDatetime: aggregation timestamp
+    :param datetime aggStartDatetime: UTC datetime of first aggregation
+    :param datetime stopDatetime: non-inclusive upper bound UTC datetime
     :param metrics: optional sequence of metric names; if specified (non-None),
       the operation will be limited to the given metric names
-    :returns: a sparse sequence of two-tuples: (metric_name, count); metrics
-      that have no tweets in the given aggregation period will be absent from
-      the result.
+    :returns: a sparse sequence of three-tuples: (agg_ts, metric_name, count);
+      metrics that have no tweets in a given aggregation period will be absent
+      from the result for that period.
     """
+    volumesSchema = schema.twitterTweetVolumes
+
     sel = (
-      sql.select([schema.twitterTweetSamples.c.metric, sql.func.count()])
-      .where(schema.twitterTweetSamples.c.agg_ts == aggDatetime)
-      .group_by(schema.twitterTweetSamples.c.metric)
+      sql.select([volumesSchema.c.agg_ts,
+                  volumesSchema.c.metric,
+                  volumesSchema.c.volume])
+      .where(volumesSchema.c.agg_ts >= aggStartDatetime)
+      .where(volumesSchema.c.agg_ts < stopDatetime)
     )
 
     if metrics is not None:
-      sel = sel.where(schema.twitterTweetSamples.c.metric.in_(metrics))
+      sel = sel.where(volumesSchema.c.metric.in_(metrics))
 
     return self._sqlEngine.execute(sel).fetchall()
 
@@ -27,13 +27,12 @@ import datetime
 from functools import partial
 import itertools
 import json
-from multiprocessing import Pool
+from multiprocessing.pool import ThreadPool
 from optparse import OptionParser
 import os
 import Queue
 import time
 import urllib
-import urllib2
 
 # Needed only temporarily to facilitate migration from file-based approach
 # to collectorsdb
@@ -41,7 +40,8 @@ import csv
 from StringIO import StringIO
 
 import pytz
-from sqlalchemy import select
+import requests
+from sqlalchemy import and_, func, select
 from sqlalchemy.exc import IntegrityError
 
 from nta.utils.extended_logger import ExtendedLogger
@@ -68,6 +68,7 @@ DEFAULT_SERVER = os.environ.get("TAURUS_HTM_SERVER", "127.0.0.1")
 DEFAULT_PORT = 2003
 DEFAULT_DAYS = 20
 DEFAULT_DRYRUN = False
+DEFAULT_CONCURRENCY = 16
 
 NAIVE_MARKET_OPEN_TIME = datetime.time(9, 30)    # 9:30 AM
 NAIVE_MARKET_CLOSE_TIME = datetime.time(16, 00)  # 4 PM
@@ -76,6 +77,10 @@ RETAIN_DAYS = 30 # Retain records for 30 days
 # XIgnite API credentials
 DEFAULT_API_TOKEN = os.environ.get("XIGNITE_API_TOKEN")
 
+# Maximum number of concurrent forward() calls; each of them uses a
+# collectorsdb connection
+_MAX_CONCURRENT_FORWARDS = 4
+
 HISTORY_PATH = ".history/xignite"
 
 # Columns in symbol history csv files; must match up with keys returned by
@@ -95,6 +100,10 @@ _COLS = ("StartDate",
 # Initialize logging
 _LOG = ExtendedLogger.getExtendedLogger(__name__)
 
+# Shared keep-alive HTTP session for XIgnite API requests; see
+# createHttpSession()
+g_httpSession = requests.Session()
+
 # xignite bar data API URL
 _API_URL = "http://globalquotes.xignite.com/v3/xGlobalQuotes.json/GetBars?"
 _URL_KEYS = {"IdentifierType": "Symbol",
@@ -198,7 +207,24 @@ def loadMetricSpecs():
 
 
 
-def getData(symbol, apitoken, barlength, startTime, endTime, fields):
+def createHttpSession(maxConnections):
+  """ Create a keep-alive HTTP session for XIgnite API requests that are
+  made concurrently from up to the given number of threads
+
+  :param int maxConnections: maximum number of connections kept alive
+  :rtype: requests.Session
+  """
+  session = requests.Session()
+  session.mount("http://",
+                requests.adapters.HTTPAdapter(pool_maxsize=maxConnections))
+  session.mount("https://",
+                requests.adapters.HTTPAdapter(pool_maxsize=maxConnections))
+  return session
+
+
+
+def getData(symbol, apitoken, barlength, startTime, endTime, fields,
+            httpSession=None):
   """ Request data from XigniteGlobalQuotes GetBars API
 
   See https://www.xignite.com/product/global-stock-quote-data/api/GetBars/ for
@@ -212,6 +238,8 @@ def getData(symbol, apitoken, barlength, startTime, endTime, fields):
   :param endTime: Period end time
   :type endTime: str (%m/%d/%Y %I:%M:%S %p)
   :param fields: XIgnite API field names
+  :param requests.Session httpSession: HTTP session for the request; defaults
+    to g_httpSession
 
   :returns: XIgnite GetBars API Response
   :rtype: dict
@@ -281,10 +309,14 @@ def getData(symbol, apitoken, barlength, startTime, endTime, fields):
 
   queryString = urllib.urlencode(query)
 
-  response = urllib2.urlopen(_API_URL + queryString,
+  if httpSession is None:
+    httpSession = g_httpSession
+
+  response = httpSession.get(_API_URL + queryString,
                              timeout=URLOPEN_TIMEOUT_SEC)
+  response.raise_for_status()
 
-  return json.loads(response.read())
+  return json.loads(response.text)
 
 
 
@@ -320,7 +352,51 @@ def _getLatestSample(engine, symbol):
   return queryWithRetries()
 
 
-def poll(metricSpecs, apitoken, barlength, days):
+
+def _getLatestSamples(engine, symbols):
+  """ Get latest samples from xignite_security_bars table for the given stock
+  symbols in one query
+
+  :param engine: SQLAlchemy engine object
+  :param symbols: sequence of stock symbols
+  :returns: Latest sample of each symbol that has samples
+  :rtype: dict of symbol -> sqlalchemy.engine.RowProxy
+  """
+  if not symbols:
+    return dict()
+
+  endTimestamp = func.timestamp(xigniteSecurityBars.c.EndDate,
+                                xigniteSecurityBars.c.EndTime)
+
+  latest = (select([xigniteSecurityBars.c.symbol,
+                    func.max(endTimestamp).label("maxEnd")])
+            .where(xigniteSecurityBars.c.symbol.in_(symbols))
+            .group_by(xigniteSecurityBars.c.symbol)
+            .alias("latest"))
+
+  sel = (select([xigniteSecurityBars])
+         .select_from(
+           xigniteSecurityBars.join(
+             latest,
+             and_(xigniteSecurityBars.c.symbol == latest.c.symbol,
+                  endTimestamp == latest.c.maxEnd))))
+
+
+  @collectorsdb.retryOnTransientErrors
+  def queryWithRetries():
+    return engine.execute(sel).fetchall()
+
+
+  return dict((row.symbol, row) for row in queryWithRetries())
+
+
+
+_QUERY_LATEST_SAMPLE = object()
+
+
+
+def poll(metricSpecs, apitoken, barlength, days,
+         lastSample=_QUERY_LATEST_SAMPLE, httpSession=None):
   """ Poll XIgnite data for given metricspecs associated with the same symbol,
   returning only new data relative to previously fetched data
 
@@ -330,6 +406,11 @@ def poll(metricSpecs, apitoken, barlength, days):
   :param barlength: Aggregation time period (in minutes)
   :param days: Number of days to request
   :type days: int
+  :param lastSample: Latest sample of the symbol from `_getLatestSamples()`,
+    None if it has none; queried from xignite_security_bars table if omitted
+  :type lastSample: sqlalchemy.engine.RowProxy
+  :param requests.Session httpSession: HTTP session for XIgnite API requests;
+    defaults to g_httpSession
   :returns: security details (dict), and new data as a sequence of dicts
   :rtype: 2-tuple
   """
@@ -342,8 +423,8 @@ def poll(metricSpecs, apitoken, barlength, days):
                                          # prevent too recent of a bucket from
                                          # being returned
 
-    engine = collectorsdb.engineFactory()
-    lastSample = _getLatestSample(engine, symbol)
+    if lastSample is _QUERY_LATEST_SAMPLE:
+      lastSample = _getLatestSample(collectorsdb.engineFactory(), symbol)
 
     if lastSample:
       localizedLastEndTime = (
@@ -418,7 +499,8 @@ def poll(metricSpecs, apitoken, barlength, days):
                      barlength=barlength,
                      startTime=localizedStartTime.strftime(DATE_FMT),
                      endTime=localizedEndTime.strftime(DATE_FMT),
-                     fields=fields)
+                     fields=fields,
+                     httpSession=httpSession)
     except Exception as e:
       _LOG.exception("Unexpected error while retrieving data from XIgnite.")
       return {"Symbol": symbol}, []
@@ -451,20 +533,25 @@ def poll(metricSpecs, apitoken, barlength, days):
 
 def forward(metricSpecs, data, security, server=DEFAULT_SERVER,
             port=DEFAULT_PORT,
-            dryrun=DEFAULT_DRYRUN):
+            dryrun=DEFAULT_DRYRUN,
+            lastSample=_QUERY_LATEST_SAMPLE):
   """ Forward stock data to HTM-IT/Taurus instance via custom metric
 
   :param metricSpecs: Sequence of one or more StockMetricSpec objects associated
     with the same stock symbol for which polling was conducted
   :param list data: List of sample dicts
   :param dict security: Details of security from XIgnite API
+  :param lastSample: Latest sample of the symbol from `_getLatestSamples()`,
+    None if it has none; queried from xignite_security_bars table if omitted
+  :type lastSample: sqlalchemy.engine.RowProxy
   """
   try:
     symbol = security["Symbol"]
 
     engine = collectorsdb.engineFactory()
 
-    lastSample = _getLatestSample(engine, symbol)
+    if lastSample is _QUERY_LATEST_SAMPLE:
+      lastSample = _getLatestSample(engine, symbol)
     if lastSample:
       localizedLastEndTime = (
         getEasternLocalizedEndTimestampFromSampleRow(lastSample))
@@ -703,7 +790,8 @@ def main():
   pollFn = partial(poll,
                    apitoken=options.apitoken,
                    barlength=options.barlength,
-                   days=options.days)
+                   days=options.days,
+                   httpSession=createHttpSession(options.concurrency))
 
   # Bind forward() kwargs to CLI options
   forwardFn = partial(forward,
@@ -711,7 +799,11 @@ def main():
                       port=options.port,
                       dryrun=options.dryrun)
 
-  pool = Pool()
+  # NOTE: polling is I/O-bound, so it runs in threads that share the keep-alive
+  # HTTP session; the size of the poll pool bounds the number of concurrent
+  # XIgnite API requests
+  pollPool = ThreadPool(options.concurrency)
+  forwardPool = ThreadPool(_MAX_CONCURRENT_FORWARDS)
 
   sleepDuration = 60 * options.barlength
 
@@ -724,37 +816,50 @@ def main():
 
   try:
     while True:
-      # Run poll() for each symbol in the process pool
+      cycleStartTime = time.time()
+
+      latestSamples = _getLatestSamples(collectorsdb.engineFactory(),
+                                        symbolToMetricSpecs.keys())
+
+      # Run poll() for each symbol in the poll pool, forwarding results as they
+      # arrive
       pendingAsyncResults = []
-      for security, data in pool.imap_unordered(
-          pollFn,
+      for security, data in pollPool.imap_unordered(
+          lambda metricSpecs: pollFn(
+            metricSpecs, lastSample=latestSamples.get(metricSpecs[0].symbol)),
           symbolToMetricSpecs.itervalues()):
         # Forward result (if available) to HTM-IT/Taurus instance
         if data:
+          symbol = security["Symbol"]
           pendingAsyncResults.append(
-            pool.apply_async(
+            forwardPool.apply_async(
               forwardFn,
-              (symbolToMetricSpecs[security["Symbol"]], data, security)))
+              (symbolToMetricSpecs[symbol], data, security),
+              dict(lastSample=latestSamples.get(symbol))))
         else:
           _LOG.info("No new data for %s", security["Symbol"])
 
 
       # Run garbage collection on our tables
-      pendingAsyncResults.append(pool.apply_async(_purgeOldRecords))
-
-      _LOG.info("Sleeping for %d seconds. zzzzzzzz....", sleepDuration)
-      time.sleep(sleepDuration)
+      pendingAsyncResults.append(forwardPool.apply_async(_purgeOldRecords))
 
       # Wait for all async tasks to complete to avoid out-of-order metric data
-      if pendingAsyncResults:
-        for r in pendingAsyncResults:
-          try:
-            r.get()
-          except Exception:
-            # Async task failed - log and suppress
-            _LOG.exception("Async task failed.")
+      for r in pendingAsyncResults:
+        try:
+          r.get()
+        except Exception:
+          # Async task failed - log and suppress
+          _LOG.exception("Async task failed.")
+
+      cycleDuration = time.time() - cycleStartTime
+      _LOG.info("Polling cycle of numSymbols=%d with numForwardTasks=%d "
+                "completed in %.1f seconds", len(symbolToMetricSpecs),
+                len(pendingAsyncResults), cycleDuration)
 
-        _LOG.info("Async numTasks=%d completed", len(pendingAsyncResults))
+      # Sleep for the remainder of the bar
+      sleepSec = max(sleepDuration - cycleDuration, 0)
+      _LOG.info("Sleeping for %d seconds. zzzzzzzz....", sleepSec)
+      time.sleep(sleepSec)
 
   except KeyboardInterrupt:
     # Log the traceback to help with debugging in case we were deadlocked
@@ -762,8 +867,10 @@ def main():
     pass
 
   finally:
-    pool.close()
-    pool.join()
+    pollPool.close()
+    forwardPool.close()
+    pollPool.join()
+    forwardPool.join()
 
 
 
@@ -812,6 +919,15 @@ def _parseArgs():
       dest="dryrun",
       help="Use this flag to do a dry run [default: %default]")
 
+  parser.add_option(
+      "--concurrency",
+      action="store",
+      type="int",
+      default=DEFAULT_CONCURRENCY,
+      dest="concurrency",
+      help="Maximum number of concurrent XIgnite API requests "
+           "[default: %default]")
+
   parser.add_option(
       "--apitoken",
       action="store",
@@ -24,7 +24,6 @@ from collections import defaultdict
 import datetime
 import json
 from mock import call, Mock, patch
-import StringIO
 import sys
 import unittest
 import urlparse
@@ -43,15 +42,22 @@ def setUpModule():
   "taurus.metric_collectors.xignite.xignite_stock_agent.metricDataBatchWrite",
   spec_set=xignite_stock_agent.metricDataBatchWrite)
 @patch(
-  "taurus.metric_collectors.xignite.xignite_stock_agent.urllib2",
+  "taurus.metric_collectors.xignite.xignite_stock_agent.g_httpSession",
   autospec=True)
 class XigniteStockAgentTestCase(unittest.TestCase):
 
-  @patch("taurus.metric_collectors.xignite.xignite_stock_agent.Pool",
+  @patch(
+    "taurus.metric_collectors.xignite.xignite_stock_agent._getLatestSamples",
+    autospec=True)
+  @patch(
+    "taurus.metric_collectors.xignite.xignite_stock_agent.collectorsdb",
+    autospec=True)
+  @patch("taurus.metric_collectors.xignite.xignite_stock_agent.ThreadPool",
     autospec=True)
   @patch("taurus.metric_collectors.xignite.xignite_stock_agent.time",
   autospec=True)
-  def testMain(self, time, Pool, urllib2, metricDataBatchWriter):
+  def testMain(self, time, ThreadPool, collectorsdb, _getLatestSamples,
+               httpSession, metricDataBatchWriter):
     # Load metric specs from metric configuration
     symbolToMetricSpecs = defaultdict(list)
     for spec in xignite_stock_agent.loadMetricSpecs():
@@ -60,7 +66,9 @@ class XigniteStockAgentTestCase(unittest.TestCase):
     symbolIter = symbolToMetricSpecs.itervalues()
 
     time.sleep.side_effect = [None, None, KeyboardInterrupt()]
-    Pool.return_value.imap_unordered.return_value = iter([
+    time.time.return_value = 0
+    _getLatestSamples.return_value = dict()
+    ThreadPool.return_value.imap_unordered.return_value = iter([
       ({"Symbol": next(symbolIter)[0].symbol}, [Mock()]),
       ({"Symbol": next(symbolIter)[0].symbol}, [Mock()]),
       ({"Symbol": next(symbolIter)[0].symbol}, [Mock()])
@@ -68,13 +76,17 @@ class XigniteStockAgentTestCase(unittest.TestCase):
     with patch.object(sys, "argv", [None, "--apitoken=foobar"]):
       xignite_stock_agent.main()
 
-    self.assertTrue(Pool.called)
-    self.assertEqual(Pool.return_value.imap_unordered.call_count, 3)
-    self.assertEqual(Pool.return_value.apply_async.call_count, 6)
+    # Poll and forward pools
+    self.assertEqual(ThreadPool.call_count, 2)
+    self.assertEqual(ThreadPool.return_value.imap_unordered.call_count, 3)
+    self.assertEqual(ThreadPool.return_value.apply_async.call_count, 6)
+
+    # One latest sample query per polling cycle
+    self.assertEqual(_getLatestSamples.call_count, 3)
 
 
   def testGetEasternLocalizedTimestampFromSample(self,
-                                                 urllib2,
+                                                 httpSession,
                                                  metricDataBatchWriter):
     timestamp = xignite_stock_agent.getEasternLocalizedTimestampFromSample(
       "12/30/2014", "4:00:00 PM", "-5.0")
@@ -89,7 +101,7 @@ class XigniteStockAgentTestCase(unittest.TestCase):
 
 
   def testGetEasternLocalizedEndTimestampFromSampleRow(self,
-                                                       urllib2,
+                                                       httpSession,
                                                        metricDataBatchWriter):
 
     rowproxy = Mock(EndDate=datetime.date(2014, 12,30),
@@ -107,7 +119,7 @@ class XigniteStockAgentTestCase(unittest.TestCase):
     self.assertEqual(timestamp.tzname(), "EST")
 
 
-  def testLoadMetricSpecs(self, urllib2, metricDataBatchWriter):
+  def testLoadMetricSpecs(self, httpSession, metricDataBatchWriter):
     metricSpecs = xignite_stock_agent.loadMetricSpecs()
 
     for spec in metricSpecs:
@@ -116,7 +128,7 @@ class XigniteStockAgentTestCase(unittest.TestCase):
     self.assertEqual(len(metricSpecs), len(set(metricSpecs)))
 
 
-  def testGetData(self, urllib2, metricDataBatchWriter):
+  def testGetData(self, httpSession, metricDataBatchWriter):
     apiResponse = {
       "Outcome": "Success",
       "Message": None,
@@ -168,7 +180,7 @@ class XigniteStockAgentTestCase(unittest.TestCase):
       }
     }
 
-    urllib2.urlopen.return_value = StringIO.StringIO(json.dumps(apiResponse))
+    httpSession.get.return_value = Mock(text=json.dumps(apiResponse))
 
     endTime = (datetime.datetime.now(pytz.timezone("UTC"))
                                 .astimezone(pytz.timezone("US/Eastern")))
@@ -211,8 +223,9 @@ class XigniteStockAgentTestCase(unittest.TestCase):
 
     self.assertDictEqual(result, apiResponse)
 
-    self.assertTrue(urllib2.urlopen.called)
-    args, _ = urllib2.urlopen.call_args_list[0]
+    self.assertTrue(httpSession.get.called)
+    httpSession.get.return_value.raise_for_status.assert_called_once_with()
+    args, _ = httpSession.get.call_args_list[0]
     parseResult = urlparse.urlparse(args[0])
     query = urlparse.parse_qs(parseResult.query)
     self.assertSequenceEqual(query["_fields"][0].split(","), fields)
@@ -238,7 +251,7 @@ class XigniteStockAgentTestCase(unittest.TestCase):
   @patch(
     "taurus.metric_collectors.xignite.xignite_stock_agent.collectorsdb",
     autospec=True)
-  def testPoll(self, collectorsdb, _getLatestSample, getData, urllib2,
+  def testPoll(self, collectorsdb, _getLatestSample, getData, httpSession,
                metricDataBatchWriter):
 
     getData.return_value = {
@@ -325,6 +338,61 @@ class XigniteStockAgentTestCase(unittest.TestCase):
     self.assertFalse(result[1])
 
 
+  @patch(
+    "taurus.metric_collectors.xignite.xignite_stock_agent.getData",
+    autospec=True)
+  @patch(
+    "taurus.metric_collectors.xignite.xignite_stock_agent._getLatestSample",
+    autospec=True)
+  @patch(
+    "taurus.metric_collectors.xignite.xignite_stock_agent.collectorsdb",
+    autospec=True)
+  def testPollWithLatestSample(self, collectorsdb, _getLatestSample, getData,
+                               httpSession, metricDataBatchWriter):
+    getData.return_value = {
+      "Outcome": "Success",
+      "Bars": [
+          {
+              "StartDate": "1/15/2015",
+              "StartTime": "9:25:00 AM",
+              "EndDate": "1/15/2015",
+              "EndTime": "9:30:00 AM",
+              "UTCOffset": -5
+          },
+          {
+              "StartDate": "1/15/2015",
+              "StartTime": "9:30:00 AM",
+              "EndDate": "1/15/2015",
+              "EndTime": "9:35:00 AM",
+              "UTCOffset": -5
+          }
+      ],
+      "Security": {"Symbol": "MSFT"}
+    }
+
+    msft = xignite_stock_agent.StockMetricSpec(
+      metricName="XIGNITE.MSFT.VOLUME",
+      symbol="MSFT",
+      stockExchange="NASDAQ",
+      sampleKey="Volume")
+
+    # The latest sample from the bulk query is used instead of querying it
+    security, data = xignite_stock_agent.poll(
+      (msft,),
+      apitoken="apitoken",
+      barlength=5,
+      days=21,
+      lastSample=Mock(EndDate=datetime.date(2015, 1, 15),
+                      EndTime=datetime.time(9, 30, 0)),
+      httpSession=httpSession)
+
+    self.assertFalse(_getLatestSample.called)
+    self.assertFalse(collectorsdb.engineFactory.called)
+    self.assertDictEqual(security, {"Symbol": "MSFT"})
+    self.assertSequenceEqual(data, getData.return_value["Bars"][1:])
+    self.assertIs(getData.call_args[1]["httpSession"], httpSession)
+
+
   @unittest.skip("TAUR-1335")
   @patch(
     "taurus.metric_collectors.xignite.xignite_stock_agent._getLatestSample",
@@ -333,7 +401,7 @@ class XigniteStockAgentTestCase(unittest.TestCase):
     "taurus.metric_collectors.xignite.xignite_stock_agent.collectorsdb",
     autospec=True)
   def testForward(self, collectorsdb, _getLatestSample,
-                  urllib2, metricDataBatchWriter):
+                  httpSession, metricDataBatchWriter):
 
     mockSample = Mock(EndDate=datetime.date(2015, 1, 15),
                       EndTime=datetime.time(9, 30, 0))
@@ -452,7 +520,7 @@ class XigniteStockAgentTestCase(unittest.TestCase):
     "taurus.metric_collectors.xignite.xignite_stock_agent.collectorsdb",
     autospec=True)
   def testForwardAfterHours(self, collectorsdb, _getLatestSample,
-                  urllib2, metricDataBatchWriter):
+                  httpSession, metricDataBatchWriter):
 
     mockSample = Mock(EndDate=datetime.date(2015, 1, 15),
                       EndTime=datetime.time(17, 30, 0))
@@ -532,7 +600,7 @@ class XigniteStockAgentTestCase(unittest.TestCase):
     "taurus.metric_collectors.xignite.xignite_stock_agent.collectorsdb",
     autospec=True)
   def testForwardNoLastSample(self, collectorsdb, _getLatestSample,
-                              urllib2, metricDataBatchWriter):
+                              httpSession, metricDataBatchWriter):
 
     _getLatestSample.return_value = None
 
@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2015, Numenta, Inc.  Unless you have purchased from
+# Numenta, Inc. a separate commercial license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+"""
+Measure the throughput (samples/sec) of metric_utils.metricDataBatchWrite
+for collectors that enter it repeatedly with a few samples at a time,
+comparing its original implementation, which connected to the message bus on
+every entry and published synchronously, with the process-wide
+MetricDataPublisher. Verifies that both publish the same samples.
+
+Publishes to an in-process stand-in for MessageBusConnector that simulates
+the broker's connect and publisher confirm latencies.
+
+Usage:
+  python metric_data_publish_benchmark.py --writes=2000 --samples-per-write=5
+"""
+
+import argparse
+import contextlib
+import json
+import threading
+import time
+
+from mock import patch
+
+from taurus.metric_collectors import metric_utils
+
+
+
+def _parseArgs():
+  parser = argparse.ArgumentParser(description=__doc__)
+  parser.add_argument("--writes", type=int, default=2000, dest="numWrites",
+                      help="Number of metricDataBatchWrite blocks per thread")
+  parser.add_argument("--samples-per-write", type=int, default=5,
+                      dest="samplesPerWrite",
+                      help="Number of samples put per metricDataBatchWrite")
+  parser.add_argument("--threads", type=int, default=1, dest="numThreads",
+                      help="Number of concurrent writer threads")
+  parser.add_argument("--connect-ms", type=float, default=5, dest="connectMs",
+                      help="Simulated broker connect latency")
+  parser.add_argument("--confirm-ms", type=float, default=1, dest="confirmMs",
+                      help="Simulated publisher confirm latency")
+  return parser.parse_args()
+
+
+
+class _StandInMessageBusConnector(object):
+  """ Stand-in for MessageBusConnector that records published samples """
+
+  connectSec = 0
+  confirmSec = 0
+
+  # Published samples
+  samples = []
+  _samplesLock = threading.Lock()
+
+  def __init__(self):
+    time.sleep(self.connectSec)
+
+
+  def __enter__(self):
+    return self
+
+
+  def __exit__(self, *_args):
+    self.close()
+
+
+  def close(self):
+    pass
+
+
+  def publish(self, mqName, body, persistent):  # pylint: disable=W0613
+    time.sleep(self.confirmSec)
+    with self._samplesLock:
+      self.samples.extend(json.loads(body)["data"])
+
+
+
+@contextlib.contextmanager
+def _metricDataBatchWriteOriginal(log):  # pylint: disable=W0613
+  """ metricDataBatchWrite's original implementation """
+  batch = []
+
+  bus = metric_utils.message_bus_connector.MessageBusConnector()
+
+  def sendBatch():
+    try:
+      msg = json.dumps(dict(protocol="plain", data=batch))
+      bus.publish(mqName="taurus.metric.custom.data", body=msg, persistent=True)
+    finally:
+      del batch[:]
+
+
+  def putSample(metricName, value, epochTimestamp):
+    batch.append("%s %r %d" % (metricName, float(value), epochTimestamp))
+    if len(batch) >= metric_utils._METRIC_DATA_BATCH_WRITE_SIZE:
+      sendBatch()
+
+
+  with bus:
+    yield putSample
+
+    if batch:
+      sendBatch()
+
+
+
+class _NullLogger(object):
+  def info(self, *_args):
+    pass
+
+
+
+def _runWriter(metricDataBatchWrite, threadIndex, args):
+  for i in xrange(args.numWrites):
+    with metricDataBatchWrite(log=_NullLogger()) as putSample:
+      for j in xrange(args.samplesPerWrite):
+        putSample(metricName="benchmark.%d.%d" % (threadIndex, j),
+                  value=i,
+                  epochTimestamp=1438785600 + 300 * i)
+
+
+
+def _measure(metricDataBatchWrite, args):
+  """
+  :returns: two-tuple (<samples/sec>, <sorted published samples>)
+  """
+  del _StandInMessageBusConnector.samples[:]
+
+  threads = [
+    threading.Thread(target=_runWriter,
+                     args=(metricDataBatchWrite, i, args))
+    for i in xrange(args.numThreads)]
+
+  startTime = time.time()
+  for thread in threads:
+    thread.start()
+  for thread in threads:
+    thread.join()
+  elapsed = time.time() - startTime
+
+  samples = sorted(_StandInMessageBusConnector.samples)
+  return len(samples) / elapsed, samples
+
+
+
+def main():
+  args = _parseArgs()
+
+  _StandInMessageBusConnector.connectSec = args.connectMs / 1000.0
+  _StandInMessageBusConnector.confirmSec = args.confirmMs / 1000.0
+
+  results = []
+  with patch.object(metric_utils.message_bus_connector, "MessageBusConnector",
+                    new=_StandInMessageBusConnector):
+    for label, metricDataBatchWrite in (
+        ("original", _metricDataBatchWriteOriginal),
+        ("publisher", metric_utils.metricDataBatchWrite)):
+      samplesPerSec, samples = _measure(metricDataBatchWrite, args)
+      results.append(samples)
+
+      print ("writes=%-6d samples/write=%-4d threads=%-3d %-10s "
+             "%10.0f samples/s") % (
+               args.numWrites, args.samplesPerWrite, args.numThreads, label,
+               samplesPerSec)
+
+  if results[0] != results[1]:
+    raise Exception("Original and publisher results differ")
+
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,198 @@
+#!/usr/bin/env python
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2015, Numenta, Inc.  Unless you have purchased from
+# Numenta, Inc. a separate commercial license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+"""
+Measure the throughput (tweets/sec) of a TweetStorer ingesting a backlog of
+raw tagged statuses into the database, comparing its original sequential
+loop, which decoded, tagged and saved each batch of 100 messages in turn,
+with its pipelined reaper and writer stages. Verifies that both save all
+tweets.
+
+Runs against a temporary database on the MySQL server configured in
+collectors-sqldb.conf.
+
+Usage:
+  python tweet_ingest_benchmark.py --tweets=100000 --references-per-tweet=2
+"""
+
+import argparse
+import json
+import Queue
+import random
+import threading
+import time
+
+import sqlalchemy as sql
+
+from taurus.metric_collectors import collectorsdb, metric_utils
+from taurus.metric_collectors.collectorsdb import schema
+from taurus.metric_collectors.collectorsdb.collectorsdb_test_utils import (
+  ManagedTempRepository)
+from taurus.metric_collectors.twitterdirect import twitter_direct_agent
+from taurus.metric_collectors.twitterdirect.twitter_direct_agent import (
+  TweetStorer, TweetTagIndex, TwitterStreamListener)
+
+
+
+_AGG_SEC = 300
+
+
+
+def _parseArgs():
+  parser = argparse.ArgumentParser(description=__doc__)
+  parser.add_argument("--tweets", type=int, default=100000, dest="numTweets",
+                      help="Number of tagged statuses per measurement")
+  parser.add_argument("--references-per-tweet", type=int, default=2,
+                      dest="referencesPerTweet",
+                      help="Number of metrics matched by each status")
+  parser.add_argument("--timeout", type=float, default=600,
+                      help="Maximum seconds per measurement")
+  return parser.parse_args()
+
+
+
+def _generateStatuses(firstTweetId, numTweets, referencesPerTweet,
+                      metricSymbols):
+  """ Generate raw statuses, each mentioning referencesPerTweet of the given
+  metric symbols
+  """
+  rng = random.Random(firstTweetId)
+
+  statuses = []
+  for i in xrange(numTweets):
+    tweetId = str(firstTweetId + i)
+    userId = str(rng.randrange(100000000, 999999999))
+    symbols = rng.sample(metricSymbols, referencesPerTweet)
+    statuses.append(json.dumps(dict(
+      created_at="Wed Aug 05 14:44:32 +0000 2015",
+      id=int(tweetId), id_str=tweetId,
+      text=" ".join(["Some tweet text"] + ["$" + sym for sym in symbols]),
+      in_reply_to_status_id=None,
+      user=dict(id=int(userId), id_str=userId, name="User %s" % (userId,),
+                screen_name="user%s" % (userId,)),
+      entities=dict(
+        hashtags=[], urls=[], user_mentions=[],
+        symbols=[dict(text=sym, indices=[0, len(sym) + 1])
+                 for sym in symbols]),
+      retweeted=False, lang="en", timestamp_ms="1438785872858"),
+      separators=(",", ":")))
+
+  return statuses
+
+
+
+def _createStorer(tagIndex, msgQ):
+  return TweetStorer(tagIndex=tagIndex, aggSec=_AGG_SEC, msgQ=msgQ,
+                     echoData=False)
+
+
+
+def _ingestSequential(tagIndex, statuses, timeout):  # pylint: disable=W0613
+  """ TweetStorer's original ingest loop """
+  storer = _createStorer(tagIndex, msgQ=None)
+
+  aggRefDatetime = metric_utils.establishLastEmittedSampleDatetime(
+    key=twitter_direct_agent._EMITTED_TWEET_VOLUME_SAMPLE_TRACKER_KEY,
+    aggSec=_AGG_SEC)
+
+  batchSize = 100
+  for i in xrange(0, len(statuses), batchSize):
+    tweets, _ = storer._reapMessages(statuses[i:i + batchSize])
+    if tweets:
+      storer._saveTweets(messages=tweets, aggRefDatetime=aggRefDatetime)
+
+
+
+def _ingestPipelined(tagIndex, statuses, timeout):
+  """ TweetStorer's pipelined reaper and writer stages """
+  msgQ = Queue.Queue()
+  for status in statuses:
+    msgQ.put(status)
+
+  storer = _createStorer(tagIndex, msgQ=msgQ)
+
+  storerThread = threading.Thread(target=storer._run)
+  storerThread.setDaemon(True)
+  storerThread.start()
+
+  numTweets = sum(1 for status in statuses
+                  if status is not TwitterStreamListener.ConnectionMarker)
+
+  deadline = time.time() + timeout
+  while storer._writerStats.numItems < numTweets:
+    if not storerThread.isAlive() or time.time() > deadline:
+      raise Exception("Pipelined ingest didn't complete; %s; %s" % (
+        storer._reaperStats, storer._writerStats))
+    time.sleep(0.01)
+
+  print "  %s; %s; writeBatchSize=%d" % (
+    storer._reaperStats, storer._writerStats, storer._writeBatchSize)
+
+
+
+def _countTweets(firstTweetId, numTweets):
+  tweetsSchema = schema.twitterTweets
+  return collectorsdb.engineFactory().execute(
+    sql.select([sql.func.count()])
+    .where(tweetsSchema.c.uid.between(str(firstTweetId),
+                                      str(firstTweetId + numTweets - 1)))
+    ).scalar()
+
+
+
+def main():
+  args = _parseArgs()
+
+  metricSpecs = twitter_direct_agent.loadMetricSpecs()
+  metricSymbols = [spec.symbol.upper() for spec in metricSpecs]
+
+  tagIndex = TweetTagIndex(
+    symbolToMetricMap=dict((spec.symbol.lower(), spec.metric)
+                           for spec in metricSpecs),
+    userIdToMetricsMap=dict())
+
+  with ManagedTempRepository("ingestbench"):
+    firstTweetId = 628939652129538049
+    for label, ingest in (("sequential", _ingestSequential),
+                          ("pipelined", _ingestPipelined)):
+      statuses = [TwitterStreamListener.ConnectionMarker] + _generateStatuses(
+        firstTweetId, args.numTweets, args.referencesPerTweet, metricSymbols)
+
+      startTime = time.time()
+      ingest(tagIndex, statuses, args.timeout)
+      elapsed = time.time() - startTime
+
+      numSaved = _countTweets(firstTweetId, args.numTweets)
+      if numSaved != args.numTweets:
+        raise Exception("%s ingest saved %d of %d tweets" % (
+          label, numSaved, args.numTweets))
+
+      print "tweets=%-7d references/tweet=%-3d %-10s %10.0f tweets/s" % (
+        args.numTweets, args.referencesPerTweet, label,
+        args.numTweets / elapsed)
+
+      firstTweetId += args.numTweets
+
+
+
+if __name__ == "__main__":
+  main()
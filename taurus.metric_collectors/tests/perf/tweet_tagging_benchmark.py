@@ -0,0 +1,322 @@
+#!/usr/bin/env python
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2015, Numenta, Inc.  Unless you have purchased from
+# Numenta, Inc. a separate commercial license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+
+"""
+Measure the throughput (tweets/sec per core) of TweetStorer's tagging of
+streamed twitter statuses, replaying a recorded firehose through the original
+tagging, which decoded every status and walked it with each tagger, and
+through TweetStorer._reapMessages with its compiled TweetTagIndex. Verifies
+that both tag the same tweets with the same metrics.
+
+The firehose file has one raw status JSON per line, as received by
+TwitterStreamListener.on_data. Screen names of the twitter metrics are mapped
+to user ids found in the recorded statuses. Without a firehose file, a
+synthetic one is generated from the twitter metrics.
+
+Usage:
+  python tweet_tagging_benchmark.py [--firehose=<path>] [--processes=4]
+"""
+
+import argparse
+import json
+import multiprocessing
+import random
+import time
+
+from taurus.metric_collectors import collectorsdb
+from taurus.metric_collectors.twitterdirect import twitter_direct_agent
+from taurus.metric_collectors.twitterdirect.twitter_direct_agent import (
+  TweetStorer, TweetTagIndex, TwitterStreamListener)
+
+
+
+# Raw statuses to replay; set before forking the replay processes
+_gMessages = None
+
+_gSymbolToMetricMap = None
+_gUserIdToMetricsMap = None
+
+
+
+def _parseArgs():
+  parser = argparse.ArgumentParser(description=__doc__)
+  parser.add_argument("--firehose", default=None,
+                      help="Recorded firehose file; one status per line")
+  parser.add_argument("--tweets", type=int, default=100000, dest="numTweets",
+                      help="Number of synthetic tweets without --firehose")
+  parser.add_argument("--match-ratio", type=float, default=0.05,
+                      dest="matchRatio",
+                      help="Ratio of synthetic tweets matching a metric")
+  parser.add_argument("--processes", type=int,
+                      default=multiprocessing.cpu_count(),
+                      dest="numProcesses",
+                      help="Number of concurrent replay processes")
+  parser.add_argument("--rounds", type=int, default=3, dest="numRounds",
+                      help="Number of firehose replays per measurement")
+  return parser.parse_args()
+
+
+
+def _loadFirehose(path):
+  with open(path) as firehose:
+    return [line.rstrip("\r\n") for line in firehose if line.strip()]
+
+
+
+def _mapScreenNamesFromFirehose(messages, metricSpecs):
+  """ Map screen names of the metrics to user ids of source users and user
+  mentions of the recorded statuses
+
+  :returns: userId-to-metricNames map
+  """
+  screenNameToMetricsMap = dict()
+  for spec in metricSpecs:
+    for screenName in spec.screenNames:
+      screenNameToMetricsMap.setdefault(screenName.lower(), set()).add(
+        spec.metric)
+
+  userIdToMetricsMap = dict()
+
+  def mapUser(userObj):
+    metricNames = screenNameToMetricsMap.get(
+      (userObj.get("screen_name") or "").lower())
+    if metricNames:
+      userIdToMetricsMap.setdefault(userObj["id_str"], set()).update(
+        metricNames)
+
+  for msg in messages:
+    msg = json.loads(msg)
+    if "in_reply_to_status_id" not in msg:
+      continue
+
+    mapUser(msg["user"])
+    for mention in msg["entities"].get("user_mentions") or ():
+      mapUser(mention)
+
+  return userIdToMetricsMap
+
+
+
+def _generateFirehose(numTweets, matchRatio, metricSpecs):
+  """ Generate synthetic statuses, about matchRatio of which match metrics
+
+  :returns: two-tuple (<messages>, <userIdToMetricsMap>)
+  """
+  rng = random.Random(42)
+
+  userIdToMetricsMap = dict()
+  screenNameToUserId = dict()
+  for spec in metricSpecs:
+    for screenName in spec.screenNames:
+      userId = screenNameToUserId.setdefault(
+        screenName.lower(), str(10000000 + len(screenNameToUserId)))
+      userIdToMetricsMap.setdefault(userId, set()).add(spec.metric)
+
+  metricUserIds = screenNameToUserId.values()
+  metricSymbols = [spec.symbol.upper() for spec in metricSpecs]
+
+  def makeUser(userId):
+    return dict(
+      id=int(userId), id_str=userId, name="User %s" % (userId,),
+      screen_name="user%s" % (userId,), location="", url=None,
+      description="Tweets about things " * 5, protected=False,
+      followers_count=rng.randrange(10000), friends_count=rng.randrange(1000),
+      listed_count=0, created_at="Wed Apr 16 20:03:52 +0000 2014",
+      favourites_count=0, utc_offset=None, time_zone=None, geo_enabled=False,
+      verified=False, statuses_count=rng.randrange(100000), lang="en",
+      profile_background_color="C0DEED",
+      profile_image_url="http://pbs.twimg.com/profile_images/%s.png" % (
+        userId,))
+
+  messages = []
+  for i in xrange(numTweets):
+    userId = str(rng.randrange(100000000, 999999999))
+    symbols = ["XYZ%d" % (rng.randrange(1000),)]
+    mentionedUserIds = [str(rng.randrange(100000000, 999999999))]
+
+    if rng.random() < matchRatio:
+      choice = rng.randrange(3)
+      if choice == 0:
+        userId = rng.choice(metricUserIds)
+      elif choice == 1:
+        symbols.append(rng.choice(metricSymbols))
+      else:
+        mentionedUserIds.append(rng.choice(metricUserIds))
+
+    tweetId = str(628939652129538049 + i)
+    messages.append(json.dumps(dict(
+      created_at="Wed Aug 05 14:44:32 +0000 2015",
+      id=int(tweetId), id_str=tweetId,
+      text=" ".join(["Some tweet text"] + ["$" + sym for sym in symbols]),
+      source="<a href=\"http://twitter.com\">Twitter Web Client</a>",
+      truncated=False, in_reply_to_status_id=None,
+      in_reply_to_status_id_str=None, in_reply_to_user_id=None,
+      in_reply_to_user_id_str=None, in_reply_to_screen_name=None,
+      user=makeUser(userId), geo=None, coordinates=None, place=None,
+      contributors=None, retweet_count=0, favorite_count=0,
+      entities=dict(
+        hashtags=[], trends=[], urls=[],
+        symbols=[dict(text=sym, indices=[0, len(sym) + 1])
+                 for sym in symbols],
+        user_mentions=[dict(id=int(mentionedUserId), id_str=mentionedUserId,
+                            screen_name="user%s" % (mentionedUserId,),
+                            name="User", indices=[0, 10])
+                       for mentionedUserId in mentionedUserIds]),
+      favorited=False, retweeted=False, possibly_sensitive=False,
+      filter_level="low", lang="en", timestamp_ms="1438785872858"),
+      separators=(",", ":")))
+
+  return messages, userIdToMetricsMap
+
+
+
+def _reapOriginal(messages, symbolToMetricMap, userIdToMetricsMap):
+  """ TweetStorer's original decoding and tagging of statuses
+
+  :returns: sequence of tagged tweets
+  """
+  tweets = []
+  for msg in messages:
+    msg = json.loads(msg)
+    if "in_reply_to_status_id" not in msg:
+      continue
+
+    msg["metricTagSet"] = metricTagSet = set()
+
+    entities = msg.get("entities")
+    if entities:
+      for sym in entities.get("symbols") or ():
+        ticker = sym.get("text")
+        if ticker:
+          metricName = symbolToMetricMap.get(ticker.lower())
+          if metricName:
+            metricTagSet.add(metricName)
+
+    userObj = msg.get("user")
+    if userObj:
+      metricNames = userIdToMetricsMap.get(userObj.get("id_str"))
+      if metricNames:
+        metricTagSet.update(metricNames)
+
+    if entities:
+      for mention in entities.get("user_mentions") or ():
+        metricNames = userIdToMetricsMap.get(mention.get("id_str"))
+        if metricNames:
+          metricTagSet.update(metricNames)
+
+    if metricTagSet:
+      tweets.append(msg)
+
+  return tweets
+
+
+
+def _createIndexedReaper():
+  storer = TweetStorer(
+    tagIndex=TweetTagIndex(symbolToMetricMap=_gSymbolToMetricMap,
+                           userIdToMetricsMap=_gUserIdToMetricsMap),
+    aggSec=300,
+    msgQ=None,
+    echoData=False)
+
+  storer._reapMessages([TwitterStreamListener.ConnectionMarker])
+
+  return lambda messages: storer._reapMessages(messages)[0]
+
+
+
+def _createOriginalReaper():
+  return lambda messages: _reapOriginal(messages, _gSymbolToMetricMap,
+                                        _gUserIdToMetricsMap)
+
+
+
+def _replay(task):
+  """ Replay process target
+
+  :returns: elapsed seconds
+  """
+  createReaper, numRounds = task
+  reap = createReaper()
+
+  batchSize = 100
+  startTime = time.time()
+  for _ in xrange(numRounds):
+    for i in xrange(0, len(_gMessages), batchSize):
+      reap(_gMessages[i:i + batchSize])
+
+  return time.time() - startTime
+
+
+
+def main():
+  global _gMessages, _gSymbolToMetricMap, _gUserIdToMetricsMap
+
+  args = _parseArgs()
+
+  metricSpecs = twitter_direct_agent.loadMetricSpecs()
+  _gSymbolToMetricMap = dict((spec.symbol, spec.metric)
+                             for spec in metricSpecs)
+
+  if args.firehose:
+    _gMessages = _loadFirehose(args.firehose)
+    _gUserIdToMetricsMap = _mapScreenNamesFromFirehose(_gMessages,
+                                                       metricSpecs)
+  else:
+    _gMessages, _gUserIdToMetricsMap = _generateFirehose(
+      args.numTweets, args.matchRatio, metricSpecs)
+
+  originalTweets = _createOriginalReaper()(_gMessages)
+  indexedTweets = _createIndexedReaper()(_gMessages)
+  if ([(tweet["id_str"], tweet["metricTagSet"]) for tweet in originalTweets] !=
+      [(tweet["id_str"], tweet["metricTagSet"]) for tweet in indexedTweets]):
+    raise Exception("Original and indexed tagging results differ")
+
+  # TweetStorer's collectorsdb engine must not be inherited by the replay
+  # processes
+  collectorsdb.resetEngineSingleton()
+
+  print "statuses=%d tagged=%d metrics=%d userIds=%d" % (
+    len(_gMessages), len(indexedTweets), len(metricSpecs),
+    len(_gUserIdToMetricsMap))
+
+  for label, createReaper in (("original", _createOriginalReaper),
+                              ("indexed", _createIndexedReaper)):
+    pool = multiprocessing.Pool(args.numProcesses)
+    try:
+      elapsedTimes = pool.map(_replay,
+                              [(createReaper, args.numRounds)] *
+                              args.numProcesses)
+    finally:
+      pool.close()
+      pool.join()
+
+    perCore = [len(_gMessages) * args.numRounds / elapsed
+               for elapsed in elapsedTimes]
+    print "processes=%-3d %-9s %10.0f tweets/s per core; %10.0f tweets/s" % (
+      args.numProcesses, label, sum(perCore) / len(perCore), sum(perCore))
+
+
+
+if __name__ == "__main__":
+  main()
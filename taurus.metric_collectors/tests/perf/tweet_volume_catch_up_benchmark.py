@@ -0,0 +1,201 @@
+#!/usr/bin/env python
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2015, Numenta, Inc.  Unless you have purchased from
+# Numenta, Inc. a separate commercial license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+
+"""
+Measure how long MetricDataForwarder takes to catch up on a backlog of tweet
+volume aggregations (24 hours by default), comparing its original forwarding,
+which counted twitter_tweet_samples rows and saved the last emitted
+aggregation once per aggregation interval, with forwarding of
+twitter_tweet_volumes ranges. Verifies that both emit the same samples.
+
+Tweets are saved via TweetStorer into a temporary database on the MySQL server
+configured in collectors-sqldb.conf; samples are captured instead of being
+published to the message bus.
+
+Usage:
+  python tweet_volume_catch_up_benchmark.py --hours=24 --tweets-per-interval=500
+"""
+
+import argparse
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+import random
+import time
+
+from mock import patch
+import sqlalchemy as sql
+
+from nta.utils import date_time_utils
+
+from taurus.metric_collectors import collectorsdb, metric_utils
+from taurus.metric_collectors.collectorsdb import schema
+from taurus.metric_collectors.collectorsdb.collectorsdb_test_utils import (
+  ManagedTempRepository)
+from taurus.metric_collectors.twitterdirect import twitter_direct_agent
+from taurus.metric_collectors.twitterdirect.twitter_direct_agent import (
+  MetricDataForwarder, TweetStorer)
+
+
+
+_AGG_SEC = 300
+
+
+
+def _parseArgs():
+  parser = argparse.ArgumentParser(description=__doc__)
+  parser.add_argument("--hours", type=int, default=24,
+                      help="Hours of backlog to catch up on")
+  parser.add_argument("--tweets-per-interval", type=int, default=500,
+                      dest="tweetsPerInterval",
+                      help="Number of tagged tweets per aggregation interval")
+  return parser.parse_args()
+
+
+
+def _saveBacklog(metricSpecs, startDatetime, numIntervals, tweetsPerInterval):
+  """ Save tagged tweets via TweetStorer
+
+  :returns: tweets/sec
+  """
+  rng = random.Random(42)
+  metricNames = [spec.metric for spec in metricSpecs]
+
+  storer = TweetStorer(tagIndex=None, aggSec=_AGG_SEC, msgQ=None,
+                       echoData=False)
+
+  numTweets = numIntervals * tweetsPerInterval
+  batchSize = 100
+  startTime = time.time()
+  for i in xrange(0, numTweets, batchSize):
+    messages = []
+    for j in xrange(i, min(i + batchSize, numTweets)):
+      createdAt = startDatetime + timedelta(
+        seconds=j * _AGG_SEC // tweetsPerInterval)
+      messages.append(dict(
+        id_str=str(628939652129538049 + j),
+        created_at=createdAt.strftime("%a %b %d %H:%M:%S +0000 %Y"),
+        text="Some tweet text",
+        lang="en",
+        user=dict(id_str=str(rng.randrange(10 ** 9)), screen_name="someone",
+                  name="Someone"),
+        metricTagSet=frozenset(rng.sample(metricNames, rng.randint(1, 2)))))
+
+    storer._saveTweets(messages=messages, aggRefDatetime=startDatetime)
+
+  return numTweets / (time.time() - startTime)
+
+
+
+@contextmanager
+def _captureMetricDataBatchWrite(samples):
+  """ Patch metric_utils.metricDataBatchWrite to capture samples """
+  @contextmanager
+  def metricDataBatchWrite(log):  # pylint: disable=W0613
+    yield lambda **sample: samples.append(sample)
+
+  with patch.object(metric_utils, "metricDataBatchWrite",
+                    new=metricDataBatchWrite):
+    yield
+
+
+
+def _forwardPerInterval(forwarder, lastEmittedAggTime, stopDatetime):
+  """ MetricDataForwarder's original catch-up """
+  samplesSchema = schema.twitterTweetSamples
+  periodTimedelta = timedelta(seconds=_AGG_SEC)
+  aggStartDatetime = lastEmittedAggTime + periodTimedelta
+
+  while aggStartDatetime < stopDatetime:
+    metricToVolumeMap = defaultdict(int, collectorsdb.engineFactory().execute(
+      sql.select([samplesSchema.c.metric, sql.func.count()])
+      .where(samplesSchema.c.agg_ts == aggStartDatetime)
+      .group_by(samplesSchema.c.metric)).fetchall())
+
+    epochTimestamp = date_time_utils.epochFromNaiveUTCDatetime(
+      aggStartDatetime)
+
+    with metric_utils.metricDataBatchWrite(log=None) as putSample:
+      for spec in forwarder._metricSpecs:
+        putSample(metricName=spec.metric,
+                  value=metricToVolumeMap[spec.metric],
+                  epochTimestamp=epochTimestamp)
+
+    metric_utils.updateLastEmittedSampleDatetime(
+      key=twitter_direct_agent._EMITTED_TWEET_VOLUME_SAMPLE_TRACKER_KEY,
+      sampleDatetime=aggStartDatetime)
+
+    aggStartDatetime += periodTimedelta
+
+
+
+def _forwardRanged(forwarder, lastEmittedAggTime, stopDatetime):
+  """ MetricDataForwarder's catch-up from twitter_tweet_volumes """
+  forwarder._forwardTweetVolumeMetrics(lastEmittedAggTime=lastEmittedAggTime,
+                                       stopDatetime=stopDatetime)
+
+
+
+def main():
+  args = _parseArgs()
+
+  metricSpecs = twitter_direct_agent.loadMetricSpecs()
+
+  numIntervals = args.hours * 3600 // _AGG_SEC
+  startDatetime = datetime(2015, 8, 5)
+  lastEmittedAggTime = startDatetime - timedelta(seconds=_AGG_SEC)
+  stopDatetime = startDatetime + timedelta(seconds=numIntervals * _AGG_SEC)
+
+  with ManagedTempRepository("volbench"):
+    collectorsdb.engineFactory().execute(
+      schema.emittedSampleTracker.insert()  # pylint: disable=E1120
+      .values(key=twitter_direct_agent._EMITTED_TWEET_VOLUME_SAMPLE_TRACKER_KEY,
+              sample_ts=lastEmittedAggTime))
+
+    tweetsPerSec = _saveBacklog(metricSpecs, startDatetime, numIntervals,
+                                args.tweetsPerInterval)
+    print "Saved backlog: intervals=%d tweets=%d %.0f tweets/s" % (
+      numIntervals, numIntervals * args.tweetsPerInterval, tweetsPerSec)
+
+    forwarder = MetricDataForwarder(metricSpecs, aggSec=_AGG_SEC)
+
+    results = []
+    for label, forward in (("per-interval", _forwardPerInterval),
+                           ("ranged", _forwardRanged)):
+      samples = []
+      with _captureMetricDataBatchWrite(samples):
+        startTime = time.time()
+        forward(forwarder, lastEmittedAggTime, stopDatetime)
+        elapsed = time.time() - startTime
+
+      results.append(samples)
+      print "hours=%-3d metrics=%-4d %-12s %8.2fs catch-up; %8.0f samples/s" % (
+        args.hours, len(metricSpecs), label, elapsed, len(samples) / elapsed)
+
+    if results[0] != results[1]:
+      raise Exception("Per-interval and ranged forwarding results differ")
+
+
+
+if __name__ == "__main__":
+  main()
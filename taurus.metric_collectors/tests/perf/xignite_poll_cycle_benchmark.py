@@ -0,0 +1,231 @@
+#!/usr/bin/env python
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2015, Numenta, Inc.  Unless you have purchased from
+# Numenta, Inc. a separate commercial license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+"""
+Measure the wall time of an xignite_stock_agent polling cycle, comparing its
+original polling, which ran poll() in a process pool with a latest-sample
+query and a new HTTP connection per symbol, with polling in a bounded thread
+pool that shares a keep-alive HTTP session and one bulk latest-sample query.
+Verifies that both return the same bars.
+
+Polls a local stub of the XIgnite GetBars API that responds after a simulated
+latency; collectorsdb queries are replaced by a simulated query latency.
+
+Usage:
+  python xignite_poll_cycle_benchmark.py --symbols=500 --latency-ms=50
+"""
+
+import argparse
+import BaseHTTPServer
+from functools import partial
+import json
+from multiprocessing import Pool
+from multiprocessing.pool import ThreadPool
+import SocketServer
+import threading
+import time
+import urllib
+import urllib2
+import urlparse
+
+from mock import patch
+
+from taurus.metric_collectors.xignite import xignite_stock_agent
+from taurus.metric_collectors.xignite.xignite_stock_agent import (
+  StockMetricSpec)
+
+
+
+def _parseArgs():
+  parser = argparse.ArgumentParser(description=__doc__)
+  parser.add_argument("--symbols", type=int, default=500, dest="numSymbols",
+                      help="Number of stock symbols to poll")
+  parser.add_argument("--latency-ms", type=float, default=50,
+                      dest="latencyMs",
+                      help="Simulated XIgnite API response latency")
+  parser.add_argument("--db-latency-ms", type=float, default=2,
+                      dest="dbLatencyMs",
+                      help="Simulated collectorsdb query latency")
+  parser.add_argument("--concurrency", type=int,
+                      default=xignite_stock_agent.DEFAULT_CONCURRENCY,
+                      help="Number of polling threads")
+  return parser.parse_args()
+
+
+
+class _StubHTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+  daemon_threads = True
+  request_queue_size = 1024
+
+
+
+class _GetBarsHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+  """ Stub of XIgnite GetBars API; responds with two bars of the requested
+  symbol after the server's simulated latency
+  """
+  protocol_version = "HTTP/1.1"
+
+
+  def do_GET(self):  # pylint: disable=C0103
+    symbol = urlparse.parse_qs(
+      urlparse.urlparse(self.path).query)["Identifier"][0]
+
+    time.sleep(self.server.latencySec)
+
+    body = json.dumps(dict(
+      Outcome="Success",
+      Message=None,
+      Identity="Request",
+      Delay=0.01,
+      Security=dict(Symbol=symbol, Name=symbol, Market="NASDAQ"),
+      Bars=[dict(StartDate="1/15/2015", StartTime=startTime,
+                 EndDate="1/15/2015", EndTime=endTime, UTCOffset=-5,
+                 Open=46.2, High=46.4, Low=45.9, Close=46.0, Volume=504494,
+                 Trades=2414)
+            for startTime, endTime in (("9:30:00 AM", "9:35:00 AM"),
+                                       ("9:35:00 AM", "9:40:00 AM"))]))
+
+    self.send_response(200)
+    self.send_header("Content-Type", "application/json")
+    self.send_header("Content-Length", str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+
+  def log_message(self, *_args):
+    pass
+
+
+
+def _getDataOriginal(symbol, apitoken, barlength, startTime, endTime, fields,
+                     httpSession=None):  # pylint: disable=W0613
+  """ getData's original implementation, which opened a new HTTP connection
+  per request
+  """
+  query = dict(xignite_stock_agent._URL_KEYS)
+  query.update({"Identifier": symbol,
+                "StartTime": startTime,
+                "EndTime": endTime,
+                "Period": barlength,
+                "_Token": apitoken,
+                "_fields": ",".join(fields)})
+
+  response = urllib2.urlopen(
+    xignite_stock_agent._API_URL + urllib.urlencode(query),
+    timeout=xignite_stock_agent.URLOPEN_TIMEOUT_SEC)
+
+  return json.loads(response.read())
+
+
+
+def _pollOriginal(metricSpecs, dbLatencySec):
+  """ Process pool target: poll() with its own latest-sample query """
+  time.sleep(dbLatencySec)
+  return xignite_stock_agent.poll(metricSpecs, apitoken="token", barlength=5,
+                                  days=1, lastSample=None)
+
+
+
+def _runOriginalCycle(symbolToMetricSpecs, args):
+  """ xignite_stock_agent's original polling cycle """
+  pool = Pool()
+  try:
+    startTime = time.time()
+    results = list(pool.imap_unordered(
+      partial(_pollOriginal, dbLatencySec=args.dbLatencyMs / 1000.0),
+      symbolToMetricSpecs.itervalues()))
+    return time.time() - startTime, results
+  finally:
+    pool.close()
+    pool.join()
+
+
+
+def _runConcurrentCycle(symbolToMetricSpecs, args):
+  """ xignite_stock_agent's polling cycle with a bounded thread pool, shared
+  keep-alive HTTP session and bulk latest-sample query
+  """
+  pool = ThreadPool(args.concurrency)
+  httpSession = xignite_stock_agent.createHttpSession(args.concurrency)
+  try:
+    startTime = time.time()
+
+    # Bulk latest-sample query
+    time.sleep(args.dbLatencyMs / 1000.0)
+    latestSamples = dict()
+
+    results = list(pool.imap_unordered(
+      lambda metricSpecs: xignite_stock_agent.poll(
+        metricSpecs, apitoken="token", barlength=5, days=1,
+        lastSample=latestSamples.get(metricSpecs[0].symbol),
+        httpSession=httpSession),
+      symbolToMetricSpecs.itervalues()))
+    return time.time() - startTime, results
+  finally:
+    pool.close()
+    pool.join()
+
+
+
+def main():
+  args = _parseArgs()
+
+  symbolToMetricSpecs = dict(
+    ("SYM%d" % (i,),
+     [StockMetricSpec(metricName="XIGNITE.SYM%d.%s" % (i, sampleKey.upper()),
+                      symbol="SYM%d" % (i,),
+                      stockExchange="NASDAQ",
+                      sampleKey=sampleKey)
+      for sampleKey in ("Close", "Volume")])
+    for i in xrange(args.numSymbols))
+
+  server = _StubHTTPServer(("127.0.0.1", 0), _GetBarsHandler)
+  server.latencySec = args.latencyMs / 1000.0
+  serverThread = threading.Thread(target=server.serve_forever)
+  serverThread.setDaemon(True)
+  serverThread.start()
+
+  apiUrl = "http://127.0.0.1:%d/GetBars?" % (server.server_address[1],)
+
+  results = []
+  try:
+    with patch.object(xignite_stock_agent, "_API_URL", new=apiUrl):
+      for label, runCycle, getData in (
+          ("original", _runOriginalCycle, _getDataOriginal),
+          ("concurrent", _runConcurrentCycle, xignite_stock_agent.getData)):
+        with patch.object(xignite_stock_agent, "getData", new=getData):
+          elapsed, cycleResults = runCycle(symbolToMetricSpecs, args)
+
+        results.append(sorted(cycleResults))
+        print "symbols=%-5d latency=%-5.0fms %-11s %8.2fs per cycle" % (
+          args.numSymbols, args.latencyMs, label, elapsed)
+  finally:
+    server.shutdown()
+    server.server_close()
+
+  if results[0] != results[1]:
+    raise Exception("Original and concurrent polling results differ")
+
+
+
+if __name__ == "__main__":
+  main()
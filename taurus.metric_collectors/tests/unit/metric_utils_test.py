@@ -647,6 +647,20 @@ class MetricUtilsTestCase(unittest.TestCase):
       verify=ANY, auth=("taurus", ""))
 
 
+  @staticmethod
+  def _createMessageBusMock(messageBusConnectorClassMock):
+    messageBusConnectorClass = (
+      metric_utils.message_bus_connector.MessageBusConnector)
+    messageBusMock = MagicMock(
+      spec_set=messageBusConnectorClass,
+      publish=Mock(spec_set=messageBusConnectorClass.publish))
+    messageBusMock.__enter__.return_value = messageBusMock
+
+    messageBusConnectorClassMock.return_value = messageBusMock
+
+    return messageBusMock
+
+
   @patch(("taurus.metric_collectors.metric_utils.message_bus_connector"
           ".MessageBusConnector"), autospec=True)
   def testMetricDataBatchWrite(self, messageBusConnectorClassMock):
@@ -656,44 +670,32 @@ class MetricUtilsTestCase(unittest.TestCase):
       for i in xrange((metric_utils._METRIC_DATA_BATCH_WRITE_SIZE * 3) / 2)
     ]
 
-    messageBusConnectorClass = (
-      metric_utils.message_bus_connector.MessageBusConnector)
-    messageBusMock = MagicMock(
-      spec_set=messageBusConnectorClass,
-      publish=Mock(spec_set=messageBusConnectorClass.publish))
-    messageBusMock.__enter__.return_value = messageBusMock
+    messageBusMock = self._createMessageBusMock(messageBusConnectorClassMock)
 
-    messageBusConnectorClassMock.return_value = messageBusMock
+    # Make sure that batches are only published when full or flushed
+    publisher = metric_utils.MetricDataPublisher(maxDelaySec=60)
 
     loggerMock = Mock(spec_set=logging.Logger)
-    with metric_utils.metricDataBatchWrite(loggerMock) as putSample:
-      # put enough for the first batch
-      for sample in samples[:metric_utils._METRIC_DATA_BATCH_WRITE_SIZE]:
-        putSample(*sample)
-
-      # The first publish call should be for a full batch
-      self.assertEqual(messageBusMock.publish.call_count, 1)
-      call0 = mock.call(
-        mqName="taurus.metric.custom.data",
-        persistent=True,
-        body=json.dumps(
-          dict(
-            protocol="plain",
-            data=["%s %r %d" % (m, v, t)
-                  for m, v, t
-                  in samples[:metric_utils._METRIC_DATA_BATCH_WRITE_SIZE]])))
-      self.assertEqual(messageBusMock.publish.call_args_list[0], call0)
-
-      # put the remaining samples
-      for sample in samples[metric_utils._METRIC_DATA_BATCH_WRITE_SIZE:]:
-        putSample(*sample)
-
-      # the remaining incomplete batch will be sent upon exit from the context,
-      # but not yet
-      self.assertEqual(messageBusMock.publish.call_count, 1)
-
-    # Now, the remainder should be sent, too
+    with patch.object(metric_utils, "getMetricDataPublisher", autospec=True,
+                      return_value=publisher):
+      with metric_utils.metricDataBatchWrite(loggerMock) as putSample:
+        for sample in samples:
+          putSample(*sample)
+
+    # The first publish call should be for a full batch, and the remainder
+    # should be sent upon exit from the context
     self.assertEqual(messageBusMock.publish.call_count, 2)
+    call0 = mock.call(
+      mqName="taurus.metric.custom.data",
+      persistent=True,
+      body=json.dumps(
+        dict(
+          protocol="plain",
+          data=["%s %r %d" % (m, v, t)
+                for m, v, t
+                in samples[:metric_utils._METRIC_DATA_BATCH_WRITE_SIZE]])))
+    self.assertEqual(messageBusMock.publish.call_args_list[0], call0)
+
     call1 = mock.call(
       mqName="taurus.metric.custom.data",
       persistent=True,
@@ -705,6 +707,71 @@ class MetricUtilsTestCase(unittest.TestCase):
                 in samples[metric_utils._METRIC_DATA_BATCH_WRITE_SIZE:]])))
     self.assertEqual(messageBusMock.publish.call_args_list[1], call1)
 
+    # The connection is reused across batches
+    self.assertEqual(messageBusConnectorClassMock.call_count, 1)
+    self.assertEqual(loggerMock.info.call_count, 1)
+
+
+  @patch(("taurus.metric_collectors.metric_utils.message_bus_connector"
+          ".MessageBusConnector"), autospec=True)
+  def testMetricDataPublisherPublishesAfterMaxDelay(
+      self, messageBusConnectorClassMock):
+    messageBusMock = self._createMessageBusMock(messageBusConnectorClassMock)
+    published = metric_utils.threading.Event()
+    messageBusMock.publish.side_effect = lambda **_kwargs: published.set()
+
+    publisher = metric_utils.MetricDataPublisher(maxDelaySec=0.01)
+    publisher.put(metric_utils._PublishSession(), "FOO.BAR 1.0 300")
+
+    # Published without a flush
+    self.assertTrue(published.wait(10))
+    messageBusMock.publish.assert_called_once_with(
+      mqName="taurus.metric.custom.data",
+      persistent=True,
+      body=json.dumps(dict(protocol="plain", data=["FOO.BAR 1.0 300"])))
+
+
+  @patch(("taurus.metric_collectors.metric_utils.message_bus_connector"
+          ".MessageBusConnector"), autospec=True)
+  def testMetricDataBatchWriteWithPublishFailure(
+      self, messageBusConnectorClassMock):
+    messageBusMock = self._createMessageBusMock(messageBusConnectorClassMock)
+    messageBusMock.publish.side_effect = iter([Exception("Broker is down"),
+                                               None])
+
+    publisher = metric_utils.MetricDataPublisher(maxDelaySec=60)
+
+    loggerMock = Mock(spec_set=logging.Logger)
+    with patch.object(metric_utils, "getMetricDataPublisher", autospec=True,
+                      return_value=publisher):
+      with self.assertRaises(metric_utils.MetricDataPublishError):
+        with metric_utils.metricDataBatchWrite(loggerMock) as putSample:
+          putSample("FOO.BAR", 1, 300)
+
+      # The publisher reconnects and carries on
+      with metric_utils.metricDataBatchWrite(loggerMock) as putSample:
+        putSample("FOO.BAR", 2, 600)
+
+    self.assertEqual(messageBusMock.publish.call_count, 2)
+    self.assertEqual(messageBusMock.close.call_count, 1)
+    self.assertEqual(messageBusConnectorClassMock.call_count, 2)
+
+
+  def testGetMetricDataPublisher(self):
+    singleton = metric_utils._MetricDataPublisherSingleton
+    with patch.object(singleton, "_publisher", new=None), \
+        patch.object(singleton, "_pid", new=None):
+      with patch.object(metric_utils, "MetricDataPublisher",
+                        autospec=True) as publisherClassMock:
+        publisher = metric_utils.getMetricDataPublisher()
+        self.assertIs(metric_utils.getMetricDataPublisher(), publisher)
+        self.assertEqual(publisherClassMock.call_count, 1)
+
+        # A forked process gets a publisher of its own
+        with patch.object(metric_utils.os, "getpid", autospec=True,
+                          return_value=-1):
+          metric_utils.getMetricDataPublisher()
+        self.assertEqual(publisherClassMock.call_count, 2)
 
 
 if __name__ == "__main__":
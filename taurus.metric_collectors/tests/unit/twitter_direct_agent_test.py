@@ -24,13 +24,132 @@
 unit tests for taurus.metric_collectors.twitterdirect.twitter_direct_agent
 """
 
-from datetime import datetime
+from contextlib import contextmanager
+from datetime import datetime, timedelta
 import json
 import unittest
 
-from mock import Mock
+from mock import Mock, patch
+from sqlalchemy.dialects import mysql
 
 from taurus.metric_collectors.twitterdirect import twitter_direct_agent
+from taurus.metric_collectors.twitterdirect.twitter_direct_agent import (
+  TweetTagIndex)
+
+
+
+def _makeTweet(userId, symbols=(), mentionedUserIds=()):
+  return dict(
+    in_reply_to_status_id=None,
+    id_str="628939652129538049",
+    text="Some tweet text",
+    user=dict(id_str=userId, screen_name="someone"),
+    entities=dict(
+      symbols=[dict(text=symbol) for symbol in symbols],
+      user_mentions=[dict(id_str=mentionedUserId)
+                     for mentionedUserId in mentionedUserIds]))
+
+
+
+def _makeTagIndex():
+  return TweetTagIndex(
+    symbolToMetricMap={
+      "acn": "TWITTER.TWEET.HANDLE.ACN.VOLUME",
+      "googl": "TWITTER.TWEET.HANDLE.GOOGL.VOLUME",
+      "goog": "TWITTER.TWEET.HANDLE.GOOG.VOLUME"
+    },
+    userIdToMetricsMap={
+      "10194682": set(["TWITTER.TWEET.HANDLE.ACN.VOLUME"]),
+      "20536157": set(["TWITTER.TWEET.HANDLE.GOOGL.VOLUME",
+                       "TWITTER.TWEET.HANDLE.GOOG.VOLUME"])
+    })
+
+
+
+class TweetTagIndexTestCase(unittest.TestCase):
+
+
+  def testTag(self):
+    tagIndex = _makeTagIndex()
+
+    self.assertEqual(len(tagIndex), 3)
+
+    def tagNames(msg):
+      return tagIndex.getMetricNames(tagIndex.tag(msg))
+
+    # No match
+    self.assertEqual(tagNames(_makeTweet("1", symbols=["IBM"],
+                                         mentionedUserIds=["2"])),
+                     frozenset())
+    self.assertEqual(tagNames(dict(in_reply_to_status_id=None)), frozenset())
+
+    # Cashtags match regardless of case
+    self.assertEqual(tagNames(_makeTweet("1", symbols=["Acn", "IBM"])),
+                     frozenset(["TWITTER.TWEET.HANDLE.ACN.VOLUME"]))
+
+    # Source user may map to multiple metrics
+    self.assertEqual(tagNames(_makeTweet("20536157")),
+                     frozenset(["TWITTER.TWEET.HANDLE.GOOGL.VOLUME",
+                                "TWITTER.TWEET.HANDLE.GOOG.VOLUME"]))
+
+    # Matches on cashtags, source user and mentions are combined
+    self.assertEqual(tagNames(_makeTweet(u"1", symbols=[u"GOOG"],
+                                         mentionedUserIds=[u"10194682"])),
+                     frozenset(["TWITTER.TWEET.HANDLE.ACN.VOLUME",
+                                "TWITTER.TWEET.HANDLE.GOOG.VOLUME"]))
+
+
+  def testMayMatchRawTweet(self):
+    tagIndex = _makeTagIndex()
+
+    self.assertFalse(tagIndex.mayMatchRawTweet(
+      json.dumps(_makeTweet("1", symbols=["IBM"], mentionedUserIds=["2"]))))
+
+    self.assertTrue(tagIndex.mayMatchRawTweet(
+      json.dumps(_makeTweet("1", symbols=["acn"]))))
+    self.assertTrue(tagIndex.mayMatchRawTweet(
+      json.dumps(_makeTweet("20536157"))))
+    self.assertTrue(tagIndex.mayMatchRawTweet(
+      json.dumps(_makeTweet("1", mentionedUserIds=["10194682"]),
+                 separators=(",", ":"))))
+
+
+  def testBuildTagIndexAndStreamFilterParams(self):
+    metricSpecs = [
+      twitter_direct_agent.TwitterMetricSpec(
+        resource="Accenture",
+        metric="TWITTER.TWEET.HANDLE.ACN.VOLUME",
+        screenNames=["Accenture"],
+        symbol="acn"),
+      twitter_direct_agent.TwitterMetricSpec(
+        resource="Google",
+        metric="TWITTER.TWEET.HANDLE.GOOG.VOLUME",
+        screenNames=["google", "Unknown"],
+        symbol="goog")
+    ]
+
+    users = [Mock(screen_name="Accenture", id_str=u"10194682"),
+             Mock(screen_name="Google", id_str=u"20536157")]
+
+    with patch.object(twitter_direct_agent.tweepy, "API",
+                      autospec=True) as apiClassMock:
+      apiClassMock.return_value.lookup_users.return_value = users
+
+      tagIndex, streamFilterParams = (
+        twitter_direct_agent.buildTagIndexAndStreamFilterParams(
+          metricSpecs, authHandler=Mock()))
+
+    self.assertItemsEqual(streamFilterParams["track"],
+                          ["@accenture", "@google", "@unknown", "$acn",
+                           "$goog"])
+    self.assertItemsEqual(streamFilterParams["follow"],
+                          ["10194682", "20536157"])
+
+    self.assertEqual(
+      tagIndex.getMetricNames(tagIndex.tag(
+        _makeTweet("20536157", symbols=["ACN"]))),
+      frozenset(["TWITTER.TWEET.HANDLE.ACN.VOLUME",
+                 "TWITTER.TWEET.HANDLE.GOOG.VOLUME"]))
 
 
 
@@ -83,7 +202,7 @@ class TweetStorerTestCase(unittest.TestCase):
     """ Test handling of empty message sequence by TweetStorer._reapMessages
     """
     storer = twitter_direct_agent.TweetStorer(
-      taggingMap=Mock(),
+      tagIndex=Mock(),
       aggSec=300,
       msgQ=Mock(),
       echoData=False)
@@ -98,7 +217,7 @@ class TweetStorerTestCase(unittest.TestCase):
     """ Test handling of "limit" notifications in TweetStorer._reapMessages
     """
     storer = twitter_direct_agent.TweetStorer(
-      taggingMap=Mock(),
+      tagIndex=Mock(),
       aggSec=300,
       msgQ=Mock(),
       echoData=False)
@@ -164,13 +283,52 @@ class TweetStorerTestCase(unittest.TestCase):
     self.assertEqual(storer._runtimeStreamingStats.streamNumber, 2)
 
 
+  def testReapMessagesWithTweets(self):
+    """ Test tagging of tweets and pre-filtering of unmatched tweets in
+    TweetStorer._reapMessages
+    """
+    storer = twitter_direct_agent.TweetStorer(
+      tagIndex=_makeTagIndex(),
+      aggSec=300,
+      msgQ=Mock(),
+      echoData=False)
+
+    deleteMsg = dict(delete=dict(status=dict(id_str="1", user_id_str="2")))
+
+    with patch.object(twitter_direct_agent.json, "loads", autospec=True,
+                      side_effect=json.loads) as loadsMock:
+      tweets, deletes = storer._reapMessages(
+        [
+          twitter_direct_agent.TwitterStreamListener.ConnectionMarker,
+          json.dumps(_makeTweet("1", symbols=["IBM"])),
+          json.dumps(_makeTweet("1", symbols=["ACN"])),
+          json.dumps(deleteMsg),
+          json.dumps(_makeTweet("1", mentionedUserIds=["20536157"]))
+        ])
+
+    # The unmatched tweet wasn't decoded
+    self.assertEqual(loadsMock.call_count, 3)
+
+    self.assertEqual([tweet["metricTagSet"] for tweet in tweets],
+                     [frozenset(["TWITTER.TWEET.HANDLE.ACN.VOLUME"]),
+                      frozenset(["TWITTER.TWEET.HANDLE.GOOGL.VOLUME",
+                                 "TWITTER.TWEET.HANDLE.GOOG.VOLUME"])])
+    self.assertEqual(deletes, [deleteMsg])
+
+    self.assertEqual(storer._currentStreamStats.numTweets, 3)
+    self.assertEqual(storer._currentStreamStats.numUntaggedTweets, 1)
+    self.assertEqual(storer._currentStreamStats.numDeleteStatuses, 1)
+    self.assertEqual(storer._runtimeStreamingStats.numTweets, 3)
+    self.assertEqual(storer._runtimeStreamingStats.numUntaggedTweets, 1)
+
+
   def testCreateTweetAndReferenceRowsWithMissingLangKey(self):
     """ Test case for TAUR-1370 wherein a missing `lang` key resulted in a
     failure to reap tweet, but also resulted in a faulty entry in
     `twitter_tweets` table with null values, causing the agent to crash later
     in the pipeline """
     storer = twitter_direct_agent.TweetStorer(
-      taggingMap=Mock(),
+      tagIndex=Mock(),
       aggSec=300,
       msgQ=Mock(),
       echoData=False)
@@ -262,5 +420,260 @@ class TweetStorerTestCase(unittest.TestCase):
     self.assertEqual(tweetRow["created_at"], datetime(2015, 8, 5, 14, 44, 32))
 
 
+  def testSelectNewReferenceRows(self):
+    aggDatetime = datetime(2015, 8, 5, 14, 40)
+    referenceRows = [
+      dict(metric="M1", msg_uid="1", agg_ts=aggDatetime),
+      dict(metric="M2", msg_uid="1", agg_ts=aggDatetime),
+      dict(metric="M1", msg_uid="2", agg_ts=aggDatetime),
+      # Duplicate tweet in the same batch
+      dict(metric="M1", msg_uid="2", agg_ts=aggDatetime)
+    ]
+
+    conn = Mock()
+    conn.execute.return_value = [(u"M2", u"1")]
+
+    newReferenceRows = twitter_direct_agent.TweetStorer._selectNewReferenceRows(
+      conn, referenceRows)
+
+    self.assertEqual(newReferenceRows, [referenceRows[0], referenceRows[2]])
+    self.assertEqual(conn.execute.call_count, 1)
+
+    # The existing references are selected with a locking read
+    query = conn.execute.call_args[0][0]
+    self.assertIn("FOR UPDATE", str(query.compile(dialect=mysql.dialect())))
+
+
+  def testCountTweetVolumes(self):
+    agg1 = datetime(2015, 8, 5, 14, 40)
+    agg2 = datetime(2015, 8, 5, 14, 45)
+
+    volumeRows = twitter_direct_agent.TweetStorer._countTweetVolumes([
+      dict(metric="M1", msg_uid="1", agg_ts=agg1),
+      dict(metric="M2", msg_uid="1", agg_ts=agg1),
+      dict(metric="M1", msg_uid="2", agg_ts=agg1),
+      dict(metric="M1", msg_uid="3", agg_ts=agg2)
+    ])
+
+    self.assertItemsEqual(volumeRows,
+                          [dict(agg_ts=agg1, metric="M1", volume=2),
+                           dict(agg_ts=agg1, metric="M2", volume=1),
+                           dict(agg_ts=agg2, metric="M1", volume=1)])
+
+
+  def testPipelineStageStatsRudimentary(self):
+    """ Very rudimentary tests of TweetStorer._PipelineStageStats
+    """
+    inputQ = Mock()
+    inputQ.qsize.return_value = 3
+    stats = twitter_direct_agent.TweetStorer._PipelineStageStats(
+      "writer", inputQ)
+
+    # Make sure that str doesn't crash on stats with default attributes
+    str(stats)
+
+    stats.add(10)
+    stats.add(5)
+    self.assertEqual(stats.numItems, 15)
+    self.assertEqual(stats.numBatches, 2)
+    self.assertIn("queueDepth=3", str(stats))
+
+
+  def testAdaptWriteBatchSize(self):
+    storer = twitter_direct_agent.TweetStorer(
+      tagIndex=Mock(),
+      aggSec=300,
+      msgQ=Mock(),
+      echoData=False)
+
+    minSize = storer._MIN_WRITE_BATCH_SIZE
+    maxSize = storer._MAX_WRITE_BATCH_SIZE
+    fastSec = storer._TARGET_WRITE_LATENCY_SEC / 4
+    slowSec = storer._TARGET_WRITE_LATENCY_SEC * 2
+
+    self.assertEqual(storer._writeBatchSize, minSize)
+
+    # Fast, but partial batches don't grow the batch size
+    storer._adaptWriteBatchSize(numTweets=minSize - 1, latencySec=fastSec)
+    self.assertEqual(storer._writeBatchSize, minSize)
+
+    # Fast full batches double it up to the maximum
+    storer._adaptWriteBatchSize(numTweets=minSize, latencySec=fastSec)
+    self.assertEqual(storer._writeBatchSize, minSize * 2)
+
+    for _ in xrange(20):
+      storer._adaptWriteBatchSize(numTweets=storer._writeBatchSize,
+                                  latencySec=fastSec)
+    self.assertEqual(storer._writeBatchSize, maxSize)
+
+    # Slow batches halve it down to the minimum
+    storer._adaptWriteBatchSize(numTweets=maxSize, latencySec=slowSec)
+    self.assertEqual(storer._writeBatchSize, maxSize // 2)
+
+    for _ in xrange(20):
+      storer._adaptWriteBatchSize(numTweets=10, latencySec=slowSec)
+    self.assertEqual(storer._writeBatchSize, minSize)
+
+
+  def testRunWriterCoalescesRows(self):
+    """ The writer stage saves rows queued by the reaper stage in one batch and
+    carries on after failed saves
+    """
+    class StopWriter(BaseException):
+      pass
+
+    storer = twitter_direct_agent.TweetStorer(
+      tagIndex=Mock(),
+      aggSec=300,
+      msgQ=Mock(),
+      echoData=False)
+
+    storer._rowQ.put(([dict(uid="1")], [dict(msg_uid="1", metric="M1")]))
+    storer._rowQ.put(([dict(uid="2"), dict(uid="3")],
+                      [dict(msg_uid="2", metric="M1")]))
+
+    savedBatches = []
+
+    def saveTweetRows(tweetRows, referenceRows):
+      savedBatches.append((tweetRows, referenceRows))
+      if len(savedBatches) == 1:
+        storer._rowQ.put(([dict(uid="4")], []))
+        storer._rowQ.put(([dict(uid="5")], []))
+        raise Exception("Transient failure")
+      elif len(savedBatches) == 2:
+        storer._rowQ.put(([dict(uid="6")], []))
+      else:
+        raise StopWriter()
+
+    with patch.object(storer, "_saveTweetRows", autospec=True,
+                      side_effect=saveTweetRows):
+      with self.assertRaises(StopWriter):
+        storer._runWriter()
+
+    self.assertEqual(len(savedBatches), 3)
+
+    self.assertEqual(
+      savedBatches[0],
+      ([dict(uid="1"), dict(uid="2"), dict(uid="3")],
+       [dict(msg_uid="1", metric="M1"), dict(msg_uid="2", metric="M1")]))
+
+    self.assertEqual(savedBatches[1], ([dict(uid="4"), dict(uid="5")], []))
+    self.assertEqual(storer._writerStats.numItems, 2)
+
+
+
+class MetricDataForwarderTestCase(unittest.TestCase):
+
+
+  def setUp(self):
+    self.metricSpecs = [
+      twitter_direct_agent.TwitterMetricSpec(
+        resource="Accenture",
+        metric="TWITTER.TWEET.HANDLE.ACN.VOLUME",
+        screenNames=["Accenture"],
+        symbol="acn"),
+      twitter_direct_agent.TwitterMetricSpec(
+        resource="Google",
+        metric="TWITTER.TWEET.HANDLE.GOOG.VOLUME",
+        screenNames=["google"],
+        symbol="goog")
+    ]
+
+
+  @patch.object(twitter_direct_agent.metric_utils, "metricDataBatchWrite",
+                autospec=True)
+  @patch.object(twitter_direct_agent.MetricDataForwarder,
+                "_queryTweetVolumes", autospec=True)
+  def testAggregateAndForward(self, queryTweetVolumesMock,
+                              metricDataBatchWriteMock):
+    agg1 = datetime(2015, 8, 5, 14, 40)
+    agg2 = datetime(2015, 8, 5, 14, 45)
+    stopDatetime = datetime(2015, 8, 5, 14, 50)
+
+    queryTweetVolumesMock.return_value = [
+      (agg1, "TWITTER.TWEET.HANDLE.ACN.VOLUME", 3),
+      (agg2, "TWITTER.TWEET.HANDLE.GOOG.VOLUME", 5)
+    ]
+
+    samples = []
+
+    @contextmanager
+    def metricDataBatchWrite(log):  # pylint: disable=W0613
+      yield lambda **sample: samples.append(sample)
+
+    metricDataBatchWriteMock.side_effect = metricDataBatchWrite
+
+    forwarder = twitter_direct_agent.MetricDataForwarder(self.metricSpecs,
+                                                         aggSec=300)
+    forwarder.aggregateAndForward(aggStartDatetime=agg1,
+                                  stopDatetime=stopDatetime)
+
+    # All intervals were queried at once
+    queryTweetVolumesMock.assert_called_once_with(forwarder, agg1,
+                                                  stopDatetime, None)
+    self.assertEqual(metricDataBatchWriteMock.call_count, 1)
+
+    epoch1 = 1438785600
+    epoch2 = epoch1 + 300
+    self.assertEqual(
+      samples,
+      [dict(metricName="TWITTER.TWEET.HANDLE.ACN.VOLUME", value=3,
+            epochTimestamp=epoch1),
+       dict(metricName="TWITTER.TWEET.HANDLE.GOOG.VOLUME", value=0,
+            epochTimestamp=epoch1),
+       dict(metricName="TWITTER.TWEET.HANDLE.ACN.VOLUME", value=0,
+            epochTimestamp=epoch2),
+       dict(metricName="TWITTER.TWEET.HANDLE.GOOG.VOLUME", value=5,
+            epochTimestamp=epoch2)])
+
+
+  @patch.object(twitter_direct_agent.metric_utils,
+                "updateLastEmittedSampleDatetime", autospec=True)
+  @patch.object(twitter_direct_agent.MetricDataForwarder,
+                "aggregateAndForward", autospec=True)
+  @patch.object(twitter_direct_agent.MetricDataForwarder,
+                "_MAX_FORWARD_RANGE_SEC", new=3600)
+  def testForwardTweetVolumeMetricsCatchUp(self, aggregateAndForwardMock,
+                                           updateLastEmittedMock):
+    period = timedelta(seconds=300)
+    lastEmittedAggTime = datetime(2015, 8, 5, 0, 0)
+    stopDatetime = lastEmittedAggTime + period * 31
+
+    # Fail while forwarding the third range
+    aggregateAndForwardMock.side_effect = iter(
+      [None, None, Exception("Failed")])
+
+    forwarder = twitter_direct_agent.MetricDataForwarder(self.metricSpecs,
+                                                         aggSec=300)
+    result = forwarder._forwardTweetVolumeMetrics(
+      lastEmittedAggTime=lastEmittedAggTime,
+      stopDatetime=stopDatetime)
+
+    self.assertEqual(
+      [(call[1]["aggStartDatetime"], call[1]["stopDatetime"])
+       for call in aggregateAndForwardMock.call_args_list],
+      [(lastEmittedAggTime + period, lastEmittedAggTime + period * 13),
+       (lastEmittedAggTime + period * 13, lastEmittedAggTime + period * 25),
+       (lastEmittedAggTime + period * 25, stopDatetime)])
+
+    # The last emitted aggregation is saved once per range
+    self.assertEqual(
+      [call[1]["sampleDatetime"]
+       for call in updateLastEmittedMock.call_args_list],
+      [lastEmittedAggTime + period * 12, lastEmittedAggTime + period * 24])
+    self.assertEqual(result, lastEmittedAggTime + period * 24)
+
+    # Resume forwarding of the remaining intervals
+    aggregateAndForwardMock.side_effect = None
+    result = forwarder._forwardTweetVolumeMetrics(
+      lastEmittedAggTime=result,
+      stopDatetime=stopDatetime)
+
+    self.assertEqual(result, lastEmittedAggTime + period * 30)
+    self.assertEqual(updateLastEmittedMock.call_args[1]["sampleDatetime"],
+                     lastEmittedAggTime + period * 30)
+
+
+
 if __name__ == "__main__":
   unittest.main()
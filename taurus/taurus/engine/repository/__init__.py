@@ -47,6 +47,7 @@ from htmengine.repository import (addMetric,
                                   getMetricWithUpdateLock,
                                   getMetricCountForServer,
                                   getMetricData,
+                                  getMetricDataChunks,
                                   getMetricDataCount,
                                   getProcessedMetricDataCount,
                                   getMetricDataWithRawAnomalyScoresTail,
@@ -61,6 +62,7 @@ from htmengine.repository import (addMetric,
                                   updateMetricColumns,
                                   updateMetricColumnsForRefStatus,
                                   updateMetricDataColumns,
+                                  updateMetricDataColumnsBulk,
                                   lockOperationExclusive,
                                   OperationLock)
 
@@ -0,0 +1,79 @@
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2015, Numenta, Inc.  Unless you have purchased from
+# Numenta, Inc. a separate commercial license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+
+"""partition metric_data by day
+
+Revision ID: 1b2dbf1483bc
+Revises: 1d2eddc43366
+Create Date: 2015-11-02 14:21:37.318204
+"""
+
+from datetime import datetime, timedelta
+
+from alembic import context, op
+
+from htmengine.repository.queries import partitionMetricDataByDay
+
+
+# Revision identifiers, used by Alembic. Do not change.
+revision = '1b2dbf1483bc'
+down_revision = '1d2eddc43366'
+
+
+
+# Max number of past days to create daily partitions for; older rows go into
+# the first partition
+_MAX_PAST_PARTITION_DAYS = 365
+
+# Number of upcoming days to create daily partitions for; the rest are created
+# by metric_garbage_collector
+_NUM_FUTURE_PARTITION_DAYS = 7
+
+
+
+def upgrade():
+  """ Partition metric_data by day on timestamp, so that
+  metric_garbage_collector may drop expired days instead of deleting their rows
+  """
+  today = datetime.utcnow().date()
+
+  firstDay = today
+  if not context.is_offline_mode():
+    oldestTimestamp = op.get_bind().execute(
+      "SELECT MIN(timestamp) FROM metric_data").scalar()
+    if oldestTimestamp is not None:
+      firstDay = min(
+        today,
+        max(oldestTimestamp.date(),
+            today - timedelta(days=_MAX_PAST_PARTITION_DAYS)))
+
+  days = [firstDay + timedelta(days=i)
+          for i in xrange((today - firstDay).days +
+                          _NUM_FUTURE_PARTITION_DAYS + 1)]
+
+  # NOTE: op.execute also emits the statements in offline mode
+  partitionMetricDataByDay(op, days)
+
+
+
+def downgrade():
+  raise NotImplementedError("Rollback is not supported.")
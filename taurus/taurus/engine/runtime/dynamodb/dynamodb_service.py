@@ -30,8 +30,11 @@ client.
 from datetime import datetime, timedelta
 from decimal import Context, Underflow, Clamped, Overflow
 import json
+from multiprocessing.pool import ThreadPool
 import os
 import sys
+import threading
+import time
 
 import boto.dynamodb2
 from boto.dynamodb2.exceptions import (
@@ -133,6 +136,106 @@ def convertInferenceResultRowToMetricDataItem(metricId, row):
 
 
 
+class InstanceDataHourlyAggregator(object):
+  """ Write-behind buffer of the max anomaly scores of `instance_data_hourly`
+  items.
+
+  Coalesces the anomaly scores of model inference results per (instance, hour)
+  item and metric type until they are popped for writing, and remembers the
+  scores that were written so that lower scores of the same hour don't need to
+  be written again.
+  """
+
+  # Number of hours of written scores to remember, counting back from the
+  # latest hour that was written
+  _WRITTEN_SCORES_RETENTION_HOURS = 24
+
+
+  def __init__(self):
+    # (instanceName, hour) -> {metricType: max anomaly score} pending write
+    self._pendingScores = dict()
+
+    # (instanceName, hour) -> {metricType: anomaly score} known to be stored
+    self._writtenScores = dict()
+
+    # Latest hour in _writtenScores; None if empty
+    self._latestWrittenHour = None
+
+
+  def __len__(self):
+    return len(self._pendingScores)
+
+
+  def add(self, instanceName, metricType, rows):
+    """ Aggregate the anomaly scores of model inference result rows
+
+    :param str instanceName: name of the instance
+    :param str metricType: the metric type identifier
+    :param rows: model inference result rows per "results" property of
+      htmengine/runtime/json_schema/model_inference_results_msg_schema.json
+    :type rows: Sequence of dicts
+    """
+    for row in rows:
+      hour = datetime.utcfromtimestamp(row["ts"]).replace(minute=0,
+                                                          second=0,
+                                                          microsecond=0)
+      scores = self._pendingScores.setdefault((instanceName, hour), dict())
+      scores[metricType] = max(scores.get(metricType, 0.0), row["anomaly"])
+
+
+  def popUpdates(self):
+    """ Remove the pending scores from the buffer
+
+    :returns: (instanceName, hour, scores) of the items with pending scores
+      above their written scores, where scores is a dict of max anomaly scores
+      keyed by metric type; ordered by instance and hour
+    :rtype: list of tuples
+    """
+    updates = []
+    for (instanceName, hour), scores in sorted(
+        self._pendingScores.iteritems()):
+      writtenScores = self._writtenScores.get((instanceName, hour), dict())
+      scores = dict((metricType, score)
+                    for metricType, score in scores.iteritems()
+                    if (metricType not in writtenScores or
+                        score > writtenScores[metricType]))
+      if scores:
+        updates.append((instanceName, hour, scores))
+
+    self._pendingScores.clear()
+
+    return updates
+
+
+  def markWritten(self, instanceName, hour, scores):
+    """ Record the scores of an item that were written or found to be exceeded
+    by the stored ones, and forget the written scores of expired hours
+
+    :param str instanceName: name of the instance
+    :param datetime hour: the item's hour
+    :param dict scores: anomaly scores keyed by metric type
+    """
+    retention = timedelta(hours=self._WRITTEN_SCORES_RETENTION_HOURS)
+
+    if self._latestWrittenHour is None or hour > self._latestWrittenHour:
+      # The retention window moves forward; forget the hours that fall out of
+      # it. This scan only happens when a later hour is written, not on every
+      # call
+      self._latestWrittenHour = hour
+      expiration = hour - retention
+      for key in [key for key in self._writtenScores if key[1] < expiration]:
+        del self._writtenScores[key]
+    elif hour < self._latestWrittenHour - retention:
+      # Already expired
+      return
+
+    writtenScores = self._writtenScores.setdefault((instanceName, hour), dict())
+    for metricType, score in scores.iteritems():
+      writtenScores[metricType] = max(writtenScores.get(metricType, score),
+                                      score)
+
+
+
 class DynamoDBService(object):
   """ Binds a "dynamodb" queue to:
       - The model results fanout exchange defined in the
@@ -141,12 +244,22 @@ class DynamoDBService(object):
       - Non-metric data topic exchange defined in the ``exchange_name``
         configuration directive of the ``non_metric_data`` configuration
         section
+
+  Updates of `instance_data_hourly` are write-behind: the max anomaly scores
+  of model inference result batches are coalesced in an
+  InstanceDataHourlyAggregator and flushed when the consumer has no more
+  buffered messages or `instance_data_hourly_flush_interval_sec` after the
+  oldest pending batch was received. The batches' messages are acked after
+  their scores were flushed, so the updates are at-least-once.
   """
 
   _FRESH_DATA_THRESHOLD_DAYS = 14
 
   _INPUT_QUEUE_NAME = "dynamodb"
 
+  # Max number of items per DynamoDB BatchWriteItem request
+  _MAX_BATCH_WRITE_ITEMS = 25
+
 
   def __init__(self):
     self._modelResultsExchange = (
@@ -154,8 +267,24 @@ class DynamoDBService(object):
     self._nonMetricDataExchange = (
       taurus.engine.config.get("non_metric_data", "exchange_name"))
 
+    self._instanceDataHourlyFlushIntervalSec = taurus.engine.config.getfloat(
+      "dynamodb", "instance_data_hourly_flush_interval_sec")
+    self._numMetricDataBatchWriters = taurus.engine.config.getint(
+      "dynamodb", "metric_data_batch_writers")
+
     self.dynamodb = self.connectDynamoDB()
 
+    self._instanceDataHourly = InstanceDataHourlyAggregator()
+
+    # Messages whose acks are deferred until their instance_data_hourly scores
+    # are flushed, in order of receipt
+    self._unackedMessages = []
+    self._oldestUnackedMessageTime = None
+
+    # Thread pool of parallel metric_data batch writers; created on demand
+    self._metricDataWriterPool = None
+    self._metricDataWriterLocal = threading.local()
+
     self._metric = None
     self._metric_data = None
     self._metric_tweets = None
@@ -257,34 +386,80 @@ class DynamoDBService(object):
 
   def _publishMetricData(self, metricId, rows):
     """ Specific handler for metric data rows.  Publishes to the
-    `taurus.data.metric_data` dynamodb table.
+    `taurus.data.metric_data` dynamodb table, splitting rows that don't fit in
+    one BatchWriteItem request among parallel batch writers.
 
     :param str metricId: unique metric identifier
     :param rows: model inference result rows per "results" property of
       htmengine/runtime/json_schema/model_inference_results_msg_schema.json
     :type rows: Sequence of dicts
     """
-    with self._metric_data.batch_write() as dynamodbBatchWrite:
-      processedKeys = set()
-      for row in rows:
-        data=convertInferenceResultRowToMetricDataItem(metricId, row)
-
-        # Safeguard against erroneously-provided duplicate timestamp in batch
-        key = (data.uid, data.timestamp)
-        if key in processedKeys:
-          # This would trigger ValidationException from DynamoDB with the
-          # message "Provided list of item keys contains duplicates"
-          g_log.error("Duplicate metric_data key in batch write: data=%r from "
-                      "row=%r from batchLen=%d", data, row, len(rows))
-          continue
+    items = []
+    processedKeys = set()
+    for row in rows:
+      data=convertInferenceResultRowToMetricDataItem(metricId, row)
+
+      # Safeguard against erroneously-provided duplicate timestamp in batch
+      key = (data.uid, data.timestamp)
+      if key in processedKeys:
+        # This would trigger ValidationException from DynamoDB with the
+        # message "Provided list of item keys contains duplicates"
+        g_log.error("Duplicate metric_data key in batch write: data=%r from "
+                    "row=%r from batchLen=%d", data, row, len(rows))
+        continue
+
+      items.append(data._asdict())
+      processedKeys.add(key)
+
+    if (len(items) <= self._MAX_BATCH_WRITE_ITEMS or
+        self._numMetricDataBatchWriters <= 1):
+      self._batchWriteItems(self._metric_data, items)
+      return
+
+    if self._metricDataWriterPool is None:
+      self._metricDataWriterPool = ThreadPool(self._numMetricDataBatchWriters)
+
+    self._metricDataWriterPool.map(
+      self._batchWriteMetricDataInWriterThread,
+      [items[i:i + self._MAX_BATCH_WRITE_ITEMS]
+       for i in xrange(0, len(items), self._MAX_BATCH_WRITE_ITEMS)])
 
-        dynamodbBatchWrite.put_item(data=data._asdict(), overwrite=True)
-        processedKeys.add(key)
+
+  def _batchWriteMetricDataInWriterThread(self, items):
+    """ Batch writer thread pool target: put items into the
+    `taurus.data.metric_data` dynamodb table
+
+    :param items: item data dicts
+    """
+    table = getattr(self._metricDataWriterLocal, "table", None)
+    if table is None:
+      # NOTE: boto connections aren't thread-safe, so each writer thread uses
+      # its own
+      table = Table(self._metric_data.table_name,
+                    connection=self.connectDynamoDB())
+      self._metricDataWriterLocal.table = table
+
+    self._batchWriteItems(table, items)
+
+
+  @staticmethod
+  def _batchWriteItems(table, items):
+    """ Put items into a dynamodb table via BatchWriteItem requests, replacing
+    existing ones
+
+    :param boto.dynamodb2.table.Table table: the table
+    :param items: item data dicts
+    """
+    with table.batch_write() as dynamodbBatchWrite:
+      for item in items:
+        dynamodbBatchWrite.put_item(data=item, overwrite=True)
 
 
   def _publishInstanceDataHourly(self, instanceName, metricType, rows):
-    """ Specific handler for instance data rows.  Publishes to the
-    `taurus.data.instance_data_hourly` dynamodb table.
+    """ Specific handler for instance data rows.  Aggregates the rows' max
+    anomaly scores per hour for publishing to the
+    `taurus.data.instance_data_hourly` dynamodb table by
+    `_flushInstanceDataHourly()`.
 
     :param instanceName: name of the instance
     :type instanceName: str
@@ -296,106 +471,150 @@ class DynamoDBService(object):
       htmengine/runtime/json_schema/model_inference_results_msg_schema.json
     :type rows: Sequence of dicts
     """
-    hourToMaxScore = {}
-    for row in rows:
-      # row.timestamp is a datetime instance
-      ts = datetime.utcfromtimestamp(row["ts"]).replace(minute=0,
-                                                        second=0,
-                                                        microsecond=0)
-      # Store the max anomaly likelihood for the period
-      hourToMaxScore[ts] = max(hourToMaxScore.get(ts, 0.0),
-                               row["anomaly"])
-    for ts, score in sorted(hourToMaxScore.iteritems()):
-      score = FIXED_DYNAMODB_CONTEXT.create_decimal_from_float(score)
-      dateHour = ts.strftime("%Y-%m-%dT%H")
-
-      data = {
-          "instance_id": {"S": instanceName},
-          "date_hour": {"S": dateHour},
-          "date": {"S": ts.strftime("%Y-%m-%d")},
-          "hour": {"S": ts.strftime("%H")},
-          "anomaly_score": {"M": {metricType: {"N": str(score)}}},
-      }
-      # Validate the data fields against the schema
-      InstanceDataHourlyDynamoDBDefinition().Item(**data)
-
-      # First try a conditional update for the anomaly score for this metric
-      updateKey = {"instance_id": data["instance_id"],
-                   "date_hour": data["date_hour"]}
+    self._instanceDataHourly.add(instanceName, metricType, rows)
+
+
+  def _flushInstanceDataHourly(self):
+    """ Publish the aggregated max anomaly scores to the
+    `taurus.data.instance_data_hourly` dynamodb table and ack the messages
+    whose scores were aggregated
+    """
+    updates = self._instanceDataHourly.popUpdates()
+    for instanceName, hour, scores in updates:
+      self._updateInstanceDataHourlyItem(instanceName, hour, scores)
+      self._instanceDataHourly.markWritten(instanceName, hour, scores)
+
+    if self._unackedMessages:
+      g_log.debug("Flushed %d instance_data_hourly item(s) of %d batch(es)",
+                  len(updates), len(self._unackedMessages))
+
+      # NOTE: all earlier messages were already acked
+      self._unackedMessages[-1].ack(multiple=True)
+      self._unackedMessages = []
+      self._oldestUnackedMessageTime = None
+
+
+  def _updateInstanceDataHourlyItem(self, instanceName, hour, scores):
+    """ Raise the anomaly scores of an `instance_data_hourly` item to the
+    given ones, creating the item if needed. All metric types' scores are
+    updated in one conditional update, falling back to an update per metric
+    type if the item has a higher score for any of them.
+
+    :param str instanceName: name of the instance
+    :param datetime hour: the item's hour
+    :param dict scores: max anomaly scores keyed by metric type
+    """
+    decimalScores = dict(
+      (metricType, FIXED_DYNAMODB_CONTEXT.create_decimal_from_float(score))
+      for metricType, score in scores.iteritems())
+    dateHour = hour.strftime("%Y-%m-%dT%H")
+
+    data = {
+        "instance_id": {"S": instanceName},
+        "date_hour": {"S": dateHour},
+        "date": {"S": hour.strftime("%Y-%m-%d")},
+        "hour": {"S": hour.strftime("%H")},
+        "anomaly_score": {"M": dict(
+          (metricType, {"N": str(score)})
+          for metricType, score in decimalScores.iteritems())},
+    }
+    # Validate the data fields against the schema
+    InstanceDataHourlyDynamoDBDefinition().Item(**data)
+
+    # First try a conditional update for the anomaly scores of the metrics
+    updateKey = {"instance_id": data["instance_id"],
+                 "date_hour": data["date_hour"]}
+    assignments = []
+    conditions = []
+    updateValues = {}
+    for i, (metricType, score) in enumerate(sorted(
+        decimalScores.iteritems())):
       anomalyScoreMetric = "anomaly_score.%s" % metricType
-      updateCondition = ("attribute_not_exists(%(asm)s) or "
-                         "%(asm)s < :value" % {"asm": anomalyScoreMetric})
-      updateValues = {":value": {"N": str(score)}}
-      updateExpression = "SET %s = :value" % anomalyScoreMetric
-
-      @retryOnTransientDynamoDBError(g_log)
-      def updateItemWithRetries():
-        self.dynamodb.update_item(self._instance_data_hourly.table_name,
-                                  key=updateKey,
-                                  update_expression=updateExpression,
-                                  condition_expression=updateCondition,
-                                  expression_attribute_values=updateValues)
-
-      try:
-        updateItemWithRetries()
-      except ResourceNotFoundException:
-        # There is no row yet, so continue on to PutItem
-        pass
-      except ValidationException:
-        # It's OK, let's continue and try the PutItem
-        pass
-      except ConditionalCheckFailedException:
-        # The existing value is larger so we are done
-        continue
-      except Exception:
-        g_log.exception("update_item failed: table=%s; updateKey=%s; "
-                        "update=%s; condition=%s; values=%s",
-                        self._instance_data_hourly.table_name, updateKey,
-                        updateExpression, updateCondition, updateValues)
-        raise
-      else:
-        # There was no exception, the update succeeded, we are done
-        continue
+      value = ":value%d" % (i,)
+      assignments.append("%s = %s" % (anomalyScoreMetric, value))
+      conditions.append("(attribute_not_exists(%(asm)s) or "
+                        "%(asm)s < %(value)s)" % {"asm": anomalyScoreMetric,
+                                                  "value": value})
+      updateValues[value] = {"N": str(score)}
+    updateCondition = " and ".join(conditions)
+    updateExpression = "SET %s" % (", ".join(assignments),)
+
+    @retryOnTransientDynamoDBError(g_log)
+    def updateItemWithRetries():
+      self.dynamodb.update_item(self._instance_data_hourly.table_name,
+                                key=updateKey,
+                                update_expression=updateExpression,
+                                condition_expression=updateCondition,
+                                expression_attribute_values=updateValues)
+
+    def updateScoresSeparately():
+      for metricType, score in scores.iteritems():
+        self._updateInstanceDataHourlyItem(instanceName, hour,
+                                           {metricType: score})
 
-      # If the UpdateItem failed with ResourceNotFoundException, put the row
-      # and continue to next iteration of the loop
-
-      putCondition = "attribute_not_exists(instance_id)"
-
-      @retryOnTransientDynamoDBError(g_log)
-      def putItemWithRetries(item, condition):
-        self.dynamodb.put_item(
-          self._instance_data_hourly.table_name,
-          item=item,
-          condition_expression=condition)
-
-      try:
-        putItemWithRetries(data, putCondition)
-      except ConditionalCheckFailedException:
-        # No problem, row already exists!
-        pass
-      except Exception:
-        g_log.exception("put_item failed: table=%s; condition=%s; item=%s",
-                        self._instance_data_hourly.table_name, putCondition,
-                        data)
-        raise
-      else:
-        # There was no exception, the put succeeded, we are done
-        continue
+    try:
+      updateItemWithRetries()
+    except ResourceNotFoundException:
+      # There is no row yet, so continue on to PutItem
+      pass
+    except ValidationException:
+      # It's OK, let's continue and try the PutItem
+      pass
+    except ConditionalCheckFailedException:
+      # The existing value is larger, so we are done unless other metric types'
+      # values are smaller
+      if len(scores) > 1:
+        updateScoresSeparately()
+      return
+    except Exception:
+      g_log.exception("update_item failed: table=%s; updateKey=%s; "
+                      "update=%s; condition=%s; values=%s",
+                      self._instance_data_hourly.table_name, updateKey,
+                      updateExpression, updateCondition, updateValues)
+      raise
+    else:
+      # There was no exception, the update succeeded, we are done
+      return
 
-      # In the case that a parallel process beat us to it
-      try:
-        updateItemWithRetries()
-      except ConditionalCheckFailedException:
-        # The existing value is larger so we are done
-        continue
-      except Exception:
-        g_log.exception("update_item failed: table=%s; updateKey=%s; "
-                        "update=%s; condition=%s; values=%s",
-                        self._instance_data_hourly.table_name, updateKey,
-                        updateExpression, updateCondition, updateValues)
-        raise
+    # If the UpdateItem failed with ResourceNotFoundException, put the row
 
+    putCondition = "attribute_not_exists(instance_id)"
+
+    @retryOnTransientDynamoDBError(g_log)
+    def putItemWithRetries(item, condition):
+      self.dynamodb.put_item(
+        self._instance_data_hourly.table_name,
+        item=item,
+        condition_expression=condition)
+
+    try:
+      putItemWithRetries(data, putCondition)
+    except ConditionalCheckFailedException:
+      # No problem, row already exists!
+      pass
+    except Exception:
+      g_log.exception("put_item failed: table=%s; condition=%s; item=%s",
+                      self._instance_data_hourly.table_name, putCondition,
+                      data)
+      raise
+    else:
+      # There was no exception, the put succeeded, we are done
+      return
+
+    # In the case that a parallel process beat us to it
+    try:
+      updateItemWithRetries()
+    except ConditionalCheckFailedException:
+      # The existing value is larger, so we are done unless other metric types'
+      # values are smaller
+      if len(scores) > 1:
+        updateScoresSeparately()
+    except Exception:
+      g_log.exception("update_item failed: table=%s; updateKey=%s; "
+                      "update=%s; condition=%s; values=%s",
+                      self._instance_data_hourly.table_name, updateKey,
+                      updateExpression, updateCondition, updateValues)
+      raise
 
 
   def _handleModelInferenceResults(self, body):
@@ -405,6 +624,9 @@ class DynamoDBService(object):
     :param body: Serialized message payload; the message is compliant with
       htmengine/runtime/json_schema/model_inference_results_msg_schema.json.
     :type body: str
+    :returns: True if the batch's anomaly scores were aggregated for
+      `_flushInstanceDataHourly()`; False if the batch was dropped
+    :rtype: bool
     """
     try:
       batch = AnomalyService.deserializeModelResult(body)
@@ -421,7 +643,7 @@ class DynamoDBService(object):
     if not batch["results"]:
       g_log.error("Empty results in model inference results batch; model=%s",
                   metricId)
-      return
+      return False
 
     lastRow = batch["results"][-1]
     if (datetime.utcfromtimestamp(lastRow["ts"]) <
@@ -429,7 +651,7 @@ class DynamoDBService(object):
          timedelta(days=self._FRESH_DATA_THRESHOLD_DAYS))):
       g_log.info("Dropping stale result batch from model=%s; first=%s; last=%s",
                  metricId, batch["results"][0], lastRow)
-      return
+      return False
 
     instanceName = batch["metric"]["resource"]
 
@@ -449,21 +671,22 @@ class DynamoDBService(object):
     if not metricType:
       g_log.warning("Missing value for metricType, uid=%s, name=%s",
                     metricId, metricName)
-      return
+      return False
 
     if not metricTypeName:
       g_log.warning("Missing value for metricTypeName, uid=%s, name=%s",
                     metricId, metricName)
-      return
+      return False
 
     if not symbol:
       g_log.warning("Missing value for symbol, uid=%s, name=%s",
                     metricId, metricName)
-      return
+      return False
 
     self._publishMetricData(metricId, batch["results"])
     self._publishInstanceDataHourly(instanceName, metricType,
                                     batch["results"])
+    return True
 
 
   def _handleNonMetricTweetData(self, body):
@@ -558,7 +781,12 @@ class DynamoDBService(object):
       dataType = (message.properties.headers.get("dataType")
                   if message.properties.headers else None)
       if not dataType:
-        self._handleModelInferenceResults(message.body)
+        if self._handleModelInferenceResults(message.body):
+          # Ack the message after its instance_data_hourly scores are flushed
+          if not self._unackedMessages:
+            self._oldestUnackedMessageTime = time.time()
+          self._unackedMessages.append(message)
+          return
       elif dataType == "model-cmd-result":
         self._handleModelCommandResult(message.body)
       else:
@@ -637,6 +865,14 @@ class DynamoDBService(object):
           else:
             g_log.warning("Unexpected amqp event=%r", evt)
 
+          # Flush the aggregated instance_data_hourly scores before waiting for
+          # more messages, or if they are due
+          if self._unackedMessages and (
+              not amqpClient.hasEvent() or
+              (time.time() - self._oldestUnackedMessageTime >=
+               self._instanceDataHourlyFlushIntervalSec)):
+            self._flushInstanceDataHourly()
+
     except amqp.exceptions.AmqpConnectionError:
       g_log.exception("RabbitMQ connection failed")
       raise
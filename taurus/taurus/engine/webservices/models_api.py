@@ -19,12 +19,9 @@
 # http://numenta.org/licenses/
 # ----------------------------------------------------------------------
 # pylint: disable=C0103,W1401
-import calendar
-from collections import defaultdict
-import itertools
+import functools
 import json
 import math
-import msgpack
 import re
 import urlparse
 from validictory import validate, ValidationError
@@ -32,6 +29,7 @@ import web
 
 from htmengine import utils
 from htmengine.adapters.datasource import createDatasourceAdapter
+from htmengine.utils import metric_data_encoders
 import htmengine.exceptions as app_exceptions
 
 from taurus.engine import config, repository, taurus_logging
@@ -425,7 +423,7 @@ class MetricDataHandler(AuthenticatedBaseHandler):
 
     Parameters:
 
-      :param limit: (optional) max number of records to return
+      :param limit: (optional) max number of records to return per model
       :type limit: int
       :param from: (optional) return records from this timestamp
       :type from: timestamp
@@ -434,6 +432,10 @@ class MetricDataHandler(AuthenticatedBaseHandler):
       :param anomaly: anomaly score to filter
       :type anomaly: float
 
+    Records are in ascending timestamp order if `from` is given, otherwise in
+    descending timestamp order. The response is streamed in chunks of records
+    as they are read from the database.
+
     Returns:
 
     ::
@@ -452,6 +454,20 @@ class MetricDataHandler(AuthenticatedBaseHandler):
                 "rowid
             ]
         }
+
+    Without a model id, records are grouped by model:
+    ``{"metrics": [{"uid": ..., "data": [...]}, ...], "names": [...]}``
+
+    With "Accept: application/octet-stream", returns a stream of msgpack
+    arrays: ``["names", "uid", "timestamp", "value", "anomaly_score",
+    "rowid"]`` followed by one array per record, with epoch timestamps.
+
+    With "Accept: application/x-msgpack-columnar", returns a stream of msgpack
+    arrays: the same names header followed by columnar frames of records of a
+    single model: ``[uid, timestamps, values, anomaly_scores, rowids]``, where
+    the columns are raw strings holding little-endian arrays of int64 epoch
+    timestamps, float64 values, float64 anomaly scores (NaN if null) and int64
+    rowids.
     """
     queryParams = dict(urlparse.parse_qsl(web.ctx.env['QUERY_STRING']))
     fromTimestamp = queryParams.get("from")
@@ -459,84 +475,38 @@ class MetricDataHandler(AuthenticatedBaseHandler):
     anomaly = float(queryParams.get("anomaly") or 0.0)
     limit = int(queryParams.get("limit") or 0)
 
-    with web.ctx.connFactory() as conn:
-      fields = (schema.metric_data.c.uid,
-                schema.metric_data.c.timestamp,
-                schema.metric_data.c.metric_value,
-                schema.metric_data.c.anomaly_score,
-                schema.metric_data.c.rowid)
-      names = ("names",) + tuple(["value" if col.name == "metric_value"
-                                  else col.name
-                                  for col in fields])
-      if fromTimestamp:
-        sort = schema.metric_data.c.timestamp.asc()
-      else:
-        sort = schema.metric_data.c.timestamp.desc()
-
-      result = repository.getMetricData(conn,
-                                        metricId=metricId,
-                                        fields=fields,
-                                        fromTimestamp=fromTimestamp,
-                                        toTimestamp=toTimestamp,
-                                        score=anomaly,
-                                        sort=sort)
-
-    if "application/octet-stream" in web.ctx.env.get('HTTP_ACCEPT', ""):
-      results_per_uid = defaultdict(int)
-      packer = msgpack.Packer()
+    accept = web.ctx.env.get('HTTP_ACCEPT', "")
+    if metric_data_encoders.COLUMNAR_MSGPACK_CONTENT_TYPE in accept:
+      self.addStandardHeaders(
+        content_type=metric_data_encoders.COLUMNAR_MSGPACK_CONTENT_TYPE)
+      web.header('X-Accel-Buffering', 'no')
+      encode = metric_data_encoders.encodeMsgpackColumns
+    elif "application/octet-stream" in accept:
       self.addStandardHeaders(content_type='application/octet-stream')
       web.header('X-Accel-Buffering', 'no')
-
-      yield packer.pack(names)
-      for row in result:
-        if not limit or (limit and len(results_per_uid[row.uid]) < limit):
-          resultTuple = (
-              row.uid,
-              calendar.timegm(row.timestamp.timetuple()),
-              row.metric_value,
-              row.anomaly_score,
-              row.rowid,
-            )
-          yield packer.pack(resultTuple)
-          results_per_uid[row.uid] += 1
+      encode = metric_data_encoders.encodeMsgpackRows
     else:
-
-      if metricId is None:
-        output = {}
-        for row in result:
-          uid = row.uid
-          default = {"uid": uid, "data": []}
-          recordTuple = (
-            row.timestamp.strftime("%Y-%m-%d %H:%M:%S"),
-            row.metric_value,
-            row.anomaly_score,
-            row.rowid
-          )
-          metricDataRecord = output.setdefault(uid, default)
-          if not limit or (limit and len(metricDataRecord["data"]) < limit):
-            metricDataRecord["data"].append(recordTuple)
-
-        results = {
-          "metrics":  output.values(),
-          "names": names[2:]
-        }
-
-      else:
-        if limit:
-          results = {"names": names[2:],
-                     "data": [(row.timestamp.strftime("%Y-%m-%d %H:%M:%S"),
-                               row.metric_value,
-                               row.anomaly_score,
-                               row.rowid)
-                              for row in itertools.islice(result, 0, limit)]}
-        else:
-          results = {"names": names[2:],
-                     "data": [(row.timestamp.strftime("%Y-%m-%d %H:%M:%S"),
-                               row.metric_value,
-                               row.anomaly_score,
-                               row.rowid) for row in result]}
       self.addStandardHeaders()
-      yield utils.jsonEncode(results)
+      encode = functools.partial(metric_data_encoders.encodeJSON,
+                                 multiMetric=metricId is None)
+
+    with web.ctx.connFactory() as conn:
+      chunks = repository.getMetricDataChunks(
+        conn,
+        metricId=metricId,
+        fields=(schema.metric_data.c.uid,
+                schema.metric_data.c.timestamp,
+                schema.metric_data.c.metric_value,
+                schema.metric_data.c.anomaly_score,
+                schema.metric_data.c.rowid),
+        fromTimestamp=fromTimestamp,
+        toTimestamp=toTimestamp,
+        score=anomaly,
+        descending=not fromTimestamp,
+        limit=limit or None)
+
+      for piece in encode(chunks):
+        yield piece
 
 
 
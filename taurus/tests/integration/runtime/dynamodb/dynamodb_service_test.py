@@ -315,6 +315,62 @@ class DynamoDBServiceTest(TestCaseBase):
       self.fail("Metric not deleted from dynamodb")
 
 
+  def testInstanceDataHourlyWriteBehind(self):
+    """ Test coalesced instance_data_hourly updates of DynamoDBService
+    instances, including concurrent updates of the same item, against the
+    configured DynamoDB (e.g., the DynamoDB Local test tool)
+    """
+    instanceName = "TEST." + "".join(random.sample(string.ascii_letters, 16))
+    hour = datetime.datetime.utcnow().replace(minute=0, second=0,
+                                              microsecond=0)
+    ts = epochFromNaiveUTCDatetime(hour)
+
+    service = DynamoDBService()
+    otherService = DynamoDBService()
+
+    instanceDataHourlyTable = Table(
+      InstanceDataHourlyDynamoDBDefinition().tableName,
+      connection=DynamoDBService.connectDynamoDB())
+
+    def getAnomalyScores():
+      item = instanceDataHourlyTable.lookup(instanceName,
+                                            hour.strftime("%Y-%m-%dT%H"),
+                                            consistent=True)
+      return dict((metricType, float(score))
+                  for metricType, score in item["anomaly_score"].iteritems())
+
+    # Creates the item with both metric types
+    service._publishInstanceDataHourly(
+      instanceName, "StockPrice", [dict(ts=ts, anomaly=0.25),
+                                   dict(ts=ts + 300, anomaly=0.5)])
+    service._publishInstanceDataHourly(
+      instanceName, "StockVolume", [dict(ts=ts, anomaly=0.25)])
+    service._flushInstanceDataHourly()
+
+    self.addCleanup(
+      instanceDataHourlyTable.delete_item,
+      instance_id=instanceName, date_hour=hour.strftime("%Y-%m-%dT%H"))
+
+    self.assertEqual(getAnomalyScores(),
+                     {"StockPrice": 0.5, "StockVolume": 0.25})
+
+    # Another service raises one score of the item
+    otherService._publishInstanceDataHourly(
+      instanceName, "StockPrice", [dict(ts=ts + 600, anomaly=0.875)])
+    otherService._flushInstanceDataHourly()
+
+    # A combined update with a lower score of that metric type still raises
+    # the other score
+    service._publishInstanceDataHourly(
+      instanceName, "StockPrice", [dict(ts=ts + 900, anomaly=0.75)])
+    service._publishInstanceDataHourly(
+      instanceName, "StockVolume", [dict(ts=ts + 900, anomaly=0.625)])
+    service._flushInstanceDataHourly()
+
+    self.assertEqual(getAnomalyScores(),
+                     {"StockPrice": 0.875, "StockVolume": 0.625})
+
+
 
 def setUpModule():
   logging_support.LoggingSupport.initTestApp()
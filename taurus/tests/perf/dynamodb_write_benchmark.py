@@ -0,0 +1,258 @@
+#!/usr/bin/env python
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2015, Numenta, Inc.  Unless you have purchased from
+# Numenta, Inc. a separate commercial license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+
+"""
+Count the DynamoDB write calls per 1k model inference results of
+DynamoDBService with write-behind instance_data_hourly updates, which are
+coalesced across the batches of up to --prefetch messages, versus updating
+instance_data_hourly per message as DynamoDBService originally did.
+
+Each message carries one result of one metric, as the model results of
+real-time data do; the metrics are the --metric-types metric types of each of
+--instances instances, reporting every 5 minutes.
+
+By default, runs against an in-memory DynamoDB stand-in; with --dynamodb, runs
+against the DynamoDB configured in the application's [dynamodb] config (e.g.,
+the DynamoDB Local test tool).
+
+Usage:
+  APPLICATION_CONFIG_PATH=<conf dir> python dynamodb_write_benchmark.py \
+    --results=1000 --instances=20 --metric-types=3 --prefetch=50
+"""
+
+import argparse
+from collections import Counter
+from datetime import datetime
+from decimal import Decimal
+import random
+import re
+import threading
+import time
+
+from boto.dynamodb2.exceptions import (ConditionalCheckFailedException,
+                                       ValidationException)
+
+from nta.utils.date_time_utils import epochFromNaiveUTCDatetime
+
+from taurus.engine.runtime.dynamodb.dynamodb_service import DynamoDBService
+
+
+
+_METRIC_TYPES = ("StockPrice", "StockVolume", "TwitterVolume", "NewsVolume")
+
+_WRITE_CALLS = ("update_item", "put_item", "batch_write_item")
+
+
+
+def _parseArgs():
+  parser = argparse.ArgumentParser(description=__doc__)
+  parser.add_argument("--results", type=int, default=1000, dest="numResults",
+                      help="Number of model inference results")
+  parser.add_argument("--instances", type=int, default=20,
+                      dest="numInstances")
+  parser.add_argument("--metric-types", type=int, default=3,
+                      choices=range(1, len(_METRIC_TYPES) + 1),
+                      dest="numMetricTypes",
+                      help="Number of metric types per instance")
+  parser.add_argument("--prefetch", type=int, default=50,
+                      help="Number of messages per flush of write-behind "
+                           "instance_data_hourly updates")
+  parser.add_argument("--dynamodb", action="store_true",
+                      help="Use the configured DynamoDB instead of the "
+                           "in-memory stand-in")
+  return parser.parse_args()
+
+
+
+class _DynamoDBStandIn(object):
+  """ In-memory stand-in for the instance_data_hourly updates and batch writes
+  of DynamoDBService, with the conditional semantics of DynamoDB
+  """
+
+  _ASSIGNMENT_REGEX = re.compile(r"anomaly_score\.(\w+) = (:\w+)")
+
+
+  def __init__(self):
+    # (table name, instance_id, date_hour) -> {metricType: Decimal score}
+    self._items = dict()
+
+
+  def create_table(self, **_kwargs): # pylint: disable=C0103
+    return dict()
+
+
+  def batch_write_item(self, _requestItems): # pylint: disable=C0103
+    return dict()
+
+
+  def update_item(self, tableName, key, update_expression,
+                  condition_expression, expression_attribute_values):
+    # pylint: disable=W0613
+    scores = self._items.get((tableName, key["instance_id"]["S"],
+                              key["date_hour"]["S"]))
+    if scores is None:
+      raise ValidationException(
+        400, "The document path provided in the update expression is invalid "
+        "for update")
+
+    assignments = [
+      (metricType, Decimal(expression_attribute_values[value]["N"]))
+      for metricType, value in self._ASSIGNMENT_REGEX.findall(
+        update_expression)]
+
+    for metricType, score in assignments:
+      if metricType in scores and not scores[metricType] < score:
+        raise ConditionalCheckFailedException(400,
+                                              "The conditional request failed")
+
+    scores.update(assignments)
+
+
+  def put_item(self, tableName, item, condition_expression):
+    # pylint: disable=W0613
+    key = (tableName, item["instance_id"]["S"], item["date_hour"]["S"])
+    if key in self._items:
+      raise ConditionalCheckFailedException(400,
+                                            "The conditional request failed")
+
+    self._items[key] = dict(
+      (metricType, Decimal(score["N"]))
+      for metricType, score in item["anomaly_score"]["M"].iteritems())
+
+
+
+class _WriteCallCounter(object):
+  """ Proxy of a DynamoDB connection that counts its write calls """
+
+  def __init__(self, connection):
+    self._connection = connection
+    self._lock = threading.Lock()
+    self.counts = Counter()
+
+
+  def __getattr__(self, name):
+    attr = getattr(self._connection, name)
+    if name not in _WRITE_CALLS:
+      return attr
+
+    def countedCall(*args, **kwargs):
+      with self._lock:
+        self.counts[name] += 1
+      return attr(*args, **kwargs)
+
+    return countedCall
+
+
+
+def _generateMessages(args):
+  """
+  :returns: list of (instanceName, metricType, rows) of single-result messages
+    in order of their results' timestamps
+  """
+  rng = random.Random(42)
+  startTs = epochFromNaiveUTCDatetime(
+    datetime.utcnow().replace(minute=0, second=0, microsecond=0))
+
+  metrics = [("BENCHMARK%d" % (i,), metricType)
+             for i in xrange(args.numInstances)
+             for metricType in _METRIC_TYPES[:args.numMetricTypes]]
+
+  return [(instanceName, metricType,
+           [dict(rowid=i // len(metrics) + 1,
+                 ts=startTs + 300 * (i // len(metrics)),
+                 value=rng.uniform(0, 1000),
+                 rawAnomaly=rng.random(),
+                 anomaly=rng.betavariate(0.5, 5))])
+          for i, (instanceName, metricType) in enumerate(
+            metrics[i % len(metrics)] for i in xrange(args.numResults))]
+
+
+
+def _makeService(connection):
+  class BenchmarkDynamoDBService(DynamoDBService):
+    @staticmethod
+    def connectDynamoDB():
+      return connection
+
+  return BenchmarkDynamoDBService()
+
+
+
+def _publishPerMessage(service, messages, _args):
+  """ DynamoDBService's original publishing, which updated instance_data_hourly
+  items for each message
+  """
+  for instanceName, metricType, rows in messages:
+    service._publishMetricData(instanceName, rows)
+    hour = datetime.utcfromtimestamp(rows[0]["ts"]).replace(minute=0,
+                                                            second=0,
+                                                            microsecond=0)
+    service._updateInstanceDataHourlyItem(instanceName, hour,
+                                          {metricType: rows[0]["anomaly"]})
+
+
+
+def _publishWriteBehind(service, messages, args):
+  for i, (instanceName, metricType, rows) in enumerate(messages, 1):
+    service._publishMetricData(instanceName, rows)
+    service._publishInstanceDataHourly(instanceName, metricType, rows)
+    if i % args.prefetch == 0 or i == len(messages):
+      service._flushInstanceDataHourly()
+
+
+
+def main():
+  args = _parseArgs()
+
+  messages = _generateMessages(args)
+
+  for label, publish in (("per-message", _publishPerMessage),
+                         ("write-behind", _publishWriteBehind)):
+    if args.dynamodb:
+      connection = _WriteCallCounter(DynamoDBService.connectDynamoDB())
+    else:
+      connection = _WriteCallCounter(_DynamoDBStandIn())
+
+    service = _makeService(connection)
+    connection.counts.clear()
+
+    startTime = time.time()
+    publish(service, messages, args)
+    elapsed = time.time() - startTime
+
+    perKResults = dict((name, connection.counts[name] * 1000.0 /
+                               args.numResults)
+                       for name in _WRITE_CALLS)
+
+    print ("results=%-6d instances=%-4d metricTypes=%d prefetch=%-4d %-12s "
+           "writeCallsPer1kResults=%7.1f (update_item=%.1f put_item=%.1f "
+           "batch_write_item=%.1f) %.2fs") % (
+             args.numResults, args.numInstances, args.numMetricTypes,
+             args.prefetch, label, sum(perKResults.values()),
+             perKResults["update_item"], perKResults["put_item"],
+             perKResults["batch_write_item"], elapsed)
+
+
+
+if __name__ == "__main__":
+  main()
@@ -479,6 +479,8 @@ class DynamoDBServiceTestCase(unittest.TestCase):
 
     # Run the function under test
     service._publishInstanceDataHourly(instanceName, "TwitterVolume", rows)
+    self.assertEqual(connectionMock.update_item.call_count, 0)
+    service._flushInstanceDataHourly()
 
     # Validate results
     self.assertEqual(connectionMock.update_item.call_count, 2)
@@ -506,5 +508,197 @@ class DynamoDBServiceTestCase(unittest.TestCase):
     self.assertEqual(kwargs1["condition_expression"], condition)
 
 
+  def testPublishInstanceDataHourlyCoalescesMetricTypes(
+      self, connectDynamoDB, _gracefulCreateTable):
+    connectionMock = Mock(spec_set=DynamoDBConnection)
+    connectDynamoDB.return_value = connectionMock
+    ts = epochFromNaiveUTCDatetime(datetime(2015, 2, 20, 0, 46, 28))
+
+    service = DynamoDBService()
+    service._publishInstanceDataHourly(
+      "testName", "StockPrice", [dict(ts=ts, anomaly=0.5)])
+    service._publishInstanceDataHourly(
+      "testName", "StockVolume", [dict(ts=ts, anomaly=0.25)])
+    service._publishInstanceDataHourly(
+      "testName", "StockPrice", [dict(ts=ts + 300, anomaly=0.75)])
+    service._flushInstanceDataHourly()
+
+    connectionMock.update_item.assert_called_once_with(
+      InstanceDataHourlyDynamoDBDefinition().tableName,
+      key={"instance_id": {"S": "testName"},
+           "date_hour": {"S": "2015-02-20T00"}},
+      update_expression=("SET anomaly_score.StockPrice = :value0, "
+                         "anomaly_score.StockVolume = :value1"),
+      condition_expression=(
+        "(attribute_not_exists(anomaly_score.StockPrice) or "
+        "anomaly_score.StockPrice < :value0) and "
+        "(attribute_not_exists(anomaly_score.StockVolume) or "
+        "anomaly_score.StockVolume < :value1)"),
+      expression_attribute_values={":value0": {"N": "0.75"},
+                                   ":value1": {"N": "0.25"}})
+    self.assertEqual(connectionMock.put_item.call_count, 0)
+
+    # Scores that don't exceed the written ones aren't written again
+    connectionMock.update_item.reset_mock()
+    service._publishInstanceDataHourly(
+      "testName", "StockPrice", [dict(ts=ts + 600, anomaly=0.5)])
+    service._flushInstanceDataHourly()
+    self.assertEqual(connectionMock.update_item.call_count, 0)
+
+    service._publishInstanceDataHourly(
+      "testName", "StockVolume", [dict(ts=ts + 600, anomaly=0.5)])
+    service._flushInstanceDataHourly()
+    connectionMock.update_item.assert_called_once_with(
+      ANY, key=ANY, update_expression="SET anomaly_score.StockVolume = :value0",
+      condition_expression=ANY,
+      expression_attribute_values={":value0": {"N": "0.5"}})
+
+
+  def testPublishInstanceDataHourlyFallsBackToUpdatePerMetricType(
+      self, connectDynamoDB, _gracefulCreateTable):
+    connectionMock = Mock(spec_set=DynamoDBConnection)
+    connectionMock.update_item.side_effect = [
+      dynamodb_service.ConditionalCheckFailedException(400, "check failed"),
+      None,
+      dynamodb_service.ConditionalCheckFailedException(400, "check failed")]
+    connectDynamoDB.return_value = connectionMock
+    ts = epochFromNaiveUTCDatetime(datetime(2015, 2, 20, 0, 46, 28))
+
+    service = DynamoDBService()
+    service._publishInstanceDataHourly(
+      "testName", "StockPrice", [dict(ts=ts, anomaly=0.5)])
+    service._publishInstanceDataHourly(
+      "testName", "StockVolume", [dict(ts=ts, anomaly=0.25)])
+    service._flushInstanceDataHourly()
+
+    self.assertEqual(connectionMock.update_item.call_count, 3)
+    self.assertItemsEqual(
+      [kwargs["update_expression"]
+       for _, kwargs in connectionMock.update_item.call_args_list[1:]],
+      ["SET anomaly_score.StockPrice = :value0",
+       "SET anomaly_score.StockVolume = :value0"])
+    self.assertEqual(connectionMock.put_item.call_count, 0)
+
+
+  @patch.object(AnomalyService, "deserializeModelResult",
+                spec_set=AnomalyService.deserializeModelResult)
+  def testMessageHandlerDefersAckUntilInstanceDataHourlyFlush(
+      self, deserializeModelResult, connectDynamoDB, _gracefulCreateTable):
+    connectDynamoDB.return_value = Mock(spec_set=DynamoDBConnection)
+
+    deserializeModelResult.return_value = dict(
+      metric=dict(
+        uid="3b035a5916994f2bb950f5717138f94b",
+        name="XIGNITE.AGN.VOLUME",
+        resource="Resource-of-XIGNITE.AGN.VOLUME",
+        spec=dict(
+          userInfo=dict(
+            symbol="AGN",
+            metricType="StockVolume",
+            metricTypeName="Stock Volume"
+          )
+        )
+      ),
+      results=[dict(rowid=4790, ts=int(time.time()), value=9305.0,
+                    rawAnomaly=0.775, anomaly=0.999840891)]
+    )
+
+    messages = [
+      amqp.messages.ConsumerMessage(
+        body=Mock(),
+        properties=Mock(headers=dict()),
+        methodInfo=amqp.messages.MessageDeliveryInfo(consumerTag=Mock(),
+                                                     deliveryTag=i,
+                                                     redelivered=False,
+                                                     exchange=Mock(),
+                                                     routingKey=""),
+        ackImpl=Mock(),
+        nackImpl=Mock())
+      for i in xrange(1, 3)]
+
+    service = DynamoDBService()
+    for message in messages:
+      service.messageHandler(message)
+
+    for message in messages:
+      self.assertFalse(message._ackImpl.called)
+
+    service._flushInstanceDataHourly()
+
+    self.assertEqual(service.dynamodb.update_item.call_count, 1)
+    self.assertFalse(messages[0]._ackImpl.called)
+    messages[1]._ackImpl.assert_called_once_with(2, True)
+
+
+  @patch.object(dynamodb_service, "Table", autospec=True)
+  def testPublishMetricDataInParallelBatches(self, tableClassMock,
+                                             connectDynamoDB,
+                                             _gracefulCreateTable):
+    metricId = "3b035a5916994f2bb950f5717138f94b"
+    startTs = epochFromNaiveUTCDatetime(datetime(2015, 3, 20, 0, 0, 0))
+    rows = [dict(rowid=i, ts=startTs + 300 * i, value=float(i),
+                 rawAnomaly=0.5, anomaly=0.25)
+            for i in xrange(60)]
+
+    putItemMock = (tableClassMock.return_value.batch_write.return_value
+                   .__enter__.return_value.put_item)
+
+    service = DynamoDBService()
+    service._publishMetricData(metricId, rows)
+
+    self.assertEqual(
+      tableClassMock.return_value.batch_write.return_value.__enter__
+      .call_count, 3)
+    self.assertItemsEqual(
+      [kwargs["data"]["timestamp"]
+       for _, kwargs in putItemMock.call_args_list],
+      [dynamodb_service.convertInferenceResultRowToMetricDataItem(
+        metricId, row).timestamp
+       for row in rows])
+    self.assertFalse(service._metric_data.batch_write.called)
+
+
+
+class InstanceDataHourlyAggregatorTestCase(unittest.TestCase):
+
+
+  def testWrittenScoresOfExpiredHoursForgotten(self):
+    aggregator = dynamodb_service.InstanceDataHourlyAggregator()
+    retentionHours = aggregator._WRITTEN_SCORES_RETENTION_HOURS
+    hour0 = datetime(2015, 2, 20, 0)
+
+    aggregator.markWritten("a", hour0, dict(StockPrice=0.5))
+    aggregator.markWritten("b", hour0 + timedelta(hours=retentionHours),
+                           dict(StockPrice=0.5))
+
+    # Earlier hours within the retention window don't move it
+    aggregator.markWritten("a", hour0 + timedelta(hours=1),
+                           dict(StockPrice=0.25))
+    aggregator.markWritten("a", hour0 + timedelta(hours=1),
+                           dict(StockPrice=0.75))
+    self.assertEqual(
+      aggregator._writtenScores,
+      {("a", hour0): dict(StockPrice=0.5),
+       ("a", hour0 + timedelta(hours=1)): dict(StockPrice=0.75),
+       ("b", hour0 + timedelta(hours=retentionHours)): dict(StockPrice=0.5)})
+
+    # A later hour moves the retention window past hour0
+    aggregator.markWritten("b", hour0 + timedelta(hours=retentionHours + 1),
+                           dict(StockPrice=0.5))
+    self.assertNotIn(("a", hour0), aggregator._writtenScores)
+    self.assertEqual(len(aggregator._writtenScores), 3)
+
+    # Hours that already fell out of the window aren't remembered
+    aggregator.markWritten("c", hour0, dict(StockPrice=0.5))
+    self.assertNotIn(("c", hour0), aggregator._writtenScores)
+
+    # So their scores are written again
+    aggregator.add("c", "StockPrice",
+                   [dict(ts=epochFromNaiveUTCDatetime(hour0), anomaly=0.25)])
+    self.assertEqual(aggregator.popUpdates(),
+                     [("c", hour0, dict(StockPrice=0.25))])
+
+
+
 if __name__ == "__main__":
   unittest.main()
@@ -22,6 +22,44 @@
 
 """
 Implements Unicorn's model interface.
+
+By default, the model runner runs a single model: it reads one JSON
+[<timestamp>, <value>] input sample per line from stdin and writes one JSON
+[<rowIndex>, <anomalyProbability>] result per line to stdout.
+
+With --multi, the model runner hosts any number of models, addressed by
+modelId, and exchanges batches: each line on stdin is a JSON command object,
+and each command's result is written as one JSON line to stdout:
+
+  {"command": "createModel", "modelId": "1", "stats": {"min": 0, "max": 10},
+   "replaceParams": [["modelConfig/modelParams/spParams/spVerbosity", 1]]}
+    -> {"command": "createModel", "modelId": "1", "rowIndex": 0}
+
+  {"command": "run", "modelId": "1", "timestamps": [1438649711, ...],
+   "values": [835.93679, ...]}
+    -> {"command": "run", "modelId": "1", "rowIndex": <index of first row>,
+        "anomalyProbabilities": [0.0301029996658834, ...]}
+
+  {"command": "deleteModel", "modelId": "1"}
+    -> {"command": "deleteModel", "modelId": "1"}
+
+A command that fails results in {"command": ..., "modelId": ...,
+"errorText": ..., "diagnosticInfo": ...} without affecting the other models;
+so does a malformed command line, with null "command" and "modelId" if they
+can't be determined. A run command's rows are validated before any of them is
+fed to the model, so a rejected batch leaves the model's rowIndex unchanged.
+"replaceParams" is optional.
+
+Snapshots: with --snapshotDir, the model runner saves a snapshot of the OPF
+model, the anomaly likelihood state and the number of rows processed every
+--snapshotInterval rows and when stdin is closed. With --resume, it restores
+the model from the snapshot, if one exists, instead of creating a new one;
+the Front End feeds all of the rows again, and the model runner skips the
+rows that the snapshot already accounts for, so that only new rows are
+processed and their results keep their original rowIndex values. In --multi
+mode, createModel accepts the optional "snapshotDir", "snapshotInterval" and
+"resume" members, and its result includes the "rowIndex" of the next row
+that the model expects.
 """
 import os
 import sys
@@ -42,10 +80,12 @@ if _scriptIsFrozen():
   os.environ["PROJ_DIR"] = os.path.join(os.path.dirname(sys.executable),
                                         "pyproj", "data")
 
+import cPickle as pickle
 from datetime import datetime
 import json
 import logging
 from argparse import ArgumentParser
+import shutil
 import traceback
 
 import validictory
@@ -69,6 +109,16 @@ _REPLACE_PATH_SEPARATOR = "/" # Path separator between components in
                               # e.g. modelConfig/modelParams/clParams
 
 
+# Names of the OPF model checkpoint directory and the model runner state file
+# within a model snapshot directory
+_SNAPSHOT_MODEL_DIR_NAME = "model"
+_SNAPSHOT_STATE_FILE_NAME = "state.pickle"
+
+# Suffixes of the sibling directories used for replacing a snapshot directory
+_SNAPSHOT_TEMP_DIR_SUFFIX = ".tmp"
+_SNAPSHOT_OLD_DIR_SUFFIX = ".old"
+
+
 
 class _CommandLineArgError(Exception):
   """ Error parsing command-line options """
@@ -80,19 +130,32 @@ class _Options(object):
   """Options returned by _parseArgs"""
 
 
-  __slots__ = ("modelId", "stats", "replaceParams")
+  __slots__ = ("modelId", "stats", "replaceParams", "multiModel",
+               "snapshotDir", "snapshotInterval", "resume")
 
 
-  def __init__(self, modelId, stats, replaceParams):
+  def __init__(self, modelId, stats, replaceParams, multiModel=False,
+               snapshotDir=None, snapshotInterval=0, resume=False):
     """
-    :param str modelId: model identifier
+    :param str modelId: model identifier; None if multiModel
     :param dict stats: Metric data stats per stats_schema.json in the
-      unicorn_backend package
+      unicorn_backend package; None if multiModel
     :param sequence replaceParams: Parameter replacement PATH REPLACEMENT pairs
+    :param bool multiModel: True to host multiple models using the batched
+      command protocol
+    :param str snapshotDir: directory of the model snapshot; None to not save
+      snapshots
+    :param int snapshotInterval: number of rows between periodic snapshots; 0
+      to save a snapshot only when stdin is closed
+    :param bool resume: True to resume the model from its snapshot, if any
     """
     self.modelId = modelId
     self.stats = stats
     self.replaceParams = replaceParams
+    self.multiModel = multiModel
+    self.snapshotDir = snapshotDir
+    self.snapshotInterval = snapshotInterval
+    self.resume = resume
 
 
   @property
@@ -115,18 +178,25 @@ def _parseArgs():
       raise _CommandLineArgError(msg)
 
   parser = SilentArgumentParser(description=("Start Unicorn ModelRunner that "
-                                             "runs a single model."))
+                                             "runs a single model, or hosts "
+                                             "multiple models with --multi."))
 
   parser.add_argument("--model",
                       type=str,
                       dest="modelId",
-                      required=True,
-                      help="REQUIRED: Model id string")
+                      help="REQUIRED without --multi: Model id string")
 
   parser.add_argument("--stats",
                       type=str,
-                      required=True,
-                      help="REQUIRED: See unicorn_backend/stats_schema.json")
+                      help=("REQUIRED without --multi: See "
+                            "unicorn_backend/stats_schema.json"))
+
+  parser.add_argument("--multi",
+                      action="store_true",
+                      dest="multiModel",
+                      default=False,
+                      help=("Host multiple models, created and fed via the "
+                            "batched command protocol on stdin"))
 
   parser.add_argument("--replaceParam",
                       nargs=2,
@@ -154,14 +224,56 @@ def _parseArgs():
                         "are allowed, should you need to replace multiple "
                         "params."))
 
+  parser.add_argument("--snapshotDir",
+                      type=str,
+                      help=("Directory of the model snapshot, which is saved "
+                            "every --snapshotInterval rows and when stdin is "
+                            "closed"))
+
+  parser.add_argument("--snapshotInterval",
+                      type=int,
+                      default=0,
+                      help=("Number of rows between periodic model snapshots; "
+                            "0 (default) to save a snapshot only when stdin is "
+                            "closed"))
+
+  parser.add_argument("--resume",
+                      action="store_true",
+                      default=False,
+                      help=("Resume the model from the snapshot in "
+                            "--snapshotDir, if any, skipping the input rows "
+                            "that the snapshot accounts for"))
+
   options = parser.parse_args()
 
+  if options.snapshotInterval < 0:
+    parser.error("Negative --snapshotInterval option value")
+
+  if options.multiModel:
+    if (options.modelId is not None or options.stats is not None or
+        options.replaceParams or options.snapshotDir is not None or
+        options.snapshotInterval or options.resume):
+      parser.error("--model, --stats, --replaceParam, --snapshotDir, "
+                   "--snapshotInterval and --resume don't apply to --multi; "
+                   "pass them in createModel commands instead")
+
+    return _Options(modelId=None,
+                    stats=None,
+                    replaceParams=[],
+                    multiModel=True)
+
   if not options.modelId:
     parser.error("Missing or empty --modelId option value")
 
   if not options.stats:
     parser.error("Missing or empty --stats option value")
 
+  if options.resume and not options.snapshotDir:
+    parser.error("--resume requires --snapshotDir")
+
+  if options.snapshotInterval and not options.snapshotDir:
+    parser.error("--snapshotInterval requires --snapshotDir")
+
   try:
     stats = json.loads(options.stats)
   except ValueError:
@@ -171,25 +283,39 @@ def _parseArgs():
   replaceParams = [(path, json.loads(replacement))
                    for path, replacement in options.replaceParams]
 
-  # Path to stats schema file is different depending on whether or not the
-  # script is frozen. See http://stackoverflow.com/a/2632297
-  if _scriptIsFrozen():
-    modelRunnerDir = os.path.dirname(os.path.realpath(sys.executable))
-  else:
-    modelRunnerDir = os.path.dirname(os.path.realpath(__file__))
-
   try:
-    # Assume that stats_schema.json is in the same dir as this script.
-    statsSchemaFile = os.path.join(modelRunnerDir, "stats_schema.json")
-    with open(statsSchemaFile, "rb") as statsSchema:
-      validictory.validate(stats, json.load(statsSchema))
+    _validateStats(stats)
   except validictory.ValidationError as ex:
     parser.error("--stats option value failed schema validation: %r" % (ex,))
 
 
   return _Options(modelId=options.modelId,
                   stats=stats,
-                  replaceParams=replaceParams)
+                  replaceParams=replaceParams,
+                  snapshotDir=options.snapshotDir,
+                  snapshotInterval=options.snapshotInterval,
+                  resume=options.resume)
+
+
+
+def _validateStats(stats):
+  """ Validate metric data stats against stats_schema.json in the
+  unicorn_backend package
+
+  :param dict stats: Metric data stats
+  :raises validictory.ValidationError: if validation fails
+  """
+  # Path to stats schema file is different depending on whether or not the
+  # script is frozen. See http://stackoverflow.com/a/2632297
+  if _scriptIsFrozen():
+    modelRunnerDir = os.path.dirname(os.path.realpath(sys.executable))
+  else:
+    modelRunnerDir = os.path.dirname(os.path.realpath(__file__))
+
+  # Assume that stats_schema.json is in the same dir as this script.
+  statsSchemaFile = os.path.join(modelRunnerDir, "stats_schema.json")
+  with open(statsSchemaFile, "rb") as statsSchema:
+    validictory.validate(stats, json.load(statsSchema))
 
 
 
@@ -229,21 +355,52 @@ class _ModelRunner(object):
   )
 
 
-  def __init__(self, modelId, stats, replaceParams):
+  def __init__(self, modelId, stats, replaceParams=(), snapshotDir=None,
+               snapshotInterval=0, resume=False):
     """
     :param str modelId: model identifier
     :param dict stats: Metric data stats per stats_schema.json in the
       unicorn_backend package.
     :param sequence replaceParams: Parameter replacement PATH REPLACEMENT pairs
+    :param str snapshotDir: directory of the model snapshot; None to not save
+      snapshots
+    :param int snapshotInterval: number of rows between periodic snapshots; 0
+      to save snapshots only via saveSnapshot
+    :param bool resume: True to restore the model from the snapshot in
+      snapshotDir, if any, instead of creating a new one
+    :raises ValueError: if snapshotInterval or resume is given without
+      snapshotDir
     """
+    if (snapshotInterval or resume) and not snapshotDir:
+      raise ValueError("snapshotInterval and resume require snapshotDir")
+
     self._modelId = modelId
+    self._stats = stats
+    self._replaceParams = [list(pair) for pair in replaceParams]
+    self._snapshotDir = snapshotDir
+    self._snapshotInterval = snapshotInterval
 
     self._modelRecordEncoder = record_stream.ModelRecordEncoder(
       fields=self._INPUT_RECORD_SCHEMA)
 
-    self._model = self._createModel(stats=stats, replaceParams=replaceParams)
+    snapshotState = self._loadSnapshot() if resume else None
 
-    self._anomalyLikelihood = AnomalyLikelihood()
+    if snapshotState is not None:
+      self._model = snapshotState["model"]
+      self._anomalyLikelihood = snapshotState["anomalyLikelihood"]
+      self.numRows = snapshotState["numRows"]
+    else:
+      self._model = self._createModel(stats=stats,
+                                      replaceParams=replaceParams)
+      self._anomalyLikelihood = AnomalyLikelihood()
+      # Number of input rows processed so far
+      self.numRows = 0
+
+    # Value of numRows as of the latest snapshot
+    self._numRowsAtSnapshot = self.numRows
+
+    # Value of numRows as of the latest periodic snapshot attempt
+    self._numRowsAtSnapshotAttempt = self.numRows
 
 
   @classmethod
@@ -274,18 +431,135 @@ class _ModelRunner(object):
     return model
 
 
+  def _loadSnapshot(self):
+    """ Load the model snapshot from the snapshot directory
+
+    :returns: None if there is no snapshot; otherwise, dict with the restored
+      "model", "anomalyLikelihood" and "numRows"
+    :raises ValueError: if the snapshot was created with different stats or
+      replaceParams
+    """
+    snapshotDir = self._snapshotDir
+    if not os.path.isdir(snapshotDir):
+      # A previous saveSnapshot may have been interrupted while replacing the
+      # snapshot directory
+      snapshotDir = self._snapshotDir + _SNAPSHOT_OLD_DIR_SUFFIX
+      if not os.path.isdir(snapshotDir):
+        g_log.info("No snapshot of model=%s in %s; starting a new model",
+                   self._modelId, self._snapshotDir)
+        return None
+
+    with open(os.path.join(snapshotDir, _SNAPSHOT_STATE_FILE_NAME),
+              "rb") as stateFile:
+      state = pickle.load(stateFile)
+
+    if (state["stats"] != self._stats or
+        state["replaceParams"] != self._replaceParams):
+      raise ValueError(
+        "Snapshot of model=%s in %s was created with different stats=%r or "
+        "replaceParams=%r" % (self._modelId, snapshotDir, state["stats"],
+                              state["replaceParams"]))
+
+    state["model"] = ModelFactory.loadFromCheckpoint(
+      os.path.join(snapshotDir, _SNAPSHOT_MODEL_DIR_NAME))
+
+    g_log.info("Resumed model=%s from snapshot in %s; numRows=%d",
+               self._modelId, snapshotDir, state["numRows"])
+
+    return state
+
+
+  def saveSnapshot(self):
+    """ Save a snapshot of the OPF model, the anomaly likelihood state and the
+    number of rows processed to the snapshot directory.
+
+    NOTE: the snapshot is saved to a temporary sibling directory that then
+    replaces the snapshot directory, so that a failure while saving doesn't
+    corrupt the previous snapshot.
+    """
+    tempDir = self._snapshotDir + _SNAPSHOT_TEMP_DIR_SUFFIX
+    oldDir = self._snapshotDir + _SNAPSHOT_OLD_DIR_SUFFIX
+
+    if os.path.exists(tempDir):
+      shutil.rmtree(tempDir)
+    os.makedirs(tempDir)
+
+    self._model.save(
+      saveModelDir=os.path.join(tempDir, _SNAPSHOT_MODEL_DIR_NAME))
+
+    state = dict(stats=self._stats,
+                 replaceParams=self._replaceParams,
+                 anomalyLikelihood=self._anomalyLikelihood,
+                 numRows=self.numRows)
+    with open(os.path.join(tempDir, _SNAPSHOT_STATE_FILE_NAME),
+              "wb") as stateFile:
+      pickle.dump(state, stateFile, pickle.HIGHEST_PROTOCOL)
+
+    # NOTE: os.rename doesn't replace an existing directory on all platforms
+    if os.path.exists(self._snapshotDir):
+      if os.path.exists(oldDir):
+        shutil.rmtree(oldDir)
+      os.rename(self._snapshotDir, oldDir)
+
+    os.rename(tempDir, self._snapshotDir)
+
+    if os.path.exists(oldDir):
+      shutil.rmtree(oldDir)
+
+    self._numRowsAtSnapshot = self._numRowsAtSnapshotAttempt = self.numRows
+
+    g_log.info("Saved snapshot of model=%s in %s; numRows=%d",
+               self._modelId, self._snapshotDir, self.numRows)
+
+
+  def _saveSnapshotIfDue(self):
+    """ Save a snapshot if snapshotInterval rows were processed since the
+    latest attempt.
+
+    NOTE: failures are logged and otherwise ignored, so that they don't
+    interrupt row processing or discard results that the model already
+    computed; the next attempt is made after another snapshotInterval rows.
+    """
+    if (self._snapshotInterval and
+        self.numRows - self._numRowsAtSnapshotAttempt >=
+        self._snapshotInterval):
+      try:
+        self.saveSnapshot()
+      except Exception:  # pylint: disable=W0703
+        g_log.exception("Failed to save periodic snapshot of model=%s in %s; "
+                        "numRows=%d", self._modelId, self._snapshotDir,
+                        self.numRows)
+        self._numRowsAtSnapshotAttempt = self.numRows
+
+
+  def saveFinalSnapshot(self):
+    """ Save a snapshot upon clean shutdown if snapshots are enabled and rows
+    were processed since the latest one
+    """
+    if self._snapshotDir and self.numRows != self._numRowsAtSnapshot:
+      self.saveSnapshot()
+
+
   @classmethod
-  def _readInputMessages(cls):
+  def _readInputMessages(cls, numRowsToSkip=0):
     """Create a generator that waits for and yields input messages from
     stdin
 
     yields two-tuple (<timestamp>, <scalar-value>), where <timestamp> is the
     `datetime.datetime` timestamp of the metric data sample and <scalar-value>
     is the floating point value of the metric data sample.
+
+    :param int numRowsToSkip: number of leading input messages to discard
+      without parsing them; e.g., rows already accounted for by a resumed
+      snapshot
     """
     while True:
       message = sys.stdin.readline()
 
+      if numRowsToSkip and message:
+        numRowsToSkip -= 1
+        continue
+
       if message:
         timestamp, scalarValue = json.loads(message)
         yield (datetime.utcfromtimestamp(timestamp), scalarValue)
@@ -329,18 +603,227 @@ class _ModelRunner(object):
     return self._anomalyLikelihood.computeLogLikelihood(anomalyProbability)
 
 
+  def processBatch(self, timestamps, values):
+    """ Compute anomaly log likelihood scores of a batch of input rows
+
+    :param timestamps: epoch timestamps of the input rows
+    :param values: floating point values of the input rows
+
+    :returns: Log-scaled anomaly probabilities of the input rows
+    :rtype: list
+    :raises ValueError: if any of the input rows is invalid; the model isn't
+      fed any of the rows in that case
+    """
+    if len(timestamps) != len(values):
+      raise ValueError("Mismatched numbers of timestamps=%d and values=%d" % (
+        len(timestamps), len(values)))
+
+    # Convert the whole batch up front, so that an invalid row doesn't leave
+    # the model having consumed only part of the batch
+    inputRows = []
+    for i, (timestamp, value) in enumerate(zip(timestamps, values)):
+      try:
+        inputRows.append((datetime.utcfromtimestamp(timestamp), float(value)))
+      except (TypeError, ValueError) as ex:
+        raise ValueError("Invalid input row=%d of batch: timestamp=%r, "
+                         "value=%r (%s)" % (i, timestamp, value, ex))
+
+    anomalyProbabilities = []
+    for inputRow in inputRows:
+      anomalyProbabilities.append(self._computeAnomalyProbability(inputRow))
+      self.numRows += 1
+
+    self._saveSnapshotIfDue()
+
+    return anomalyProbabilities
+
+
   def run(self):
     """ Run the model: ingest and process the input metric data and emit output
     messages containing anomaly scores
     """
-    g_log.info("Processing model=%s", self._modelId)
+    g_log.info("Processing model=%s; skipping numRows=%d", self._modelId,
+               self.numRows)
 
-    for rowIndex, inputRow in enumerate(self._readInputMessages()):
+    for inputRow in self._readInputMessages(numRowsToSkip=self.numRows):
       anomalyProbability = self._computeAnomalyProbability(inputRow)
+      rowIndex = self.numRows
+      self.numRows += 1
 
       self._emitOutputMessage(rowIndex=rowIndex,
                               anomalyProbability=anomalyProbability)
 
+      self._saveSnapshotIfDue()
+
+    self.saveFinalSnapshot()
+
+
+
+class _MultiModelRunner(object):
+  """ Host multiple _ModelRunner models addressed by modelId; execute batched
+  commands from stdin and emit their results to stdout. See the module
+  docstring for the protocol.
+  """
+
+  def __init__(self):
+    # Hosted models: modelId -> _ModelRunner
+    self._models = dict()
+
+
+  @classmethod
+  def _readCommandMessages(cls):
+    """Create a generator that waits for and yields command messages from
+    stdin
+
+    yields command message lines
+    """
+    while True:
+      message = sys.stdin.readline()
+
+      if message:
+        yield message
+      else:
+        # Front End closed the pipe (or died)
+        break
+
+
+  @classmethod
+  def _parseCommand(cls, message):
+    """ Parse a command message line
+
+    :param str message: command message line
+    :returns: command dict
+    :raises ValueError: if the message isn't a JSON object
+    """
+    command = json.loads(message)
+    if not isinstance(command, dict):
+      raise ValueError("Command message is not a JSON object: %r" % (message,))
+
+    return command
+
+
+  @classmethod
+  def _emitOutputMessage(cls, result):
+    """Emit output message to stdout
+
+    :param dict result: command result
+    """
+    sys.stdout.write("%s\n" % (json.dumps(result),))
+    sys.stdout.flush()
+
+
+  def _createModel(self, modelId, stats, replaceParams=(), snapshotDir=None,
+                   snapshotInterval=0, resume=False):
+    if modelId in self._models:
+      raise ValueError("Model %s already exists" % (modelId,))
+
+    _validateStats(stats)
+
+    if resume and not snapshotDir:
+      raise ValueError("resume requires snapshotDir")
+
+    if snapshotInterval and not snapshotDir:
+      raise ValueError("snapshotInterval requires snapshotDir")
+
+    model = _ModelRunner(modelId=modelId,
+                         stats=stats,
+                         replaceParams=replaceParams,
+                         snapshotDir=snapshotDir,
+                         snapshotInterval=snapshotInterval,
+                         resume=resume)
+    self._models[modelId] = model
+
+    g_log.info("Created model=%s; numModels=%d", modelId, len(self._models))
+
+    return dict(rowIndex=model.numRows)
+
+
+  def _getModel(self, modelId):
+    try:
+      return self._models[modelId]
+    except KeyError:
+      raise ValueError("Unknown model %s" % (modelId,))
+
+
+  def _run(self, modelId, timestamps, values):
+    model = self._getModel(modelId)
+
+    rowIndex = model.numRows
+
+    return dict(rowIndex=rowIndex,
+                anomalyProbabilities=model.processBatch(timestamps, values))
+
+
+  def _deleteModel(self, modelId):
+    self._getModel(modelId)
+    del self._models[modelId]
+
+    g_log.info("Deleted model=%s; numModels=%d", modelId, len(self._models))
+
+    return dict()
+
+
+  def _executeCommand(self, message):
+    """ Execute a command
+
+    :param str message: command message line
+    :returns: result message; includes errorText and diagnosticInfo if the
+      command failed or the message is malformed
+    :rtype: dict
+    """
+    commandName = None
+    modelId = None
+
+    result = dict(command=commandName, modelId=modelId)
+
+    try:
+      command = self._parseCommand(message)
+
+      commandName = command.get("command")
+      modelId = command.get("modelId")
+      result.update(command=commandName, modelId=modelId)
+
+      if commandName == "createModel":
+        result.update(self._createModel(
+          modelId=modelId,
+          stats=command["stats"],
+          replaceParams=command.get("replaceParams", ()),
+          snapshotDir=command.get("snapshotDir"),
+          snapshotInterval=command.get("snapshotInterval", 0),
+          resume=command.get("resume", False)))
+      elif commandName == "run":
+        result.update(self._run(modelId=modelId,
+                                timestamps=command["timestamps"],
+                                values=command["values"]))
+      elif commandName == "deleteModel":
+        result.update(self._deleteModel(modelId=modelId))
+      else:
+        raise ValueError("Unknown command %r" % (commandName,))
+    except Exception as ex:  # pylint: disable=W0703
+      g_log.exception("Command=%s failed for model=%s", commandName, modelId)
+
+      result.update(errorText=str(ex) or repr(ex),
+                    diagnosticInfo=traceback.format_exc())
+
+    return result
+
+
+  def run(self):
+    """ Run the models: execute commands and emit their results until stdin is
+    closed
+    """
+    g_log.info("Hosting multiple models")
+
+    for message in self._readCommandMessages():
+      self._emitOutputMessage(self._executeCommand(message))
+
+    for modelId, model in self._models.iteritems():
+      # Don't let one model's failure prevent the others' snapshots
+      try:
+        model.saveFinalSnapshot()
+      except Exception:  # pylint: disable=W0703
+        g_log.exception("Failed to save final snapshot of model=%s", modelId)
+
 
 
 def main():
@@ -349,7 +832,17 @@ def main():
   g_log.addHandler(logging.NullHandler())
   try:
 
-    _ModelRunner(**vars(_parseArgs())).run()
+    options = _parseArgs()
+
+    if options.multiModel:
+      _MultiModelRunner().run()
+    else:
+      _ModelRunner(modelId=options.modelId,
+                   stats=options.stats,
+                   replaceParams=options.replaceParams,
+                   snapshotDir=options.snapshotDir,
+                   snapshotInterval=options.snapshotInterval,
+                   resume=options.resume).run()
 
   except Exception as ex:  # pylint: disable=W0703
     g_log.exception("ModelRunner failed")
@@ -23,8 +23,11 @@
 
 import json
 import logging
+import os
+import shutil
 import subprocess
 import sys
+import tempfile
 import time
 import types
 import unittest
@@ -49,12 +52,13 @@ class ModelRunnerTestCase(unittest.TestCase):
 
 
   @staticmethod
-  def _startModelRunnerSubprocess(modelId, stats):
+  def _startModelRunnerSubprocess(modelId, stats, extraArgs=()):
     """Start the unicorn model_runner subprocess
 
     :param str modelId: model identifier
     :param dict stats: Metric data stats per stats_schema.json in the
       unicorn_backend package
+    :param sequence extraArgs: additional command-line args
     :returns: the started subprocess.Popen object wrapped in
       ManagedSubprocessTerminator
     :rtype: nta.utils.test_utils.ManagedSubprocessTerminator
@@ -63,7 +67,28 @@ class ModelRunnerTestCase(unittest.TestCase):
       args=[sys.executable,
             "-m", "unicorn_backend.model_runner",
             "--model=%s" % modelId,
-            "--stats=%s" % (json.dumps(stats),)],
+            "--stats=%s" % (json.dumps(stats),)] + list(extraArgs),
+      stdin=subprocess.PIPE,
+      stdout=subprocess.PIPE,
+      stderr=subprocess.PIPE,
+      close_fds=True)
+
+    _LOGGER.info("Started unicorn model_runner subprocess=%s", process)
+    return test_utils.ManagedSubprocessTerminator(process)
+
+
+  @staticmethod
+  def _startMultiModelRunnerSubprocess():
+    """Start the unicorn model_runner subprocess in multi-model mode
+
+    :returns: the started subprocess.Popen object wrapped in
+      ManagedSubprocessTerminator
+    :rtype: nta.utils.test_utils.ManagedSubprocessTerminator
+    """
+    process = subprocess.Popen(
+      args=[sys.executable,
+            "-m", "unicorn_backend.model_runner",
+            "--multi"],
       stdin=subprocess.PIPE,
       stdout=subprocess.PIPE,
       stderr=subprocess.PIPE,
@@ -208,3 +233,83 @@ class ModelRunnerTestCase(unittest.TestCase):
       self.assertEqual(stderrData, "")
 
       self.assertEqual(mrProcess.returncode, 0)
+
+
+  def testResumeFromSnapshot(self):
+    modelId = uuid.uuid1().hex
+    stats = {"min": 0, "max": 100}
+
+    tempDir = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, tempDir)
+    snapshotDir = os.path.join(tempDir, "snapshot")
+
+    inputRecords = [[time.time() + i, i + 0.599] for i in xrange(15)]
+
+    def feedInput(records, extraArgs):
+      with self._startModelRunnerSubprocess(
+          modelId, stats,
+          extraArgs=["--snapshotDir=%s" % (snapshotDir,)] + extraArgs
+      ) as mrProcess:
+        stdoutData, stderrData = mrProcess.communicate(
+          input="".join("%s\n" % (json.dumps(rec),) for rec in records))
+
+        self.assertEqual(stderrData, "")
+        self.assertEqual(mrProcess.returncode, 0)
+
+        return [json.loads(line) for line in stdoutData.splitlines()]
+
+    # The snapshot is saved upon clean shutdown
+    outputRecords = feedInput(inputRecords[:10], ["--snapshotInterval=4"])
+    self.assertEqual([rowIndex for rowIndex, _ in outputRecords], range(10))
+    self.assertTrue(os.path.isdir(snapshotDir))
+
+    # Only the new rows are processed upon resume
+    outputRecords = feedInput(inputRecords, ["--resume"])
+    self.assertEqual([rowIndex for rowIndex, _ in outputRecords],
+                     range(10, 15))
+    for _, anomalyLikelihood in outputRecords:
+      self.assertIsInstance(anomalyLikelihood, float)
+
+
+  def testMultiModelFeedBatchesGetOutput(self):
+    stats = {"min": 0, "max": 100}
+    modelIds = [uuid.uuid1().hex for _ in xrange(2)]
+
+    timestamps = [time.time() + i for i in xrange(10)]
+    values = [i + 0.599 for i in xrange(10)]
+
+    with self._startMultiModelRunnerSubprocess() as mrProcess:
+      def executeCommand(**command):
+        mrProcess.stdin.write("%s\n" % (json.dumps(command),))
+        mrProcess.stdin.flush()
+
+        result = json.loads(mrProcess.stdout.readline())
+        self.assertNotIn("errorText", result)
+        self.assertEqual(result["command"], command["command"])
+        self.assertEqual(result["modelId"], command["modelId"])
+        return result
+
+      for modelId in modelIds:
+        executeCommand(command="createModel", modelId=modelId, stats=stats)
+
+      for modelId in modelIds:
+        for i in xrange(0, len(timestamps), 5):
+          result = executeCommand(command="run", modelId=modelId,
+                                  timestamps=timestamps[i:i + 5],
+                                  values=values[i:i + 5])
+
+          self.assertEqual(result["rowIndex"], i)
+          self.assertEqual(len(result["anomalyProbabilities"]), 5)
+          for anomalyLikelihood in result["anomalyProbabilities"]:
+            self.assertIsInstance(anomalyLikelihood, float)
+
+      for modelId in modelIds:
+        executeCommand(command="deleteModel", modelId=modelId)
+
+      # Close the subprocess's stdin and wait for it to terminate
+      mrProcess.stdin.close()
+      mrProcess.wait()
+
+      self.assertEqual(mrProcess.stdout.read(), "")
+      self.assertEqual(mrProcess.stderr.read(), "")
+      self.assertEqual(mrProcess.returncode, 0)
@@ -0,0 +1,188 @@
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2015, Numenta, Inc.  Unless you have purchased from
+# Numenta, Inc. a separate commercial license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+
+"""
+Measure the throughput (rows/sec) of unicorn model_runner processing
+mock_data_generator-style input for one or more models, comparing one
+single-model runner process per model, fed one JSON row per line, with one
+--multi runner process hosting all of the models, fed batches of rows.
+Verifies that both produce the same anomaly probabilities.
+
+Usage:
+  python model_runner_benchmark.py --rows=100000 --models=1 --batch-size=1000
+"""
+
+import argparse
+import json
+import subprocess
+import sys
+import threading
+import time
+
+
+
+_STATS = {"min": 0, "max": 1000}
+
+
+
+def _parseArgs():
+  parser = argparse.ArgumentParser(description=__doc__)
+  parser.add_argument("--rows", type=int, default=100000, dest="numRows",
+                      help="Total number of input rows across all models")
+  parser.add_argument("--models", type=int, default=1, dest="numModels",
+                      help="Number of models")
+  parser.add_argument("--batch-size", type=int, default=1000,
+                      dest="batchSize",
+                      help="Number of rows per run command with --multi")
+  return parser.parse_args()
+
+
+
+def _generateRows(numRows):
+  """ mock_data_generator's sample with consecutive 5-minute timestamps """
+  return [(1438649711 + 300 * i, 835.93679) for i in xrange(numRows)]
+
+
+
+def _startModelRunner(args):
+  return subprocess.Popen(
+    args=[sys.executable, "-m", "unicorn_backend.model_runner"] + args,
+    stdin=subprocess.PIPE,
+    stdout=subprocess.PIPE,
+    close_fds=True)
+
+
+
+def _writeInThread(process, messages):
+  """ Write messages to the process's stdin in a thread, so that its stdout
+  can be read concurrently
+  """
+  def write():
+    for message in messages:
+      process.stdin.write(message)
+    process.stdin.close()
+
+  thread = threading.Thread(target=write)
+  thread.setDaemon(True)
+  thread.start()
+  return thread
+
+
+
+def _runSingleModelProcesses(modelRows, args):
+  """ One single-model runner process per model
+
+  :returns: anomaly probabilities per model
+  """
+  processes = [
+    _startModelRunner(["--model=%d" % (i,), "--stats=%s" % json.dumps(_STATS)])
+    for i in xrange(args.numModels)]
+
+  writers = [
+    _writeInThread(process,
+                   ("%s\n" % (json.dumps(row),) for row in rows))
+    for process, rows in zip(processes, modelRows)]
+
+  results = []
+  for process in processes:
+    probabilities = []
+    for line in process.stdout:
+      _, anomalyProbability = json.loads(line)
+      probabilities.append(anomalyProbability)
+    results.append(probabilities)
+
+  for process, writer in zip(processes, writers):
+    writer.join()
+    if process.wait() != 0:
+      raise Exception("model_runner failed with returncode=%s" % (
+        process.returncode,))
+
+  return results
+
+
+
+def _runMultiModelProcess(modelRows, args):
+  """ One --multi runner process hosting all of the models
+
+  :returns: anomaly probabilities per model
+  """
+  process = _startModelRunner(["--multi"])
+
+  def generateCommands():
+    for modelId in xrange(args.numModels):
+      yield dict(command="createModel", modelId=modelId, stats=_STATS)
+
+    for i in xrange(0, max(len(rows) for rows in modelRows), args.batchSize):
+      for modelId, rows in enumerate(modelRows):
+        batch = rows[i:i + args.batchSize]
+        if batch:
+          timestamps, values = zip(*batch)
+          yield dict(command="run", modelId=modelId, timestamps=timestamps,
+                     values=values)
+
+  writer = _writeInThread(
+    process,
+    ("%s\n" % (json.dumps(command),) for command in generateCommands()))
+
+  results = [[] for _ in xrange(args.numModels)]
+  for line in process.stdout:
+    result = json.loads(line)
+    if "errorText" in result:
+      raise Exception("Command failed: %s" % (result,))
+
+    if result["command"] == "run":
+      results[result["modelId"]].extend(result["anomalyProbabilities"])
+
+  writer.join()
+  if process.wait() != 0:
+    raise Exception("model_runner failed with returncode=%s" % (
+      process.returncode,))
+
+  return results
+
+
+
+def main():
+  args = _parseArgs()
+
+  rowsPerModel = args.numRows // args.numModels
+  modelRows = [_generateRows(rowsPerModel) for _ in xrange(args.numModels)]
+
+  results = []
+  for label, runModels in (("single", _runSingleModelProcesses),
+                           ("multi", _runMultiModelProcess)):
+    startTime = time.time()
+    modelResults = runModels(modelRows, args)
+    elapsed = time.time() - startTime
+
+    results.append(modelResults)
+    print "rows=%-7d models=%-4d batchSize=%-5d %-7s %10.0f rows/s" % (
+      rowsPerModel * args.numModels, args.numModels, args.batchSize, label,
+      rowsPerModel * args.numModels / elapsed)
+
+  if results[0] != results[1]:
+    raise Exception("Single-model and multi-model results differ")
+
+
+
+if __name__ == "__main__":
+  main()
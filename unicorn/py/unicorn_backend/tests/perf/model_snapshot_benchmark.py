@@ -0,0 +1,138 @@
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2015, Numenta, Inc.  Unless you have purchased from
+# Numenta, Inc. a separate commercial license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+
+"""
+Measure the time that unicorn model_runner takes to produce the results of
+rows appended to a file of mock_data_generator-style input, comparing a cold
+start, which processes the whole file, with --resume from the snapshot saved
+after the original rows, which processes only the appended rows. Also reports
+the time taken to process the original rows and save the snapshot, and
+whether the resumed model's results match the cold start's.
+
+Usage:
+  python model_snapshot_benchmark.py --rows=50000 --new-rows=1000
+"""
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+
+
+_STATS = {"min": 0, "max": 1000}
+
+
+
+def _parseArgs():
+  parser = argparse.ArgumentParser(description=__doc__)
+  parser.add_argument("--rows", type=int, default=50000, dest="numRows",
+                      help="Number of rows in the original file")
+  parser.add_argument("--new-rows", type=int, default=1000, dest="numNewRows",
+                      help="Number of rows appended to the file")
+  parser.add_argument("--snapshot-interval", type=int, default=0,
+                      dest="snapshotInterval",
+                      help="Rows between periodic snapshots; 0 for none")
+  return parser.parse_args()
+
+
+
+def _generateRows(numRows):
+  """ mock_data_generator's sample with consecutive 5-minute timestamps """
+  return [(1438649711 + 300 * i, 835.93679) for i in xrange(numRows)]
+
+
+
+def _runModel(inputPath, extraArgs):
+  """ Run a single-model runner process over the input file
+
+  :returns: (elapsed seconds, list of [rowIndex, anomalyProbability] results)
+  """
+  startTime = time.time()
+
+  with open(inputPath, "rb") as inputFile:
+    process = subprocess.Popen(
+      args=[sys.executable, "-m", "unicorn_backend.model_runner",
+            "--model=benchmark",
+            "--stats=%s" % (json.dumps(_STATS),)] + extraArgs,
+      stdin=inputFile,
+      stdout=subprocess.PIPE,
+      close_fds=True)
+
+    results = [json.loads(line) for line in process.stdout]
+
+  if process.wait() != 0:
+    raise Exception("model_runner failed with returncode=%s" % (
+      process.returncode,))
+
+  return time.time() - startTime, results
+
+
+
+def main():
+  args = _parseArgs()
+
+  tempDir = tempfile.mkdtemp()
+  try:
+    rows = _generateRows(args.numRows + args.numNewRows)
+
+    originalPath = os.path.join(tempDir, "original.json")
+    appendedPath = os.path.join(tempDir, "appended.json")
+    for path, numRows in ((originalPath, args.numRows),
+                          (appendedPath, len(rows))):
+      with open(path, "wb") as inputFile:
+        for row in rows[:numRows]:
+          inputFile.write("%s\n" % (json.dumps(row),))
+
+    snapshotArgs = ["--snapshotDir=%s" % (os.path.join(tempDir, "snapshot"),)]
+
+    elapsed, _ = _runModel(
+      originalPath,
+      snapshotArgs + ["--snapshotInterval=%d" % (args.snapshotInterval,)])
+    print "rows=%-7d %-12s %8.2fs" % (args.numRows, "snapshot", elapsed)
+
+    coldElapsed, coldResults = _runModel(appendedPath, [])
+    print "rows=%-7d %-12s %8.2fs" % (args.numNewRows, "cold-start",
+                                      coldElapsed)
+
+    resumeElapsed, resumeResults = _runModel(appendedPath,
+                                             snapshotArgs + ["--resume"])
+    print "rows=%-7d %-12s %8.2fs" % (args.numNewRows, "resume",
+                                      resumeElapsed)
+
+    if ([rowIndex for rowIndex, _ in resumeResults] !=
+        range(args.numRows, len(rows))):
+      raise Exception("Resumed model didn't process exactly the new rows")
+
+    print "speedup=%.1fx; resumed results match cold start: %s" % (
+      coldElapsed / resumeElapsed, resumeResults == coldResults[args.numRows:])
+  finally:
+    shutil.rmtree(tempDir)
+
+
+
+if __name__ == "__main__":
+  main()
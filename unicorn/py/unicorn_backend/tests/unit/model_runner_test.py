@@ -21,9 +21,14 @@
 
 """Unit test of the unicorn_backend.model_runner module"""
 
+import cPickle as pickle
+import json
 import logging
 from mock import patch
+import os
+import shutil
 import sys
+import tempfile
 import unittest
 
 from nta.utils.logging_support_raw import LoggingSupport
@@ -92,3 +97,255 @@ class ModelRunnerTestCase(unittest.TestCase):
 
     # _ModelRunner flushed output
     stdoutFlushMock.assert_called_once_with()
+
+
+  def testParseArgsMultiModel(self):
+    """ --multi needs no model options and rejects them
+    """
+    with patch.object(sys, "argv", ["unicorn_backend/model_runner.py",
+                                    "--multi"]):
+      # pylint: disable=W0212
+      options = model_runner._parseArgs()
+
+    self.assertTrue(options.multiModel)
+    self.assertIsNone(options.modelId)
+
+    for argumentPattern in (['--model="1"'],
+                            ['--stats={"max": 10, "min": 0}']):
+      with patch.object(sys, "argv", ["unicorn_backend/model_runner.py",
+                                      "--multi"] + argumentPattern):
+        # pylint: disable=W0212
+        with self.assertRaises(model_runner._CommandLineArgError):
+          model_runner._parseArgs()
+
+
+  def testParseArgsSnapshot(self):
+    """ Snapshot options are parsed and validated
+    """
+    modelArgs = ["unicorn_backend/model_runner.py", '--model="1"',
+                 '--stats={"max": 10, "min": 0}']
+
+    with patch.object(sys, "argv", modelArgs + ["--snapshotDir=/tmp/snap",
+                                                "--snapshotInterval=100",
+                                                "--resume"]):
+      # pylint: disable=W0212
+      options = model_runner._parseArgs()
+
+    self.assertEqual(options.snapshotDir, "/tmp/snap")
+    self.assertEqual(options.snapshotInterval, 100)
+    self.assertTrue(options.resume)
+
+    for argv in (modelArgs + ["--resume"],
+                 modelArgs + ["--snapshotInterval=100"],
+                 modelArgs + ["--snapshotDir=/tmp/snap",
+                              "--snapshotInterval=-1"],
+                 ["unicorn_backend/model_runner.py", "--multi",
+                  "--snapshotDir=/tmp/snap"]):
+      with patch.object(sys, "argv", argv):
+        # pylint: disable=W0212
+        with self.assertRaises(model_runner._CommandLineArgError):
+          model_runner._parseArgs()
+
+
+  @patch("sys.stdout.write", autospec=True)
+  @patch("sys.stdout.flush", autospec=True)
+  @patch("sys.stdin.readline", autospec=True)
+  @patch.object(model_runner, "ModelFactory", autospec=True)
+  def testSnapshotAndResume(self, modelFactoryMock, readlineMock,
+                            _stdoutFlushMock, stdoutWriteMock):
+    """ _ModelRunner saves snapshots periodically and upon clean shutdown, and
+    skips the rows that the snapshot accounts for upon resume
+    """
+    tempDir = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, tempDir)
+    snapshotDir = os.path.join(tempDir, "snapshot")
+
+    stats = {"max": 10, "min": 0}
+    inputRows = ["[%d, 5.0]\n" % (1438649711 + 300 * i,) for i in xrange(5)]
+
+    modelMock = modelFactoryMock.create.return_value
+    modelMock.run.return_value.inferences = {"anomalyScore": 0.5}
+    modelFactoryMock.loadFromCheckpoint.return_value = modelMock
+
+    # Process the first three rows, saving a snapshot after two rows and
+    # upon shutdown
+    readlineMock.side_effect = iter(inputRows[:3] + [""])
+
+    # pylint: disable=W0212
+    model_runner._ModelRunner(modelId="1", stats=stats,
+                              snapshotDir=snapshotDir,
+                              snapshotInterval=2).run()
+
+    self.assertEqual(modelMock.save.call_count, 2)
+    modelMock.save.assert_called_with(
+      saveModelDir=os.path.join(snapshotDir + ".tmp", "model"))
+    self.assertEqual(os.listdir(tempDir), ["snapshot"])
+
+    with open(os.path.join(snapshotDir, "state.pickle"), "rb") as stateFile:
+      self.assertEqual(pickle.load(stateFile)["numRows"], 3)
+
+    # Resume, feeding all of the rows again
+    modelFactoryMock.create.reset_mock()
+    stdoutWriteMock.reset_mock()
+    readlineMock.side_effect = iter(inputRows + [""])
+
+    # pylint: disable=W0212
+    model_runner._ModelRunner(modelId="1", stats=stats,
+                              snapshotDir=snapshotDir,
+                              resume=True).run()
+
+    self.assertFalse(modelFactoryMock.create.called)
+    modelFactoryMock.loadFromCheckpoint.assert_called_once_with(
+      os.path.join(snapshotDir, "model"))
+
+    self.assertEqual(
+      [json.loads(args[0])[0] for args, _ in stdoutWriteMock.call_args_list],
+      [3, 4])
+
+    with open(os.path.join(snapshotDir, "state.pickle"), "rb") as stateFile:
+      self.assertEqual(pickle.load(stateFile)["numRows"], 5)
+
+    # Periodic snapshots need a snapshot directory
+    with self.assertRaises(ValueError):
+      # pylint: disable=W0212
+      model_runner._ModelRunner(modelId="1", stats=stats, snapshotInterval=2)
+
+    # A snapshot of a model with different stats isn't resumed
+    with self.assertRaises(ValueError):
+      # pylint: disable=W0212
+      model_runner._ModelRunner(modelId="1", stats={"max": 20, "min": 0},
+                                snapshotDir=snapshotDir, resume=True)
+
+
+  @patch.object(model_runner, "ModelFactory", autospec=True)
+  def testPeriodicSnapshotFailureDoesNotInterruptBatch(self,
+                                                       modelFactoryMock):
+    """ A failed periodic snapshot is logged without discarding the results
+    of the batch that triggered it
+    """
+    tempDir = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, tempDir)
+
+    # The snapshot directory can't be created under a regular file
+    blockingFilePath = os.path.join(tempDir, "file")
+    open(blockingFilePath, "wb").close()
+
+    modelMock = modelFactoryMock.create.return_value
+    modelMock.run.return_value.inferences = {"anomalyScore": 0.5}
+
+    # pylint: disable=W0212
+    runner = model_runner._ModelRunner(
+      modelId="1", stats={"max": 10, "min": 0},
+      snapshotDir=os.path.join(blockingFilePath, "snapshot"),
+      snapshotInterval=2)
+
+    anomalyProbabilities = runner.processBatch([1438649711, 1438650011],
+                                               [835.93679, 835.93679])
+
+    self.assertEqual(len(anomalyProbabilities), 2)
+    self.assertEqual(runner.numRows, 2)
+    self.assertFalse(modelMock.save.called)
+
+
+  @patch("sys.stdout.write", autospec=True)
+  @patch("sys.stdout.flush", autospec=True)
+  @patch("sys.stdin.readline", autospec=True)
+  def testMultiModelRunner(self, readlineMock, stdoutFlushMock,
+                           stdoutWriteMock):
+    """ _MultiModelRunner().run() executes batched commands for multiple models
+    from STDIN and writes one result per command to STDOUT
+    """
+    commands = [
+      dict(command="createModel", modelId="1", stats={"max": 10, "min": 0}),
+      dict(command="createModel", modelId="2", stats={"max": 10, "min": 0}),
+      dict(command="run", modelId="1", timestamps=[1438649711],
+           values=[835.93679]),
+      dict(command="run", modelId="2", timestamps=[1438649711, 1438650011],
+           values=[835.93679, 835.93679]),
+      dict(command="run", modelId="2", timestamps=[1438650311],
+           values=[835.93679]),
+      dict(command="deleteModel", modelId="1"),
+      dict(command="run", modelId="1", timestamps=[1438650011], values=[1.0]),
+      dict(command="createModel", modelId="3", stats={"maxFoo": 10}),
+      dict(command="createModel", modelId="4", stats={"max": 10, "min": 0},
+           snapshotInterval=100),
+    ]
+    readlineMock.side_effect = iter(
+      ["%s\n" % (json.dumps(command),) for command in commands] + [""])
+
+    # pylint: disable=W0212
+    model_runner._MultiModelRunner().run()
+
+    results = [json.loads(args[0])
+               for args, _ in stdoutWriteMock.call_args_list]
+    self.assertEqual(len(results), len(commands))
+    self.assertEqual(stdoutFlushMock.call_count, len(commands))
+
+    self.assertEqual(results[0],
+                     dict(command="createModel", modelId="1", rowIndex=0))
+    self.assertEqual(results[1],
+                     dict(command="createModel", modelId="2", rowIndex=0))
+
+    # Models are independent of each other
+    self.assertEqual(results[2],
+                     dict(command="run", modelId="1", rowIndex=0,
+                          anomalyProbabilities=[0.0301029996658834]))
+    self.assertEqual(results[3]["rowIndex"], 0)
+    self.assertEqual(results[3]["anomalyProbabilities"][0],
+                     0.0301029996658834)
+    self.assertEqual(len(results[3]["anomalyProbabilities"]), 2)
+    self.assertEqual(results[4]["rowIndex"], 2)
+    self.assertEqual(len(results[4]["anomalyProbabilities"]), 1)
+
+    self.assertEqual(results[5], dict(command="deleteModel", modelId="1"))
+
+    # Failed commands are reported without stopping the runner
+    for result in results[6:]:
+      self.assertIn("errorText", result)
+      self.assertIn("diagnosticInfo", result)
+
+
+  @patch("sys.stdout.write", autospec=True)
+  @patch("sys.stdout.flush", autospec=True)
+  @patch("sys.stdin.readline", autospec=True)
+  def testMultiModelRunnerRejectsMalformedInput(self, readlineMock,
+                                                _stdoutFlushMock,
+                                                stdoutWriteMock):
+    """ _MultiModelRunner().run() reports malformed command messages and
+    invalid batches as failed commands, without feeding any of an invalid
+    batch's rows to the model
+    """
+    readlineMock.side_effect = iter([
+      "%s\n" % (json.dumps(dict(command="createModel", modelId="1",
+                                 stats={"max": 10, "min": 0})),),
+      "{not json\n",
+      "[1438649711, 835.93679]\n",
+      "%s\n" % (json.dumps(dict(command="run", modelId="1",
+                                 timestamps=[1438649711, 1438650011],
+                                 values=[835.93679, "abc"])),),
+      "%s\n" % (json.dumps(dict(command="run", modelId="1",
+                                 timestamps=[1438649711],
+                                 values=[835.93679])),),
+      ""])
+
+    # pylint: disable=W0212
+    model_runner._MultiModelRunner().run()
+
+    results = [json.loads(args[0])
+               for args, _ in stdoutWriteMock.call_args_list]
+    self.assertEqual(len(results), 5)
+
+    for result in results[1:3]:
+      self.assertIsNone(result["command"])
+      self.assertIsNone(result["modelId"])
+      self.assertIn("errorText", result)
+      self.assertIn("diagnosticInfo", result)
+
+    self.assertEqual(results[3]["command"], "run")
+    self.assertIn("errorText", results[3])
+    self.assertNotIn("anomalyProbabilities", results[3])
+
+    # The invalid batch didn't advance the model
+    self.assertEqual(results[4],
+                     dict(command="run", modelId="1", rowIndex=0,
+                          anomalyProbabilities=[0.0301029996658834]))